@@ -0,0 +1,256 @@
+"""
+Abandoned cart detection as a resumable stream over CartActivity.
+
+``detect_abandoned_carts`` reads cart events in ``(timestamp, id)`` order,
+CHUNK_SIZE rows at a time, from the watermark saved by the previous run. It
+keeps one compact entry per open cart session -- user, first and last
+activity, ``{product_id: quantity}`` -- in a dict ordered by last activity,
+so expiring sessions is a walk from the front. The stream's own clock (the
+timestamp of the event being read) drives expiry: a session that has been
+quiet for ABANDONED_CART_WINDOW_MINUTES is closed, and if it still holds
+items and its user placed no order between the first add and the end of the
+window, it is saved as an ``AbandonedCart`` priced at the current product
+prices. Memory is bounded by the sessions active within one window, not by
+the number of events.
+
+Each chunk's carts are written in the same transaction as the new watermark
+and the serialized open sessions (``StreamCheckpoint``), so a crashed run
+resumes exactly where the last committed chunk ended without duplicates or
+gaps; the watermark only moves from the value a run started from, so an
+overlapping run fails instead of recording a chunk twice.
+
+Events newer than SETTLE are left for the next run: the ingestion buffer
+stamps events before it inserts them, so a batch still being flushed can
+commit with slightly older timestamps.
+
+Only signed-in sessions can be checked for a conversion (orders carry no
+session key); an anonymous session whose cart went quiet is reported as
+abandoned even if the visitor later ordered after signing in elsewhere.
+"""
+import json
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from orders.models import Order
+from products.models import Product
+from .models import AbandonedCart, CartActivity, StreamCheckpoint
+
+CHECKPOINT = 'abandoned_carts'
+CHUNK_SIZE = 5000
+SETTLE = timedelta(minutes=1)
+
+# Open session entry: [user_id, started (epoch s), last activity (epoch s), {product_id: quantity}]
+USER, STARTED, LAST, ITEMS = range(4)
+
+
+def _window():
+    return timedelta(minutes=getattr(settings, 'ABANDONED_CART_WINDOW_MINUTES', 60))
+
+
+def _session_key(session_key, user_id):
+    if session_key:
+        return session_key
+    return f'user:{user_id}' if user_id else None
+
+
+class CartSessions:
+    """Open cart sessions ordered by last activity"""
+
+    def __init__(self, window_seconds):
+        self.window = window_seconds
+        self.sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def apply(self, key, user_id, moment, product_id, action, quantity):
+        session = self.sessions.pop(key, None)
+        if session is None:
+            session = [user_id, moment, moment, {}]
+        session[USER] = session[USER] or user_id
+        session[LAST] = moment
+        items = session[ITEMS]
+        product = str(product_id)
+        if action == 'add':
+            items[product] = items.get(product, 0) + quantity
+        elif action == 'update':
+            items[product] = quantity
+        else:
+            items[product] = items.get(product, 0) - quantity
+        if items.get(product, 0) <= 0:
+            items.pop(product, None)
+        # Re-inserting keeps the dict ordered by last activity
+        self.sessions[key] = session
+
+    def expire(self, now):
+        """Pop and return ``[(key, session)]`` quiet for a whole window as of ``now``"""
+        expired = []
+        sessions = self.sessions
+        while sessions:
+            key = next(iter(sessions))
+            if sessions[key][LAST] > now - self.window:
+                break
+            expired.append((key, sessions.pop(key)))
+        return expired
+
+    def to_bytes(self):
+        return zlib.compress(json.dumps(list(self.sessions.items()), separators=(',', ':')).encode())
+
+    @classmethod
+    def from_bytes(cls, data, window_seconds):
+        tracker = cls(window_seconds)
+        if data:
+            tracker.sessions = OrderedDict(json.loads(zlib.decompress(bytes(data))))
+        return tracker
+
+
+def _timestamp(moment):
+    return moment.timestamp()
+
+
+def _datetime(seconds):
+    return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+
+
+def _abandoned(expired, window_seconds):
+    """Unsaved AbandonedCart rows for the expired sessions that hold items and did not convert"""
+    candidates = [(key, session) for key, session in expired if session[ITEMS]]
+    if not candidates:
+        return []
+
+    user_ids = {session[USER] for _, session in candidates if session[USER]}
+    orders = {}
+    if user_ids:
+        earliest = _datetime(min(session[STARTED] for _, session in candidates))
+        for user_id, created_at in Order.objects.filter(
+            user_id__in=user_ids, created_at__gte=earliest
+        ).values_list('user_id', 'created_at'):
+            orders.setdefault(user_id, []).append(_timestamp(created_at))
+
+    product_ids = {int(product) for _, session in candidates for product in session[ITEMS]}
+    prices = {
+        product_id: sale_price if sale_price is not None else price
+        for product_id, price, sale_price in Product.objects.filter(
+            id__in=product_ids
+        ).values_list('id', 'price', 'sale_price')
+    }
+
+    carts = []
+    for key, session in candidates:
+        converted = any(
+            session[STARTED] <= placed <= session[LAST] + window_seconds
+            for placed in orders.get(session[USER], ())
+        )
+        if converted:
+            continue
+        items, value = [], Decimal('0')
+        for product, quantity in session[ITEMS].items():
+            price = prices.get(int(product))
+            if price is None:
+                continue
+            items.append({'product': int(product), 'quantity': quantity, 'unit_price': str(price)})
+            value += price * quantity
+        if not items:
+            continue
+        carts.append(AbandonedCart(
+            session_key=key[:100],
+            user_id=session[USER],
+            started_at=_datetime(session[STARTED]),
+            last_activity_at=_datetime(session[LAST]),
+            items=items,
+            item_count=sum(item['quantity'] for item in items),
+            value=value,
+        ))
+    return carts
+
+
+class StreamConflict(Exception):
+    """Another run advanced the watermark first"""
+
+
+def _commit(checkpoint, previous, tracker, expired, window_seconds):
+    """Save one chunk's carts together with the watermark and open sessions
+
+    The checkpoint only moves if it still holds ``previous`` (time, id), so
+    overlapping runs cannot both record the same chunk.
+    """
+    carts = _abandoned(expired, window_seconds)
+    with transaction.atomic():
+        moved = StreamCheckpoint.objects.filter(
+            pk=checkpoint.pk, watermark_time=previous[0], watermark_id=previous[1]
+        ).update(
+            watermark_time=checkpoint.watermark_time,
+            watermark_id=checkpoint.watermark_id,
+            state=tracker.to_bytes(),
+            updated_at=timezone.now(),
+        )
+        if not moved:
+            raise StreamConflict('the abandoned-cart stream was advanced by another run')
+        AbandonedCart.objects.bulk_create(carts, ignore_conflicts=True)
+    return len(carts)
+
+
+def detect_abandoned_carts(since=None, until=None, chunk_size=CHUNK_SIZE, window=None):
+    """Advance the stream from its watermark to ``until`` (default: now less SETTLE)
+
+    ``since`` only applies on the first run, before any watermark exists
+    (default: one window before ``until``). Returns a dict of counters.
+    """
+    window = window or _window()
+    window_seconds = window.total_seconds()
+    until = until or timezone.now() - SETTLE
+    checkpoint, _ = StreamCheckpoint.objects.get_or_create(name=CHECKPOINT)
+    if checkpoint.watermark_time is None:
+        start = since or until - window
+        StreamCheckpoint.objects.filter(pk=checkpoint.pk, watermark_time__isnull=True).update(watermark_time=start)
+        checkpoint.refresh_from_db()
+    tracker = CartSessions.from_bytes(checkpoint.state, window_seconds)
+    stats = {'events': 0, 'abandoned': 0, 'closed': 0}
+
+    while True:
+        rows = list(CartActivity.objects.filter(
+            Q(timestamp__gt=checkpoint.watermark_time)
+            | Q(timestamp=checkpoint.watermark_time, id__gt=checkpoint.watermark_id),
+            timestamp__lt=until,
+        ).order_by('timestamp', 'id').values_list(
+            'id', 'timestamp', 'session_key', 'user_id', 'product_id', 'action', 'quantity'
+        )[:chunk_size])
+        if not rows:
+            break
+
+        previous = (checkpoint.watermark_time, checkpoint.watermark_id)
+        expired = []
+        for event_id, moment, session_key, user_id, product_id, action, quantity in rows:
+            key = _session_key(session_key, user_id)
+            if key is None:
+                continue
+            seconds = _timestamp(moment)
+            expired.extend(tracker.expire(seconds))
+            tracker.apply(key, user_id, seconds, product_id, action, quantity)
+        checkpoint.watermark_id, checkpoint.watermark_time = rows[-1][0], rows[-1][1]
+        stats['events'] += len(rows)
+        stats['closed'] += len(expired)
+        stats['abandoned'] += _commit(checkpoint, previous, tracker, expired, window_seconds)
+        if len(rows) < chunk_size:
+            break
+
+    # Nothing older than ``until`` is still to come, so the clock can move up to it
+    expired = tracker.expire(_timestamp(until))
+    stats['closed'] += len(expired)
+    if expired:
+        previous = (checkpoint.watermark_time, checkpoint.watermark_id)
+        stats['abandoned'] += _commit(checkpoint, previous, tracker, expired, window_seconds)
+    stats['open'] = len(tracker)
+    return stats
+
+
+def reset_abandoned_cart_stream():
+    """Forget the watermark and open sessions; the next run starts from ``since``"""
+    StreamCheckpoint.objects.filter(name=CHECKPOINT).delete()
@@ -1,11 +1,14 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.http import StreamingHttpResponse
 from django.utils.html import format_html
 from django.utils.formats import number_format
 from django.utils import timezone
 from datetime import timedelta
 
-from .models import PageView, ProductClick, CartActivity, OrderAnalytics
-from orders.models import Order, OrderItem
+from .models import PageView, ProductClick, CartActivity, CustomerMetrics, OrderAnalytics
+from .exports import FORMATS, export_filename, export_stream
+from .retention import purge_before
+from orders.models import OrderItem
 from products.models import Product, Category
 from users.models import User
 
@@ -204,9 +207,10 @@ class OrderAnalyticsAdmin(admin.ModelAdmin):
         )
 
     def customer_insights(self, obj):
-        user = obj.order.user
-        total_orders = Order.objects.filter(user=user).count()
-        total_spent = Order.objects.filter(user=user).aggregate(total=Sum('total'))['total'] or 0
+        # Paid orders only, from the per-customer metrics (analytics/customers.py)
+        metrics = CustomerMetrics.objects.filter(user_id=obj.order.user_id).first()
+        total_orders = metrics.order_count if metrics else 0
+        total_spent = metrics.total_spent if metrics else 0
         avg_order_value = (total_spent / total_orders) if total_orders else 0
         return format_html(
             '<div style="background:#e7f3ff;padding:15px;border-radius:5px;">'
@@ -240,20 +244,34 @@ admin.site.register(PageView, PageViewAdmin)
 # ---------------------------------------------------------------------
 # ADMIN ACTIONS
 # ---------------------------------------------------------------------
+def _streaming_export(queryset, export_format, compress):
+    response = StreamingHttpResponse(
+        export_stream(queryset, export_format, compress=compress),
+        content_type='application/gzip' if compress else FORMATS[export_format],
+    )
+    filename = export_filename(queryset.model, export_format, compress, suffix=f"-{timezone.now():%Y%m%d-%H%M%S}")
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 def export_analytics_data(modeladmin, request, queryset):
-    messages.info(request, f"Export functionality would be implemented here. Selected {queryset.count()} items.")
-export_analytics_data.short_description = "Export selected analytics data"
+    return _streaming_export(queryset, 'csv', compress=False)
+export_analytics_data.short_description = "Export selected analytics data (CSV)"
+
+def export_analytics_ndjson_gzip(modeladmin, request, queryset):
+    return _streaming_export(queryset, 'ndjson', compress=True)
+export_analytics_ndjson_gzip.short_description = "Export selected analytics data (gzipped NDJSON)"
 
 def clear_old_analytics_data(modeladmin, request, queryset):
-    one_year_ago = timezone.now() - timedelta(days=365)
-    deleted_count = queryset.filter(timestamp__lt=one_year_ago).count()
-    queryset.filter(timestamp__lt=one_year_ago).delete()
-    messages.success(request, f"Deleted {deleted_count} old analytics records.")
-clear_old_analytics_data.short_description = "Clear analytics data older than 1 year"
-
-PageViewAdmin.actions = [export_analytics_data, clear_old_analytics_data]
-CartActivityAdmin.actions = [export_analytics_data, clear_old_analytics_data]
-ProductClickAdmin.actions = [export_analytics_data, clear_old_analytics_data]
+    # Rolls the old days up first, then deletes them in small batches (see analytics/retention.py).
+    # Page views, product clicks and cart activity are purged together, whichever list it runs from.
+    cutoff = timezone.localdate() - timedelta(days=365)
+    rows = sum(result.rows for result in purge_before(cutoff))
+    messages.success(request, f"Rolled up and deleted {rows} raw analytics records older than {cutoff}.")
+clear_old_analytics_data.short_description = "Roll up and clear all raw analytics data older than 1 year"
+
+PageViewAdmin.actions = [export_analytics_data, export_analytics_ndjson_gzip, clear_old_analytics_data]
+CartActivityAdmin.actions = [export_analytics_data, export_analytics_ndjson_gzip, clear_old_analytics_data]
+ProductClickAdmin.actions = [export_analytics_data, export_analytics_ndjson_gzip, clear_old_analytics_data]
 
 # ---------------------------------------------------------------------
 # ADMIN HEADER CUSTOMIZATION
@@ -0,0 +1,319 @@
+"""
+Acquisition channel capture and attribution.
+
+Storefront page views that arrive with UTM parameters or from another site
+are recorded as ``AcquisitionTouch`` rows (through the ingestion buffer),
+keyed to the storefront's analytics session id and, when signed in, the
+user. Registration, and the first signed-in event of a session, link the
+session's anonymous touches to the account. When an order is created,
+``attribute_order`` picks the customer's first touch or their last touch
+within ATTRIBUTION_WINDOW_DAYS (ATTRIBUTION_MODEL) and writes its channel and
+campaign into ``OrderAnalytics``; no touch means Direct.
+
+Channel breakdowns read ``DailyChannelStats``: visits, signups, orders, new
+customers and revenue per day and channel. Counters are incremented as
+touches are flushed, users sign up and orders are attributed, and
+``rebuild_channel_stats`` (run by ``rollup_analytics``) recomputes a range
+exactly from the source tables.
+"""
+import logging
+from collections import Counter
+from decimal import Decimal
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from orders.models import Order
+from .models import AcquisitionTouch, CustomerMetrics, DailyChannelStats, OrderAnalytics
+from .rollups import day_bounds
+
+logger = logging.getLogger(__name__)
+
+DIRECT = 'Direct'
+CHANNELS = ['Organic Search', 'Paid Search', 'Social Media', 'Email Marketing', 'Referral', 'Other', DIRECT]
+COUNTER_FIELDS = ['visits', 'signups', 'orders', 'customers', 'revenue']
+
+UTM_FIELDS = {'utm_source': 'source', 'utm_medium': 'medium', 'utm_campaign': 'campaign'}
+MAX_UTM_LENGTH = 100
+MAX_URL_LENGTH = 200
+
+PAID_MEDIUMS = {'cpc', 'ppc', 'paid', 'paidsearch', 'paid_search', 'sem'}
+EMAIL_MEDIUMS = {'email', 'e-mail', 'newsletter'}
+SOCIAL_MEDIUMS = {'social', 'social-media', 'social_media', 'sm'}
+SEARCH_ENGINES = ('google.', 'bing.', 'yahoo.', 'duckduckgo.', 'baidu.', 'yandex.', 'ecosia.', 'ask.')
+SOCIAL_SITES = (
+    'facebook.', 'fb.', 'instagram.', 'twitter.', 't.co', 'x.com', 'linkedin.', 'lnkd.in',
+    'pinterest.', 'tiktok.', 'reddit.', 'youtube.', 'whatsapp.', 'snapchat.',
+)
+
+
+def _host(url):
+    try:
+        host = urlsplit(url).hostname or ''
+    except ValueError:
+        return ''
+    return host[4:] if host.startswith('www.') else host
+
+
+def _absolute_url(value):
+    return value if isinstance(value, str) and value.startswith(('http://', 'https://')) else ''
+
+
+def _matches(host, sites):
+    return any(host.startswith(site) or f'.{site}' in f'.{host}' for site in sites)
+
+
+def classify(source='', medium='', referrer_host=''):
+    """Channel for a visit's UTM source/medium and referring host"""
+    source, medium = source.lower(), medium.lower()
+    social = _matches(source, SOCIAL_SITES) or source in {'facebook', 'instagram', 'twitter', 'tiktok', 'linkedin'}
+    if medium in PAID_MEDIUMS:
+        return 'Social Media' if social else 'Paid Search'
+    if medium in EMAIL_MEDIUMS:
+        return 'Email Marketing'
+    if medium in SOCIAL_MEDIUMS or social or _matches(referrer_host, SOCIAL_SITES):
+        return 'Social Media'
+    if medium == 'organic' or _matches(referrer_host, SEARCH_ENGINES):
+        return 'Organic Search'
+    if medium == 'referral' or referrer_host:
+        return 'Referral'
+    if source or medium:
+        return 'Other'
+    return DIRECT
+
+
+def build_touch(landing_page, referrer='', user_id=None, session_key='', utm=None):
+    """An unsaved AcquisitionTouch for a landing, or None for direct and internal visits
+
+    UTM parameters are read from ``utm`` when given, else from the landing
+    page's query string. A referrer on the storefront's own host is internal
+    navigation, not a new touch.
+    """
+    landing_page = _absolute_url(landing_page)
+    if utm is None:
+        query = parse_qs(urlsplit(landing_page).query)
+        utm = {key: values[0] for key, values in query.items() if key in UTM_FIELDS and values}
+    fields = {
+        field: str(utm.get(key) or '')[:MAX_UTM_LENGTH].strip()
+        for key, field in UTM_FIELDS.items()
+    }
+    referrer = _absolute_url(referrer)
+    referrer_host = _host(referrer)
+    if referrer_host and referrer_host == _host(landing_page):
+        referrer, referrer_host = '', ''
+    if not (fields['source'] or fields['medium'] or fields['campaign'] or referrer_host):
+        return None
+    return AcquisitionTouch(
+        user_id=user_id,
+        session_key=session_key,
+        channel=classify(fields['source'], fields['medium'], referrer_host),
+        referrer=referrer[:MAX_URL_LENGTH],
+        landing_page=landing_page[:MAX_URL_LENGTH],
+        **fields,
+    )
+
+
+def increment_channel_stats(day, channel, retries=1, **counts):
+    """Add ``counts`` to one day/channel counter row"""
+    counts = {field: value for field, value in counts.items() if value}
+    if not counts:
+        return
+    updated = DailyChannelStats.objects.filter(date=day, channel=channel).update(
+        updated_at=timezone.now(), **{field: F(field) + value for field, value in counts.items()}
+    )
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            DailyChannelStats.objects.create(date=day, channel=channel, **counts)
+    except IntegrityError:
+        # Another worker created the row first; add to it now
+        if not retries:
+            raise
+        increment_channel_stats(day, channel, retries=retries - 1, **counts)
+
+
+def record_touches(touches):
+    """Ingestion hook: count a batch of saved touches as visits"""
+    visits = Counter((timezone.localdate(touch.timestamp), touch.channel) for touch in touches)
+    for (day, channel), count in visits.items():
+        increment_channel_stats(day, channel, visits=count)
+
+
+def link_sessions(events):
+    """Ingestion hook: hand a session's anonymous touches to the user its signed-in events name"""
+    sessions = {
+        event.session_key: event.user_id
+        for event in events
+        if event.session_key and getattr(event, 'user_id', None)
+    }
+    for session_key, user_id in sessions.items():
+        AcquisitionTouch.objects.filter(session_key=session_key, user__isnull=True).update(user_id=user_id)
+
+
+def first_touch(user_id):
+    return AcquisitionTouch.objects.filter(user_id=user_id).order_by('timestamp', 'id').first()
+
+
+def record_signup(user, session_key='', landing_page='', referrer='', utm=None):
+    """Registration hook: link the session's touches to ``user`` and count the signup"""
+    if session_key:
+        AcquisitionTouch.objects.filter(session_key=session_key, user__isnull=True).update(user=user)
+    if landing_page or referrer or utm:
+        touch = build_touch(landing_page, referrer, user_id=user.pk, session_key=session_key, utm=utm)
+        if touch is not None:
+            touch.save()
+            record_touches([touch])
+    touch = first_touch(user.pk)
+    increment_channel_stats(timezone.localdate(user.date_joined), touch.channel if touch else DIRECT, signups=1)
+
+
+def capture_signup(request, user):
+    """UserViewSet.create hook: attribute a new account from its session and signup payload
+
+    The signup form sends the storefront's analytics ``session_id`` and may
+    send ``landing_page``, ``referrer`` and ``utm_*`` fields alongside the
+    registration data. Failures are logged and never fail the registration.
+    """
+    from .ingest import session_id
+    data = request.data if hasattr(request.data, 'get') else {}
+    utm = {key: data.get(key) for key in UTM_FIELDS if data.get(key)}
+    try:
+        record_signup(
+            user,
+            session_key=session_id(data, request.COOKIES.get(settings.SESSION_COOKIE_NAME, '')[:100]),
+            landing_page=data.get('landing_page') or '',
+            referrer=data.get('referrer') or '',
+            utm=utm or None,
+        )
+    except DatabaseError:
+        logger.exception('Failed to record acquisition for user %s', user.pk)
+
+
+def attribute_order(order_id):
+    """Write the order's acquisition channel and campaign into OrderAnalytics and count it"""
+    order = Order.objects.only('id', 'user_id', 'total', 'created_at').get(pk=order_id)
+    touches = AcquisitionTouch.objects.filter(user_id=order.user_id, timestamp__lte=order.created_at)
+    if getattr(settings, 'ATTRIBUTION_MODEL', 'last_touch') == 'first_touch':
+        touch = touches.order_by('timestamp', 'id').first()
+    else:
+        window = timezone.timedelta(days=getattr(settings, 'ATTRIBUTION_WINDOW_DAYS', 30))
+        touch = touches.filter(timestamp__gte=order.created_at - window).order_by('-timestamp', '-id').first()
+    channel = touch.channel if touch else DIRECT
+    campaign = touch.campaign if touch else ''
+
+    defaults = {'acquisition_channel': channel, 'marketing_campaign': campaign}
+    metrics = CustomerMetrics.objects.filter(user_id=order.user_id).first()
+    if metrics is not None:
+        defaults['customer_lifetime_value'] = metrics.total_spent
+    OrderAnalytics.objects.update_or_create(order=order, defaults=defaults)
+
+    first_order = not Order.objects.filter(user_id=order.user_id, created_at__lt=order.created_at).exists()
+    increment_channel_stats(
+        timezone.localdate(order.created_at), channel,
+        orders=1, customers=int(first_order), revenue=order.total,
+    )
+    return channel, campaign
+
+
+def _attribute_committed_order(order_id):
+    # Runs after the order has committed; a failure here must not turn its response into a 500.
+    # The order then counts as Direct until rollup_analytics rebuilds the channel counters.
+    try:
+        attribute_order(order_id)
+    except Exception:
+        logger.exception('Failed to attribute order %s', order_id)
+
+
+def schedule_attribution(order_id):
+    transaction.on_commit(lambda: _attribute_committed_order(order_id))
+
+
+def _empty_counters():
+    return {'visits': 0, 'signups': 0, 'orders': 0, 'customers': 0, 'revenue': Decimal('0')}
+
+
+def compute_channel_stats(start, end):
+    """Recount ``{(date, channel): counters}`` from touches, signups and orders"""
+    lower, upper = day_bounds(start, end)
+    totals = {}
+
+    def add(day, channel, **values):
+        row = totals.setdefault((day, channel or DIRECT), _empty_counters())
+        for field, value in values.items():
+            row[field] += value or 0
+
+    visits = AcquisitionTouch.objects.filter(timestamp__gte=lower, timestamp__lt=upper).annotate(
+        day=TruncDate('timestamp')
+    ).values('day', 'channel').annotate(count=Count('id')).order_by()
+    for row in visits:
+        add(row['day'], row['channel'], visits=row['count'])
+
+    first_channel = AcquisitionTouch.objects.filter(user=OuterRef('pk')).order_by('timestamp', 'id').values('channel')
+    signups = get_user_model().objects.filter(date_joined__gte=lower, date_joined__lt=upper).annotate(
+        day=TruncDate('date_joined'), channel=Subquery(first_channel[:1])
+    )
+    for row in signups.values('day', 'channel').annotate(count=Count('id')).order_by():
+        add(row['day'], row['channel'], signups=row['count'])
+
+    # Orders created before attribution existed have no OrderAnalytics row and count as Direct
+    earlier = Order.objects.filter(user=OuterRef('user'), created_at__lt=OuterRef('created_at'))
+    orders = Order.objects.filter(created_at__gte=lower, created_at__lt=upper).annotate(
+        day=TruncDate('created_at'), channel=F('orderanalytics__acquisition_channel'), repeat=Exists(earlier)
+    )
+    for row in orders.values('day', 'channel', 'repeat').annotate(count=Count('id'), revenue=Sum('total')).order_by():
+        add(
+            row['day'], row['channel'],
+            orders=row['count'], revenue=row['revenue'],
+            customers=0 if row['repeat'] else row['count'],
+        )
+
+    return totals
+
+
+def rebuild_channel_stats(start, end, batch_size=500):
+    """Recompute and upsert the counters for ``start``..``end``; returns the rows written"""
+    totals = compute_channel_stats(start, end)
+    # Zero out channels that had activity on a day in a previous run but not any more
+    for key in DailyChannelStats.objects.filter(date__gte=start, date__lte=end).values_list('date', 'channel'):
+        totals.setdefault(key, _empty_counters())
+    rows = [DailyChannelStats(date=day, channel=channel, **values) for (day, channel), values in totals.items()]
+    with transaction.atomic():
+        DailyChannelStats.objects.bulk_create(
+            rows,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['date', 'channel'],
+            update_fields=COUNTER_FIELDS + ['updated_at'],
+        )
+    return len(rows)
+
+
+def channel_breakdown(start, end):
+    """New customers per channel over ``start``..``end``, from one range aggregate of the counters"""
+    rows = DailyChannelStats.objects.filter(date__gte=start, date__lte=end).values('channel').annotate(
+        **{f'total_{field}': Sum(field) for field in COUNTER_FIELDS}
+    ).order_by()
+    stats = {row['channel']: row for row in rows}
+    total_customers = sum(row['total_customers'] for row in stats.values())
+    breakdown = []
+    for channel in CHANNELS:
+        row = stats.get(channel)
+        if row is None:
+            continue
+        breakdown.append({
+            'channel': channel,
+            'customers': row['total_customers'],
+            'percentage': round(row['total_customers'] / total_customers * 100, 1) if total_customers else 0,
+            'visits': row['total_visits'],
+            'signups': row['total_signups'],
+            'orders': row['total_orders'],
+            'revenue': float(row['total_revenue'] or 0),
+        })
+    breakdown.sort(key=lambda row: row['customers'], reverse=True)
+    return breakdown
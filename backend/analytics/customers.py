@@ -0,0 +1,141 @@
+"""
+Per-customer lifetime metrics.
+
+``CustomerMetrics`` holds, for every customer with a paid order, the number
+of paid orders, the amount spent on them, the first and last paid order and
+whether they have ordered more than once. An order counts while its
+payment_status is paid or partially refunded and, when it has payments,
+while ``amount_paid`` (net of refunds) is above zero; orders marked paid
+without payment records count their total.
+
+``Order.update_payment_status`` and the bulk ``sync_payment_state`` (bulk
+refunds, admin payment actions) schedule ``refresh_customer_metrics`` for
+every customer whose order payment state changed, once the change commits:
+one aggregate over that customer's orders, then an upsert. The same refresh copies lifetime
+value and days to first purchase onto the customer's OrderAnalytics rows.
+``rebuild_customer_metrics`` recomputes everyone in bulk (backfills, drift
+repair) from one grouped aggregate.
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Max, Min, Sum, When
+
+from orders.models import Order
+from .models import CustomerMetrics, OrderAnalytics
+
+PAID_STATUSES = ('paid', 'partially_refunded')
+METRIC_FIELDS = ['order_count', 'total_spent', 'first_order_at', 'last_order_at', 'is_repeat']
+
+
+def _paid_orders():
+    # Orders backed by payments count while money is kept; a full refund takes them out
+    return Order.objects.filter(payment_status__in=PAID_STATUSES).exclude(
+        latest_payment__isnull=False, amount_paid__lte=0
+    )
+
+
+def _customer_totals():
+    # What was kept (net of refunds) where payments are recorded, else the order total
+    spent = Case(
+        When(latest_payment__isnull=False, then=F('amount_paid')),
+        default=F('total'),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    return dict(
+        paid_orders=Count('id'),
+        spent=Sum(spent),
+        first=Min('created_at'),
+        last=Max('created_at'),
+    )
+
+
+def _metrics_row(user_id, totals):
+    return CustomerMetrics(
+        user_id=user_id,
+        order_count=totals['paid_orders'],
+        total_spent=totals['spent'] or 0,
+        first_order_at=totals['first'],
+        last_order_at=totals['last'],
+        is_repeat=totals['paid_orders'] >= 2,
+    )
+
+
+def _upsert(rows, batch_size=1000):
+    CustomerMetrics.objects.bulk_create(
+        rows,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=METRIC_FIELDS + ['updated_at'],
+    )
+
+
+def days_to_first_purchase(date_joined, first_order_at):
+    if first_order_at is None:
+        return None
+    return max((first_order_at - date_joined).days, 0)
+
+
+def _sync_order_analytics(metrics, date_joined):
+    OrderAnalytics.objects.filter(order__user_id=metrics.user_id).update(
+        customer_lifetime_value=metrics.total_spent,
+        days_to_first_purchase=days_to_first_purchase(date_joined, metrics.first_order_at),
+    )
+
+
+def refresh_customer_metrics(user_id):
+    """Recompute one customer's row from their orders"""
+    totals = _paid_orders().filter(user_id=user_id).aggregate(**_customer_totals())
+    with transaction.atomic():
+        if not totals['paid_orders']:
+            CustomerMetrics.objects.filter(user_id=user_id).delete()
+            OrderAnalytics.objects.filter(order__user_id=user_id).update(
+                customer_lifetime_value=0, days_to_first_purchase=None
+            )
+            return None
+        metrics = _metrics_row(user_id, totals)
+        _upsert([metrics])
+        date_joined = get_user_model().objects.values_list('date_joined', flat=True).get(pk=user_id)
+        _sync_order_analytics(metrics, date_joined)
+    return metrics
+
+
+def schedule_customer_refresh(user_ids):
+    """Refresh each of ``user_ids`` once the current transaction commits"""
+    user_ids = sorted({user_id for user_id in user_ids if user_id})
+
+    def refresh():
+        for user_id in user_ids:
+            refresh_customer_metrics(user_id)
+
+    if user_ids:
+        transaction.on_commit(refresh)
+
+
+def rebuild_customer_metrics(batch_size=1000):
+    """Recompute every customer's row in bulk; returns the number of customers with paid orders"""
+    rows = [
+        _metrics_row(row['user_id'], row)
+        for row in _paid_orders().values('user_id').annotate(**_customer_totals()).order_by('user_id')
+    ]
+    with transaction.atomic():
+        CustomerMetrics.objects.exclude(user_id__in=_paid_orders().values('user_id')).delete()
+        _upsert(rows, batch_size=batch_size)
+
+        metrics = {row.user_id: row for row in rows}
+        analytics = OrderAnalytics.objects.only('id').annotate(
+            customer_id=F('order__user_id'), date_joined=F('order__user__date_joined')
+        ).order_by('id')
+        batch = []
+        for record in analytics.iterator(chunk_size=batch_size):
+            row = metrics.get(record.customer_id)
+            record.customer_lifetime_value = row.total_spent if row else 0
+            record.days_to_first_purchase = (
+                days_to_first_purchase(record.date_joined, row.first_order_at) if row else None
+            )
+            batch.append(record)
+            if len(batch) >= batch_size:
+                OrderAnalytics.objects.bulk_update(batch, ['customer_lifetime_value', 'days_to_first_purchase'])
+                batch = []
+        OrderAnalytics.objects.bulk_update(batch, ['customer_lifetime_value', 'days_to_first_purchase'])
+    return len(rows)
@@ -0,0 +1,113 @@
+"""
+Cached admin dashboard snapshot.
+
+The dashboard figures are computed with conditional aggregation -- one
+query per table -- into a plain dict stamped with ``as_of`` and kept in the
+cache. It is rebuilt when it expires, when ``refresh_dashboard_stats`` runs
+on a schedule, or after new orders are committed. An order commit only
+flags the snapshot stale (one cache write on the checkout request); the
+next dashboard read rebuilds it, at most once per
+``DASHBOARD_STATS_MIN_REFRESH`` seconds, and serves the previous snapshot
+in between.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from core.utils import CacheKeys
+from orders.models import Order
+from products.models import Product, ProductVariant
+from users.models import User
+from .models import PageView, ProductClick
+from .rollups import day_bounds
+
+LOW_STOCK_THRESHOLD = 10
+
+
+def compute_dashboard_stats():
+    """Build a fresh snapshot straight from the database"""
+    now = timezone.now()
+    today = timezone.localdate(now)
+    today_start, _ = day_bounds(today, today)
+    week_start, _ = day_bounds(today - timedelta(days=7), today)
+
+    orders = Order.objects.aggregate(
+        order_count=Count('id'),
+        today_count=Count('id', filter=Q(created_at__gte=today_start)),
+        week_count=Count('id', filter=Q(created_at__gte=week_start)),
+        pending_count=Count('id', filter=Q(status='pending')),
+        revenue_total=Sum('total'),
+        revenue_week=Sum('total', filter=Q(created_at__gte=week_start)),
+        revenue_today=Sum('total', filter=Q(created_at__gte=today_start)),
+    )
+    stock = ProductVariant.objects.aggregate(
+        low_stock=Count('product', distinct=True, filter=Q(stock_quantity__lte=LOW_STOCK_THRESHOLD)),
+        out_of_stock=Count('product', distinct=True, filter=Q(stock_quantity=0)),
+    )
+    customers = User.objects.filter(is_staff=False).aggregate(
+        total=Count('id'),
+        new_this_week=Count('id', filter=Q(date_joined__gte=week_start)),
+    )
+    page_views = PageView.objects.aggregate(
+        total=Count('id'),
+        this_week=Count('id', filter=Q(timestamp__gte=week_start)),
+    )
+
+    return {
+        'as_of': now,
+        'data': {
+            'orders': {
+                'total': orders['order_count'],
+                'today': orders['today_count'],
+                'this_week': orders['week_count'],
+                'pending': orders['pending_count'],
+            },
+            'revenue': {
+                'total': float(orders['revenue_total'] or 0),
+                'this_week': float(orders['revenue_week'] or 0),
+                'today': float(orders['revenue_today'] or 0),
+            },
+            'products': {
+                'total': Product.objects.count(),
+                'low_stock': stock['low_stock'],
+                'out_of_stock': stock['out_of_stock'],
+            },
+            'customers': {
+                'total': customers['total'],
+                'new_this_week': customers['new_this_week'],
+            },
+            'analytics': {
+                'total_page_views': page_views['total'],
+                'week_page_views': page_views['this_week'],
+                'total_product_clicks': ProductClick.objects.count(),
+            },
+        },
+    }
+
+
+def refresh_dashboard_stats():
+    """Recompute the snapshot and store it in the cache"""
+    snapshot = compute_dashboard_stats()
+    cache.set(CacheKeys.DASHBOARD_STATS, snapshot, getattr(settings, 'DASHBOARD_STATS_TTL', 300))
+    return snapshot
+
+
+def get_dashboard_stats():
+    """Return the cached snapshot, rebuilding it if it has expired or orders have come in since"""
+    snapshot = cache.get(CacheKeys.DASHBOARD_STATS)
+    if snapshot is None:
+        return refresh_dashboard_stats()
+    min_interval = getattr(settings, 'DASHBOARD_STATS_MIN_REFRESH', 10)
+    if cache.get(CacheKeys.DASHBOARD_STATS_STALE) and cache.add(CacheKeys.DASHBOARD_STATS_REFRESH, True, min_interval):
+        # Cleared first, so orders committed during the rebuild flag it again
+        cache.delete(CacheKeys.DASHBOARD_STATS_STALE)
+        snapshot = refresh_dashboard_stats()
+    return snapshot
+
+
+def mark_dashboard_stale():
+    """Order-commit hook: flag the snapshot for the next dashboard read to rebuild"""
+    cache.set(CacheKeys.DASHBOARD_STATS_STALE, True, getattr(settings, 'DASHBOARD_STATS_TTL', 300))
@@ -0,0 +1,92 @@
+"""
+Streaming exports of the raw analytics event tables.
+
+Rows are read with ``values_list(...).iterator(chunk_size=...)`` -- a
+server-side cursor on PostgreSQL -- and encoded as CSV or NDJSON into
+output blocks of about ``BLOCK_SIZE`` bytes, optionally gzip-compressed on
+the fly. Nothing holds more than one chunk of rows and one output block, so
+memory stays flat however many rows are exported. The same generators back
+the admin export actions (through StreamingHttpResponse) and the
+``export_analytics`` command.
+"""
+import csv
+import io
+import json
+import zlib
+from itertools import chain
+
+from .models import CartActivity, PageView, ProductClick
+
+EXPORT_FIELDS = {
+    PageView: ['id', 'timestamp', 'user_id', 'session_key', 'product_id', 'category_id', 'page_url', 'ip_address'],
+    ProductClick: ['id', 'timestamp', 'user_id', 'session_key', 'product_id', 'source_page'],
+    CartActivity: ['id', 'timestamp', 'user_id', 'session_key', 'product_id', 'action', 'quantity'],
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+BLOCK_SIZE = 64 * 1024
+
+
+def _rows(queryset, fields, chunk_size):
+    return queryset.order_by().values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+def _blocks(lines):
+    """Group encoded lines into blocks of roughly BLOCK_SIZE bytes"""
+    block, size = [], 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= BLOCK_SIZE:
+            yield b''.join(block)
+            block, size = [], 0
+    if block:
+        yield b''.join(block)
+
+
+def iter_csv(queryset, fields, chunk_size=2000):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def encode(row):
+        writer.writerow(row)
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line.encode()
+
+    yield from _blocks(encode(row) for row in chain([fields], _rows(queryset, fields, chunk_size)))
+
+
+def iter_ndjson(queryset, fields, chunk_size=2000):
+    encoder = json.JSONEncoder(default=str, separators=(',', ':'))
+    yield from _blocks(
+        (encoder.encode(dict(zip(fields, row))) + '\n').encode()
+        for row in _rows(queryset, fields, chunk_size)
+    )
+
+
+def gzip_stream(blocks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for block in blocks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_stream(queryset, export_format='csv', compress=False, chunk_size=2000):
+    """Byte chunks of ``queryset`` exported as CSV or NDJSON, gzip-compressed if ``compress``"""
+    fields = EXPORT_FIELDS[queryset.model]
+    encode = iter_csv if export_format == 'csv' else iter_ndjson
+    blocks = encode(queryset, fields, chunk_size=chunk_size)
+    return gzip_stream(blocks) if compress else blocks
+
+
+def export_filename(model, export_format, compress=False, suffix=''):
+    name = f"{model._meta.model_name}{suffix}.{export_format}"
+    return f"{name}.gz" if compress else name
@@ -0,0 +1,123 @@
+"""
+Session-based conversion funnels.
+
+A funnel is an ordered list of steps drawn from ``STEP_SOURCES``. Each source
+table is read time-sorted in chunks and the streams are merged into a single
+pass over events; per visitor we only keep the index of the next step they
+need, so memory grows with the number of visitors, not events. A visitor
+completes a step when its event arrives after they completed the previous
+one (and, with ``window``, within that long of entering the funnel).
+
+Visitors are the signed-in user where known, else the session key. A session
+seen with a user is folded into that user, so anonymous browsing followed by
+a signed-in checkout is one visitor. Orders carry no session, so the
+``purchase`` step only matches signed-in visitors.
+"""
+import hashlib
+import heapq
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.utils import CacheKeys
+from orders.models import Order, OrderItem
+from .models import CartActivity, PageView, ProductClick
+from .rollups import day_bounds
+
+# step name -> (model, timestamp field, user field, session field, filters)
+STEP_SOURCES = {
+    'page_view': (PageView, 'timestamp', 'user_id', 'session_key', {}),
+    'product_view': (ProductClick, 'timestamp', 'user_id', 'session_key', {}),
+    'add_to_cart': (CartActivity, 'timestamp', 'user_id', 'session_key', {'action': 'add'}),
+    'purchase': (Order, 'created_at', 'user_id', None, {}),
+}
+DEFAULT_STEPS = ['page_view', 'product_view', 'add_to_cart', 'purchase']
+
+
+def _step_events(step, lower, upper, product=None, chunk_size=2000):
+    """Yield ``(timestamp, step, user_id, session_key)`` for one step, oldest first"""
+    model, time_field, user_field, session_field, filters = STEP_SOURCES[step]
+    if step == 'purchase' and product is not None:
+        # An order counts as a purchase of the product when it has a line for it
+        queryset = OrderItem.objects.filter(
+            product=product, order__created_at__gte=lower, order__created_at__lt=upper
+        ).order_by('order__created_at').values_list('order__created_at', 'order__user_id', 'order_id').distinct()
+        for created_at, user_id, _ in queryset.iterator(chunk_size=chunk_size):
+            yield created_at, step, user_id, ''
+        return
+
+    queryset = model.objects.filter(**{f'{time_field}__gte': lower, f'{time_field}__lt': upper}, **filters)
+    if product is not None:
+        queryset = queryset.filter(product=product)
+    if session_field is None:
+        for timestamp, user_id in queryset.order_by(time_field).values_list(time_field, user_field).iterator(
+            chunk_size=chunk_size
+        ):
+            yield timestamp, step, user_id, ''
+        return
+    for timestamp, user_id, session_key in queryset.order_by(time_field).values_list(
+        time_field, user_field, session_field
+    ).iterator(chunk_size=chunk_size):
+        yield timestamp, step, user_id, session_key
+
+
+def compute_funnel(steps, start, end, product=None, window=None):
+    """Count the visitors reaching each step of ``steps`` between ``start`` and ``end``"""
+    lower, upper = day_bounds(start, end)
+    streams = [_step_events(step, lower, upper, product) for step in dict.fromkeys(steps)]
+
+    session_users = {}
+    progress = {}    # visitor -> index of the next step they need
+    entered_at = {}  # visitor -> time they completed the first step
+    reached = [0] * len(steps)
+
+    for timestamp, step, user_id, session_key in heapq.merge(*streams, key=itemgetter(0)):
+        if user_id and session_key:
+            session_users.setdefault(session_key, user_id)
+        user_id = user_id or session_users.get(session_key)
+        if user_id:
+            visitor = ('u', user_id)
+            anonymous = ('s', session_key) if session_key else None
+            if anonymous in progress and progress.get(visitor, 0) < progress[anonymous]:
+                # Carry anonymous progress over once the session signs in
+                progress[visitor] = progress.pop(anonymous)
+                entered_at[visitor] = entered_at.pop(anonymous)
+        elif session_key:
+            visitor = ('s', session_key)
+        else:
+            continue
+
+        index = progress.get(visitor, 0)
+        if index >= len(steps) or steps[index] != step:
+            continue
+        if index and window is not None and timestamp - entered_at[visitor] > window:
+            continue
+        if index == 0:
+            entered_at[visitor] = timestamp
+        progress[visitor] = index + 1
+        reached[index] += 1
+
+    results = []
+    for index, step in enumerate(steps):
+        count = reached[index]
+        previous = reached[index - 1] if index else count
+        results.append({
+            'step': step,
+            'visitors': count,
+            'conversion_from_previous': round(count / previous * 100, 2) if previous else 0,
+            'conversion_from_start': round(count / reached[0] * 100, 2) if reached[0] else 0,
+            'drop_off': previous - count,
+        })
+    return results
+
+
+def get_funnel(steps, start, end, product=None, window=None):
+    """compute_funnel, cached for FUNNEL_CACHE_TTL seconds per distinct query"""
+    signature = repr((list(steps), start, end, product, window)).encode()
+    key = CacheKeys.FUNNEL.format(hashlib.sha1(signature).hexdigest())
+    results = cache.get(key)
+    if results is None:
+        results = compute_funnel(steps, start, end, product=product, window=window)
+        cache.set(key, results, getattr(settings, 'FUNNEL_CACHE_TTL', 600))
+    return results
@@ -0,0 +1,97 @@
+"""
+HyperLogLog cardinality sketches for unique-visitor counts.
+
+A sketch is ``2 ** PRECISION`` one-byte registers; with the default precision
+of 12 the standard error is about 1.6% whatever the cardinality. Sketches
+merge losslessly (register-wise max), so the unique visitors of any date
+range is the estimate of the merged daily sketches. ``to_bytes`` stores the
+registers zlib-compressed: a sketch that has seen a handful of visitors is a
+few dozen bytes, a saturated one about 3 KB.
+"""
+import hashlib
+import math
+import zlib
+
+PRECISION = 12
+
+
+def _lanes(m, byte):
+    return int.from_bytes(bytes([byte]) * m, 'big')
+
+
+def _register_max(a, b, high_bits):
+    """Byte-wise max of two register arrays packed into ints
+
+    Registers never exceed 64, so per byte ``(a | 0x80) - b`` cannot borrow
+    from its neighbour and keeps its high bit exactly where a >= b. That bit,
+    spread to the whole byte, selects a or b -- one pass of big-int
+    arithmetic instead of a Python loop over every register.
+    """
+    select = ((((a | high_bits) - b) & high_bits) >> 7) * 0xFF
+    return (a & select) | (b & ~select)
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    def __init__(self, registers=None, precision=PRECISION):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+        if len(self.registers) != self.m:
+            raise ValueError(f'expected {self.m} registers, got {len(self.registers)}')
+
+    def add(self, value):
+        """Record one visitor identifier (any value with a stable str())"""
+        x = _hash64(value)
+        width = 64 - self.precision
+        index = x >> width
+        rank = width - (x & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other):
+        """Fold ``other`` into this sketch in place"""
+        return self._merge_all([other])
+
+    def _merge_all(self, sketches):
+        high_bits = _lanes(self.m, 0x80)
+        merged = int.from_bytes(self.registers, 'big')
+        for sketch in sketches:
+            if sketch.precision != self.precision:
+                raise ValueError('cannot merge sketches of different precision')
+            merged = _register_max(merged, int.from_bytes(sketch.registers, 'big'), high_bits)
+        self.registers = bytearray(merged.to_bytes(self.m, 'big'))
+        return self
+
+    @classmethod
+    def union(cls, sketches, precision=PRECISION):
+        return cls(precision=precision)._merge_all(sketches)
+
+    def count(self):
+        """Estimated number of distinct values added"""
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(self.registers.count(r) * 2.0 ** -r for r in set(self.registers))
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def __len__(self):
+        return self.count()
+
+    def to_bytes(self):
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data, precision=PRECISION):
+        return cls(zlib.decompress(bytes(data)), precision=precision)
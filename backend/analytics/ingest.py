@@ -0,0 +1,283 @@
+"""
+Buffered ingestion of storefront analytics events.
+
+``/api/analytics/track`` hands each validated event to the per-process
+``event_buffer``; the request returns as soon as the event is appended. A
+daemon thread flushes the buffer with one ``bulk_create`` per model whenever
+it holds ``ANALYTICS_BUFFER_SIZE`` events or ``ANALYTICS_FLUSH_INTERVAL``
+seconds have passed, and whatever is left is flushed from an ``atexit`` hook
+on graceful shutdown. If the database falls behind and more than
+``ANALYTICS_BUFFER_MAX_PENDING`` events pile up, the request that overflows
+the buffer flushes it itself, so memory stays bounded. A failed flush is
+re-queued; events are only dropped when the database keeps failing and the
+buffer is already full. Each batch is written in one transaction, so a
+re-queued batch is never partly in the database already.
+
+Events are keyed to the client-generated ``session_id`` the storefront sends
+with every payload (frontend/lib/analytics.ts keeps one per browser, renewed
+after 30 idle minutes); the SPA never holds Django's session cookie, which
+is only the fallback.
+
+Validation is deliberately cheap -- plain type checks, no serializer and no
+database lookups per event. Unknown product and category ids are dropped at
+flush time with a single ``id__in`` query per batch.
+
+Page views that land with UTM parameters or an external referrer also buffer
+an ``AcquisitionTouch`` (analytics.attribution), flushed with the events.
+Each flushed batch is also sampled into ``EventSample`` (analytics.sampling).
+"""
+import atexit
+import logging
+import re
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from products.models import Category, Product
+from .attribution import build_touch, link_sessions, record_touches
+from .models import AcquisitionTouch, CartActivity, PageView, ProductClick
+from .sampling import record_samples
+from .trending import record_trending
+from .visitors import record_page_views
+
+logger = logging.getLogger(__name__)
+
+MAX_URL_LENGTH = 200
+MAX_SESSION_KEY_LENGTH = 100
+MAX_QUANTITY = 10000
+SESSION_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{8,100}')
+
+# Events sent by frontend/lib/analytics.ts that we persist
+TRACKED_EVENTS = {'page_view', 'view_item', 'add_to_cart', 'remove_from_cart'}
+# Events the storefront sends that are only forwarded to gtag
+IGNORED_EVENTS = {'purchase', 'search'}
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+def _optional_id(value):
+    if value in (None, ''):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise InvalidEvent('ids must be integers')
+    if value < 1:
+        raise InvalidEvent('ids must be positive')
+    return value
+
+
+def _url(value):
+    if not isinstance(value, str) or not value.startswith(('http://', 'https://')):
+        raise InvalidEvent('url must be an absolute http(s) URL')
+    return value[:MAX_URL_LENGTH]
+
+
+def session_id(raw, default=''):
+    """The client session id carried by a payload, else ``default``"""
+    value = raw.get('session_id') if isinstance(raw, dict) else None
+    if isinstance(value, str) and SESSION_ID_PATTERN.fullmatch(value):
+        return value
+    return default
+
+
+def build_event(raw, user_id=None, session_key='', ip_address=None):
+    """Turn one raw tracking payload into an unsaved model instance
+
+    Returns None for events that are valid but not stored (purchase, search)
+    and raises InvalidEvent for anything malformed.
+    """
+    if not isinstance(raw, dict):
+        raise InvalidEvent('event must be an object')
+    event = raw.get('event')
+    if event in IGNORED_EVENTS:
+        return None
+    if event not in TRACKED_EVENTS:
+        raise InvalidEvent(f'unknown event {event!r}')
+
+    data = raw.get('data') or {}
+    if not isinstance(data, dict):
+        raise InvalidEvent('data must be an object')
+    url = _url(data.get('page_location') or raw.get('url'))
+    product_id = _optional_id(data.get('product_id'))
+    session_key = session_key[:MAX_SESSION_KEY_LENGTH]
+
+    if event == 'page_view':
+        return PageView(
+            user_id=user_id,
+            product_id=product_id,
+            category_id=_optional_id(data.get('category_id')),
+            page_url=url,
+            session_key=session_key,
+            ip_address=ip_address,
+        )
+
+    if product_id is None:
+        raise InvalidEvent(f'{event} requires product_id')
+    if event == 'view_item':
+        return ProductClick(user_id=user_id, product_id=product_id, session_key=session_key, source_page=url)
+
+    quantity = data.get('quantity', 1)
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or not 1 <= quantity <= MAX_QUANTITY:
+        raise InvalidEvent('quantity must be a positive integer')
+    return CartActivity(
+        user_id=user_id,
+        product_id=product_id,
+        action='add' if event == 'add_to_cart' else 'remove',
+        quantity=quantity,
+        session_key=session_key,
+    )
+
+
+def build_landing_touch(raw, user_id=None, session_key=''):
+    """The AcquisitionTouch carried by a valid page_view payload, or None"""
+    if raw.get('event') != 'page_view':
+        return None
+    data = raw.get('data') or {}
+    referrer = data.get('page_referrer') or raw.get('referrer') or ''
+    return build_touch(
+        data.get('page_location') or raw.get('url'),
+        referrer,
+        user_id=user_id,
+        session_key=session_key[:MAX_SESSION_KEY_LENGTH],
+    )
+
+
+def _drop_dangling(events):
+    """Drop events pointing at products or categories that do not exist"""
+    product_ids = {e.product_id for e in events if getattr(e, 'product_id', None) is not None}
+    category_ids = {e.category_id for e in events if getattr(e, 'category_id', None) is not None}
+    known_products = set()
+    if product_ids:
+        known_products = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+    known_categories = set()
+    if category_ids:
+        known_categories = set(Category.objects.filter(id__in=category_ids).values_list('id', flat=True))
+
+    kept = []
+    for event in events:
+        if getattr(event, 'product_id', None) is not None and event.product_id not in known_products:
+            continue
+        if getattr(event, 'category_id', None) is not None and event.category_id not in known_categories:
+            continue
+        kept.append(event)
+    return kept
+
+
+def write_events(events, batch_size=1000):
+    """Persist a batch of unsaved events, one bulk_create per model
+
+    The inserts and the database hooks commit together, so a batch that
+    fails part way leaves nothing behind and can be retried as a whole.
+    """
+    events = _drop_dangling(events)
+    by_model = {}
+    for event in events:
+        by_model.setdefault(type(event), []).append(event)
+    try:
+        with transaction.atomic():
+            for model, rows in by_model.items():
+                model.objects.bulk_create(rows, batch_size=batch_size)
+            if PageView in by_model:
+                record_page_views(by_model[PageView])
+            if AcquisitionTouch in by_model:
+                record_touches(by_model[AcquisitionTouch])
+            link_sessions(events)
+            record_samples(events)
+    except Exception:
+        # Rolled back, so the pks bulk_create assigned point at nothing
+        for event in events:
+            event.pk = None
+        raise
+    # In-memory counters only see batches that committed
+    record_trending(events)
+    return len(events)
+
+
+class EventBuffer:
+    """Thread-safe in-process buffer flushed by a background thread"""
+
+    def __init__(self, max_size=500, flush_interval=1.0, max_pending=50000):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.stats = Counter()
+        self._events = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add(self, events):
+        with self._lock:
+            self._events.extend(events)
+            pending = len(self._events)
+        self._ensure_started()
+        if pending >= self.max_pending:
+            # The flusher is falling behind; apply back-pressure to this request
+            self.flush()
+        elif pending >= self.max_size:
+            self._wakeup.set()
+
+    def __len__(self):
+        return len(self._events)
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            if not events:
+                return 0
+            try:
+                written = write_events(events)
+            except Exception:
+                self.stats['flush_errors'] += 1
+                with self._lock:
+                    if len(self._events) + len(events) <= self.max_pending:
+                        logger.exception('Failed to flush %s analytics events; re-queueing', len(events))
+                        self._events[:0] = events
+                        return 0
+                logger.exception('Failed to flush %s analytics events; buffer full, dropping them', len(events))
+                self.stats['dropped'] += len(events)
+                return 0
+            self.stats['flushed'] += written
+            self.stats['dropped'] += len(events) - written
+            return written
+
+    def close(self):
+        """Stop the flusher thread and write out what is left"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def _ensure_started(self):
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='analytics-flush', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+        close_old_connections()
+
+
+event_buffer = EventBuffer(
+    max_size=getattr(settings, 'ANALYTICS_BUFFER_SIZE', 500),
+    flush_interval=getattr(settings, 'ANALYTICS_FLUSH_INTERVAL', 1.0),
+    max_pending=getattr(settings, 'ANALYTICS_BUFFER_MAX_PENDING', 50000),
+)
@@ -0,0 +1,62 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from analytics.models import EventSample
+from analytics.rollups import day_bounds
+from analytics.sampling import SAMPLED_MODELS, estimate_counts, sample_rate
+
+
+def _timed(func, runs):
+    best, result = None, None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare exact raw-table counts with the sample estimates behind ?approx=true: '
+        'best-of-N query time, relative error, and whether the exact count falls inside '
+        'the 95%% interval, for ranges ending today.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, nargs='+', default=[7, 30, 90, 365], help='Range lengths to measure'
+        )
+        parser.add_argument('--runs', type=int, default=3, help='Timed runs per query (best is reported)')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        self.stdout.write(f'Sample rate {sample_rate():g}, {EventSample.objects.count()} sampled rows')
+        self.stdout.write(
+            f"{'table':<14} {'days':>5} {'exact':>10} {'estimate':>10} {'95% interval':>23} "
+            f"{'error':>7} {'exact ms':>9} {'approx ms':>9}"
+        )
+        covered = total = 0
+        for days in options['days']:
+            start = today - timedelta(days=days - 1)
+            lower, upper = day_bounds(start, today)
+            estimates, approx_time = _timed(lambda: estimate_counts(start, today), options['runs'])
+            for model, kind in SAMPLED_MODELS.items():
+                exact, exact_time = _timed(
+                    lambda: model.objects.filter(timestamp__gte=lower, timestamp__lt=upper).count(),
+                    options['runs'],
+                )
+                estimate = estimates[kind]
+                inside = estimate.lower <= exact <= estimate.upper
+                covered += inside
+                total += 1
+                error = (estimate.value - exact) / exact * 100 if exact else 0.0
+                self.stdout.write(
+                    f"{kind:<14} {days:>5} {exact:>10} {estimate.value:>10.0f} "
+                    f"{f'[{estimate.lower:.0f}, {estimate.upper:.0f}]':>23} {error:>+6.1f}% "
+                    f"{exact_time * 1000:>9.1f} {approx_time * 1000:>9.1f}"
+                )
+        self.stdout.write(self.style.SUCCESS(f'Exact count inside the interval for {covered} of {total} ranges'))
@@ -0,0 +1,50 @@
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.exports import EXPORT_FIELDS, FORMATS, export_stream
+from analytics.rollups import day_bounds
+
+MODELS = {model._meta.model_name: model for model in EXPORT_FIELDS}
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream a raw analytics table (page views, product clicks or cart activity) to a CSV or '
+        'NDJSON file at constant memory, optionally gzip-compressed. Suitable for scheduled dumps.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(MODELS), help='Table to export')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv', dest='export_format')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip')
+        parser.add_argument('--output', '-o', default='-', help='Output file (default: stdout)')
+        parser.add_argument('--start', type=date.fromisoformat, help='First day to export (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day to export (YYYY-MM-DD)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per round trip')
+
+    def handle(self, *args, **options):
+        model = MODELS[options['model']]
+        queryset = model.objects.all()
+        if options['start'] or options['end']:
+            if not (options['start'] and options['end']):
+                raise CommandError('--start and --end must be given together')
+            lower, upper = day_bounds(options['start'], options['end'])
+            queryset = queryset.filter(timestamp__gte=lower, timestamp__lt=upper)
+
+        stream = export_stream(
+            queryset, options['export_format'], compress=options['gzip'], chunk_size=options['chunk_size']
+        )
+        written = 0
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        try:
+            for block in stream:
+                output.write(block)
+                written += len(block)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+
+        if options['output'] != '-':
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}"))
@@ -0,0 +1,74 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from analytics.retention import count_before, purge_before
+
+
+def format_bytes(value):
+    if value is None:
+        return 'n/a'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(value) < 1024 or unit == 'GB':
+            return f"{value:.0f}{unit}" if unit == 'B' else f"{value:.1f}{unit}"
+        value /= 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'Roll raw analytics events (page views, product clicks, cart activity) older than the '
+        'retention period into the daily rollups and visitor sketches, then delete them in '
+        'small indexed batches, one day at a time'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365, help='Keep this many days of raw events')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows deleted per statement')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+        parser.add_argument('--skip-rollup', action='store_true', help='Purge without refreshing the rollups first')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        cutoff = timezone.localdate() - timedelta(days=options['days'])
+
+        if options['dry_run']:
+            for model, rows in count_before(cutoff).items():
+                self.stdout.write(f"  {model._meta.db_table}: {rows} rows before {cutoff}")
+            return
+
+        def on_bucket(model, day, rows):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {model._meta.db_table} {day}: {rows} rows")
+
+        results = purge_before(
+            cutoff,
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            roll_up=not options['skip_rollup'],
+            on_bucket=on_bucket,
+        )
+
+        total_rows = total_bytes = 0
+        for result in results:
+            reclaimed = None
+            if result.bytes_before is not None and result.bytes_after is not None:
+                reclaimed = result.bytes_before - result.bytes_after
+                total_bytes += reclaimed
+            total_rows += result.rows
+            self.stdout.write(
+                f"  {result.model._meta.db_table}: {result.rows} rows, "
+                f"{format_bytes(result.bytes_before)} -> {format_bytes(result.bytes_after)} "
+                f"({format_bytes(reclaimed)} reclaimed)"
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {total_rows} raw analytics rows older than {cutoff}, {format_bytes(total_bytes)} reclaimed"
+        ))
+        if connection.vendor == 'postgresql':
+            self.stdout.write('Freed space is reused by new rows once autovacuum has processed the tables.')
+        elif connection.vendor == 'sqlite':
+            self.stdout.write('Freed pages are reused by SQLite; run VACUUM to shrink the database file.')
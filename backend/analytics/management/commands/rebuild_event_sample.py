@@ -0,0 +1,44 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from analytics.retention import oldest_event_date
+from analytics.sampling import rebuild_event_sample, sample_rate
+
+
+class Command(BaseCommand):
+    help = (
+        'Resample the raw event tables into the approximate-query sample. Run it once with '
+        '--backfill after deploying; ingestion keeps the sample current from then on.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day to resample (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day to resample (YYYY-MM-DD)')
+        parser.add_argument('--backfill', action='store_true', help='Resample from the oldest raw event')
+        parser.add_argument('--rate', type=float, default=None, help='Sampling rate (default ANALYTICS_SAMPLE_RATE)')
+        parser.add_argument('--chunk-days', type=int, default=7, help='Days resampled per transaction')
+
+    def handle(self, *args, **options):
+        rate = options['rate'] if options['rate'] is not None else sample_rate()
+        if not 0 < rate <= 1:
+            raise CommandError('--rate must be in (0, 1]')
+        end = options['end'] or timezone.localdate()
+        if options['backfill']:
+            start = oldest_event_date()
+            if start is None:
+                self.stdout.write('No raw events to sample')
+                return
+        else:
+            start = options['start'] or end
+        if start > end:
+            raise CommandError('--start cannot be after --end')
+
+        kept = 0
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + timedelta(days=options['chunk_days'] - 1), end)
+            kept += rebuild_event_sample(chunk_start, chunk_end, rate=rate)
+            chunk_start = chunk_end + timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(f'Sampled {kept} events from {start} .. {end} at rate {rate:g}'))
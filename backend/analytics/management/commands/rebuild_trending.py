@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from analytics.trending import rebuild_trending
+
+
+class Command(BaseCommand):
+    help = (
+        'Replace the trending checkpoints with a replay of recent raw events. Run it '
+        'once to seed trending, or after changing TRENDING_HALF_LIFE_HOURS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=float, default=None,
+            help='How far back to replay (default: 8 half-lives, after which events weigh under 0.5%%)',
+        )
+
+    def handle(self, *args, **options):
+        hours = options['hours']
+        if hours is None:
+            hours = 8 * getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 24)
+        counted = rebuild_trending(timezone.now() - timedelta(hours=hours))
+        self.stdout.write(self.style.SUCCESS(f'Replayed {counted} events from the last {hours:g} hours'))
@@ -0,0 +1,82 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from analytics.attribution import rebuild_channel_stats
+from analytics.models import PageView
+from analytics.product_metrics import rollup_product_days
+from analytics.rollups import rollup_days
+from analytics.visitors import rebuild_sketches
+from orders.models import Order
+from reviews.models import Review
+
+
+class Command(BaseCommand):
+    help = (
+        'Upsert the daily sales rollups (orders, revenue, items sold, page views per day and '
+        'per category), the per-product daily metrics and the acquisition channel counters. Run it on a schedule for the last couple of days, or with --backfill '
+        'to rebuild all history.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2, help='Refresh the last N days, today included')
+        parser.add_argument('--start', type=date.fromisoformat, help='First day to roll up (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day to roll up (YYYY-MM-DD)')
+        parser.add_argument('--backfill', action='store_true', help='Roll up from the first order, page view or review')
+        parser.add_argument('--chunk-days', type=int, default=31, help='Days aggregated per pass')
+        parser.add_argument('--no-categories', action='store_true', help='Skip the per-category rollup')
+        parser.add_argument('--no-products', action='store_true', help='Skip the per-product daily metrics')
+        parser.add_argument('--no-channels', action='store_true', help='Skip the acquisition channel counters')
+        parser.add_argument(
+            '--visitors',
+            action='store_true',
+            help='Also rebuild the unique-visitor sketches from the raw page views'
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        end = options['end'] or today
+        if options['backfill']:
+            first = [
+                value for value in (
+                    Order.objects.aggregate(first=Min('created_at'))['first'],
+                    PageView.objects.aggregate(first=Min('timestamp'))['first'],
+                    Review.objects.aggregate(first=Min('created_at'))['first'],
+                ) if value
+            ]
+            if not first:
+                self.stdout.write('Nothing to roll up')
+                return
+            start = timezone.localdate(min(first))
+        else:
+            start = options['start'] or end - timedelta(days=options['days'] - 1)
+        if start > end:
+            raise CommandError('--start cannot be after --end')
+
+        daily = per_category = per_product = per_channel = 0
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + timedelta(days=options['chunk_days'] - 1), end)
+            written = rollup_days(chunk_start, chunk_end, categories=not options['no_categories'])
+            daily += written[0]
+            per_category += written[1]
+            self.stdout.write(f"  {chunk_start} .. {chunk_end}: {written[0]} days, {written[1]} category rows")
+            if not options['no_products']:
+                products = rollup_product_days(chunk_start, chunk_end)
+                per_product += products
+                self.stdout.write(f"  {chunk_start} .. {chunk_end}: {products} product rows")
+            if not options['no_channels']:
+                channels = rebuild_channel_stats(chunk_start, chunk_end)
+                per_channel += channels
+                self.stdout.write(f"  {chunk_start} .. {chunk_end}: {channels} channel rows")
+            if options['visitors']:
+                sketches = rebuild_sketches(chunk_start, chunk_end)
+                self.stdout.write(f"  {chunk_start} .. {chunk_end}: {sketches} visitor sketches")
+            chunk_start = chunk_end + timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {start} .. {end}: {daily} daily rows, {per_category} category rows, "
+            f"{per_product} product rows, {per_channel} channel rows"
+        ))
@@ -0,0 +1,43 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from analytics.models import ReportJob
+from analytics.reports import requeue_stale_jobs, run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued analytics report jobs in this process. Use it as a dedicated report worker '
+        '(set REPORT_WORKERS=0 on the web processes), or with --once from a scheduler.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run what is queued now and exit')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between queue polls')
+        parser.add_argument(
+            '--purge-days', type=int, default=7,
+            help='Delete finished jobs older than this many days (0 keeps them)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = requeue_stale_jobs()
+            if requeued:
+                self.stdout.write(f'Requeued {requeued} stale jobs')
+            ran = run_pending_jobs()
+            if options['purge_days']:
+                cutoff = timezone.now() - timedelta(days=options['purge_days'])
+                ReportJob.objects.filter(
+                    status__in=['completed', 'failed'], finished_at__lt=cutoff
+                ).delete()
+            if options['once']:
+                self.stdout.write(self.style.SUCCESS(f'Ran {ran} report jobs'))
+                return
+            if ran:
+                self.stdout.write(f'Ran {ran} report jobs')
+            close_old_connections()
+            time.sleep(options['interval'])
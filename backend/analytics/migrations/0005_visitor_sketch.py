@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0004_daily_sales_rollup'),
+        ('products', '0003_delete_review'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('registers', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='visitor_sketches', to='products.product')),
+            ],
+            options={
+                'ordering': ['date'],
+                'constraints': [models.UniqueConstraint(fields=('date', 'product'), name='unique_product_visitor_sketch'), models.UniqueConstraint(condition=models.Q(('product__isnull', True)), fields=('date',), name='unique_site_visitor_sketch')],
+            },
+        ),
+    ]
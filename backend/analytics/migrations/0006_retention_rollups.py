@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0005_visitor_sketch'),
+        ('products', '0003_delete_review'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailycategorysalesrollup',
+            name='cart_adds',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dailycategorysalesrollup',
+            name='product_clicks',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dailysalesrollup',
+            name='cart_adds',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dailysalesrollup',
+            name='product_clicks',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='cartactivity',
+            index=models.Index(fields=['timestamp'], name='analytics_c_timesta_5689ff_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productclick',
+            index=models.Index(fields=['timestamp'], name='analytics_p_timesta_79851f_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0006_retention_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signal', models.CharField(max_length=20, unique=True)),
+                ('state', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
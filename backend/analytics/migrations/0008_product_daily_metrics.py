@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0007_trending_checkpoint'),
+        ('products', '0003_delete_review'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDailyMetrics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units_sold', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('rating_total', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_metrics', to='products.product')),
+            ],
+            options={
+                'verbose_name_plural': 'Product daily metrics',
+                'ordering': ['date'],
+                'constraints': [models.UniqueConstraint(fields=('date', 'product'), name='unique_product_daily_metrics')],
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0009_customer_metrics'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyChannelStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('channel', models.CharField(max_length=30)),
+                ('visits', models.PositiveIntegerField(default=0)),
+                ('signups', models.PositiveIntegerField(default=0)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('customers', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily channel stats',
+                'ordering': ['date'],
+                'constraints': [models.UniqueConstraint(fields=('date', 'channel'), name='unique_daily_channel_stats')],
+            },
+        ),
+        migrations.CreateModel(
+            name='AcquisitionTouch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(blank=True, max_length=100)),
+                ('channel', models.CharField(max_length=30)),
+                ('source', models.CharField(blank=True, max_length=100)),
+                ('medium', models.CharField(blank=True, max_length=100)),
+                ('campaign', models.CharField(blank=True, max_length=100)),
+                ('referrer', models.URLField(blank=True)),
+                ('landing_page', models.URLField(blank=True)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='acquisition_touches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'timestamp'], name='analytics_a_user_id_25ce0d_idx'), models.Index(fields=['session_key', 'timestamp'], name='analytics_a_session_7ea679_idx'), models.Index(fields=['timestamp'], name='analytics_a_timesta_e3b71c_idx')],
+            },
+        ),
+    ]
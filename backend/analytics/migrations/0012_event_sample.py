@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0011_report_jobs'),
+        ('products', '0003_delete_review'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventSample',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('page_view', 'Page view'), ('product_click', 'Product click'), ('cart_activity', 'Cart activity')], max_length=20)),
+                ('timestamp', models.DateTimeField()),
+                ('weight', models.FloatField()),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['timestamp', 'kind', 'weight'], name='analytics_e_timesta_60e9a2_idx'), models.Index(fields=['kind', 'timestamp', 'product', 'weight'], name='analytics_e_kind_36c74a_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0012_event_sample'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StreamCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('watermark_time', models.DateTimeField(blank=True, null=True)),
+                ('watermark_id', models.BigIntegerField(default=0)),
+                ('state', models.BinaryField(default=bytes)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AbandonedCart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=100)),
+                ('started_at', models.DateTimeField()),
+                ('last_activity_at', models.DateTimeField()),
+                ('items', models.JSONField(default=list)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('value', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('detected_at', models.DateTimeField(auto_now_add=True)),
+                ('notified_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='abandoned_carts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-last_activity_at'],
+                'indexes': [models.Index(fields=['last_activity_at'], name='analytics_a_last_ac_2ecabc_idx')],
+                'constraints': [models.UniqueConstraint(fields=('session_key', 'started_at'), name='unique_abandoned_cart_session')],
+            },
+        ),
+    ]
@@ -1,3 +1,6 @@
+import uuid
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth import get_user_model
 from products.models import Product, Category
@@ -26,6 +29,11 @@ class ProductClick(models.Model):
     session_key = models.CharField(max_length=100)
     source_page = models.URLField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp']),
+        ]
+
 class CartActivity(models.Model):
     ACTION_CHOICES = [
         ('add', 'Add to Cart'),
@@ -40,6 +48,32 @@ class CartActivity(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     session_key = models.CharField(max_length=100)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp']),
+        ]
+
+class EventSample(models.Model):
+    """A uniform random sample of the raw event tables, kept by analytics.sampling"""
+    KIND_CHOICES = [
+        ('page_view', 'Page view'),
+        ('product_click', 'Product click'),
+        ('cart_activity', 'Cart activity'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    timestamp = models.DateTimeField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True)
+    # 1 / the sampling rate in force when the event was sampled
+    weight = models.FloatField()
+
+    class Meta:
+        # Covering indexes: estimates are answered from the index alone
+        indexes = [
+            models.Index(fields=['timestamp', 'kind', 'weight']),
+            models.Index(fields=['kind', 'timestamp', 'product', 'weight']),
+        ]
+
 class OrderAnalytics(models.Model):
     order = models.OneToOneField('orders.Order', on_delete=models.CASCADE)
     acquisition_channel = models.CharField(max_length=50, blank=True)
@@ -48,4 +82,237 @@ class OrderAnalytics(models.Model):
     days_to_first_purchase = models.PositiveIntegerField(null=True, blank=True)
     
     class Meta:
-        verbose_name_plural = 'Order Analytics'
\ No newline at end of file
+        verbose_name_plural = 'Order Analytics'
+
+class AcquisitionTouch(models.Model):
+    """A visit arriving from a campaign (UTM parameters) or an external site"""
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='acquisition_touches')
+    session_key = models.CharField(max_length=100, blank=True)
+    channel = models.CharField(max_length=30)
+    source = models.CharField(max_length=100, blank=True)
+    medium = models.CharField(max_length=100, blank=True)
+    campaign = models.CharField(max_length=100, blank=True)
+    referrer = models.URLField(blank=True)
+    landing_page = models.URLField(blank=True)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'timestamp']),
+            models.Index(fields=['session_key', 'timestamp']),
+            models.Index(fields=['timestamp']),
+        ]
+
+    def __str__(self):
+        return f"{self.channel} touch {self.timestamp}"
+
+class DailyChannelStats(models.Model):
+    """Per-day, per-acquisition-channel counters, maintained by analytics.attribution"""
+    date = models.DateField()
+    channel = models.CharField(max_length=30)
+    visits = models.PositiveIntegerField(default=0)
+    signups = models.PositiveIntegerField(default=0)
+    orders = models.PositiveIntegerField(default=0)
+    customers = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+        verbose_name_plural = 'Daily channel stats'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'channel'], name='unique_daily_channel_stats'),
+        ]
+
+    def __str__(self):
+        return f"{self.channel} {self.date}"
+
+class AbandonedCart(models.Model):
+    """A cart session that went quiet without an order, found by analytics.abandoned_carts"""
+    session_key = models.CharField(max_length=100)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='abandoned_carts')
+    started_at = models.DateTimeField()
+    last_activity_at = models.DateTimeField()
+    # [{"product": id, "quantity": n, "unit_price": "12.50"}], priced when detected
+    items = models.JSONField(default=list)
+    item_count = models.PositiveIntegerField(default=0)
+    value = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    detected_at = models.DateTimeField(auto_now_add=True)
+    notified_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-last_activity_at']
+        indexes = [
+            models.Index(fields=['last_activity_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['session_key', 'started_at'], name='unique_abandoned_cart_session'),
+        ]
+
+    def __str__(self):
+        return f"Abandoned cart {self.session_key} ({self.value})"
+
+class StreamCheckpoint(models.Model):
+    """Watermark and open state of a resumable job over a raw event table"""
+    name = models.CharField(max_length=50, unique=True)
+    watermark_time = models.DateTimeField(null=True, blank=True)
+    watermark_id = models.BigIntegerField(default=0)
+    state = models.BinaryField(default=bytes)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} checkpoint at {self.watermark_time}"
+
+class CustomerMetrics(models.Model):
+    """Lifetime totals of one customer's paid orders, kept current by analytics.customers"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='customer_metrics')
+    order_count = models.PositiveIntegerField(default=0)
+    total_spent = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    first_order_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    last_order_at = models.DateTimeField(null=True, blank=True)
+    is_repeat = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Customer metrics'
+
+    def __str__(self):
+        return f"Customer metrics for {self.user}"
+
+class DailySalesRollup(models.Model):
+    """Per-day sales and traffic totals, upserted by analytics.rollups"""
+    date = models.DateField(unique=True)
+    orders = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    items_sold = models.PositiveIntegerField(default=0)
+    page_views = models.PositiveIntegerField(default=0)
+    product_clicks = models.PositiveIntegerField(default=0)
+    cart_adds = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+
+    def __str__(self):
+        return f"Sales rollup {self.date}"
+
+class DailyCategorySalesRollup(models.Model):
+    """Per-day, per-category sales and traffic totals, upserted by analytics.rollups"""
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_rollups')
+    orders = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    items_sold = models.PositiveIntegerField(default=0)
+    page_views = models.PositiveIntegerField(default=0)
+    product_clicks = models.PositiveIntegerField(default=0)
+    cart_adds = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'date'], name='unique_category_daily_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.category} rollup {self.date}"
+
+class ProductDailyMetrics(models.Model):
+    """Per-day, per-product sales and review totals, upserted by analytics.product_metrics"""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_metrics')
+    orders = models.PositiveIntegerField(default=0)
+    units_sold = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_total = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+        verbose_name_plural = 'Product daily metrics'
+        constraints = [
+            # Leads with date so range reads are one index range scan
+            models.UniqueConstraint(fields=['date', 'product'], name='unique_product_daily_metrics'),
+        ]
+
+    def __str__(self):
+        return f"{self.product} metrics {self.date}"
+
+class VisitorSketch(models.Model):
+    """HyperLogLog sketch of the visitors seen on one day, site-wide (product is null) or for one product"""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True, related_name='visitor_sketches')
+    registers = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='unique_product_visitor_sketch'),
+            models.UniqueConstraint(
+                fields=['date'], condition=models.Q(product__isnull=True), name='unique_site_visitor_sketch'
+            ),
+        ]
+
+    def __str__(self):
+        scope = self.product_id or 'site'
+        return f"Visitor sketch {self.date} ({scope})"
+
+
+class TrendingCheckpoint(models.Model):
+    """Merged trending sketch for one signal (see analytics/trending.py)"""
+    signal = models.CharField(max_length=20, unique=True)
+    state = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Trending checkpoint ({self.signal})"
+
+
+class ReportJob(models.Model):
+    """A long-range analytics report computed in the background (see analytics/reports.py)"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    ACTIVE_STATUSES = ('pending', 'running')
+    REPORT_CHOICES = [
+        ('sales_overview', 'Sales overview'),
+        ('customer_behavior', 'Customer behavior'),
+        ('engagement_metrics', 'Engagement metrics'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    report = models.CharField(max_length=50, choices=REPORT_CHOICES)
+    spec = models.JSONField()
+    spec_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    chunks_done = models.PositiveIntegerField(default=0)
+    chunks_total = models.PositiveIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='report_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['spec_hash', 'status', 'expires_at']),
+            models.Index(fields=['status', 'created_at']),
+        ]
+        constraints = [
+            # Identical submissions while one is queued or running share it
+            models.UniqueConstraint(
+                fields=['spec_hash'], condition=models.Q(status__in=['pending', 'running']),
+                name='unique_active_report_job'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.report} report {self.id} ({self.status})"
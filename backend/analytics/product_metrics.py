@@ -0,0 +1,155 @@
+"""
+Per-product daily metrics.
+
+``ProductDailyMetrics`` holds one row per product and day with activity: the
+orders containing the product, units sold, revenue (price * quantity of its
+lines) and the count and rating total of the approved reviews written that
+day. Order lines and reviews are aggregated in separate queries, so the two
+never fan out against each other. ``rollup_product_days`` upserts a range of
+days -- from the ``rollup_analytics`` command, like the daily sales rollup --
+and ``read_product_metrics`` answers any date range with one indexed range
+aggregate, aggregating today live so the current day is never stale.
+
+Reviews change long after the day they were written (approval, rejection,
+rating edits, deletes), so the review columns are also kept in step by
+``apply_review_changes``, which reviews/ratings.py calls with the same
+deltas it applies to ``ProductRating``, keyed on each review's creation day.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Greatest
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from orders.models import OrderItem
+from products.models import Product
+from reviews.models import Review
+from .models import ProductDailyMetrics
+from .rollups import day_bounds
+
+METRIC_FIELDS = ['orders', 'units_sold', 'revenue', 'review_count', 'rating_total']
+
+
+def _empty_metrics():
+    return {'orders': 0, 'units_sold': 0, 'revenue': Decimal('0'), 'review_count': 0, 'rating_total': 0}
+
+
+def compute_daily_product_metrics(start, end):
+    """Aggregate orders and reviews into ``{(date, product_id): metrics}`` for pairs with activity"""
+    lower, upper = day_bounds(start, end)
+    totals = defaultdict(_empty_metrics)
+
+    items = OrderItem.objects.filter(
+        order__created_at__gte=lower, order__created_at__lt=upper
+    ).annotate(day=TruncDate('order__created_at')).values('day', 'product_id').annotate(
+        order_count=Count('order_id', distinct=True),
+        units=Sum('quantity'),
+        sales=Sum(F('price') * F('quantity')),
+    ).order_by()
+    for row in items:
+        totals[(row['day'], row['product_id'])].update(
+            orders=row['order_count'], units_sold=row['units'] or 0, revenue=row['sales'] or Decimal('0')
+        )
+
+    reviews = Review.objects.filter(
+        is_approved=True, created_at__gte=lower, created_at__lt=upper
+    ).annotate(day=TruncDate('created_at')).values('day', 'product_id').annotate(
+        count=Count('id'), stars=Sum('rating')
+    ).order_by()
+    for row in reviews:
+        totals[(row['day'], row['product_id'])].update(review_count=row['count'], rating_total=row['stars'] or 0)
+
+    return totals
+
+
+def rollup_product_days(start, end, batch_size=500):
+    """Recompute and upsert the metrics rows for ``start``..``end``; returns the rows written"""
+    totals = compute_daily_product_metrics(start, end)
+    # Zero out products that had activity on a day in a previous run but not any more
+    for key in ProductDailyMetrics.objects.filter(date__gte=start, date__lte=end).values_list('date', 'product_id'):
+        if key not in totals:
+            totals[key] = _empty_metrics()
+    live_products = set(Product.objects.filter(
+        id__in={product_id for _, product_id in totals}
+    ).values_list('id', flat=True))
+    rows = [
+        ProductDailyMetrics(date=day, product_id=product_id, **values)
+        for (day, product_id), values in totals.items()
+        if product_id in live_products
+    ]
+    with transaction.atomic():
+        ProductDailyMetrics.objects.bulk_create(
+            rows,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['date', 'product'],
+            update_fields=METRIC_FIELDS + ['updated_at'],
+        )
+    return len(rows)
+
+
+def apply_review_changes(changes):
+    """Apply ``(product_id, rating, delta, created_at)`` review changes to the review columns
+
+    Called by reviews/ratings.py inside the review's transaction.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for product_id, rating, delta, created_at in changes:
+        counts = deltas[(timezone.localdate(created_at), product_id)]
+        counts[0] += delta
+        counts[1] += rating * delta
+    deltas = {key: counts for key, counts in deltas.items() if any(counts)}
+    if not deltas:
+        return
+
+    ProductDailyMetrics.objects.bulk_create(
+        [ProductDailyMetrics(date=day, product_id=product_id) for day, product_id in deltas],
+        ignore_conflicts=True,
+    )
+    now = timezone.now()
+    for (day, product_id), (count, stars) in deltas.items():
+        ProductDailyMetrics.objects.filter(date=day, product_id=product_id).update(
+            review_count=Greatest(F('review_count') + count, Value(0)),
+            rating_total=Greatest(F('rating_total') + stars, Value(0)),
+            updated_at=now,
+        )
+
+
+def read_product_metrics(start, end, limit=20):
+    """The ``limit`` best-selling products over ``start``..``end`` with their summed metrics
+
+    Returns dicts with ``product_id`` and METRIC_FIELDS, most units sold
+    first; products with reviews but no sales in the range are left out.
+    """
+    today = timezone.localdate()
+    closed_end = min(end, today - timedelta(days=1))
+    closed = ProductDailyMetrics.objects.filter(date__gte=start, date__lte=closed_end).values(
+        'product_id'
+    ).annotate(**{f'total_{field}': Sum(field) for field in METRIC_FIELDS}).order_by(
+        '-total_units_sold', 'product_id'
+    )
+
+    if end < today:
+        # Entirely closed days: rank and limit in the database
+        return [
+            {'product_id': row['product_id'], **{field: row[f'total_{field}'] for field in METRIC_FIELDS}}
+            for row in closed.filter(total_units_sold__gt=0)[:limit]
+        ]
+
+    totals = defaultdict(_empty_metrics)
+    if start <= closed_end:
+        for row in closed:
+            totals[row['product_id']] = {field: row[f'total_{field}'] for field in METRIC_FIELDS}
+    for (_, product_id), values in compute_daily_product_metrics(max(start, today), end).items():
+        for field in METRIC_FIELDS:
+            totals[product_id][field] += values[field]
+
+    ranked = sorted(
+        (product_id, values) for product_id, values in totals.items() if values['units_sold'] > 0
+    )
+    ranked.sort(key=lambda item: item[1]['units_sold'], reverse=True)
+    return [{'product_id': product_id, **values} for product_id, values in ranked[:limit]]
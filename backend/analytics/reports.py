@@ -0,0 +1,416 @@
+"""
+Analytics reports and background report jobs.
+
+A report is a list of sections, each a function of the report spec (report
+name, date range and any filters). The sales overview, customer behaviour
+and engagement views compute their payload here synchronously; long ranges
+can instead be submitted as a ``ReportJob`` and polled.
+
+A job runs section by section. Per-day sections are computed in chunks of
+REPORT_CHUNK_DAYS, and the partial result is saved with ``chunks_done`` after
+every chunk so pollers see progress. Jobs run in a small per-process thread
+pool (REPORT_WORKERS) once the submitting transaction commits, or in a
+separate worker process through the ``run_report_jobs`` command; either way a
+job is claimed with a conditional ``pending -> running`` update, so it runs
+once.
+
+Jobs are keyed by a hash of their spec. A submission returns the completed
+job for the same spec while its result is fresh (REPORT_CACHE_TTL, or
+REPORT_LIVE_CACHE_TTL when the range includes today), and identical
+submissions while one is pending or running share it -- a partial unique
+constraint makes that hold across processes.
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Avg, Count, F, Q, Sum
+from django.utils import timezone
+
+from orders.models import OrderItem
+from products.models import Product
+from .attribution import channel_breakdown
+from .cube import get_order_cube
+from .funnels import get_funnel
+from .models import CartActivity, CustomerMetrics, PageView, ProductClick, ReportJob
+from .rollups import date_range, day_bounds, read_daily_rollup
+from .sampling import approximation_info, as_dict, estimate_counts, estimate_top_products
+from .serializers import CustomerBehaviorResponseSerializer, SalesOverviewResponseSerializer
+from .trending import trending
+from .visitors import unique_visitors
+
+logger = logging.getLogger(__name__)
+
+# name: the key the value is stored under, or None to merge a dict into the result
+# chunked: computed per REPORT_CHUNK_DAYS and concatenated (per-day lists)
+Section = namedtuple('Section', 'name compute chunked')
+Report = namedtuple('Report', 'sections params serializer')
+
+
+def _sales_daily(start, end, category=None):
+    cube = get_order_cube()
+    if cube is not None:
+        return cube.daily_sales(start, end, category=category)
+    return [
+        {
+            'date': day['date'],
+            'revenue': float(day['revenue']),
+            'orders': day['orders'],
+            'items_sold': day['items_sold'],
+        }
+        for day in read_daily_rollup(start, end, category=category)
+    ]
+
+
+def _sales_top_products(start, end, category=None):
+    cube = get_order_cube()
+    if cube is not None:
+        top_sold = cube.top_k('product', start, end, k=10, metric='quantity', category=category)
+        product_ids = [product_id for product_id, _ in top_sold]
+        names = dict(Product.objects.filter(id__in=product_ids).values_list('id', 'name'))
+        revenue = dict(zip(*cube.group_by('product', start, end, metric='revenue', category=category)))
+        return [
+            {
+                'product_name': names.get(product_id, ''),
+                'total_sold': int(sold),
+                'total_revenue': round(float(revenue.get(product_id, 0)), 2),
+            }
+            for product_id, sold in top_sold
+        ]
+
+    range_start, range_end = day_bounds(start, end)
+    top_products = OrderItem.objects.filter(order__created_at__gte=range_start, order__created_at__lt=range_end)
+    if category is not None:
+        top_products = top_products.filter(product__category_id=category)
+    return list(top_products.values(
+        product_name=F('product__name')
+    ).annotate(
+        total_sold=Sum('quantity'),
+        total_revenue=Sum(F('price') * F('quantity'))
+    ).order_by('-total_sold')[:10])
+
+
+def _customer_channels(start, end, approx=False):
+    return channel_breakdown(start, end)
+
+
+def _customer_cohort(start, end, approx=False):
+    # Lifetime value and repeat rate of the customers acquired in the range
+    # (first paid order in range), from the per-customer metrics
+    range_start, range_end = day_bounds(start, end)
+    cohort = CustomerMetrics.objects.filter(
+        user__is_staff=False,
+        first_order_at__gte=range_start,
+        first_order_at__lt=range_end
+    ).aggregate(
+        total_customers=Count('id'),
+        repeat_customers=Count('id', filter=Q(is_repeat=True)),
+        avg_lifetime_value=Avg('total_spent')
+    )
+    total_customers = cohort['total_customers']
+    repeat_customers = cohort['repeat_customers']
+    return {
+        'customer_lifetime_value': float(cohort['avg_lifetime_value'] or 0),
+        'repeat_customer_rate': round(repeat_customers / total_customers * 100, 2) if total_customers else 0,
+        'total_customers': total_customers,
+        'repeat_customers': repeat_customers,
+    }
+
+
+def _customer_engagement(start, end, approx=False):
+    if approx:
+        # Estimated from the event sample (analytics/sampling.py)
+        estimates = estimate_counts(start, end)
+        counts = {
+            'page_views': estimates['page_view'],
+            'product_clicks': estimates['product_click'],
+            'cart_activities': estimates['cart_activity'],
+        }
+        return {
+            'engagement_metrics': {name: int(round(estimate.value)) for name, estimate in counts.items()},
+            'approximation': approximation_info(
+                engagement_metrics={name: as_dict(estimate) for name, estimate in counts.items()}
+            ),
+        }
+    range_start, range_end = day_bounds(start, end)
+    in_range = {'timestamp__gte': range_start, 'timestamp__lt': range_end}
+    return {
+        'engagement_metrics': {
+            'page_views': PageView.objects.filter(**in_range).count(),
+            'product_clicks': ProductClick.objects.filter(**in_range).count(),
+            'cart_activities': CartActivity.objects.filter(**in_range).count(),
+        },
+    }
+
+
+def _engagement_daily(start, end, category=None, approx=False):
+    # Page views by day, from the daily rollup (today is aggregated live)
+    return [
+        {'date': day['date'], 'views': day['page_views']}
+        for day in read_daily_rollup(start, end, category=category)
+    ]
+
+
+def _engagement_unique_visitors(start, end, category=None, approx=False):
+    return unique_visitors(start, end)
+
+
+def _engagement_popular_products(start, end, category=None, approx=False):
+    # Clicks in the range: counted from the raw clicks or, with approx, the event sample
+    if approx:
+        top = estimate_top_products(start, end)
+        names = dict(Product.objects.filter(id__in=[pid for pid, _, _ in top]).values_list('id', 'name'))
+        top = [row for row in top if row[0] in names]
+        return {
+            'popular_products': [
+                {'product__name': names[product_id], 'click_count': int(round(clicks.value))}
+                for product_id, clicks, _ in top
+            ],
+            'approximation': approximation_info(popular_products=[
+                {'product__name': names[product_id], 'click_count': as_dict(clicks), 'share': as_dict(share, 4)}
+                for product_id, clicks, share in top
+            ]),
+        }
+    range_start, range_end = day_bounds(start, end)
+    return {'popular_products': list(ProductClick.objects.filter(
+        timestamp__gte=range_start,
+        timestamp__lt=range_end
+    ).values(
+        'product__name'
+    ).annotate(
+        click_count=Count('id')
+    ).order_by('-click_count')[:10])}
+
+
+def _engagement_trending(start, end, category=None, approx=False):
+    # What is hot right now, from the decayed click sketch (analytics/trending.py).
+    # The score weights recent clicks most and ignores start_date, so it is
+    # reported next to the range's click counts rather than in place of them.
+    if end < timezone.localdate():
+        return []
+    ranked = trending.top('clicks', k=10)
+    names = dict(Product.objects.filter(id__in=[pid for pid, _ in ranked]).values_list('id', 'name'))
+    return [
+        {'product__name': names[product_id], 'trending_score': round(score, 2)}
+        for product_id, score in ranked if product_id in names
+    ]
+
+
+def _engagement_conversion(start, end, category=None, approx=False):
+    # Visitors who added to cart, and how many of them went on to order
+    cart_adds, purchases = get_funnel(['add_to_cart', 'purchase'], start, end)
+    return {
+        'cart_adds': cart_adds['visitors'],
+        'purchases': purchases['visitors'],
+        'conversion_rate': purchases['conversion_from_previous'],
+    }
+
+
+REPORTS = {
+    'sales_overview': Report(
+        sections=[
+            Section('daily_sales', _sales_daily, True),
+            Section('top_products', _sales_top_products, False),
+        ],
+        params=['category'],
+        serializer=SalesOverviewResponseSerializer,
+    ),
+    'customer_behavior': Report(
+        sections=[
+            Section('acquisition_channels', _customer_channels, False),
+            Section(None, _customer_cohort, False),
+            Section(None, _customer_engagement, False),
+        ],
+        params=['approx'],
+        serializer=CustomerBehaviorResponseSerializer,
+    ),
+    'engagement_metrics': Report(
+        sections=[
+            Section('daily_engagement', _engagement_daily, True),
+            Section('unique_visitors', _engagement_unique_visitors, False),
+            Section(None, _engagement_popular_products, False),
+            Section('trending_products', _engagement_trending, False),
+            Section('conversion_metrics', _engagement_conversion, False),
+        ],
+        params=['category', 'approx'],
+        serializer=None,
+    ),
+}
+
+
+def build_spec(report, time_data):
+    """The canonical spec of ``report`` over validated TimeRangeSerializer data"""
+    spec = {
+        'report': report,
+        'start_date': time_data['start_date'].isoformat(),
+        'end_date': time_data['end_date'].isoformat(),
+    }
+    for param in REPORTS[report].params:
+        spec[param] = time_data.get(param)
+    return spec
+
+
+def spec_hash(spec):
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def _chunks(spec):
+    """``(section, start, end)`` for every unit of work of ``spec``, in order"""
+    start, end = date.fromisoformat(spec['start_date']), date.fromisoformat(spec['end_date'])
+    chunk_days = getattr(settings, 'REPORT_CHUNK_DAYS', 31)
+    for section in REPORTS[spec['report']].sections:
+        if not section.chunked:
+            yield section, start, end
+            continue
+        for chunk_start in list(date_range(start, end))[::chunk_days]:
+            yield section, chunk_start, min(chunk_start + timedelta(days=chunk_days - 1), end)
+
+
+def _compute(section, start, end, spec):
+    params = {param: spec[param] for param in REPORTS[spec['report']].params}
+    return section.compute(start, end, **params)
+
+
+def _add(data, section, value):
+    if section.name is None:
+        data.update(value)
+    elif section.chunked:
+        data.setdefault(section.name, []).extend(value)
+    else:
+        data[section.name] = value
+
+
+def serialize_report(spec, data):
+    """The JSON payload a view would send for ``data``, as stored on the job"""
+    serializer = REPORTS[spec['report']].serializer
+    return serializer({'data': data}).data['data'] if serializer is not None else data
+
+
+def compute_report(spec, on_chunk=None):
+    """The report data for ``spec``; ``on_chunk(done, total, partial)`` is called after each chunk"""
+    chunks = list(_chunks(spec))
+    data = {}
+    for done, (section, start, end) in enumerate(chunks, start=1):
+        _add(data, section, _compute(section, start, end, spec))
+        if on_chunk is not None:
+            on_chunk(done, len(chunks), data)
+    return data
+
+
+def _expires_at(spec, now):
+    if date.fromisoformat(spec['end_date']) >= timezone.localdate(now):
+        ttl = getattr(settings, 'REPORT_LIVE_CACHE_TTL', 300)
+    else:
+        ttl = getattr(settings, 'REPORT_CACHE_TTL', 86400)
+    return now + timedelta(seconds=ttl)
+
+
+def find_report_job(spec):
+    """A fresh completed or an active job for ``spec``, or None"""
+    digest = spec_hash(spec)
+    return ReportJob.objects.filter(
+        Q(status='completed', expires_at__gt=timezone.now()) | Q(status__in=ReportJob.ACTIVE_STATUSES),
+        spec_hash=digest,
+    ).order_by('-created_at').first()
+
+
+def submit_report(spec, user=None):
+    """The job answering ``spec``, queueing a new one if none is fresh or in flight
+
+    Returns ``(job, created)``.
+    """
+    job = find_report_job(spec)
+    if job is not None:
+        return job, False
+    try:
+        with transaction.atomic():
+            job = ReportJob.objects.create(
+                report=spec['report'],
+                spec=spec,
+                spec_hash=spec_hash(spec),
+                chunks_total=len(list(_chunks(spec))),
+                requested_by=user,
+            )
+    except IntegrityError:
+        # An identical submission was queued concurrently; share it
+        return find_report_job(spec), False
+    job_id = job.pk
+    transaction.on_commit(lambda: _dispatch(job_id))
+    return job, True
+
+
+def run_report_job(job_id):
+    """Claim and compute one pending job; returns False if someone else claimed it"""
+    claimed = ReportJob.objects.filter(pk=job_id, status='pending').update(
+        status='running', started_at=timezone.now()
+    )
+    if not claimed:
+        return False
+    job = ReportJob.objects.get(pk=job_id)
+
+    def save_progress(done, total, partial):
+        ReportJob.objects.filter(pk=job_id).update(chunks_done=done, chunks_total=total, result=partial)
+
+    try:
+        job.result = serialize_report(job.spec, compute_report(job.spec, on_chunk=save_progress))
+    except Exception as exc:
+        logger.exception('Report job %s failed', job_id)
+        job.status = 'failed'
+        job.error = str(exc)[:1000]
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        return True
+    now = timezone.now()
+    job.status = 'completed'
+    job.chunks_done = job.chunks_total
+    job.finished_at = now
+    job.expires_at = _expires_at(job.spec, now)
+    job.save(update_fields=['status', 'result', 'chunks_done', 'finished_at', 'expires_at'])
+    return True
+
+
+def requeue_stale_jobs(timeout=None):
+    """Put jobs whose worker died mid-run back in the queue; returns how many"""
+    timeout = timeout if timeout is not None else getattr(settings, 'REPORT_JOB_TIMEOUT', 1800)
+    return ReportJob.objects.filter(
+        status='running', started_at__lt=timezone.now() - timedelta(seconds=timeout)
+    ).update(status='pending', started_at=None, chunks_done=0, result=None)
+
+
+def run_pending_jobs(limit=None):
+    """Run queued jobs oldest first in this process; returns the number run"""
+    ran = 0
+    queue = ReportJob.objects.filter(status='pending').order_by('created_at').values_list('pk', flat=True)
+    for job_id in queue[:limit] if limit else queue:
+        ran += run_report_job(job_id)
+    return ran
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _run_in_worker(job_id):
+    close_old_connections()
+    try:
+        run_report_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def _dispatch(job_id):
+    """Hand a committed job to this process's pool, unless jobs are left to run_report_jobs"""
+    global _executor
+    workers = getattr(settings, 'REPORT_WORKERS', 2)
+    if workers <= 0:
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analytics-report')
+    _executor.submit(_run_in_worker, job_id)
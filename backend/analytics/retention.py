@@ -0,0 +1,135 @@
+"""
+Rollup-then-purge retention for the raw analytics event tables.
+
+Raw events are handled in day buckets. Before any bucket is purged, the days
+being dropped are rolled up into DailySalesRollup /
+DailyCategorySalesRollup, and their visitor sketches are rebuilt, so the
+range views and unique-visitor counts keep answering for purged history.
+The purge then records its cutoff as a watermark (``purged_before``), so
+later rollups and sketch rebuilds -- including ``rollup_analytics
+--backfill`` -- never recompute a purged day from the now-empty raw tables.
+Each bucket is then deleted in small batches through the timestamp index. A
+batch is one short autocommit ``DELETE ... WHERE id IN (...)``, so no
+statement holds locks over a large range of the table and concurrent
+ingestion keeps flowing. The tables have no dependent rows, so Django
+issues the DELETE directly without loading anything into Python.
+"""
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db import DatabaseError, connection
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import CartActivity, PageView, ProductClick, StreamCheckpoint
+from .rollups import PURGE_CHECKPOINT, date_range, day_bounds, purged_before, rollup_days
+from .visitors import rebuild_sketches
+
+RAW_EVENT_MODELS = [PageView, ProductClick, CartActivity]
+
+PurgeResult = namedtuple('PurgeResult', 'model rows bytes_before bytes_after')
+
+
+def table_bytes(model):
+    """On-disk size of a table and its indexes, or None if the backend cannot tell"""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_total_relation_size(%s)', [table])
+            return cursor.fetchone()[0]
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute(
+                    'SELECT SUM(pgsize) FROM dbstat WHERE name IN '
+                    '(SELECT name FROM sqlite_master WHERE tbl_name = %s)',
+                    [table],
+                )
+            except DatabaseError:
+                # SQLite built without the dbstat virtual table
+                return None
+            return cursor.fetchone()[0] or 0
+    return None
+
+
+def oldest_event_date():
+    firsts = [model.objects.aggregate(first=Min('timestamp'))['first'] for model in RAW_EVENT_MODELS]
+    firsts = [first for first in firsts if first]
+    return timezone.localdate(min(firsts)) if firsts else None
+
+
+def roll_up_before(cutoff, chunk_days=31):
+    """Make sure every day before ``cutoff`` has its aggregates; returns the days covered"""
+    first = oldest_event_date()
+    kept = purged_before()
+    if first is not None and kept:
+        first = max(first, kept)
+    if first is None or first >= cutoff:
+        return 0
+    last = cutoff - timedelta(days=1)
+    chunk_start = first
+    while chunk_start <= last:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), last)
+        rollup_days(chunk_start, chunk_end)
+        rebuild_sketches(chunk_start, chunk_end)
+        chunk_start = chunk_end + timedelta(days=1)
+    return (last - first).days + 1
+
+
+def purge_bucket(model, day, batch_size=5000, pause=0.0):
+    """Delete one day of ``model`` rows in batches; returns the rows deleted"""
+    lower, upper = day_bounds(day, day)
+    bucket = model.objects.filter(timestamp__gte=lower, timestamp__lt=upper).order_by()
+    deleted = 0
+    while True:
+        ids = list(bucket.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += model.objects.filter(id__in=ids).delete()[0]
+        if pause:
+            time.sleep(pause)
+
+
+def advance_purge_watermark(cutoff):
+    """Record that raw events before ``cutoff`` are gone; the watermark never moves back"""
+    boundary, _ = day_bounds(cutoff, cutoff)
+    StreamCheckpoint.objects.get_or_create(name=PURGE_CHECKPOINT)
+    StreamCheckpoint.objects.filter(name=PURGE_CHECKPOINT).filter(
+        Q(watermark_time__isnull=True) | Q(watermark_time__lt=boundary)
+    ).update(watermark_time=boundary, updated_at=timezone.now())
+
+
+def purge_before(cutoff, batch_size=5000, pause=0.0, roll_up=True, on_bucket=None):
+    """Roll up and then purge every raw event older than the local day ``cutoff``
+
+    All raw tables are purged together: the rollup rows mix columns from each
+    of them, so purging one table alone would leave the others' days to be
+    recomputed later. The watermark moves before the first delete, so a purge
+    that stops half way never has its deleted days rolled up again.
+
+    ``on_bucket(model, day, rows)`` is called after each purged day bucket.
+    Returns one PurgeResult per raw event table.
+    """
+    if roll_up:
+        roll_up_before(cutoff)
+    advance_purge_watermark(cutoff)
+
+    results = []
+    for model in RAW_EVENT_MODELS:
+        bytes_before = table_bytes(model)
+        rows = 0
+        first = model.objects.aggregate(first=Min('timestamp'))['first']
+        if first is not None and timezone.localdate(first) < cutoff:
+            for day in date_range(timezone.localdate(first), cutoff - timedelta(days=1)):
+                purged = purge_bucket(model, day, batch_size=batch_size, pause=pause)
+                rows += purged
+                if purged and on_bucket:
+                    on_bucket(model, day, purged)
+        results.append(PurgeResult(model, rows, bytes_before, table_bytes(model)))
+    return results
+
+
+def count_before(cutoff):
+    """Rows per raw event table that purge_before(cutoff) would delete"""
+    upper, _ = day_bounds(cutoff, cutoff)
+    return {model: model.objects.filter(timestamp__lt=upper).count() for model in RAW_EVENT_MODELS}
@@ -0,0 +1,253 @@
+"""
+Daily sales rollups.
+
+``DailySalesRollup`` holds one row per calendar day (and
+``DailyCategorySalesRollup`` one row per day and category) with the order
+count, revenue, units sold, page views, product clicks and cart adds for that
+day. Rows are upserted by
+``rollup_days`` -- from the ``rollup_analytics`` command for backfills and
+from a scheduled run for the last day or two -- so range views read a single
+indexed range of the rollup instead of aggregating the raw tables once per
+day.
+
+Every day in the requested range gets a row, including days with no activity,
+so re-running a range after orders are cancelled or deleted zeroes it out.
+Days whose raw events were purged (analytics/retention.py) keep their stored
+page view, click and cart counts; only the order columns are recomputed.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from orders.models import Order, OrderItem
+from products.models import Category
+from .models import (
+    CartActivity, DailyCategorySalesRollup, DailySalesRollup, PageView, ProductClick, StreamCheckpoint,
+)
+
+ROLLUP_FIELDS = ['orders', 'revenue', 'items_sold', 'page_views', 'product_clicks', 'cart_adds']
+# Columns computed from the raw event tables, which retention purges
+EVENT_FIELDS = ['page_views', 'product_clicks', 'cart_adds']
+PURGE_CHECKPOINT = 'raw_events_purge'
+
+
+def _empty_totals():
+    return {
+        'orders': 0, 'revenue': Decimal('0'), 'items_sold': 0,
+        'page_views': 0, 'product_clicks': 0, 'cart_adds': 0,
+    }
+
+
+def day_bounds(start, end):
+    """Aware datetimes covering the local calendar days ``start``..``end`` inclusive"""
+    tz = timezone.get_current_timezone()
+    return (
+        timezone.make_aware(datetime.combine(start, time.min), tz),
+        timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz),
+    )
+
+
+def date_range(start, end):
+    current = start
+    while current <= end:
+        yield current
+        current += timedelta(days=1)
+
+
+def purged_before():
+    """First local day whose raw events are still kept, or None if nothing was ever purged"""
+    watermark = StreamCheckpoint.objects.filter(name=PURGE_CHECKPOINT).values_list(
+        'watermark_time', flat=True
+    ).first()
+    return timezone.localdate(watermark) if watermark else None
+
+
+def compute_daily_totals(start, end):
+    """Aggregate the raw tables into ``{date: totals}`` for every day in the range"""
+    lower, upper = day_bounds(start, end)
+    totals = {day: _empty_totals() for day in date_range(start, end)}
+
+    orders = Order.objects.filter(
+        created_at__gte=lower, created_at__lt=upper
+    ).annotate(day=TruncDate('created_at')).values('day').annotate(
+        order_count=Count('id'), revenue=Sum('total')
+    ).order_by()
+    for row in orders:
+        totals[row['day']].update(orders=row['order_count'], revenue=row['revenue'] or Decimal('0'))
+
+    items = OrderItem.objects.filter(
+        order__created_at__gte=lower, order__created_at__lt=upper
+    ).annotate(day=TruncDate('order__created_at')).values('day').annotate(
+        units=Sum('quantity')
+    ).order_by()
+    for row in items:
+        totals[row['day']]['items_sold'] = row['units'] or 0
+
+    views = PageView.objects.filter(
+        timestamp__gte=lower, timestamp__lt=upper
+    ).annotate(day=TruncDate('timestamp')).values('day').annotate(
+        views=Count('id')
+    ).order_by()
+    for row in views:
+        totals[row['day']]['page_views'] = row['views']
+
+    for field, queryset in (
+        ('product_clicks', ProductClick.objects.all()),
+        ('cart_adds', CartActivity.objects.filter(action='add')),
+    ):
+        rows = queryset.filter(timestamp__gte=lower, timestamp__lt=upper).annotate(
+            day=TruncDate('timestamp')
+        ).values('day').annotate(events=Count('id')).order_by()
+        for row in rows:
+            totals[row['day']][field] = row['events']
+
+    return totals
+
+
+def compute_daily_category_totals(start, end):
+    """Aggregate the raw tables into ``{(date, category_id): totals}``
+
+    An order counts once towards every category it contains an item from.
+    Page views are attributed to the viewed category, or to the viewed
+    product's category. Only (day, category) pairs with activity are returned.
+    """
+    lower, upper = day_bounds(start, end)
+    totals = defaultdict(_empty_totals)
+
+    items = OrderItem.objects.filter(
+        order__created_at__gte=lower, order__created_at__lt=upper
+    ).annotate(
+        day=TruncDate('order__created_at'), category_id=F('product__category_id')
+    ).values('day', 'category_id').annotate(
+        order_count=Count('order_id', distinct=True),
+        revenue=Sum(F('price') * F('quantity')),
+        units=Sum('quantity'),
+    ).order_by()
+    for row in items:
+        totals[(row['day'], row['category_id'])].update(
+            orders=row['order_count'],
+            revenue=row['revenue'] or Decimal('0'),
+            items_sold=row['units'] or 0,
+        )
+
+    page_views = PageView.objects.filter(timestamp__gte=lower, timestamp__lt=upper).annotate(
+        day=TruncDate('timestamp')
+    )
+    for lookup in ('category_id', 'product__category_id'):
+        filters = {f'{lookup}__isnull': False}
+        if lookup == 'product__category_id':
+            filters['category__isnull'] = True
+        rows = page_views.filter(**filters).values('day', lookup).annotate(views=Count('id')).order_by()
+        for row in rows:
+            totals[(row['day'], row[lookup])]['page_views'] += row['views']
+
+    for field, queryset in (
+        ('product_clicks', ProductClick.objects.all()),
+        ('cart_adds', CartActivity.objects.filter(action='add')),
+    ):
+        rows = queryset.filter(timestamp__gte=lower, timestamp__lt=upper).annotate(
+            day=TruncDate('timestamp'), category_id=F('product__category_id')
+        ).values('day', 'category_id').annotate(events=Count('id')).order_by()
+        for row in rows:
+            totals[(row['day'], row['category_id'])][field] = row['events']
+
+    return totals
+
+
+def rollup_days(start, end, categories=True, batch_size=500):
+    """Recompute and upsert the rollup rows for ``start``..``end`` inclusive
+
+    Returns the number of (daily, per-category) rows written.
+    """
+    kept = purged_before()
+    purged_end = min(end, kept - timedelta(days=1)) if kept else None
+
+    daily = compute_daily_totals(start, end)
+    if purged_end and start <= purged_end:
+        for row in DailySalesRollup.objects.filter(
+            date__gte=start, date__lte=purged_end
+        ).values('date', *EVENT_FIELDS):
+            daily[row.pop('date')].update(row)
+    daily_rows = [DailySalesRollup(date=day, **values) for day, values in daily.items()]
+
+    category_rows = []
+    if categories:
+        category_totals = compute_daily_category_totals(start, end)
+        # Zero out categories that had activity on a day in a previous run but not any more
+        for day, category_id in DailyCategorySalesRollup.objects.filter(
+            date__gte=start, date__lte=end
+        ).values_list('date', 'category_id'):
+            if (day, category_id) not in category_totals:
+                category_totals[(day, category_id)] = _empty_totals()
+        if purged_end and start <= purged_end:
+            for row in DailyCategorySalesRollup.objects.filter(
+                date__gte=start, date__lte=purged_end
+            ).values('date', 'category_id', *EVENT_FIELDS):
+                category_totals[(row.pop('date'), row.pop('category_id'))].update(row)
+        live_categories = set(Category.objects.values_list('id', flat=True))
+        category_rows = [
+            DailyCategorySalesRollup(date=day, category_id=category_id, **values)
+            for (day, category_id), values in category_totals.items()
+            if category_id in live_categories
+        ]
+
+    with transaction.atomic():
+        DailySalesRollup.objects.bulk_create(
+            daily_rows,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['date'],
+            update_fields=ROLLUP_FIELDS + ['updated_at'],
+        )
+        if category_rows:
+            DailyCategorySalesRollup.objects.bulk_create(
+                category_rows,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['category', 'date'],
+                update_fields=ROLLUP_FIELDS + ['updated_at'],
+            )
+    return len(daily_rows), len(category_rows)
+
+
+def rollup_recent(days=2):
+    """Refresh the last ``days`` local calendar days, today included"""
+    today = timezone.localdate()
+    return rollup_days(today - timedelta(days=days - 1), today)
+
+
+def read_daily_rollup(start, end, category=None):
+    """Daily totals for ``start``..``end`` from one range scan of the rollup
+
+    Closed days come from the rollup; today (and any later day in the range)
+    is always aggregated live so the current day is never stale. Days the
+    rollup has not covered yet read as zero.
+    """
+    today = timezone.localdate()
+    closed_end = min(end, today - timedelta(days=1))
+
+    if category is None:
+        rows = DailySalesRollup.objects.all()
+    else:
+        rows = DailyCategorySalesRollup.objects.filter(category=category)
+
+    totals = {day: _empty_totals() for day in date_range(start, end)}
+    if start <= closed_end:
+        for row in rows.filter(date__gte=start, date__lte=closed_end).values('date', *ROLLUP_FIELDS):
+            totals[row.pop('date')] = row
+
+    if end >= today:
+        live_start = max(start, today)
+        if category is None:
+            totals.update(compute_daily_totals(live_start, end))
+        else:
+            for (day, category_id), values in compute_daily_category_totals(live_start, end).items():
+                if category_id == category:
+                    totals[day] = values
+
+    return [{'date': day, **values} for day, values in sorted(totals.items())]
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from django.utils import timezone
 from datetime import timedelta
+from .funnels import DEFAULT_STEPS, STEP_SOURCES
+from .models import ReportJob
 
 class OrderStatsSerializer(serializers.Serializer):
     total = serializers.IntegerField()
@@ -22,16 +24,23 @@ class CustomerStatsSerializer(serializers.Serializer):
     total = serializers.IntegerField()
     new_this_week = serializers.IntegerField()
 
+class AnalyticsStatsSerializer(serializers.Serializer):
+    total_page_views = serializers.IntegerField()
+    week_page_views = serializers.IntegerField()
+    total_product_clicks = serializers.IntegerField()
+
 class DashboardStatsSerializer(serializers.Serializer):
     orders = OrderStatsSerializer()
     revenue = RevenueStatsSerializer()
     products = ProductStatsSerializer()
     customers = CustomerStatsSerializer()
+    analytics = AnalyticsStatsSerializer()
 
 class DailySalesSerializer(serializers.Serializer):
     date = serializers.DateField()
     revenue = serializers.FloatField()
     orders = serializers.IntegerField()
+    items_sold = serializers.IntegerField(default=0)
 
 class TopProductSerializer(serializers.Serializer):
     product__name = serializers.CharField(source='product_name')
@@ -41,7 +50,7 @@ class TopProductSerializer(serializers.Serializer):
     def to_representation(self, instance):
         data = super().to_representation(instance)
         # Rename fields for better frontend consumption
-        data['name'] = data.pop('product_name')
+        data['name'] = data.pop('product__name')
         data['revenue'] = data.pop('total_revenue')
         data['units_sold'] = data.pop('total_sold')
         return data
@@ -63,13 +72,10 @@ class AcquisitionChannelSerializer(serializers.Serializer):
     channel = serializers.CharField()
     customers = serializers.IntegerField()
     percentage = serializers.FloatField()
-
-class CustomerBehaviorSerializer(serializers.Serializer):
-    acquisition_channels = AcquisitionChannelSerializer(many=True)
-    customer_lifetime_value = serializers.FloatField()
-    repeat_customer_rate = serializers.FloatField()
-    total_customers = serializers.IntegerField()
-    repeat_customers = serializers.IntegerField()
+    visits = serializers.IntegerField(default=0)
+    signups = serializers.IntegerField(default=0)
+    orders = serializers.IntegerField(default=0)
+    revenue = serializers.FloatField(default=0)
 
 # Additional serializers for more detailed analytics
 
@@ -116,6 +122,9 @@ class TimeRangeSerializer(serializers.Serializer):
         choices=['today', 'week', 'month', 'quarter', 'year', 'custom'],
         default='week'
     )
+    category = serializers.IntegerField(required=False, min_value=1)
+    product = serializers.IntegerField(required=False, min_value=1)
+    approx = serializers.BooleanField(default=False)
 
     def validate(self, data):
         if data.get('period') == 'custom':
@@ -152,11 +161,44 @@ class TimeRangeSerializer(serializers.Serializer):
         
         return data
 
+class FunnelQuerySerializer(TimeRangeSerializer):
+    steps = serializers.CharField(default=','.join(DEFAULT_STEPS))
+    window_hours = serializers.IntegerField(required=False, min_value=1)
+
+    def validate_steps(self, value):
+        steps = [step.strip() for step in value.split(',') if step.strip()]
+        unknown = [step for step in steps if step not in STEP_SOURCES]
+        if unknown:
+            raise serializers.ValidationError(
+                f"Unknown steps: {', '.join(unknown)}. Choose from {', '.join(STEP_SOURCES)}"
+            )
+        if not 1 <= len(steps) <= 10:
+            raise serializers.ValidationError("A funnel needs between 1 and 10 steps")
+        return steps
+
+class ReportRequestSerializer(TimeRangeSerializer):
+    report = serializers.ChoiceField(choices=ReportJob.REPORT_CHOICES)
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = [
+            'id', 'report', 'spec', 'status', 'chunks_done', 'chunks_total', 'progress',
+            'result', 'error', 'created_at', 'started_at', 'finished_at', 'expires_at'
+        ]
+        read_only_fields = fields
+
+    def get_progress(self, obj):
+        return round(obj.chunks_done / obj.chunks_total * 100, 1) if obj.chunks_total else 0
+
 # Response serializers for the existing views
 
 class DashboardStatsResponseSerializer(serializers.Serializer):
     success = serializers.BooleanField(default=True)
     data = DashboardStatsSerializer()
+    as_of = serializers.DateTimeField()
     timestamp = serializers.DateTimeField(default=timezone.now)
 
 class SalesOverviewResponseSerializer(serializers.Serializer):
@@ -169,18 +211,8 @@ class ProductPerformanceResponseSerializer(serializers.Serializer):
     data = serializers.DictField(child=ProductPerformanceSerializer(many=True))
     timestamp = serializers.DateTimeField(default=timezone.now)
 
-class CustomerBehaviorResponseSerializer(serializers.Serializer):
-    success = serializers.BooleanField(default=True)
-    data = CustomerBehaviorSerializer()
-    timestamp = serializers.DateTimeField(default=timezone.now)
-
 # Add to existing serializers in analytics/serializers.py
 
-class AnalyticsStatsSerializer(serializers.Serializer):
-    total_page_views = serializers.IntegerField()
-    week_page_views = serializers.IntegerField()
-    total_product_clicks = serializers.IntegerField()
-
 class EngagementMetricsSerializer(serializers.Serializer):
     page_views = serializers.IntegerField()
     product_clicks = serializers.IntegerField()
@@ -205,14 +237,6 @@ class ConversionMetricsSerializer(serializers.Serializer):
     purchases = serializers.IntegerField()
     conversion_rate = serializers.FloatField()
 
-# Update the DashboardStatsSerializer to include analytics
-class DashboardStatsSerializer(serializers.Serializer):
-    orders = OrderStatsSerializer()
-    revenue = RevenueStatsSerializer()
-    products = ProductStatsSerializer()
-    customers = CustomerStatsSerializer()
-    analytics = AnalyticsStatsSerializer()  # Add this line
-
 # Update the CustomerBehaviorSerializer to include engagement
 class CustomerBehaviorSerializer(serializers.Serializer):
     acquisition_channels = AcquisitionChannelSerializer(many=True)
@@ -220,4 +244,10 @@ class CustomerBehaviorSerializer(serializers.Serializer):
     repeat_customer_rate = serializers.FloatField()
     total_customers = serializers.IntegerField()
     repeat_customers = serializers.IntegerField()
-    engagement_metrics = EngagementMetricsSerializer() 
\ No newline at end of file
+    engagement_metrics = EngagementMetricsSerializer()
+    approximation = serializers.DictField(required=False)
+
+class CustomerBehaviorResponseSerializer(serializers.Serializer):
+    success = serializers.BooleanField(default=True)
+    data = CustomerBehaviorSerializer()
+    timestamp = serializers.DateTimeField(default=timezone.now) 
\ No newline at end of file
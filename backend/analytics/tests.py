@@ -1,3 +1,1457 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.db.models import Count, F, Sum
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.utils.text import slugify
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from core.utils import CacheKeys
+from orders.models import Order, OrderItem
+from orders.payment_state import sync_payment_state
+from payments.bulk_refunds import process_bulk_refunds
+from payments.models import Payment, Refund
+from products.models import Category, Product, ProductVariant
+from reviews.ratings import delete_reviews, set_review_approval
+from reviews.models import Review
+from users.models import User
+from . import abandoned_carts, cube, sampling
+from .abandoned_carts import detect_abandoned_carts, reset_abandoned_cart_stream
+from .attribution import attribute_order
+from .dashboard import get_dashboard_stats
+from .exports import EXPORT_FIELDS, export_stream
+from .funnels import DEFAULT_STEPS, compute_funnel
+from .hll import HyperLogLog
+from .ingest import EventBuffer, build_landing_touch, write_events
+from .models import (
+    AbandonedCart, AcquisitionTouch, CartActivity, CustomerMetrics, DailyCategorySalesRollup, DailyChannelStats,
+    DailySalesRollup, EventSample, OrderAnalytics, PageView, ProductClick, ProductDailyMetrics, ReportJob,
+    TrendingCheckpoint,
+    VisitorSketch,
+)
+from .product_metrics import read_product_metrics, rollup_product_days
+from .reports import build_spec, compute_report, requeue_stale_jobs, run_report_job, submit_report
+from .retention import purge_before
+from .rollups import day_bounds, purged_before, read_daily_rollup, rollup_days
+from .trending import DecayedCounter, TrendingTracker, rebuild_trending
+from .visitors import daily_unique_visitors, rebuild_sketches, record_page_views, unique_visitors
+
+# Three standard errors at precision 12 (1.04 / sqrt(4096) ~= 1.6%)
+HLL_TOLERANCE = 0.05
+
+
+def create_category(name='Shirts'):
+    return Category.objects.create(name=name, slug=slugify(name))
+
+
+def create_product(name, category, price=10):
+    return Product.objects.create(
+        name=name, slug=slugify(name), description='', price=price, category=category, brand='Nexus'
+    )
+
+
+def create_order(user, total=0, **fields):
+    return Order.objects.create(
+        user=user, shipping_first_name='A', shipping_last_name='B', shipping_address='1 Main St',
+        shipping_city='Nairobi', shipping_state='NRB', shipping_zip_code='00100', payment_method='card',
+        subtotal=total, shipping_cost=0, tax_amount=0, total=total, **fields
+    )
+
+
+class HyperLogLogTests(SimpleTestCase):
+    def assertClose(self, estimate, exact):
+        self.assertLessEqual(abs(estimate - exact) / exact, HLL_TOLERANCE, f'{estimate} vs {exact}')
+
+    def test_small_cardinalities_are_near_exact(self):
+        for exact in (1, 10, 100):
+            self.assertLessEqual(abs(HyperLogLog().update(range(exact)).count() - exact), max(1, exact // 50))
+
+    def test_accuracy_across_cardinalities(self):
+        for exact in (1000, 10000, 100000):
+            sketch = HyperLogLog().update(f'visitor-{i}' for i in range(exact))
+            self.assertClose(sketch.count(), exact)
+
+    def test_duplicates_do_not_count(self):
+        sketch = HyperLogLog().update(['a', 'b', 'c'] * 1000)
+        self.assertEqual(sketch.count(), 3)
+
+    def test_merge_equals_sketch_of_union(self):
+        left = HyperLogLog().update(range(0, 6000))
+        right = HyperLogLog().update(range(4000, 12000))
+        union = HyperLogLog().update(range(0, 12000))
+
+        self.assertEqual(HyperLogLog.union([left, right]).registers, union.registers)
+        self.assertEqual(left.merge(right).registers, union.registers)
+        self.assertClose(union.count(), 12000)
+
+    def test_serialization_round_trip_is_compact(self):
+        sketch = HyperLogLog().update(range(50))
+        data = sketch.to_bytes()
+        self.assertLess(len(data), 512)
+        self.assertEqual(HyperLogLog.from_bytes(data).registers, sketch.registers)
+
+    def test_merging_a_year_of_daily_sketches_is_fast(self):
+        rng = random.Random(36)
+        days = [HyperLogLog().update(rng.sample(range(200000), 300)) for _ in range(365)]
+        started = time.perf_counter()
+        HyperLogLog.union(days).count()
+        self.assertLess(time.perf_counter() - started, 0.5)
+
+
+class VisitorSketchTests(TestCase):
+    """Sketch-backed unique visitors against exact COUNT(DISTINCT) on seeded page views"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = create_category()
+        cls.products = [create_product(f'Shirt {i}', category) for i in range(3)]
+        cls.today = timezone.localdate()
+        rng = random.Random(42)
+        views = []
+        for offset in range(7):
+            day = cls.today - timedelta(days=offset)
+            # Overlapping visitor pools so range counts are smaller than the sum of daily counts
+            for session in rng.sample(range(6000), 1500):
+                views.append((day, f'session-{session}', rng.choice(cls.products + [None])))
+
+        PageView.objects.bulk_create([
+            PageView(page_url='https://shop.example.com/', session_key=session, product=product)
+            for _, session, product in views
+        ])
+        # timestamp is auto_now_add, so spread the rows over the week afterwards
+        for offset in range(7):
+            day = cls.today - timedelta(days=offset)
+            start, _ = day_bounds(day, day)
+            ids = PageView.objects.order_by('id').values_list('id', flat=True)[offset * 1500:(offset + 1) * 1500]
+            PageView.objects.filter(id__in=list(ids)).update(timestamp=start + timedelta(hours=12))
+
+    def exact(self, start, end, product=None):
+        lower, upper = day_bounds(start, end)
+        views = PageView.objects.filter(timestamp__gte=lower, timestamp__lt=upper)
+        if product is not None:
+            views = views.filter(product=product)
+        return views.values('session_key').distinct().count()
+
+    def assertClose(self, estimate, exact):
+        self.assertLessEqual(abs(estimate - exact) / exact, HLL_TOLERANCE, f'{estimate} vs {exact}')
+
+    def test_site_wide_ranges_match_exact_counts(self):
+        rebuild_sketches(self.today - timedelta(days=6), self.today)
+        for days in (0, 2, 6):
+            start = self.today - timedelta(days=days)
+            self.assertClose(unique_visitors(start, self.today), self.exact(start, self.today))
+
+    def test_product_ranges_match_exact_counts(self):
+        rebuild_sketches(self.today - timedelta(days=6), self.today)
+        start = self.today - timedelta(days=6)
+        for product in self.products:
+            self.assertClose(unique_visitors(start, self.today, product.id), self.exact(start, self.today, product))
+
+    def test_daily_series_and_range_total(self):
+        rebuild_sketches(self.today - timedelta(days=6), self.today)
+        start = self.today - timedelta(days=9)
+        daily, total = daily_unique_visitors(start, self.today)
+
+        self.assertEqual(len(daily), 10)
+        self.assertEqual([day['unique_visitors'] for day in daily[:3]], [0, 0, 0])
+        for day in daily[3:]:
+            self.assertClose(day['unique_visitors'], self.exact(day['date'], day['date']))
+        self.assertClose(total, self.exact(start, self.today))
+        self.assertLess(total, sum(day['unique_visitors'] for day in daily))
+
+    def test_incremental_ingestion_matches_rebuild(self):
+        rebuild_sketches(self.today - timedelta(days=6), self.today)
+        rebuilt = {
+            (row.date, row.product_id): HyperLogLog.from_bytes(row.registers).registers
+            for row in VisitorSketch.objects.all()
+        }
+
+        VisitorSketch.objects.all().delete()
+        views = list(PageView.objects.order_by('?'))
+        for i in range(0, len(views), 500):
+            record_page_views(views[i:i + 500])
+
+        ingested = {
+            (row.date, row.product_id): HyperLogLog.from_bytes(row.registers).registers
+            for row in VisitorSketch.objects.all()
+        }
+        self.assertEqual(ingested, rebuilt)
+
+    def test_sketch_query_reads_one_row_per_day(self):
+        rebuild_sketches(self.today - timedelta(days=6), self.today)
+        with self.assertNumQueries(1):
+            unique_visitors(self.today - timedelta(days=6), self.today)
+
+
+
+class ProductMetricsTests(TestCase):
+    """Per-product daily metrics against a brute-force pass over orders and reviews"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = create_category()
+        cls.products = [create_product(f'Shirt {i}', category, price=10 + i) for i in range(5)]
+        ProductVariant.objects.create(product=cls.products[0], size='M', color='Red', sku='SHIRT-0-M', stock_quantity=3)
+        ProductVariant.objects.create(product=cls.products[1], size='M', color='Red', sku='SHIRT-1-M', stock_quantity=0)
+        cls.users = [
+            User.objects.create_user(email=f'shopper{i}@example.com', username=f'shopper{i}', password='x')
+            for i in range(8)
+        ]
+        cls.today = timezone.localdate()
+        rng = random.Random(42)
+
+        for offset in range(10):
+            day = cls.today - timedelta(days=offset)
+            noon = day_bounds(day, day)[0] + timedelta(hours=12)
+            for _ in range(rng.randint(2, 6)):
+                order = create_order(rng.choice(cls.users))
+                # Several lines of one product in an order must count the order once
+                for product in rng.choices(cls.products, k=rng.randint(1, 4)):
+                    OrderItem.objects.create(
+                        order=order, product=product, quantity=rng.randint(1, 3), price=product.price
+                    )
+                Order.objects.filter(pk=order.pk).update(created_at=noon)
+
+        for user in cls.users:
+            for product in rng.sample(cls.products, 3):
+                review = Review.objects.create(
+                    product=product, user=user, rating=rng.randint(1, 5), title='ok', comment='ok'
+                )
+                day = cls.today - timedelta(days=rng.randint(0, 9))
+                Review.objects.filter(pk=review.pk).update(created_at=day_bounds(day, day)[0] + timedelta(hours=9))
+        # Pending and rejected reviews do not count
+        reviews = list(Review.objects.order_by('id').values_list('id', flat=True))
+        set_review_approval(Review.objects.filter(id__in=reviews[::3] + reviews[1::3]), True)
+        set_review_approval(Review.objects.filter(id__in=reviews[1::3]), False)
+        set_review_approval(Review.objects.filter(id__in=reviews[2::6]), True)
+
+    def brute_force(self, start, end):
+        metrics = defaultdict(lambda: {
+            'orders': set(), 'units_sold': 0, 'revenue': Decimal('0'), 'review_count': 0, 'rating_total': 0
+        })
+        for item in OrderItem.objects.select_related('order'):
+            if start <= timezone.localdate(item.order.created_at) <= end:
+                row = metrics[item.product_id]
+                row['orders'].add(item.order_id)
+                row['units_sold'] += item.quantity
+                row['revenue'] += item.price * item.quantity
+        for review in Review.objects.filter(is_approved=True):
+            if start <= timezone.localdate(review.created_at) <= end:
+                metrics[review.product_id]['review_count'] += 1
+                metrics[review.product_id]['rating_total'] += review.rating
+        return {
+            product_id: dict(row, orders=len(row['orders']))
+            for product_id, row in metrics.items() if row['units_sold']
+        }
+
+    def assertMatchesBruteForce(self, start, end):
+        expected = self.brute_force(start, end)
+        rows = read_product_metrics(start, end, limit=100)
+        self.assertEqual({row.pop('product_id'): row for row in rows}, expected)
+        units = [row['units_sold'] for row in read_product_metrics(start, end, limit=100)]
+        self.assertEqual(units, sorted(units, reverse=True))
+
+    def test_ranges_match_brute_force(self):
+        rollup_product_days(self.today - timedelta(days=9), self.today)
+        yesterday = self.today - timedelta(days=1)
+        for start, end in (
+            (self.today - timedelta(days=9), yesterday),      # closed days only
+            (self.today - timedelta(days=9), self.today),     # closed days plus live today
+            (self.today - timedelta(days=3), self.today - timedelta(days=3)),
+            (self.today, self.today),
+        ):
+            self.assertMatchesBruteForce(start, end)
+
+    def test_today_is_read_live_without_a_rollup(self):
+        rollup_product_days(self.today - timedelta(days=9), self.today - timedelta(days=1))
+        self.assertMatchesBruteForce(self.today - timedelta(days=9), self.today)
+
+    def test_rerun_zeroes_days_whose_orders_were_deleted(self):
+        start = self.today - timedelta(days=9)
+        yesterday = self.today - timedelta(days=1)
+        rollup_product_days(start, yesterday)
+        lower, upper = day_bounds(yesterday, yesterday)
+        Order.objects.filter(created_at__gte=lower, created_at__lt=upper).delete()
+
+        rollup_product_days(yesterday, yesterday)
+        self.assertMatchesBruteForce(start, yesterday)
+        self.assertFalse(ProductDailyMetrics.objects.filter(date=yesterday, units_sold__gt=0).exists())
+
+    def test_review_changes_reach_closed_days_without_a_rerun(self):
+        start, yesterday = self.today - timedelta(days=9), self.today - timedelta(days=1)
+        rollup_product_days(start, yesterday)
+        old = Review.objects.filter(created_at__lt=day_bounds(yesterday, yesterday)[0]).order_by('id')
+        pending = old.filter(is_approved=False).first()
+        approved = old.filter(is_approved=True)[:3]
+
+        pending.is_approved = True
+        pending.save()
+        edited = approved[0]
+        edited.rating = edited.rating % 5 + 1
+        edited.save()
+        set_review_approval(Review.objects.filter(pk=approved[1].pk), False)
+        delete_reviews(Review.objects.filter(pk=approved[2].pk))
+
+        self.assertMatchesBruteForce(start, yesterday)
+        maintained = self.review_columns()
+        rollup_product_days(start, yesterday)
+        self.assertEqual(maintained, self.review_columns())
+
+    def review_columns(self):
+        return {
+            (row.date, row.product_id): (row.review_count, row.rating_total)
+            for row in ProductDailyMetrics.objects.filter(review_count__gt=0)
+        }
+
+    def test_closed_range_is_one_query(self):
+        rollup_product_days(self.today - timedelta(days=9), self.today)
+        with self.assertNumQueries(1):
+            read_product_metrics(self.today - timedelta(days=9), self.today - timedelta(days=1))
+
+    def test_performance_view(self):
+        rollup_product_days(self.today - timedelta(days=9), self.today)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(
+            email='admin@example.com', username='admin', password='x', is_staff=True
+        ))
+        response = client.get('/api/analytics/products/performance/', {'period': 'month'})
+        self.assertEqual(response.status_code, 200)
+
+        expected = self.brute_force(self.today - timedelta(days=30), self.today)
+        self.assertEqual(len(response.data['data']['products']), len(expected))
+        for row in response.data['data']['products']:
+            metrics = expected[row['id']]
+            self.assertEqual(row['total_sold'], metrics['units_sold'])
+            self.assertAlmostEqual(row['total_revenue'], float(metrics['revenue']))
+            self.assertEqual(row['review_count'], metrics['review_count'])
+            if metrics['review_count']:
+                self.assertAlmostEqual(row['avg_rating'], metrics['rating_total'] / metrics['review_count'], places=2)
+            in_stock = row['id'] == self.products[0].id
+            self.assertEqual(row['stock_status'], 'In Stock' if in_stock else 'Out of Stock')
+
+
+class RetentionTests(TestCase):
+    """Purged days keep their rolled-up event counts and visitor sketches"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_product('Shirt', create_category())
+        cls.today = timezone.localdate()
+        cls.cutoff = cls.today - timedelta(days=365)
+        cls.old_days = [cls.cutoff - timedelta(days=offset) for offset in (1, 2)]
+        for index, day in enumerate(cls.old_days + [cls.today]):
+            noon = day_bounds(day, day)[0] + timedelta(hours=12)
+            PageView.objects.bulk_create([
+                PageView(page_url='https://shop.example.com/', session_key=f's{index}-{i}', product=cls.product)
+                for i in range(3 + index)
+            ])
+            ProductClick.objects.create(product=cls.product, session_key=f's{index}', source_page='https://shop.example.com/')
+            CartActivity.objects.create(product=cls.product, action='add', session_key=f's{index}')
+            for model in (PageView, ProductClick, CartActivity):
+                model.objects.filter(timestamp__gt=noon + timedelta(days=1)).update(timestamp=noon)
+
+    def event_counts(self):
+        return {
+            row['date']: (row['page_views'], row['product_clicks'], row['cart_adds'])
+            for row in DailySalesRollup.objects.filter(date__in=self.old_days).values(
+                'date', 'page_views', 'product_clicks', 'cart_adds'
+            )
+        }
+
+    def test_purge_rolls_up_then_deletes_every_raw_table(self):
+        results = purge_before(self.cutoff)
+
+        self.assertEqual({result.model: result.rows for result in results}, {
+            PageView: 3 + 4, ProductClick: 2, CartActivity: 2,
+        })
+        self.assertEqual(self.event_counts(), {self.old_days[0]: (3, 1, 1), self.old_days[1]: (4, 1, 1)})
+        self.assertEqual(purged_before(), self.cutoff)
+        self.assertEqual(PageView.objects.count(), 5)
+
+    def test_rerolling_purged_days_keeps_event_counts_and_sketches(self):
+        purge_before(self.cutoff)
+        counts = self.event_counts()
+        sketches = VisitorSketch.objects.filter(date__in=self.old_days).count()
+        self.assertGreater(sketches, 0)
+
+        # A second purge, a backfill and a sketch rebuild all run over the purged days again
+        purge_before(self.cutoff)
+        rollup_days(self.old_days[-1], self.today)
+        rebuild_sketches(self.old_days[-1], self.today)
+
+        self.assertEqual(self.event_counts(), counts)
+        self.assertEqual(VisitorSketch.objects.filter(date__in=self.old_days).count(), sketches)
+
+    def test_rerolling_purged_days_still_updates_orders(self):
+        purge_before(self.cutoff)
+        user = User.objects.create_user(email='late@example.com', username='late', password='x')
+        order = create_order(user, total=25)
+        day = self.old_days[0]
+        Order.objects.filter(pk=order.pk).update(created_at=day_bounds(day, day)[0] + timedelta(hours=9))
+
+        rollup_days(day, day)
+        row = DailySalesRollup.objects.get(date=day)
+        self.assertEqual((row.orders, row.revenue), (1, Decimal('25')))
+        self.assertEqual((row.page_views, row.product_clicks, row.cart_adds), (3, 1, 1))
+
+    def test_watermark_never_moves_back(self):
+        purge_before(self.cutoff)
+        purge_before(self.cutoff - timedelta(days=30))
+        self.assertEqual(purged_before(), self.cutoff)
+
+
+class EventBufferTests(TestCase):
+    """A failed flush leaves nothing written and retries cleanly"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_product('Shirt', create_category())
+
+    def events(self):
+        return [
+            PageView(page_url='https://shop.example.com/', session_key='s1', product=self.product),
+            ProductClick(product=self.product, session_key='s1', source_page='https://shop.example.com/'),
+            CartActivity(product=self.product, action='add', session_key='s1'),
+            AcquisitionTouch(session_key='s1', channel='Email', landing_page='https://shop.example.com/'),
+        ]
+
+    def test_failed_flush_is_rolled_back_and_retried_once(self):
+        buffer = EventBuffer(max_pending=100)
+        buffer._events = self.events()
+        with mock.patch('analytics.ingest.record_samples', side_effect=DatabaseError('disk full')), \
+                self.assertLogs('analytics.ingest', 'ERROR'):
+            self.assertEqual(buffer.flush(), 0)
+
+        self.assertEqual(len(buffer), 4)
+        self.assertEqual(buffer.stats['flush_errors'], 1)
+        for model in (PageView, ProductClick, CartActivity, AcquisitionTouch, DailyChannelStats, VisitorSketch):
+            self.assertFalse(model.objects.exists(), model.__name__)
+
+        self.assertEqual(buffer.flush(), 4)
+        self.assertEqual(len(buffer), 0)
+        for model in (PageView, ProductClick, CartActivity, AcquisitionTouch):
+            self.assertEqual(model.objects.count(), 1, model.__name__)
+        self.assertEqual(DailyChannelStats.objects.get().visits, 1)
+
+    def test_failed_flush_does_not_count_trending(self):
+        buffer = EventBuffer(max_pending=100)
+        buffer._events = self.events()
+        with mock.patch('analytics.ingest.record_samples', side_effect=DatabaseError('disk full')), \
+                mock.patch('analytics.ingest.record_trending') as record_trending, \
+                self.assertLogs('analytics.ingest', 'ERROR'):
+            buffer.flush()
+        record_trending.assert_not_called()
+
+    def test_batch_is_dropped_when_the_buffer_is_full(self):
+        buffer = EventBuffer(max_pending=3)
+        buffer._events = self.events()
+        with mock.patch('analytics.ingest.record_samples', side_effect=DatabaseError('disk full')), \
+                self.assertLogs('analytics.ingest', 'ERROR') as logs:
+            buffer.flush()
+        self.assertIn('dropping them', logs.output[0])
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.stats['dropped'], 4)
+
+
+class TrackEventViewTests(TestCase):
+    """Storefront events carry the client session id and the signed-in user"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='shopper@example.com', username='shopper', password='x')
+
+    def track(self, payload, token=None):
+        client = APIClient()
+        if token:
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        with mock.patch('analytics.views.event_buffer') as buffer:
+            response = client.post('/api/analytics/track', payload, format='json')
+        events = buffer.add.call_args[0][0] if buffer.add.called else []
+        return response, events
+
+    def page_view(self, **extra):
+        return {'event': 'page_view', 'data': {'page_location': 'https://shop.example.com/'}, **extra}
+
+    def test_events_are_keyed_to_the_payload_session_id(self):
+        response, events = self.track(self.page_view(session_id='3f2b9c1e-aaaa-bbbb'))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(events[0].session_key, '3f2b9c1e-aaaa-bbbb')
+
+    def test_batch_session_id_applies_to_every_event(self):
+        response, events = self.track({
+            'session_id': 'batch-session-1',
+            'events': [self.page_view(), self.page_view(session_id='own-session-2')],
+        })
+        self.assertEqual([event.session_key for event in events], ['batch-session-1', 'own-session-2'])
+
+    def test_malformed_session_id_is_ignored(self):
+        _, events = self.track(self.page_view(session_id='x; DROP TABLE'))
+        self.assertEqual(events[0].session_key, '')
+
+    def test_access_token_identifies_the_user(self):
+        token = str(RefreshToken.for_user(self.user).access_token)
+        _, events = self.track(self.page_view(session_id='signed-in-1'), token=token)
+        self.assertEqual(events[0].user_id, self.user.pk)
+
+    def test_invalid_token_tracks_anonymously(self):
+        response, events = self.track(self.page_view(session_id='stale-token-1'), token='not-a-jwt')
+        self.assertEqual(response.status_code, 202)
+        self.assertIsNone(events[0].user_id)
+
+
+class AttributionTests(TestCase):
+    """Orders are credited to the touches of the visit that led to them"""
+
+    LANDING = 'https://shop.example.com/?utm_source=newsletter&utm_medium=email&utm_campaign=spring'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='shopper@example.com', username='shopper', password='x')
+
+    def flush(self, *events):
+        write_events(list(events))
+
+    def landing(self, session_key, user_id=None):
+        return build_landing_touch(
+            {'event': 'page_view', 'data': {'page_location': self.LANDING}},
+            user_id=user_id, session_key=session_key,
+        )
+
+    def page_view(self, session_key, user_id=None):
+        return PageView(page_url='https://shop.example.com/', session_key=session_key, user_id=user_id)
+
+    def test_order_takes_the_channel_of_the_users_last_touch(self):
+        self.flush(self.landing('visit-0001', user_id=self.user.pk))
+        order = create_order(self.user, total=40)
+
+        self.assertEqual(attribute_order(order.pk), ('Email Marketing', 'spring'))
+        analytics = OrderAnalytics.objects.get(order=order)
+        self.assertEqual((analytics.acquisition_channel, analytics.marketing_campaign), ('Email Marketing', 'spring'))
+        stats = DailyChannelStats.objects.get(channel='Email Marketing')
+        self.assertEqual((stats.visits, stats.orders, stats.customers, stats.revenue), (1, 1, 1, Decimal('40')))
+
+    def test_anonymous_touches_follow_the_session_once_the_user_signs_in(self):
+        self.flush(self.landing('visit-0002'), self.page_view('visit-0002'))
+        self.assertIsNone(AcquisitionTouch.objects.get().user_id)
+
+        self.flush(self.page_view('visit-0002', user_id=self.user.pk))
+        self.assertEqual(AcquisitionTouch.objects.get().user_id, self.user.pk)
+        order = create_order(self.user, total=10)
+        self.assertEqual(attribute_order(order.pk)[0], 'Email Marketing')
+
+    def test_other_sessions_touches_are_not_linked(self):
+        self.flush(self.landing('visit-0003'), self.page_view('visit-0004', user_id=self.user.pk))
+        self.assertIsNone(AcquisitionTouch.objects.get().user_id)
+        self.assertEqual(attribute_order(create_order(self.user).pk)[0], 'Direct')
+
+    def test_registration_links_the_payload_session(self):
+        self.flush(self.landing('visit-0005'))
+        response = APIClient().post('/api/auth/auth/register/', {
+            'email': 'new@example.com', 'username': 'newbie', 'first_name': 'N', 'last_name': 'B',
+            'password': 'correct-horse-9', 'password_confirm': 'correct-horse-9', 'session_id': 'visit-0005',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+
+        user = User.objects.get(email='new@example.com')
+        self.assertEqual(AcquisitionTouch.objects.get().user_id, user.pk)
+        self.assertEqual(DailyChannelStats.objects.get(channel='Email Marketing').signups, 1)
+
+    def test_failed_attribution_does_not_fail_the_order(self):
+        with mock.patch('analytics.attribution.attribute_order', side_effect=DatabaseError('locked')), \
+                self.assertLogs('analytics.attribution', 'ERROR'), \
+                self.captureOnCommitCallbacks(execute=True):
+            order = create_order(self.user)
+        self.assertTrue(Order.objects.filter(pk=order.pk).exists())
+        self.assertFalse(OrderAnalytics.objects.exists())
+
+
+class CustomerMetricsTests(TestCase):
+    """Lifetime metrics follow payments and refunds on every write path"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='shopper@example.com', username='shopper', password='x')
+
+    def setUp(self):
+        self.order = create_order(self.user, total=40)
+        OrderAnalytics.objects.create(order=self.order)
+
+    def pay(self, amount='40.00'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Payment.objects.create(
+                order=self.order, user=self.user, amount=Decimal(amount), status='completed',
+                processed_at=timezone.now(),
+            )
+
+    def assertSpent(self, amount, orders=1):
+        if orders:
+            metrics = CustomerMetrics.objects.get(user=self.user)
+            self.assertEqual((metrics.order_count, metrics.total_spent), (orders, Decimal(amount)))
+        else:
+            self.assertFalse(CustomerMetrics.objects.filter(user=self.user).exists())
+        self.assertEqual(OrderAnalytics.objects.get(order=self.order).customer_lifetime_value, Decimal(amount))
+
+    def test_payment_and_refund_saves_refresh_metrics(self):
+        payment = self.pay()
+        self.assertSpent('40.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Refund.objects.create(payment=payment, amount=Decimal('15.00'), status='completed')
+        self.assertSpent('25.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Refund.objects.create(payment=payment, amount=Decimal('25.00'), status='completed')
+        self.assertSpent('0', orders=0)
+
+    @mock.patch('payments.bulk_refunds.payment_gateway')
+    def test_bulk_refunds_refresh_metrics(self, gateway):
+        payment = self.pay()
+        gateway.create_refund.return_value = {'id': 're_1', 'status': 'succeeded'}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            results = process_bulk_refunds([{'payment': payment.pk, 'amount': Decimal('10.00'), 'reason': ''}])
+        self.assertEqual(results[0]['status'], 'completed')
+        self.assertSpent('30.00')
+
+    def test_sync_payment_state_refreshes_changed_customers(self):
+        payment = self.pay()
+        Payment.objects.filter(pk=payment.pk).update(status='failed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(sync_payment_state(Order.objects.filter(pk=self.order.pk)), 1)
+        self.assertSpent('0', orders=0)
+
+
+class DashboardSnapshotTests(TestCase):
+    """Order commits flag the snapshot; only dashboard reads rebuild it"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='shopper@example.com', username='shopper', password='x')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_order_commit_does_not_compute_the_snapshot(self):
+        get_dashboard_stats()
+        with mock.patch('analytics.dashboard.compute_dashboard_stats') as compute, \
+                self.captureOnCommitCallbacks(execute=True):
+            create_order(self.user, total=10)
+        compute.assert_not_called()
+
+    def test_next_read_after_an_order_rebuilds_once(self):
+        self.assertEqual(get_dashboard_stats()['data']['orders']['total'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_order(self.user, total=10)
+
+        self.assertEqual(get_dashboard_stats()['data']['orders']['total'], 1)
+        with mock.patch('analytics.dashboard.compute_dashboard_stats') as compute:
+            get_dashboard_stats()
+        compute.assert_not_called()
+
+    def test_rebuilds_are_throttled(self):
+        get_dashboard_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            create_order(self.user, total=10)
+        get_dashboard_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            create_order(self.user, total=10)
+
+        # Within DASHBOARD_STATS_MIN_REFRESH of the last rebuild the previous snapshot is served
+        self.assertEqual(get_dashboard_stats()['data']['orders']['total'], 1)
+        cache.delete(CacheKeys.DASHBOARD_STATS_REFRESH)
+        self.assertEqual(get_dashboard_stats()['data']['orders']['total'], 2)
+
+
+class AbandonedCartTests(TestCase):
+    """The stream resumes from its watermark and finds the same carts as one full pass"""
+
+    WINDOW = timedelta(minutes=30)
+
+    @classmethod
+    def setUpTestData(cls):
+        category = create_category()
+        cls.products = [create_product(f'Shirt {i}', category, price=10 + i) for i in range(3)]
+        cls.users = [
+            User.objects.create_user(email=f'shopper{i}@example.com', username=f'shopper{i}', password='x')
+            for i in range(3)
+        ]
+        cls.start = timezone.now() - timedelta(hours=12)
+        rng = random.Random(7)
+        events = []
+        for n in range(40):
+            user = rng.choice(cls.users + [None])
+            moment = cls.start + timedelta(minutes=rng.randint(0, 600))
+            for _ in range(rng.randint(1, 4)):
+                events.append((moment, f'session-{n}', user, rng.choice(['add', 'add', 'update', 'remove'])))
+                moment += timedelta(minutes=rng.randint(1, 20))
+        for moment, session_key, user, action in events:
+            cls.cart(session_key, moment, action=action, user=user, product=rng.choice(cls.products))
+
+    @classmethod
+    def cart(cls, session_key, moment, action='add', user=None, product=None):
+        event = CartActivity.objects.create(
+            session_key=session_key, user=user, product=product or cls.products[0], action=action, quantity=1
+        )
+        CartActivity.objects.filter(pk=event.pk).update(timestamp=moment)
+
+    def carts(self):
+        return set(AbandonedCart.objects.values_list('session_key', 'started_at', 'item_count', 'value'))
+
+    def full_pass(self):
+        detect_abandoned_carts(since=self.start, window=self.WINDOW)
+        expected = self.carts()
+        reset_abandoned_cart_stream()
+        AbandonedCart.objects.all().delete()
+        return expected
+
+    def test_finds_quiet_carts(self):
+        self.assertTrue(self.full_pass())
+
+    def test_runs_resumed_from_the_watermark_match_one_pass(self):
+        expected = self.full_pass()
+
+        for hours in (3, 7, None):
+            until = self.start + timedelta(hours=hours) if hours else None
+            detect_abandoned_carts(since=self.start, until=until, chunk_size=7, window=self.WINDOW)
+
+        self.assertEqual(self.carts(), expected)
+
+    def test_crashed_run_resumes_without_gaps_or_duplicates(self):
+        expected = self.full_pass()
+
+        commit = abandoned_carts._commit
+        calls = []
+
+        def crash_on_fourth_chunk(*args):
+            calls.append(1)
+            if len(calls) == 4:
+                raise DatabaseError('connection lost')
+            return commit(*args)
+
+        with mock.patch.object(abandoned_carts, '_commit', side_effect=crash_on_fourth_chunk):
+            with self.assertRaises(DatabaseError):
+                detect_abandoned_carts(since=self.start, chunk_size=10, window=self.WINDOW)
+        self.assertTrue(self.carts() < expected)
+
+        detect_abandoned_carts(since=self.start, chunk_size=10, window=self.WINDOW)
+        self.assertEqual(self.carts(), expected)
+
+    def test_cart_followed_by_an_order_is_not_abandoned(self):
+        CartActivity.objects.all().delete()
+        user = self.users[0]
+        moment = self.start + timedelta(hours=1)
+        self.cart('buyer', moment, user=user)
+        self.cart('browser', moment, user=self.users[1])
+        order = create_order(user)
+        Order.objects.filter(pk=order.pk).update(created_at=moment + timedelta(minutes=10))
+
+        detect_abandoned_carts(since=self.start, window=self.WINDOW)
+
+        self.assertEqual(list(AbandonedCart.objects.values_list('session_key', flat=True)), ['browser'])
+
+
+class DailyRollupTests(TestCase):
+    """Daily and per-category rollups hold the raw tables' totals for every day"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shirts, cls.shoes = create_category(), create_category('Shoes')
+        cls.shirt = create_product('Shirt', cls.shirts)
+        cls.shoe = create_product('Shoe', cls.shoes)
+        cls.user = User.objects.create_user(email='shopper@example.com', username='shopper', password='x')
+        cls.today = timezone.localdate()
+        cls.days = [cls.today - timedelta(days=offset) for offset in (3, 2, 1)]
+
+        cls.mixed = cls.order(cls.days[0], [(cls.shirt, 2, 10), (cls.shoe, 1, 10)])
+        cls.small = cls.order(cls.days[0], [(cls.shirt, 1, 5)])
+        cls.event(ProductClick, cls.days[0], product=cls.shoe, source_page='https://shop.example.com/')
+        cls.event(CartActivity, cls.days[0], product=cls.shirt, action='add')
+        cls.event(CartActivity, cls.days[0], product=cls.shirt, action='remove')
+        for _ in range(2):
+            cls.event(PageView, cls.days[1], product=cls.shirt, page_url='https://shop.example.com/shirt')
+        cls.event(PageView, cls.days[1], category=cls.shoes, page_url='https://shop.example.com/shoes')
+
+    @classmethod
+    def order(cls, day, lines):
+        order = create_order(cls.user, total=sum(quantity * price for _, quantity, price in lines))
+        for product, quantity, price in lines:
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, price=price)
+        Order.objects.filter(pk=order.pk).update(created_at=day_bounds(day, day)[0] + timedelta(hours=10))
+        return order
+
+    @classmethod
+    def event(cls, model, day, **fields):
+        event = model.objects.create(session_key='s1', **fields)
+        model.objects.filter(pk=event.pk).update(timestamp=day_bounds(day, day)[0] + timedelta(hours=11))
+
+    def daily(self):
+        return {
+            row.pop('date'): tuple(row.values())
+            for row in DailySalesRollup.objects.values(
+                'date', 'orders', 'revenue', 'items_sold', 'page_views', 'product_clicks', 'cart_adds'
+            )
+        }
+
+    def per_category(self):
+        return {
+            (row.pop('date'), row.pop('category')): tuple(row.values())
+            for row in DailyCategorySalesRollup.objects.values(
+                'date', 'category', 'orders', 'revenue', 'items_sold', 'page_views', 'product_clicks', 'cart_adds'
+            )
+        }
+
+    def test_rollup_writes_every_day_of_the_range(self):
+        self.assertEqual(rollup_days(self.days[0], self.days[-1]), (3, 4))
+
+        self.assertEqual(self.daily(), {
+            self.days[0]: (2, Decimal('35'), 4, 0, 1, 1),
+            self.days[1]: (0, Decimal('0'), 0, 3, 0, 0),
+            self.days[2]: (0, Decimal('0'), 0, 0, 0, 0),
+        })
+        # An order counts once towards each category it has items in
+        self.assertEqual(self.per_category(), {
+            (self.days[0], self.shirts.pk): (2, Decimal('25'), 3, 0, 0, 1),
+            (self.days[0], self.shoes.pk): (1, Decimal('10'), 1, 0, 1, 0),
+            (self.days[1], self.shirts.pk): (0, Decimal('0'), 0, 2, 0, 0),
+            (self.days[1], self.shoes.pk): (0, Decimal('0'), 0, 1, 0, 0),
+        })
+
+    def test_rerun_zeroes_removed_activity(self):
+        rollup_days(self.days[0], self.days[-1])
+        self.mixed.delete()
+
+        rollup_days(self.days[0], self.days[0])
+
+        self.assertEqual(self.daily()[self.days[0]], (1, Decimal('5'), 1, 0, 1, 1))
+        self.assertEqual(self.per_category()[(self.days[0], self.shoes.pk)], (0, Decimal('0'), 0, 0, 1, 0))
+
+    def test_read_serves_closed_days_from_the_rollup_and_today_live(self):
+        rollup_days(self.days[0], self.days[-1])
+        self.order(self.today, [(self.shoe, 3, 10)])
+
+        with self.assertNumQueries(6):
+            rows = read_daily_rollup(self.days[0], self.today)
+        self.assertEqual([(row['date'], row['orders']) for row in rows], [
+            (self.days[0], 2), (self.days[1], 0), (self.days[2], 0), (self.today, 1),
+        ])
+
+        rows = read_daily_rollup(self.days[0], self.today, category=self.shoes.pk)
+        self.assertEqual([row['items_sold'] for row in rows], [1, 0, 0, 3])
+
+    def test_sales_overview_reads_the_rollup(self):
+        rollup_days(self.days[0], self.days[-1])
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(
+            email='admin@example.com', username='admin', password='x', is_staff=True
+        ))
+
+        response = client.get('/api/analytics/sales/overview/', {
+            'period': 'custom', 'start_date': self.days[0], 'end_date': self.days[-1],
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(day['orders'], day['revenue']) for day in response.data['data']['daily_sales']],
+            [(2, 35.0), (0, 0.0), (0, 0.0)],
+        )
+
+
+class FunnelTests(TestCase):
+    """Visitors move through the steps in order, across signing in"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = create_category()
+        cls.shirt, cls.hat = [create_product(name, category) for name in ('Shirt', 'Hat')]
+        cls.user = User.objects.create_user(email='shopper@example.com', username='shopper', password='x')
+        cls.day = timezone.localdate() - timedelta(days=1)
+        cls.start = day_bounds(cls.day, cls.day)[0] + timedelta(hours=8)
+
+        # Browses anonymously, signs in, adds to cart and buys three hours after landing
+        cls.step('page_view', 0, 'signs-in')
+        cls.step('product_view', 1, 'signs-in', user=cls.user)
+        cls.step('add_to_cart', 2, 'signs-in', user=cls.user)
+        order = create_order(cls.user, total=10)
+        OrderItem.objects.create(order=order, product=cls.shirt, quantity=1, price=10)
+        Order.objects.filter(pk=order.pk).update(created_at=cls.start + timedelta(hours=3))
+        # Anonymous visitor who stops at the cart
+        cls.step('page_view', 0, 'anonymous')
+        cls.step('product_view', 1, 'anonymous')
+        cls.step('add_to_cart', 1, 'anonymous', product=cls.hat)
+        # Product view before any page view does not count as the second step
+        cls.step('product_view', 0, 'out-of-order')
+        cls.step('page_view', 1, 'out-of-order')
+        cls.step('page_view', 0, 'bounce')
+
+    @classmethod
+    def step(cls, name, hours, session_key, user=None, product=None):
+        product = product or cls.shirt
+        if name == 'page_view':
+            event = PageView.objects.create(
+                session_key=session_key, user=user, product=product, page_url='https://shop.example.com/'
+            )
+        elif name == 'product_view':
+            event = ProductClick.objects.create(
+                session_key=session_key, user=user, product=product, source_page='https://shop.example.com/'
+            )
+        else:
+            event = CartActivity.objects.create(session_key=session_key, user=user, product=product, action='add')
+        type(event).objects.filter(pk=event.pk).update(timestamp=cls.start + timedelta(hours=hours))
+
+    def setUp(self):
+        cache.clear()
+
+    def visitors(self, **options):
+        return [step['visitors'] for step in compute_funnel(DEFAULT_STEPS, self.day, self.day, **options)]
+
+    def test_counts_each_visitor_once_per_step_in_order(self):
+        results = compute_funnel(DEFAULT_STEPS, self.day, self.day)
+
+        self.assertEqual([step['visitors'] for step in results], [4, 2, 2, 1])
+        self.assertEqual(results[1]['conversion_from_previous'], 50.0)
+        self.assertEqual(results[3]['conversion_from_start'], 25.0)
+        self.assertEqual(results[1]['drop_off'], 2)
+
+    def test_window_limits_time_from_the_first_step(self):
+        self.assertEqual(self.visitors(window=timedelta(hours=2)), [4, 2, 2, 0])
+
+    def test_product_filter(self):
+        self.assertEqual(self.visitors(product=self.shirt.pk), [4, 2, 1, 1])
+
+    def test_endpoint_validates_steps(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(
+            email='admin@example.com', username='admin', password='x', is_staff=True
+        ))
+        params = {'period': 'custom', 'start_date': self.day, 'end_date': self.day}
+
+        response = client.get(
+            '/api/analytics/engagement/funnel/', {**params, 'steps': 'page_view,add_to_cart,purchase'}
+        )
+        self.assertEqual([step['visitors'] for step in response.data['steps']], [4, 2, 1])
+
+        response = client.get('/api/analytics/engagement/funnel/', {**params, 'steps': 'page_view,checkout'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(REPORT_WORKERS=0, REPORT_CHUNK_DAYS=2)
+class ReportJobTests(TestCase):
+    """Background reports run once per spec, in chunks, and are reused while fresh"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shirt = create_product('Shirt', create_category())
+        cls.admin = User.objects.create_user(
+            email='admin@example.com', username='admin', password='x', is_staff=True
+        )
+        cls.days = [timezone.localdate() - timedelta(days=offset) for offset in (3, 2, 1)]
+        order = create_order(cls.admin, total=20)
+        OrderItem.objects.create(order=order, product=cls.shirt, quantity=2, price=10)
+        Order.objects.filter(pk=order.pk).update(
+            created_at=day_bounds(cls.days[1], cls.days[1])[0] + timedelta(hours=10)
+        )
+        rollup_days(cls.days[0], cls.days[-1])
+        cls.spec = build_spec('sales_overview', {
+            'start_date': cls.days[0], 'end_date': cls.days[-1], 'category': None,
+        })
+
+    def test_identical_submissions_share_one_job(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job, created = submit_report(self.spec, user=self.admin)
+        again, created_again = submit_report(self.spec)
+
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(again.pk, job.pk)
+        # Two daily chunks of at most two days, then the top products
+        self.assertEqual(job.chunks_total, 3)
+        self.assertEqual(job.status, 'pending')
+
+    def test_job_runs_once_and_matches_the_synchronous_report(self):
+        job, _ = submit_report(self.spec)
+        progress = []
+        self.assertTrue(run_report_job(job.pk))
+        self.assertFalse(run_report_job(job.pk))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual((job.chunks_done, job.chunks_total), (3, 3))
+        self.assertGreater(job.expires_at, timezone.now())
+        expected = compute_report(self.spec, on_chunk=lambda done, total, _: progress.append((done, total)))
+        self.assertEqual(progress, [(1, 3), (2, 3), (3, 3)])
+        self.assertEqual(
+            [(day['orders'], day['revenue']) for day in job.result['daily_sales']],
+            [(day['orders'], day['revenue']) for day in expected['daily_sales']],
+        )
+        self.assertEqual([day['orders'] for day in job.result['daily_sales']], [0, 1, 0])
+        self.assertEqual(job.result['top_products'][0]['units_sold'], 2)
+
+    def test_fresh_result_is_reused_until_it_expires(self):
+        job, _ = submit_report(self.spec)
+        run_report_job(job.pk)
+
+        self.assertEqual(submit_report(self.spec), (job, False))
+
+        ReportJob.objects.filter(pk=job.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        fresh, created = submit_report(self.spec)
+        self.assertTrue(created)
+        self.assertNotEqual(fresh.pk, job.pk)
+
+    def test_failed_job_records_the_error(self):
+        job, _ = submit_report(self.spec)
+
+        with mock.patch('analytics.reports.read_daily_rollup', side_effect=DatabaseError('rollup unavailable')):
+            with self.assertLogs('analytics.reports', 'ERROR'):
+                self.assertTrue(run_report_job(job.pk))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ('failed', 'rollup unavailable'))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_stale_running_jobs_are_requeued(self):
+        stale, _ = submit_report(self.spec)
+        live, _ = submit_report(build_spec('customer_behavior', {
+            'start_date': self.days[0], 'end_date': self.days[-1], 'approx': False,
+        }))
+        ReportJob.objects.filter(pk=stale.pk).update(
+            status='running', started_at=timezone.now() - timedelta(hours=1), chunks_done=1
+        )
+        ReportJob.objects.filter(pk=live.pk).update(status='running', started_at=timezone.now())
+
+        self.assertEqual(requeue_stale_jobs(timeout=600), 1)
+
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.chunks_done, stale.started_at), ('pending', 0, None))
+        self.assertTrue(run_report_job(stale.pk))
+
+    def test_endpoint_queues_and_serves_the_job(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        payload = {
+            'report': 'sales_overview', 'period': 'custom',
+            'start_date': self.days[0], 'end_date': self.days[-1],
+        }
+
+        response = client.post('/api/analytics/reports/', payload, format='json')
+        self.assertEqual(response.status_code, 202)
+        run_report_job(response.data['id'])
+
+        detail = client.get(f"/api/analytics/reports/{response.data['id']}/")
+        self.assertEqual((detail.data['status'], detail.data['progress']), ('completed', 100.0))
+        self.assertEqual(client.post('/api/analytics/reports/', payload, format='json').status_code, 200)
+
+
+class DecayedCounterTests(SimpleTestCase):
+    """Decayed Count-Min counts rank the heaviest keys and halve every half-life"""
+    HALF_LIFE = 3600
+    NOW = 1_700_000_000.0
+
+    def counter(self, counts, timestamp=NOW):
+        counter = DecayedCounter(self.HALF_LIFE, capacity=20)
+        for key, count in counts.items():
+            for _ in range(count):
+                counter.add(key, timestamp=timestamp)
+        return counter
+
+    def counts(self, seed):
+        rng = random.Random(seed)
+        return {key: rng.randint(1, 40) for key in range(500)}
+
+    def test_estimates_never_undercount_and_top_keys_are_found(self):
+        counts = self.counts(1)
+        counter = self.counter(counts)
+
+        for key, count in counts.items():
+            self.assertGreaterEqual(counter.estimate(key, now=self.NOW), count - 1e-6)
+        heaviest = sorted(counts, key=counts.get, reverse=True)[:5]
+        found = [key for key, _ in counter.top(10, now=self.NOW)]
+        self.assertTrue(set(heaviest) <= set(found))
+
+    def test_counts_halve_every_half_life(self):
+        counter = self.counter({'shirt': 8})
+
+        self.assertAlmostEqual(counter.estimate('shirt', now=self.NOW + self.HALF_LIFE), 4)
+        self.assertAlmostEqual(counter.top(1, now=self.NOW + 3 * self.HALF_LIFE)[0][1], 1)
+
+    def test_landmark_moves_keep_older_counts(self):
+        counter = self.counter({'shirt': 4})
+        later = self.NOW + 40 * self.HALF_LIFE
+        counter.add('hat', timestamp=later)
+
+        self.assertGreater(counter.landmark, 0)
+        self.assertAlmostEqual(counter.estimate('shirt', now=later), 4 * 2.0 ** -40)
+        self.assertEqual(counter.top(1, now=later)[0][0], 'hat')
+
+    def test_merge_equals_one_sketch_of_both_streams(self):
+        first, second = self.counts(2), self.counts(3)
+        merged = self.counter(first).merge(self.counter(second, timestamp=self.NOW + self.HALF_LIFE))
+
+        both = self.counter(first)
+        for key, count in second.items():
+            for _ in range(count):
+                both.add(key, timestamp=self.NOW + self.HALF_LIFE)
+        for key in range(500):
+            self.assertAlmostEqual(merged.estimate(key, now=self.NOW), both.estimate(key, now=self.NOW))
+
+        with self.assertRaises(ValueError):
+            merged.merge(DecayedCounter(self.HALF_LIFE * 2))
+
+    def test_serialization_round_trip(self):
+        counter = self.counter(self.counts(4))
+
+        restored = DecayedCounter.from_bytes(counter.to_bytes())
+
+        self.assertEqual(restored.top(20, now=self.NOW), counter.top(20, now=self.NOW))
+        self.assertEqual(restored.estimate(7, now=self.NOW), counter.estimate(7, now=self.NOW))
+
+
+class TrendingTrackerTests(TestCase):
+    """Workers share one ranking through the checkpoints"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = create_category()
+        cls.shirt, cls.hat, cls.sock = [create_product(name, category) for name in ('Shirt', 'Hat', 'Sock')]
+
+    def events(self, product, clicks=0, views=0, adds=0):
+        return (
+            [ProductClick(product=product, timestamp=timezone.now()) for _ in range(clicks)]
+            + [PageView(product=product, timestamp=timezone.now()) for _ in range(views)]
+            + [CartActivity(product=product, action='add', timestamp=timezone.now()) for _ in range(adds)]
+        )
+
+    def ranking(self, tracker, signal='score'):
+        return [product_id for product_id, _ in tracker.top(signal)]
+
+    def test_workers_converge_after_syncing(self):
+        first, second = TrendingTracker(sync_interval=3600), TrendingTracker(sync_interval=3600)
+        first.record(self.events(self.shirt, clicks=3))
+        second.record(self.events(self.hat, clicks=2, adds=1) + self.events(self.sock, views=1))
+
+        first.sync()
+        second.sync()
+        first.sync()
+
+        self.assertEqual(TrendingCheckpoint.objects.count(), 4)
+        # score: hat 2 * 2 + 5, shirt 3 * 2, sock 1
+        self.assertEqual(self.ranking(first), [self.hat.pk, self.shirt.pk, self.sock.pk])
+        self.assertEqual(self.ranking(second), self.ranking(first))
+        self.assertEqual(self.ranking(second, 'clicks'), [self.shirt.pk, self.hat.pk])
+        self.assertAlmostEqual(dict(second.top('score'))[self.hat.pk], 9, places=2)
+
+    def test_cart_removes_and_category_views_are_not_counted(self):
+        tracker = TrendingTracker(sync_interval=3600)
+        tracker.record([
+            CartActivity(product=self.shirt, action='remove', timestamp=timezone.now()),
+            PageView(category=self.shirt.category, timestamp=timezone.now()),
+        ])
+
+        tracker.sync()
+
+        self.assertEqual(tracker.top('score'), [])
+
+    def test_engagement_counts_the_range_and_reports_trending_apart(self):
+        last_week = timezone.now() - timedelta(days=6)
+        for product, count in ((self.shirt, 3), (self.hat, 1)):
+            for _ in range(count):
+                click = ProductClick.objects.create(product=product, session_key='s1')
+                ProductClick.objects.filter(pk=click.pk).update(timestamp=last_week)
+        ProductClick.objects.create(product=self.hat, session_key='s1')
+        tracker = TrendingTracker(sync_interval=3600)
+        tracker.record(self.events(self.sock, clicks=5))
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(
+            email='admin@example.com', username='admin', password='x', is_staff=True
+        ))
+
+        with mock.patch('analytics.reports.trending', tracker):
+            response = client.get('/api/analytics/engagement/metrics/', {'period': 'week'})
+
+        self.assertEqual(
+            [(row['product__name'], row['click_count']) for row in response.data['popular_products']],
+            [('Shirt', 3), ('Hat', 2)],
+        )
+        self.assertEqual([row['product__name'] for row in response.data['trending_products']], ['Sock'])
+        self.assertAlmostEqual(response.data['trending_products'][0]['trending_score'], 5, places=1)
+
+        past = (timezone.localdate() - timedelta(days=3)).isoformat()
+        response = client.get('/api/analytics/engagement/metrics/', {
+            'period': 'custom', 'start_date': past, 'end_date': past,
+        })
+        self.assertEqual(response.data['trending_products'], [])
+
+    def test_rebuild_replays_the_raw_events(self):
+        for event in self.events(self.sock, clicks=1, adds=2) + self.events(self.shirt, views=3):
+            event.session_key = 's1'
+            event.save()
+
+        self.assertEqual(rebuild_trending(timezone.now() - timedelta(hours=1)), 6)
+
+        tracker = TrendingTracker(sync_interval=0)
+        self.assertEqual(self.ranking(tracker), [self.sock.pk, self.shirt.pk])
+        self.assertEqual(self.ranking(tracker, 'views'), [self.shirt.pk])
+
+
+@skipIf(cube.np is None, 'the order cube needs NumPy')
+class OrderCubeTests(TestCase):
+    """The cube answers the same figures as the rollups and the ORM"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shirts, cls.shoes = create_category(), create_category('Shoes')
+        cls.shirt, cls.hat = [create_product(name, cls.shirts) for name in ('Shirt', 'Hat')]
+        cls.shoe = create_product('Shoe', cls.shoes, price=30)
+        cls.user = User.objects.create_user(email='shopper@example.com', username='shopper', password='x')
+        cls.today = timezone.localdate()
+        cls.days = [cls.today - timedelta(days=offset) for offset in range(6, -1, -1)]
+
+        rng = random.Random(5)
+        for day in cls.days:
+            for _ in range(rng.randint(0, 4)):
+                lines = [
+                    (product, rng.randint(1, 3)) for product in rng.sample([cls.shirt, cls.hat, cls.shoe], 2)
+                ]
+                cls.order(day, lines, status=rng.choice(['pending', 'delivered', 'cancelled']))
+
+    @classmethod
+    def order(cls, day, lines, status='pending'):
+        order = create_order(
+            cls.user, total=sum(product.price * quantity for product, quantity in lines), status=status
+        )
+        for product, quantity in lines:
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, price=product.price)
+        Order.objects.filter(pk=order.pk).update(created_at=day_bounds(day, day)[0] + timedelta(hours=12))
+        return order
+
+    def built(self):
+        order_cube = cube.OrderCube()
+        order_cube.refresh()
+        return order_cube
+
+    def assertMatchesRollup(self, order_cube, category=None):
+        rollup_days(self.days[0], self.days[-2])
+        expected = [
+            {
+                'date': day['date'], 'orders': day['orders'],
+                'revenue': float(day['revenue']), 'items_sold': day['items_sold'],
+            }
+            for day in read_daily_rollup(self.days[0], self.today, category=category)
+        ]
+        self.assertEqual(order_cube.daily_sales(self.days[0], self.today, category=category), expected)
+
+    def test_daily_sales_match_the_rollups(self):
+        order_cube = self.built()
+
+        self.assertEqual(len(order_cube), Order.objects.count())
+        self.assertMatchesRollup(order_cube)
+        self.assertMatchesRollup(order_cube, category=self.shirts.pk)
+
+    def test_group_by_and_top_k_match_the_orm(self):
+        order_cube = self.built()
+        delivered = OrderItem.objects.filter(order__status='delivered')
+
+        keys, values = order_cube.group_by('product', self.days[0], self.today, statuses=['delivered'])
+        self.assertEqual(
+            dict(zip(keys.tolist(), values.tolist())),
+            {
+                row['product']: float(row['revenue'])
+                for row in delivered.values('product').annotate(revenue=Sum(F('price') * F('quantity')))
+            },
+        )
+        sold = delivered.values('product').annotate(units=Sum('quantity')).order_by('-units', 'product')
+        self.assertEqual(
+            [value for _, value in order_cube.top_k('product', self.days[0], self.today, k=2, statuses=['delivered'])],
+            [float(row['units']) for row in sold[:2]],
+        )
+        with self.assertRaises(ValueError):
+            order_cube.group_by('product', self.days[0], self.today, metric='orders')
+
+    def test_refresh_appends_new_orders_and_applies_saved_changes(self):
+        order_cube = self.built()
+        changed = Order.objects.filter(status='pending').order_by('id').first()
+        changed.status = 'cancelled'
+        changed.save()
+        self.order(self.days[2], [(self.shoe, 2)], status='delivered')
+
+        order_cube.refresh()
+
+        self.assertEqual(len(order_cube), Order.objects.count())
+        self.assertMatchesRollup(order_cube)
+        keys, values = order_cube.group_by('status', self.days[0], self.today, metric='lines')
+        self.assertEqual(
+            dict(zip(keys.tolist(), values.tolist())),
+            {
+                cube.STATUS_CODES[row['order__status']]: row['lines']
+                for row in OrderItem.objects.values('order__status').annotate(lines=Count('id'))
+            },
+        )
+
+    @override_settings(ANALYTICS_CUBE_ENABLED=False)
+    def test_disabled_cube_falls_back_to_the_rollups(self):
+        self.assertIsNone(cube.get_order_cube())
+
+
+class SamplingTests(TestCase):
+    """Weighted sample counts estimate the raw counts within their intervals"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = create_category()
+        cls.products = [create_product(f'Shirt {index}', category) for index in range(4)]
+        cls.day = timezone.localdate() - timedelta(days=2)
+        clicks = [
+            ProductClick(product=product, session_key='s1', source_page='https://shop.example.com/')
+            for product, count in zip(cls.products, (1200, 500, 200, 100))
+            for _ in range(count)
+        ]
+        ProductClick.objects.bulk_create(clicks)
+        PageView.objects.bulk_create([
+            PageView(session_key='s1', page_url='https://shop.example.com/') for _ in range(3000)
+        ])
+        CartActivity.objects.bulk_create([
+            CartActivity(session_key='s1', product=cls.products[0], action='add') for _ in range(400)
+        ])
+        moment = day_bounds(cls.day, cls.day)[0] + timedelta(hours=9)
+        for model in sampling.SAMPLED_MODELS:
+            model.objects.update(timestamp=moment)
+        cls.exact = {'page_view': 3000, 'product_click': 2000, 'cart_activity': 400}
+
+    def test_full_rate_sample_is_exact(self):
+        self.assertEqual(sampling.rebuild_event_sample(self.day, self.day, rate=1.0), 5400)
+
+        estimates = sampling.estimate_counts(self.day, self.day)
+
+        self.assertEqual(
+            {kind: tuple(estimate) for kind, estimate in estimates.items()},
+            {kind: (count, count, count) for kind, count in self.exact.items()},
+        )
+
+    def test_intervals_cover_the_exact_counts(self):
+        sampling.rebuild_event_sample(self.day, self.day, rate=0.2, rng=random.Random(7))
+
+        for kind, estimate in sampling.estimate_counts(self.day, self.day).items():
+            self.assertLessEqual(estimate.lower, self.exact[kind], kind)
+            self.assertGreaterEqual(estimate.upper, self.exact[kind], kind)
+            self.assertLess(estimate.upper - estimate.lower, self.exact[kind] * 0.5, kind)
+
+        top = sampling.estimate_top_products(self.day, self.day, k=2)
+        self.assertEqual([product_id for product_id, _, _ in top], [self.products[0].pk, self.products[1].pk])
+        _, clicks, share = top[0]
+        self.assertTrue(clicks.lower <= 1200 <= clicks.upper)
+        self.assertTrue(share.lower <= 0.6 <= share.upper <= 1.0)
+
+    def test_rebuild_replaces_the_sample_and_zero_rate_keeps_nothing(self):
+        sampling.rebuild_event_sample(self.day, self.day, rate=1.0)
+
+        self.assertEqual(sampling.rebuild_event_sample(self.day, self.day, rate=0), 0)
+        self.assertFalse(EventSample.objects.exists())
+
+    @override_settings(ANALYTICS_SAMPLE_RATE=1.0)
+    def test_approx_endpoint_reports_the_estimates(self):
+        sampling.rebuild_event_sample(self.day, self.day)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(
+            email='admin@example.com', username='admin', password='x', is_staff=True
+        ))
+
+        response = client.get('/api/analytics/customer/behavior/', {
+            'period': 'custom', 'start_date': self.day, 'end_date': self.day, 'approx': 'true',
+        })
+
+        self.assertEqual(response.status_code, 200)
+        data = response.data['data']
+        self.assertEqual(data['engagement_metrics']['page_views'], 3000)
+        self.assertEqual(data['approximation']['sample_rate'], 1.0)
+        self.assertEqual(
+            data['approximation']['engagement_metrics']['product_clicks'],
+            {'value': 2000, 'lower': 2000, 'upper': 2000},
+        )
+
+
+class ExportTests(TestCase):
+    """Exports stream every selected row as CSV or NDJSON, block by block"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shirt = create_product('Shirt', create_category())
+        ProductClick.objects.bulk_create([
+            ProductClick(
+                product=cls.shirt, session_key=f's{index}', source_page=f'https://shop.example.com/?q="{index}",x'
+            )
+            for index in range(300)
+        ])
+        cls.rows = list(ProductClick.objects.order_by('id').values_list(*EXPORT_FIELDS[ProductClick]))
+
+    def as_text(self, value):
+        return '' if value is None else str(value)
+
+    def test_csv_is_streamed_in_blocks(self):
+        with mock.patch('analytics.exports.BLOCK_SIZE', 1024):
+            blocks = list(export_stream(ProductClick.objects.all(), chunk_size=50))
+
+        self.assertGreater(len(blocks), 5)
+        rows = list(csv.reader(io.StringIO(b''.join(blocks).decode())))
+        self.assertEqual(rows[0], EXPORT_FIELDS[ProductClick])
+        self.assertEqual(
+            sorted(rows[1:], key=lambda row: int(row[0])),
+            [[self.as_text(value) for value in row] for row in self.rows],
+        )
+
+    def test_gzipped_ndjson_round_trips(self):
+        stream = export_stream(ProductClick.objects.filter(session_key='s7'), 'ndjson', compress=True)
+
+        lines = gzip.decompress(b''.join(stream)).decode().splitlines()
+
+        self.assertEqual(len(lines), 1)
+        record = json.loads(lines[0])
+        self.assertEqual(record['session_key'], 's7')
+        self.assertEqual(record['source_page'], 'https://shop.example.com/?q="7",x')
+        self.assertEqual(record['product_id'], self.shirt.pk)
+
+    def test_admin_action_streams_an_attachment(self):
+        self.client.force_login(User.objects.create_superuser(
+            email='admin@example.com', username='admin', password='x'
+        ))
+        selected = [row[0] for row in self.rows[:10]]
+
+        response = self.client.post('/admin/analytics/productclick/', {
+            'action': 'export_analytics_ndjson_gzip', '_selected_action': selected,
+        })
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('.ndjson.gz"', response['Content-Disposition'])
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(sorted(json.loads(line)['id'] for line in lines), selected)
+
+    def test_command_writes_the_day_range(self):
+        day = timezone.localdate() - timedelta(days=1)
+        ProductClick.objects.filter(id__in=[row[0] for row in self.rows[:3]]).update(
+            timestamp=day_bounds(day, day)[0] + timedelta(hours=8)
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'clicks.csv')
+            call_command(
+                'export_analytics', 'productclick', '--start', day.isoformat(), '--end', day.isoformat(),
+                '--output', path, stdout=io.StringIO(),
+            )
+            with open(path, newline='') as export:
+                rows = list(csv.reader(export))
+
+        self.assertEqual(sorted(int(row[0]) for row in rows[1:]), [row[0] for row in self.rows[:3]])
@@ -0,0 +1,316 @@
+"""
+Real-time trending products from decayed Count-Min sketches.
+
+Each signal -- product page views, product clicks, cart adds, and a weighted
+``score`` of the three -- keeps a Count-Min sketch of exponentially decayed
+counts plus the ``CAPACITY`` heaviest products seen so far. Decay is
+"forward": an event at time t is added with weight 2 ** ((t - landmark) /
+half_life), and estimates are scaled back to the present when read, so
+nothing has to be decayed on every tick. The landmark moves forward every 32
+half-lives (rescaling the counters once) to keep the weights in range.
+
+Ingestion (analytics.ingest) feeds every flushed batch into the process-wide
+``trending`` tracker. Every TRENDING_SYNC_INTERVAL seconds a process folds
+the counts it gathered since its last sync into the ``TrendingCheckpoint``
+rows (read, merge, write under row locks) and adopts the merged state, so all
+workers converge on the same ranking and it survives restarts. Reads never
+touch the raw event tables: ``top`` ranks at most CAPACITY candidates.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+import zlib
+from array import array
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+
+from .models import CartActivity, PageView, ProductClick, TrendingCheckpoint
+
+logger = logging.getLogger(__name__)
+
+WIDTH = 1024
+DEPTH = 4
+CAPACITY = 200
+LANDMARK_PERIOD = 32  # half-lives between landmark moves
+
+SIGNALS = ['views', 'clicks', 'cart_adds', 'score']
+# Weight of each event kind in the combined ``score`` signal
+SIGNAL_WEIGHTS = {'views': 1.0, 'clicks': 2.0, 'cart_adds': 5.0}
+
+
+def _signal(event):
+    """The signal an unsaved or saved raw event feeds, or None"""
+    if isinstance(event, PageView):
+        return 'views' if event.product_id is not None else None
+    if isinstance(event, ProductClick):
+        return 'clicks'
+    if isinstance(event, CartActivity):
+        return 'cart_adds' if event.action == 'add' else None
+    return None
+
+
+def _timestamp(moment):
+    return moment.timestamp() if moment is not None else time.time()
+
+
+@lru_cache(maxsize=65536)
+def _cells(key, width, depth):
+    """Flat counter index of ``key`` in each row of a width x depth sketch"""
+    digest = hashlib.blake2b(str(key).encode(), digest_size=4 * depth).digest()
+    return tuple(
+        row * width + int.from_bytes(digest[4 * row:4 * row + 4], 'big') % width
+        for row in range(depth)
+    )
+
+
+class DecayedCounter:
+    """Count-Min sketch of exponentially decayed counts, with its heaviest keys"""
+
+    def __init__(self, half_life, width=WIDTH, depth=DEPTH, capacity=CAPACITY, landmark=0.0):
+        self.half_life = float(half_life)
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+        self.landmark = landmark
+        self.counters = array('d', bytes(8 * width * depth))
+        self.candidates = {}  # key -> decayed estimate at the landmark
+        self._floor = 0.0     # no candidate is below this
+
+    def _cells(self, key):
+        return _cells(key, self.width, self.depth)
+
+    def _landmark_for(self, timestamp):
+        period = self.half_life * LANDMARK_PERIOD
+        return timestamp // period * period
+
+    def rescale(self, landmark):
+        """Move the landmark forward, shrinking every counter to match"""
+        if landmark <= self.landmark:
+            return
+        factor = 2.0 ** -((landmark - self.landmark) / self.half_life)
+        self.counters = array('d', (value * factor for value in self.counters))
+        self.candidates = {key: value * factor for key, value in self.candidates.items()}
+        self._floor *= factor
+        self.landmark = landmark
+
+    def add(self, key, amount=1.0, timestamp=None):
+        """Count ``amount`` of ``key`` at ``timestamp`` (epoch seconds, default now)"""
+        timestamp = time.time() if timestamp is None else timestamp
+        self.rescale(self._landmark_for(timestamp))
+        weight = amount * 2.0 ** ((timestamp - self.landmark) / self.half_life)
+        counters = self.counters
+        estimate = None
+        for cell in self._cells(key):
+            counters[cell] += weight
+            if estimate is None or counters[cell] < estimate:
+                estimate = counters[cell]
+        self._offer(key, estimate)
+
+    def _offer(self, key, estimate):
+        candidates = self.candidates
+        if key in candidates or len(candidates) < self.capacity:
+            candidates[key] = estimate
+            return
+        if estimate <= self._floor:
+            return
+        weakest = min(candidates, key=candidates.get)
+        if estimate > candidates[weakest]:
+            del candidates[weakest]
+            candidates[key] = estimate
+        self._floor = min(candidates.values())
+
+    def _decay(self, now=None):
+        now = time.time() if now is None else now
+        return 2.0 ** -((now - self.landmark) / self.half_life)
+
+    def estimate(self, key, now=None):
+        """Decayed count of ``key`` as of ``now``"""
+        return min(self.counters[cell] for cell in self._cells(key)) * self._decay(now)
+
+    def top(self, k=10, now=None):
+        """``[(key, decayed count)]`` for the ``k`` heaviest keys, heaviest first"""
+        decay = self._decay(now)
+        ranked = sorted(self.candidates.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(key, value * decay) for key, value in ranked]
+
+    def merge(self, other):
+        """Add ``other``'s counts into this sketch"""
+        if (other.width, other.depth, other.half_life) != (self.width, self.depth, self.half_life):
+            raise ValueError('cannot merge sketches of different dimensions or half-life')
+        landmark = max(self.landmark, other.landmark)
+        self.rescale(landmark)
+        factor = 2.0 ** -((landmark - other.landmark) / self.half_life)
+        self.counters = array('d', (a + b * factor for a, b in zip(self.counters, other.counters)))
+        keys = set(self.candidates) | set(other.candidates)
+        estimates = {key: min(self.counters[cell] for cell in self._cells(key)) for key in keys}
+        self.candidates = dict(sorted(estimates.items(), key=lambda item: item[1], reverse=True)[:self.capacity])
+        self._floor = min(self.candidates.values()) if len(self.candidates) >= self.capacity else 0.0
+        return self
+
+    def __bool__(self):
+        return bool(self.candidates)
+
+    def to_bytes(self):
+        header = json.dumps({
+            'half_life': self.half_life, 'width': self.width, 'depth': self.depth,
+            'capacity': self.capacity, 'landmark': self.landmark,
+            'candidates': list(self.candidates.items()),
+        }).encode()
+        return len(header).to_bytes(4, 'big') + header + zlib.compress(self.counters.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        size = int.from_bytes(data[:4], 'big')
+        header = json.loads(data[4:4 + size])
+        counter = cls(
+            header['half_life'], width=header['width'], depth=header['depth'],
+            capacity=header['capacity'], landmark=header['landmark'],
+        )
+        counter.counters = array('d')
+        counter.counters.frombytes(zlib.decompress(data[4 + size:]))
+        counter.candidates = {key: value for key, value in header['candidates']}
+        if len(counter.candidates) >= counter.capacity:
+            counter._floor = min(counter.candidates.values())
+        return counter
+
+
+class TrendingTracker:
+    """Per-process trending state: the merged sketches plus counts not yet checkpointed"""
+
+    def __init__(self, half_life=None, sync_interval=None):
+        hours = half_life if half_life is not None else getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 24)
+        self.half_life = hours * 3600
+        self.sync_interval = (
+            sync_interval if sync_interval is not None else getattr(settings, 'TRENDING_SYNC_INTERVAL', 60)
+        )
+        self.current = self._empty()
+        self.pending = self._empty()
+        self.synced_at = None
+        self._lock = threading.Lock()
+
+    def _empty(self):
+        return {signal: DecayedCounter(self.half_life) for signal in SIGNALS}
+
+    def record(self, events):
+        """Count a batch of raw events (PageView / ProductClick / CartActivity)"""
+        with self._lock:
+            for event in events:
+                signal = _signal(event)
+                if signal is None:
+                    continue
+                timestamp = _timestamp(event.timestamp)
+                for counters in (self.current, self.pending):
+                    counters[signal].add(event.product_id, timestamp=timestamp)
+                    counters['score'].add(event.product_id, SIGNAL_WEIGHTS[signal], timestamp=timestamp)
+
+    def sync(self, retries=1):
+        """Fold pending counts into the checkpoints and adopt the merged state"""
+        with self._lock:
+            pending, self.pending = self.pending, self._empty()
+        try:
+            merged = self._merge_checkpoints(pending)
+        except IntegrityError:
+            # Another worker created a checkpoint row first; merge into it now
+            self._requeue(pending)
+            if not retries:
+                raise
+            return self.sync(retries=retries - 1)
+        except Exception:
+            self._requeue(pending)
+            raise
+        with self._lock:
+            # Events recorded during the merge are in self.pending; add them back on top
+            for signal, counter in self.pending.items():
+                if counter:
+                    merged[signal].merge(counter)
+            self.current = merged
+            self.synced_at = time.monotonic()
+
+    def _requeue(self, pending):
+        with self._lock:
+            for signal, counter in pending.items():
+                if counter:
+                    self.pending[signal] = counter.merge(self.pending[signal])
+
+    def _merge_checkpoints(self, pending):
+        with transaction.atomic():
+            rows = {
+                row.signal: row
+                for row in TrendingCheckpoint.objects.select_for_update().filter(signal__in=SIGNALS)
+            }
+            merged, created = {}, []
+            for signal in SIGNALS:
+                row = rows.get(signal)
+                counter = DecayedCounter.from_bytes(row.state) if row is not None else DecayedCounter(self.half_life)
+                if not pending[signal]:
+                    merged[signal] = counter
+                    continue
+                counter.merge(pending[signal])
+                merged[signal] = counter
+                if row is None:
+                    created.append(TrendingCheckpoint(signal=signal, state=counter.to_bytes()))
+                else:
+                    row.state = counter.to_bytes()
+                    row.save(update_fields=['state', 'updated_at'])
+            TrendingCheckpoint.objects.bulk_create(created)
+        return merged
+
+    def sync_if_due(self):
+        if self.synced_at is not None and time.monotonic() - self.synced_at < self.sync_interval:
+            return
+        try:
+            self.sync()
+        except DatabaseError:
+            logger.exception('Failed to sync trending checkpoints')
+            if self.synced_at is None:
+                # Serve whatever this process has counted rather than retrying on every read
+                self.synced_at = time.monotonic()
+
+    def top(self, signal='score', k=10):
+        """``[(product_id, decayed count)]`` for the ``k`` hottest products on ``signal``"""
+        if signal not in SIGNALS:
+            raise ValueError(f'unknown trending signal {signal!r}')
+        self.sync_if_due()
+        return [(int(product_id), count) for product_id, count in self.current[signal].top(k)]
+
+
+def rebuild_trending(since, chunk_size=5000):
+    """Replay raw events newer than ``since`` into fresh checkpoints; returns events counted"""
+    tracker = TrendingTracker(sync_interval=0)
+    counted = 0
+    sources = [
+        PageView.objects.filter(product__isnull=False).only('product_id', 'timestamp'),
+        ProductClick.objects.only('product_id', 'timestamp'),
+        CartActivity.objects.filter(action='add').only('product_id', 'timestamp', 'action'),
+    ]
+    for queryset in sources:
+        batch = []
+        for event in queryset.filter(timestamp__gte=since).iterator(chunk_size=chunk_size):
+            batch.append(event)
+            if len(batch) >= chunk_size:
+                tracker.record(batch)
+                counted += len(batch)
+                batch = []
+        tracker.record(batch)
+        counted += len(batch)
+
+    with transaction.atomic():
+        TrendingCheckpoint.objects.filter(signal__in=SIGNALS).delete()
+        TrendingCheckpoint.objects.bulk_create([
+            TrendingCheckpoint(signal=signal, state=tracker.pending[signal].to_bytes()) for signal in SIGNALS
+        ])
+    return counted
+
+
+def record_trending(events):
+    """Ingestion hook: count a flushed batch and checkpoint when due"""
+    trending.record(events)
+    trending.sync_if_due()
+
+
+trending = TrendingTracker()
@@ -7,4 +7,11 @@ urlpatterns = [
     path('products/performance/', views.ProductPerformanceView.as_view(), name='product-performance'),
     path('customer/behavior/', views.CustomerBehaviorView.as_view(), name='customer-behavior'),
     path('engagement/metrics/', views.EngagementMetricsView.as_view(), name='engagement-metrics'),
+    path('engagement/unique-visitors/', views.UniqueVisitorsView.as_view(), name='unique-visitors'),
+    path('engagement/funnel/', views.FunnelView.as_view(), name='funnel'),
+    path('reports/', views.ReportJobListView.as_view(), name='report-jobs'),
+    path('reports/<uuid:job_id>/', views.ReportJobDetailView.as_view(), name='report-job-detail'),
+    # The storefront posts to /api/analytics/track without a trailing slash
+    path('track', views.TrackEventView.as_view(), name='track-event'),
+    path('track/', views.TrackEventView.as_view()),
 ]
\ No newline at end of file
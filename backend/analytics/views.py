@@ -1,18 +1,29 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAdminUser
-from django.db.models import Count, Sum, Avg, Q
-from django.utils import timezone
+from rest_framework.permissions import IsAdminUser, AllowAny
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from django.conf import settings
+from django.db.models import Exists, OuterRef
 from datetime import timedelta, datetime
-from orders.models import Order, OrderItem
-from products.models import Product
-from users.models import User
-from .models import PageView, ProductClick, CartActivity  # Import from analytics models
+from products.models import Product, ProductVariant
+from .models import ReportJob  # Import from analytics models
+from .dashboard import get_dashboard_stats
+from .funnels import get_funnel
+from .ingest import InvalidEvent, build_event, build_landing_touch, event_buffer, session_id
+from .product_metrics import read_product_metrics
+from .reports import build_spec, compute_report, submit_report
+from .visitors import daily_unique_visitors
 from .serializers import (
     DashboardStatsResponseSerializer, 
     SalesOverviewResponseSerializer,
     ProductPerformanceResponseSerializer,
     CustomerBehaviorResponseSerializer,
+    FunnelQuerySerializer,
+    ReportJobSerializer,
+    ReportRequestSerializer,
     TimeRangeSerializer
 )
 
@@ -20,86 +31,10 @@ class DashboardStatsView(APIView):
     permission_classes = [IsAdminUser]
     
     def get(self, request):
-        # Time ranges
-        today = timezone.now().date()
-        week_ago = today - timedelta(days=7)
-        month_ago = today - timedelta(days=30)
+        # Served from the cached snapshot; see analytics/dashboard.py
+        snapshot = get_dashboard_stats()
         
-        # Order statistics
-        total_orders = Order.objects.count()
-        today_orders = Order.objects.filter(created_at__date=today).count()
-        week_orders = Order.objects.filter(created_at__date__gte=week_ago).count()
-        pending_orders = Order.objects.filter(status='pending').count()
-        
-        # Revenue statistics
-        total_revenue = Order.objects.aggregate(
-            total=Sum('total')
-        )['total'] or 0
-        
-        week_revenue = Order.objects.filter(
-            created_at__date__gte=week_ago
-        ).aggregate(
-            total=Sum('total')
-        )['total'] or 0
-        
-        today_revenue = Order.objects.filter(
-            created_at__date=today
-        ).aggregate(
-            total=Sum('total')
-        )['total'] or 0
-        
-        # Product statistics
-        total_products = Product.objects.count()
-        low_stock_products = Product.objects.filter(
-            variants__stock_quantity__lte=10
-        ).distinct().count()
-        out_of_stock_products = Product.objects.filter(
-            variants__stock_quantity=0
-        ).distinct().count()
-        
-        # Customer statistics
-        total_customers = User.objects.filter(is_staff=False).count()
-        new_customers_week = User.objects.filter(
-            date_joined__date__gte=week_ago,
-            is_staff=False
-        ).count()
-        
-        # Analytics statistics
-        total_page_views = PageView.objects.count()
-        week_page_views = PageView.objects.filter(timestamp__date__gte=week_ago).count()
-        total_product_clicks = ProductClick.objects.count()
-        
-        data = {
-            'orders': {
-                'total': total_orders,
-                'today': today_orders,
-                'this_week': week_orders,
-                'pending': pending_orders,
-            },
-            'revenue': {
-                'total': float(total_revenue),
-                'this_week': float(week_revenue),
-                'today': float(today_revenue),
-            },
-            'products': {
-                'total': total_products,
-                'low_stock': low_stock_products,
-                'out_of_stock': out_of_stock_products,
-            },
-            'customers': {
-                'total': total_customers,
-                'new_this_week': new_customers_week,
-            },
-            'analytics': {
-                'total_page_views': total_page_views,
-                'week_page_views': week_page_views,
-                'total_product_clicks': total_product_clicks,
-            }
-        }
-        
-        serializer = DashboardStatsResponseSerializer({
-            'data': data
-        })
+        serializer = DashboardStatsResponseSerializer(snapshot)
         return Response(serializer.data)
 
 class SalesOverviewView(APIView):
@@ -109,46 +44,9 @@ class SalesOverviewView(APIView):
         # Time range validation
         time_serializer = TimeRangeSerializer(data=request.query_params)
         time_serializer.is_valid(raise_exception=True)
-        time_data = time_serializer.validated_data
-        
-        start_date = time_data['start_date']
-        end_date = time_data['end_date']
-        
-        # Daily sales data
-        daily_sales = []
-        current_date = start_date
-        
-        while current_date <= end_date:
-            day_sales = Order.objects.filter(
-                created_at__date=current_date
-            ).aggregate(
-                total=Sum('total'),
-                count=Count('id')
-            )
-            
-            daily_sales.append({
-                'date': current_date,
-                'revenue': float(day_sales['total'] or 0),
-                'orders': day_sales['count'] or 0,
-            })
-            
-            current_date += timedelta(days=1)
         
-        # Top selling products
-        top_products = OrderItem.objects.filter(
-            order__created_at__date__gte=start_date,
-            order__created_at__date__lte=end_date
-        ).values(
-            'product__name'
-        ).annotate(
-            total_sold=Sum('quantity'),
-            total_revenue=Sum('price')
-        ).order_by('-total_sold')[:10]
-        
-        data = {
-            'daily_sales': daily_sales,
-            'top_products': top_products
-        }
+        # Daily sales and top products; see analytics/reports.py
+        data = compute_report(build_spec('sales_overview', time_serializer.validated_data))
         
         serializer = SalesOverviewResponseSerializer({
             'data': data
@@ -167,27 +65,26 @@ class ProductPerformanceView(APIView):
         start_date = time_data['start_date']
         end_date = time_data['end_date']
         
-        # Product performance metrics
+        # Product performance metrics, from the per-product daily metrics
+        metrics = read_product_metrics(start_date, end_date, limit=20)
+        in_stock = ProductVariant.objects.filter(product=OuterRef('pk'), stock_quantity__gt=0)
         products = Product.objects.filter(
-            orderitem__order__created_at__date__gte=start_date,
-            orderitem__order__created_at__date__lte=end_date
-        ).annotate(
-            total_sold=Sum('orderitem__quantity'),
-            total_revenue=Sum('orderitem__price'),
-            avg_rating=Avg('reviews__rating'),
-            review_count=Count('reviews')
-        ).filter(total_sold__isnull=False).order_by('-total_sold')[:20]
+            id__in=[row['product_id'] for row in metrics]
+        ).annotate(in_stock=Exists(in_stock)).only('id', 'name').in_bulk()
         
         product_data = []
-        for product in products:
+        for row in metrics:
+            product = products.get(row['product_id'])
+            if product is None:
+                continue
             product_data.append({
                 'id': product.id,
                 'name': product.name,
-                'total_sold': product.total_sold or 0,
-                'total_revenue': float(product.total_revenue or 0),
-                'avg_rating': float(product.avg_rating or 0),
-                'review_count': product.review_count or 0,
-                'stock_status': 'In Stock' if product.variants.filter(stock_quantity__gt=0).exists() else 'Out of Stock'
+                'total_sold': row['units_sold'],
+                'total_revenue': float(row['revenue']),
+                'avg_rating': round(row['rating_total'] / row['review_count'], 2) if row['review_count'] else 0,
+                'review_count': row['review_count'],
+                'stock_status': 'In Stock' if product.in_stock else 'Out of Stock'
             })
         
         serializer = ProductPerformanceResponseSerializer({
@@ -202,78 +99,9 @@ class CustomerBehaviorView(APIView):
         # Time range validation
         time_serializer = TimeRangeSerializer(data=request.query_params)
         time_serializer.is_valid(raise_exception=True)
-        time_data = time_serializer.validated_data
-        
-        start_date = time_data['start_date']
-        end_date = time_data['end_date']
-        
-        # Customer acquisition channels (mock data - in real app, track this)
-        acquisition_data = [
-            {'channel': 'Organic Search', 'customers': 45, 'percentage': 35},
-            {'channel': 'Social Media', 'customers': 30, 'percentage': 23},
-            {'channel': 'Email Marketing', 'customers': 25, 'percentage': 19},
-            {'channel': 'Direct', 'customers': 20, 'percentage': 15},
-            {'channel': 'Referral', 'customers': 10, 'percentage': 8},
-        ]
-        
-        # Customer lifetime value
-        customer_lifetime_value = User.objects.filter(
-            is_staff=False,
-            orders__isnull=False,
-            orders__created_at__date__gte=start_date,
-            orders__created_at__date__lte=end_date
-        ).annotate(
-            total_spent=Sum('orders__total'),
-            order_count=Count('orders')
-        ).aggregate(
-            avg_lifetime_value=Avg('total_spent')
-        )
-        
-        # Repeat customer rate
-        total_customers = User.objects.filter(
-            is_staff=False,
-            orders__created_at__date__gte=start_date,
-            orders__created_at__date__lte=end_date
-        ).distinct().count()
         
-        repeat_customers = User.objects.filter(
-            is_staff=False,
-            orders__created_at__date__gte=start_date,
-            orders__created_at__date__lte=end_date
-        ).annotate(
-            order_count=Count('orders')
-        ).filter(order_count__gte=2).distinct().count()
-        
-        repeat_rate = (repeat_customers / total_customers * 100) if total_customers > 0 else 0
-        
-        # Customer engagement metrics
-        total_page_views = PageView.objects.filter(
-            timestamp__date__gte=start_date,
-            timestamp__date__lte=end_date
-        ).count()
-        
-        total_product_clicks = ProductClick.objects.filter(
-            timestamp__date__gte=start_date,
-            timestamp__date__lte=end_date
-        ).count()
-        
-        cart_activities = CartActivity.objects.filter(
-            timestamp__date__gte=start_date,
-            timestamp__date__lte=end_date
-        ).count()
-        
-        data = {
-            'acquisition_channels': acquisition_data,
-            'customer_lifetime_value': float(customer_lifetime_value['avg_lifetime_value'] or 0),
-            'repeat_customer_rate': round(repeat_rate, 2),
-            'total_customers': total_customers,
-            'repeat_customers': repeat_customers,
-            'engagement_metrics': {
-                'page_views': total_page_views,
-                'product_clicks': total_product_clicks,
-                'cart_activities': cart_activities,
-            }
-        }
+        # Acquisition channels, the range's customer cohort and engagement counts
+        data = compute_report(build_spec('customer_behavior', time_serializer.validated_data))
         
         serializer = CustomerBehaviorResponseSerializer({
             'data': data
@@ -287,59 +115,152 @@ class EngagementMetricsView(APIView):
     def get(self, request):
         time_serializer = TimeRangeSerializer(data=request.query_params)
         time_serializer.is_valid(raise_exception=True)
-        time_data = time_serializer.validated_data
-        
-        start_date = time_data['start_date']
-        end_date = time_data['end_date']
         
-        # Page views by day
-        daily_page_views = []
-        current_date = start_date
+        data = compute_report(build_spec('engagement_metrics', time_serializer.validated_data))
         
-        while current_date <= end_date:
-            views_count = PageView.objects.filter(
-                timestamp__date=current_date
-            ).count()
-            
-            daily_page_views.append({
-                'date': current_date,
-                'views': views_count,
-            })
-            
-            current_date += timedelta(days=1)
+        return Response(data)
+
+class ReportJobListView(APIView):
+    """Submit a report to compute in the background; list recent report jobs
+    
+    POST {"report": "sales_overview", "period": "year", ...} returns the job
+    (202 while queued or running, 200 when a fresh cached result exists).
+    Poll GET /reports/<id>/ for progress and the result.
+    """
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        jobs = ReportJob.objects.defer('result')[:50]
+        serializer = ReportJobSerializer(jobs, many=True)
+        return Response({'results': serializer.data})
+    
+    def post(self, request):
+        request_serializer = ReportRequestSerializer(data=request.data)
+        request_serializer.is_valid(raise_exception=True)
+        query = request_serializer.validated_data
         
-        # Most viewed products
-        popular_products = ProductClick.objects.filter(
-            timestamp__date__gte=start_date,
-            timestamp__date__lte=end_date
-        ).values(
-            'product__name'
-        ).annotate(
-            click_count=Count('id')
-        ).order_by('-click_count')[:10]
+        job, _ = submit_report(build_spec(query['report'], query), user=request.user)
         
-        # Cart conversion rate
-        cart_adds = CartActivity.objects.filter(
-            timestamp__date__gte=start_date,
-            timestamp__date__lte=end_date,
-            action='add'
-        ).count()
+        return Response(
+            ReportJobSerializer(job).data,
+            status=status.HTTP_200_OK if job.status == 'completed' else status.HTTP_202_ACCEPTED
+        )
+
+class ReportJobDetailView(APIView):
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request, job_id):
+        job = ReportJob.objects.filter(pk=job_id).first()
+        if job is None:
+            return Response({'error': 'Report job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(ReportJobSerializer(job).data)
+
+class UniqueVisitorsView(APIView):
+    """Estimated unique visitors per day and for the whole range, site-wide or for ?product=<id>"""
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        time_serializer = TimeRangeSerializer(data=request.query_params)
+        time_serializer.is_valid(raise_exception=True)
+        time_data = time_serializer.validated_data
         
-        purchases = OrderItem.objects.filter(
-            order__created_at__date__gte=start_date,
-            order__created_at__date__lte=end_date
-        ).count()
+        daily, total = daily_unique_visitors(
+            time_data['start_date'], time_data['end_date'], product=time_data.get('product')
+        )
         
-        conversion_rate = (purchases / cart_adds * 100) if cart_adds > 0 else 0
+        return Response({
+            'product': time_data.get('product'),
+            'unique_visitors': total,
+            'daily': daily,
+        })
+
+class FunnelView(APIView):
+    """Per-step visitors and drop-off for ?steps=page_view,product_view,add_to_cart,purchase"""
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        serializer = FunnelQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+        
+        window = query.get('window_hours')
+        steps = get_funnel(
+            query['steps'],
+            query['start_date'],
+            query['end_date'],
+            product=query.get('product'),
+            window=timedelta(hours=window) if window else None,
+        )
         
-        data = {
-            'daily_engagement': daily_page_views,
-            'popular_products': list(popular_products),
-            'conversion_metrics': {
-                'cart_adds': cart_adds,
-                'purchases': purchases,
-                'conversion_rate': round(conversion_rate, 2)
-            }
-        }
+        return Response({
+            'start_date': query['start_date'],
+            'end_date': query['end_date'],
+            'product': query.get('product'),
+            'window_hours': window,
+            'steps': steps,
+        })
+
+class OptionalJWTAuthentication(JWTAuthentication):
+    """JWT auth that treats a missing, expired or invalid token as anonymous"""
+    
+    def authenticate(self, request):
+        try:
+            return super().authenticate(request)
+        except (AuthenticationFailed, InvalidToken):
+            return None
+
+class TrackEventView(APIView):
+    """Storefront event ingestion (frontend/lib/analytics.ts)
+
+    Accepts a single event, a list of events or {"events": [...]}. Valid
+    events are buffered and written in bulk by analytics.ingest; malformed
+    ones are counted and skipped so one bad event never fails a batch.
+    Events are keyed to the payload's session_id and, when the storefront
+    forwards its access token, to the signed-in user; a stale token never
+    fails tracking.
+    """
+    authentication_classes = [OptionalJWTAuthentication]
+    permission_classes = [AllowAny]
+    
+    def post(self, request):
+        payload = request.data
+        # A batch may carry one session_id for all its events; each event may also carry its own
+        batch_session = session_id(payload, request.COOKIES.get(settings.SESSION_COOKIE_NAME, ''))
+        if isinstance(payload, dict) and 'events' in payload:
+            payload = payload['events']
+        events = payload if isinstance(payload, list) else [payload]
+        
+        max_batch = getattr(settings, 'ANALYTICS_MAX_BATCH', 500)
+        if len(events) > max_batch:
+            return Response(
+                {'error': f'At most {max_batch} events per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        return Response(data)
\ No newline at end of file
+        user_id = request.user.pk if request.user.is_authenticated else None
+        ip_address = request.META.get('REMOTE_ADDR') or None
+        
+        accepted, touches, rejected, ignored = [], [], 0, 0
+        for raw in events:
+            session_key = session_id(raw, batch_session)
+            try:
+                event = build_event(raw, user_id=user_id, session_key=session_key, ip_address=ip_address)
+            except InvalidEvent:
+                rejected += 1
+                continue
+            if event is None:
+                ignored += 1
+                continue
+            accepted.append(event)
+            touch = build_landing_touch(raw, user_id=user_id, session_key=session_key)
+            if touch is not None:
+                touches.append(touch)
+        
+        if accepted:
+            event_buffer.add(accepted + touches)
+        
+        return Response(
+            {'accepted': len(accepted), 'ignored': ignored, 'rejected': rejected},
+            status=status.HTTP_202_ACCEPTED if accepted or not rejected else status.HTTP_400_BAD_REQUEST
+        )
+
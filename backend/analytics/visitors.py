@@ -0,0 +1,141 @@
+"""
+Unique-visitor counts from per-day HyperLogLog sketches.
+
+Every page view feeds two sketches for its local calendar day: the site-wide
+one (product is null) and, for product pages, the product's. Ingestion
+(analytics.ingest) folds each flushed batch into the stored sketches, and
+``rebuild_sketches`` recomputes a range from the raw PageView table. Unique
+visitors over any range is the estimate of the merged daily sketches --
+a few KB read per day instead of a COUNT(DISTINCT) over every page view.
+
+A visitor is the signed-in user, else the session key, else the IP address.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .hll import HyperLogLog
+from .models import PageView, VisitorSketch
+from .rollups import date_range, day_bounds, purged_before
+
+
+def visitor_key(user_id=None, session_key='', ip_address=None):
+    if user_id:
+        return f'u:{user_id}'
+    if session_key:
+        return f's:{session_key}'
+    if ip_address:
+        return f'ip:{ip_address}'
+    return None
+
+
+def sketch_page_views(page_views):
+    """Build ``{(date, product_id or None): HyperLogLog}`` from PageView rows or instances"""
+    sketches = defaultdict(HyperLogLog)
+    for view in page_views:
+        key = visitor_key(view.user_id, view.session_key, view.ip_address)
+        if key is None:
+            continue
+        day = timezone.localdate(view.timestamp)
+        sketches[(day, None)].add(key)
+        if view.product_id is not None:
+            sketches[(day, view.product_id)].add(key)
+    return sketches
+
+
+def _scope_filter(keys):
+    scopes = Q()
+    for day, product_id in keys:
+        if product_id is None:
+            scopes |= Q(date=day, product__isnull=True)
+        else:
+            scopes |= Q(date=day, product_id=product_id)
+    return scopes
+
+
+def merge_sketches(sketches, retries=1):
+    """Fold in-memory sketches into the stored ones (read, merge, write under row locks)"""
+    if not sketches:
+        return 0
+    try:
+        with transaction.atomic():
+            existing = {
+                (row.date, row.product_id): row
+                for row in VisitorSketch.objects.select_for_update().filter(_scope_filter(sketches))
+            }
+            updated, created = [], []
+            for (day, product_id), sketch in sketches.items():
+                row = existing.get((day, product_id))
+                if row is None:
+                    created.append(VisitorSketch(date=day, product_id=product_id, registers=sketch.to_bytes()))
+                    continue
+                merged = HyperLogLog.from_bytes(row.registers).merge(sketch)
+                row.registers = merged.to_bytes()
+                row.updated_at = timezone.now()
+                updated.append(row)
+            VisitorSketch.objects.bulk_update(updated, ['registers', 'updated_at'])
+            VisitorSketch.objects.bulk_create(created)
+    except IntegrityError:
+        # Another worker created one of the rows first; its sketch is there to merge into now
+        if not retries:
+            raise
+        return merge_sketches(sketches, retries=retries - 1)
+    return len(sketches)
+
+
+def record_page_views(page_views):
+    """Ingestion hook: add a batch of saved page views to the stored sketches"""
+    return merge_sketches(sketch_page_views(page_views))
+
+
+def rebuild_sketches(start, end, chunk_size=5000):
+    """Recompute the sketches for ``start``..``end`` from the PageView table
+
+    Days whose page views were purged keep their stored sketches.
+    """
+    kept = purged_before()
+    if kept:
+        start = max(start, kept)
+    if start > end:
+        return 0
+    lower, upper = day_bounds(start, end)
+    page_views = PageView.objects.filter(timestamp__gte=lower, timestamp__lt=upper).only(
+        'user_id', 'session_key', 'ip_address', 'product_id', 'timestamp'
+    )
+    sketches = sketch_page_views(page_views.iterator(chunk_size=chunk_size))
+    with transaction.atomic():
+        VisitorSketch.objects.filter(date__gte=start, date__lte=end).delete()
+        VisitorSketch.objects.bulk_create([
+            VisitorSketch(date=day, product_id=product_id, registers=sketch.to_bytes())
+            for (day, product_id), sketch in sketches.items()
+        ], batch_size=500)
+    return len(sketches)
+
+
+def _stored_sketches(start, end, product=None):
+    rows = VisitorSketch.objects.filter(date__gte=start, date__lte=end)
+    if product is None:
+        rows = rows.filter(product__isnull=True)
+    else:
+        rows = rows.filter(product=product)
+    return rows.values_list('date', 'registers')
+
+
+def unique_visitors(start, end, product=None):
+    """Estimated distinct visitors over ``start``..``end``, site-wide or for one product"""
+    return HyperLogLog.union(
+        HyperLogLog.from_bytes(registers) for _, registers in _stored_sketches(start, end, product)
+    ).count()
+
+
+def daily_unique_visitors(start, end, product=None):
+    """Per-day estimates plus the estimate for the whole range, from one range read"""
+    by_day = {day: HyperLogLog.from_bytes(registers) for day, registers in _stored_sketches(start, end, product)}
+    daily = [
+        {'date': day, 'unique_visitors': by_day[day].count() if day in by_day else 0}
+        for day in date_range(start, end)
+    ]
+    return daily, HyperLogLog.union(by_day.values()).count()
+
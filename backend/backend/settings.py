@@ -163,6 +163,71 @@ MPESA_CONSUMER_SECRET = os.getenv('MPESA_CONSUMER_SECRET', '')
 MPESA_BUSINESS_SHORTCODE = os.getenv('MPESA_BUSINESS_SHORTCODE', '')
 MPESA_PASSKEY = os.getenv('MPESA_PASSKEY', '')
 MPESA_CALLBACK_URL = os.getenv('MPESA_CALLBACK_URL', 'https://yourdomain.com/api/payments/mpesa/callback/')
+MPESA_TIMEOUT = int(os.getenv('MPESA_TIMEOUT', '30'))
+
+# Local payment provider simulator (payments/simulator.py). When set, the M-Pesa and
+# card gateways send their API calls to it instead of the real providers.
+PAYMENT_SIMULATOR_URL = os.getenv('PAYMENT_SIMULATOR_URL', '')
+PAYMENT_GATEWAY_TIMEOUT = int(os.getenv('PAYMENT_GATEWAY_TIMEOUT', '30'))
+
+# Circuit breaker / bulkhead around provider calls (payments/resilience.py). The breaker
+# state is kept in the cache, so configure a shared CACHES backend to trip it across workers.
+PAYMENT_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('PAYMENT_CIRCUIT_FAILURE_THRESHOLD', '5'))
+PAYMENT_CIRCUIT_FAILURE_WINDOW = int(os.getenv('PAYMENT_CIRCUIT_FAILURE_WINDOW', '60'))
+PAYMENT_CIRCUIT_RESET_TIMEOUT = int(os.getenv('PAYMENT_CIRCUIT_RESET_TIMEOUT', '30'))
+PAYMENT_GATEWAY_MAX_CONCURRENT = int(os.getenv('PAYMENT_GATEWAY_MAX_CONCURRENT', '10'))
+PAYMENT_GATEWAY_ACQUIRE_TIMEOUT = float(os.getenv('PAYMENT_GATEWAY_ACQUIRE_TIMEOUT', '0.5'))
+
+# M-Pesa status push channel (payments/events.py)
+PAYMENT_STATUS_TOKEN_MAX_AGE = int(os.getenv('PAYMENT_STATUS_TOKEN_MAX_AGE', '3600'))
+PAYMENT_STATUS_STREAM_TIMEOUT = int(os.getenv('PAYMENT_STATUS_STREAM_TIMEOUT', '300'))
+PAYMENT_STATUS_POLL_INTERVAL = float(os.getenv('PAYMENT_STATUS_POLL_INTERVAL', '1.0'))
+
+# Concurrent gateway calls per bulk refund request (payments/bulk_refunds.py)
+BULK_REFUND_MAX_WORKERS = int(os.getenv('BULK_REFUND_MAX_WORKERS', '8'))
+
+# Cached admin dashboard snapshot (analytics/dashboard.py)
+DASHBOARD_STATS_TTL = int(os.getenv('DASHBOARD_STATS_TTL', '300'))
+DASHBOARD_STATS_MIN_REFRESH = int(os.getenv('DASHBOARD_STATS_MIN_REFRESH', '10'))
+
+# Storefront event ingestion buffer (analytics/ingest.py), per worker process
+ANALYTICS_BUFFER_SIZE = int(os.getenv('ANALYTICS_BUFFER_SIZE', '500'))
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv('ANALYTICS_FLUSH_INTERVAL', '1.0'))
+ANALYTICS_BUFFER_MAX_PENDING = int(os.getenv('ANALYTICS_BUFFER_MAX_PENDING', '50000'))
+ANALYTICS_MAX_BATCH = int(os.getenv('ANALYTICS_MAX_BATCH', '500'))
+
+# Cached funnel results (analytics/funnels.py)
+FUNNEL_CACHE_TTL = int(os.getenv('FUNNEL_CACHE_TTL', '600'))
+
+# In-memory order cube for the analytics views (analytics/cube.py); needs numpy
+ANALYTICS_CUBE_ENABLED = os.getenv('ANALYTICS_CUBE_ENABLED', 'False') == 'True'
+ANALYTICS_CUBE_REFRESH_INTERVAL = int(os.getenv('ANALYTICS_CUBE_REFRESH_INTERVAL', '30'))
+ANALYTICS_CUBE_REBUILD_INTERVAL = int(os.getenv('ANALYTICS_CUBE_REBUILD_INTERVAL', '3600'))
+
+# Trending products (analytics/trending.py)
+TRENDING_HALF_LIFE_HOURS = float(os.getenv('TRENDING_HALF_LIFE_HOURS', '24'))
+TRENDING_SYNC_INTERVAL = int(os.getenv('TRENDING_SYNC_INTERVAL', '60'))
+
+# Order acquisition attribution (analytics/attribution.py): last_touch or first_touch
+ATTRIBUTION_MODEL = os.getenv('ATTRIBUTION_MODEL', 'last_touch')
+ATTRIBUTION_WINDOW_DAYS = int(os.getenv('ATTRIBUTION_WINDOW_DAYS', '30'))
+
+# Background analytics report jobs (analytics/reports.py). REPORT_WORKERS threads per
+# process run submitted jobs; set it to 0 to leave them to the run_report_jobs command.
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', '2'))
+REPORT_CHUNK_DAYS = int(os.getenv('REPORT_CHUNK_DAYS', '31'))
+REPORT_CACHE_TTL = int(os.getenv('REPORT_CACHE_TTL', '86400'))
+REPORT_LIVE_CACHE_TTL = int(os.getenv('REPORT_LIVE_CACHE_TTL', '300'))
+REPORT_JOB_TIMEOUT = int(os.getenv('REPORT_JOB_TIMEOUT', '1800'))
+
+# Fraction of raw analytics events kept for ?approx=true queries (analytics/sampling.py)
+ANALYTICS_SAMPLE_RATE = float(os.getenv('ANALYTICS_SAMPLE_RATE', '0.01'))
+
+# Cart sessions quiet this long without an order are abandoned (analytics/abandoned_carts.py)
+ABANDONED_CART_WINDOW_MINUTES = int(os.getenv('ABANDONED_CART_WINDOW_MINUTES', '60'))
+
+# Cached first page of each product's review feed (reviews/feed.py); dropped on review changes
+REVIEW_FEED_CACHE_TTL = int(os.getenv('REVIEW_FEED_CACHE_TTL', '3600'))
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -1,4 +1,4 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 from rest_framework.response import Response
 
 class StandardResultsSetPagination(PageNumberPagination):
@@ -23,3 +23,10 @@ class LargeResultsSetPagination(StandardResultsSetPagination):
 class SmallResultsSetPagination(StandardResultsSetPagination):
     page_size = 10
     max_page_size = 50
+
+class NewestFirstCursorPagination(CursorPagination):
+    """Keyset pagination on (created_at, id), newest first; needs an index ending in those columns"""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    ordering = ('-created_at', '-id')
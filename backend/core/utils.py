@@ -11,6 +11,13 @@ class CacheKeys:
     FEATURED_PRODUCTS = 'featured_products'
     USER_SESSION = 'user_session_{}'
     SEARCH_SUGGESTIONS = 'search_suggestions_{}'
+    MPESA_TRANSACTION_STATUS = 'mpesa_transaction_status_{}'
+    PAYMENT_CIRCUIT = 'payment_circuit_{}_{}'
+    DASHBOARD_STATS = 'dashboard_stats'
+    DASHBOARD_STATS_REFRESH = 'dashboard_stats_refresh'
+    DASHBOARD_STATS_STALE = 'dashboard_stats_stale'
+    FUNNEL = 'funnel_{}'
+    REVIEW_FEED = 'review_feed_{}'
 
 def cache_result(key, timeout=300):
     """Decorator to cache function results"""
@@ -66,7 +66,8 @@ class OrderAdmin(admin.ModelAdmin):
     list_filter = ('status', 'payment_status', 'created_at', 'payment_method', 'shipping_country')
     search_fields = ('order_number', 'user__email', 'user__username', 'shipping_first_name', 'shipping_last_name')
     readonly_fields = (
-        'order_number', 'created_at', 'updated_at', 'paid_at', 'shipped_at', 'delivered_at',
+        'order_number', 'latest_payment', 'amount_paid',
+        'created_at', 'updated_at', 'paid_at', 'shipped_at', 'delivered_at',
         'order_summary', 'customer_info', 'shipping_info', 'payment_info', 'timeline'
     )
     list_per_page = 25
@@ -188,6 +189,7 @@ class OrderAdmin(admin.ModelAdmin):
         payment_details = [
             f"<strong>Method:</strong> {obj.payment_method}",
             f"<strong>Status:</strong> {obj.get_payment_status_display()}",
+            f"<strong>Amount paid:</strong> ${number_format(obj.amount_paid, 2)}",
             f"<strong>Transaction ID:</strong> {obj.payment_transaction_id or 'Not available'}"
         ]
         if obj.paid_at:
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from analytics.customers import schedule_customer_refresh
+from orders.models import Order
+from orders.payment_state import METRIC_FIELDS, STATE_FIELDS, iter_payment_state_drift
+
+
+class Command(BaseCommand):
+    help = (
+        'Verify the denormalized payment state on orders (payment_status, latest_payment, '
+        'amount_paid, paid_at) against their payments and refunds, and optionally repair drift'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Write the recomputed state back')
+        parser.add_argument('--batch-size', type=int, default=500, help='Orders written per bulk update')
+        parser.add_argument('--order', action='append', dest='orders', help='Only check this order number')
+        parser.add_argument('--verbose-drift', action='store_true', help='Print every drifted order')
+
+    def handle(self, *args, **options):
+        queryset = Order.objects.all()
+        if options['orders']:
+            queryset = queryset.filter(order_number__in=options['orders'])
+
+        batch = []
+        drifted = 0
+        for order, before, changed in iter_payment_state_drift(queryset):
+            drifted += 1
+            if options['verbose_drift']:
+                after = {**before, **{field: getattr(order, field) for field in changed}}
+                after['latest_payment'] = order.latest_payment_id
+                details = ', '.join(f"{field}: {before[field]} -> {after[field]}" for field in changed)
+                self.stdout.write(f"  {order.order_number}: {details}")
+
+            if options['repair']:
+                batch.append((order, changed))
+                if len(batch) >= options['batch_size']:
+                    self.flush(batch)
+                    batch = []
+        if batch:
+            self.flush(batch)
+
+        total = queryset.count()
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS(f"All {total} orders are consistent with their payments"))
+        elif options['repair']:
+            self.stdout.write(self.style.SUCCESS(f"Repaired {drifted} of {total} orders"))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f"{drifted} of {total} orders have drifted; run with --repair to fix them"
+            ))
+
+    def flush(self, batch):
+        now = timezone.now()
+        for order, _ in batch:
+            order.updated_at = now
+        with transaction.atomic():
+            Order.objects.bulk_update([order for order, _ in batch], STATE_FIELDS + ['updated_at'])
+            schedule_customer_refresh(order.user_id for order, changed in batch if METRIC_FIELDS & set(changed))
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_payment_state'),
+        ('payments', '0004_payment_ledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='orders_orde_created_0e92de_idx'),
+        ),
+    ]
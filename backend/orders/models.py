@@ -1,8 +1,10 @@
 # backend/orders/models.py
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from django.core.validators import MinValueValidator
 from products.models import Product, ProductVariant
 from users.models import User
+from .payment_state import STATE_FIELDS, annotate_payment_state, apply_payment_state
 
 class Order(models.Model):
     ORDER_STATUS = [
@@ -41,6 +43,11 @@ class Order(models.Model):
     # Payment information
     payment_method = models.CharField(max_length=50)
     payment_transaction_id = models.CharField(max_length=100, blank=True)
+    # Denormalized from payments/refunds; see orders.payment_state
+    latest_payment = models.ForeignKey(
+        'payments.Payment', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    amount_paid = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     
     # Pricing
     subtotal = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
@@ -57,6 +64,9 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
 
     def __str__(self):
         return f"Order {self.order_number}"
@@ -64,30 +74,35 @@ class Order(models.Model):
     def save(self, *args, **kwargs):
         if not self.order_number:
             self.order_number = self.generate_order_number()
+        adding = self._state.adding
         super().save(*args, **kwargs)
+        if adding:
+            from analytics.attribution import schedule_attribution
+            from analytics.dashboard import mark_dashboard_stale
+            transaction.on_commit(mark_dashboard_stale)
+            schedule_attribution(self.pk)
 
     def generate_order_number(self):
         import random
         import string
         return f"ORD-{''.join(random.choices(string.ascii_uppercase + string.digits, k=8))}"
 
-    @property
-    def latest_payment(self):
-        return self.payments.order_by('-created_at').first()
-    
     def update_payment_status(self):
-        """Update payment status based on associated payments"""
-        latest_payment = self.latest_payment
-        if latest_payment:
-            if latest_payment.status == 'completed':
-                self.payment_status = 'paid'
-            elif latest_payment.status == 'refunded':
-                self.payment_status = 'refunded'
-            elif latest_payment.status == 'partially_refunded':
-                self.payment_status = 'partially_refunded'
-            elif latest_payment.status == 'failed':
-                self.payment_status = 'failed'
-            self.save()
+        """Recompute payment_status, latest_payment and amount_paid from the order's payments"""
+        with transaction.atomic():
+            current = annotate_payment_state(
+                Order.objects.select_for_update().only('pk', 'updated_at', *STATE_FIELDS)
+            ).get(pk=self.pk)
+            changed = apply_payment_state(current, timezone.now())
+            if changed:
+                current.save(update_fields=changed + ['updated_at'])
+            if {'payment_status', 'amount_paid'} & set(changed):
+                from analytics.customers import schedule_customer_refresh
+                schedule_customer_refresh([self.user_id])
+
+        for attname in ('payment_status', 'latest_payment_id', 'amount_paid', 'paid_at', 'updated_at'):
+            setattr(self, attname, getattr(current, attname))
+        return changed
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
@@ -0,0 +1,129 @@
+"""
+Denormalized payment state on Order.
+
+``Order.payment_status``, ``Order.latest_payment`` and ``Order.amount_paid``
+are derived from the order's Payment and Refund rows. They are kept in step
+transactionally by ``Order.update_payment_status`` (called from
+``Payment.save`` / ``Refund.save``) and can be recomputed in bulk with
+``sync_payment_state`` (bulk refunds, admin actions, drift repair). Either
+way, customers whose paid amount or status changed get their lifetime
+metrics refreshed on commit.
+"""
+from decimal import Decimal
+
+from django.apps import apps
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+# Payment statuses that mean money was received for the order
+SETTLED_PAYMENT_STATUSES = ('completed', 'refunded', 'partially_refunded')
+
+# Latest payment status -> order payment status; other statuses leave it unchanged
+PAYMENT_STATUS_MAP = {
+    'completed': 'paid',
+    'refunded': 'refunded',
+    'partially_refunded': 'partially_refunded',
+    'failed': 'failed',
+}
+
+STATE_FIELDS = ['payment_status', 'latest_payment', 'amount_paid', 'paid_at']
+# Changes to these fields affect the customer's lifetime metrics
+METRIC_FIELDS = {'payment_status', 'amount_paid'}
+
+
+def _money(subquery):
+    return Coalesce(
+        Subquery(subquery, output_field=DecimalField(max_digits=10, decimal_places=2)),
+        Value(Decimal('0.00')),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+def annotate_payment_state(queryset):
+    """Annotate orders with the payment state derived from their payments and refunds"""
+    Payment = apps.get_model('payments', 'Payment')
+    Refund = apps.get_model('payments', 'Refund')
+
+    latest = Payment.objects.filter(order=OuterRef('pk')).order_by('-created_at')
+    paid = Payment.objects.filter(
+        order=OuterRef('pk'), status__in=SETTLED_PAYMENT_STATUSES
+    ).values('order').annotate(total=Sum('amount')).values('total')
+    refunded = Refund.objects.filter(
+        payment__order=OuterRef('pk'), status='completed'
+    ).values('payment__order').annotate(total=Sum('amount')).values('total')
+
+    return queryset.annotate(
+        expected_latest_payment_id=Subquery(latest.values('id')[:1]),
+        expected_latest_payment_status=Subquery(latest.values('status')[:1]),
+        expected_processed_at=Subquery(latest.values('processed_at')[:1]),
+        expected_paid=_money(paid),
+        expected_refunded=_money(refunded),
+    )
+
+
+def apply_payment_state(order, now):
+    """Copy the annotated state onto ``order`` and return the names of the fields that changed"""
+    changed = []
+
+    if order.latest_payment_id != order.expected_latest_payment_id:
+        order.latest_payment_id = order.expected_latest_payment_id
+        changed.append('latest_payment')
+
+    amount_paid = order.expected_paid - order.expected_refunded
+    if order.amount_paid != amount_paid:
+        order.amount_paid = amount_paid
+        changed.append('amount_paid')
+
+    payment_status = PAYMENT_STATUS_MAP.get(order.expected_latest_payment_status, order.payment_status)
+    if order.payment_status != payment_status:
+        order.payment_status = payment_status
+        changed.append('payment_status')
+
+    if payment_status == 'paid' and not order.paid_at:
+        order.paid_at = order.expected_processed_at or now
+        changed.append('paid_at')
+
+    return changed
+
+
+def iter_payment_state_drift(queryset, chunk_size=1000):
+    """Yield ``(order, before, changed)`` for every order whose stored payment state has drifted"""
+    now = timezone.now()
+    orders = annotate_payment_state(
+        queryset.only('pk', 'order_number', 'user_id', 'updated_at', *STATE_FIELDS)
+    ).order_by('pk')
+    for order in orders.iterator(chunk_size=chunk_size):
+        before = {
+            'payment_status': order.payment_status,
+            'latest_payment': order.latest_payment_id,
+            'amount_paid': order.amount_paid,
+            'paid_at': order.paid_at,
+        }
+        changed = apply_payment_state(order, now)
+        if changed:
+            yield order, before, changed
+
+
+def sync_payment_state(queryset, batch_size=500):
+    """Recompute and store payment state for ``queryset`` with batched bulk updates; returns orders fixed"""
+    from analytics.customers import schedule_customer_refresh
+    Order = queryset.model
+    now = timezone.now()
+    batch = []
+    customers = set()
+    fixed = 0
+    for order, _, changed in iter_payment_state_drift(queryset):
+        order.updated_at = now
+        batch.append(order)
+        if METRIC_FIELDS & set(changed):
+            customers.add(order.user_id)
+        if len(batch) >= batch_size:
+            Order.objects.bulk_update(batch, STATE_FIELDS + ['updated_at'])
+            fixed += len(batch)
+            batch = []
+    if batch:
+        Order.objects.bulk_update(batch, STATE_FIELDS + ['updated_at'])
+        fixed += len(batch)
+    schedule_customer_refresh(customers)
+    return fixed
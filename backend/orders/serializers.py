@@ -38,11 +38,11 @@ class OrderSerializer(serializers.ModelSerializer):
                  'status', 'payment_status', 'shipping_first_name', 
                  'shipping_last_name', 'shipping_address', 'shipping_city',
                  'shipping_state', 'shipping_zip_code', 'shipping_country',
-                 'shipping_phone', 'payment_method', 'subtotal', 'shipping_cost',
-                 'tax_amount', 'total', 'items', 'created_at', 'updated_at',
-                 'paid_at', 'shipped_at', 'delivered_at')
-        read_only_fields = ('id', 'order_number', 'created_at', 'updated_at',
-                          'paid_at', 'shipped_at', 'delivered_at')
+                 'shipping_phone', 'payment_method', 'latest_payment', 'amount_paid',
+                 'subtotal', 'shipping_cost', 'tax_amount', 'total', 'items',
+                 'created_at', 'updated_at', 'paid_at', 'shipped_at', 'delivered_at')
+        read_only_fields = ('id', 'order_number', 'payment_status', 'latest_payment', 'amount_paid',
+                          'created_at', 'updated_at', 'paid_at', 'shipped_at', 'delivered_at')
     
     def get_user_full_name(self, obj):
         return f"{obj.user.first_name} {obj.user.last_name}"
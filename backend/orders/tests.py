@@ -1,3 +1,108 @@
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+
+from analytics.models import CustomerMetrics
+from payments.models import Payment, Refund
+from users.models import User
+from .models import Order
+from .payment_state import iter_payment_state_drift, sync_payment_state
+
+
+def create_order(user, total=Decimal('100.00')):
+    return Order.objects.create(
+        user=user, shipping_first_name='A', shipping_last_name='B', shipping_address='1 Main St',
+        shipping_city='Nairobi', shipping_state='NRB', shipping_zip_code='00100', payment_method='card',
+        subtotal=total, shipping_cost=0, tax_amount=0, total=total,
+    )
+
+
+class PaymentStateTests(TestCase):
+    """Order.payment_status, latest_payment and amount_paid follow the payments and refunds"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='shopper@example.com', username='shopper', password='x')
+
+    def setUp(self):
+        self.order = create_order(self.user)
+
+    def pay(self, amount='100.00', status='completed'):
+        return Payment.objects.create(
+            order=self.order, user=self.user, amount=Decimal(amount), status=status,
+            processed_at=timezone.now() if status == 'completed' else None,
+        )
+
+    def assertState(self, payment_status, amount_paid, latest_payment):
+        self.order.refresh_from_db()
+        self.assertEqual(
+            (self.order.payment_status, self.order.amount_paid, self.order.latest_payment_id),
+            (payment_status, Decimal(amount_paid), latest_payment.pk),
+        )
+
+    def test_completed_payment_marks_the_order_paid(self):
+        payment = self.pay()
+
+        self.assertState('paid', '100.00', payment)
+        self.assertEqual(self.order.paid_at, payment.processed_at)
+
+    def test_pending_payment_changes_nothing_until_it_completes(self):
+        payment = self.pay(status='pending')
+        self.assertState('pending', '0.00', payment)
+
+        payment.status = 'completed'
+        payment.save()
+        self.assertState('paid', '100.00', payment)
+
+    def test_completed_refund_reduces_amount_paid(self):
+        payment = self.pay()
+        refund = Refund.objects.create(payment=payment, amount=Decimal('30.00'), status='pending')
+        self.assertState('paid', '100.00', payment)
+
+        refund.status = 'completed'
+        refund.save()
+        payment.status = 'partially_refunded'
+        payment.save()
+        self.assertState('partially_refunded', '70.00', payment)
+
+    def test_latest_failed_payment_keeps_settled_amounts(self):
+        self.pay('40.00')
+        retry = self.pay('60.00', status='failed')
+
+        self.assertState('failed', '40.00', retry)
+
+    def test_sync_repairs_drift_and_refreshes_customers(self):
+        payment = self.pay()
+        other = create_order(self.user)
+        Order.objects.filter(pk=self.order.pk).update(payment_status='pending', amount_paid=0, latest_payment=None)
+
+        drift = list(iter_payment_state_drift(Order.objects.all()))
+        self.assertEqual([(order.pk, sorted(changed)) for order, _, changed in drift], [
+            (self.order.pk, ['amount_paid', 'latest_payment', 'payment_status']),
+        ])
+
+        with mock.patch('analytics.customers.schedule_customer_refresh') as refresh:
+            self.assertEqual(sync_payment_state(Order.objects.filter(pk__in=[self.order.pk, other.pk])), 1)
+        refresh.assert_called_once_with({self.user.pk})
+        self.assertState('paid', '100.00', payment)
+        self.assertEqual(list(iter_payment_state_drift(Order.objects.all())), [])
+
+    def test_check_order_payments_reports_and_repairs(self):
+        payment = self.pay()
+        Order.objects.filter(pk=self.order.pk).update(amount_paid=0)
+
+        out = StringIO()
+        call_command('check_order_payments', '--verbose-drift', stdout=out)
+        self.assertIn(f'{self.order.order_number}: amount_paid: 0.00 -> 100', out.getvalue())
+        self.assertIn('1 of 1 orders have drifted', out.getvalue())
+        self.assertState('paid', '0.00', payment)
 
-# Create your tests here.
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('check_order_payments', '--repair', stdout=StringIO())
+        self.assertState('paid', '100.00', payment)
+        # The repair refreshes the customer's lifetime metrics like any other payment change
+        self.assertEqual(CustomerMetrics.objects.get(user=self.user).total_spent, Decimal('100.00'))
@@ -1,8 +1,15 @@
 from django.contrib import admin
+from django.db import transaction
 from django.utils.html import format_html
 from django.utils import timezone
 from django.utils.formats import number_format
-from .models import PaymentMethod, Payment, Refund, Transaction, MpesaTransaction, MpesaCallback
+from orders.models import Order
+from orders.payment_state import sync_payment_state
+from .ledger import post_capture
+from .models import (
+    PaymentMethod, Payment, Refund, Transaction, MpesaTransaction, MpesaCallback,
+    LedgerEntry, PaymentBalance, OrderBalance
+)
 
 # --- Inlines ---
 class TransactionInline(admin.TabularInline):
@@ -190,12 +197,21 @@ class PaymentAdmin(admin.ModelAdmin):
 
     # --- Actions ---
     def mark_as_completed(self, request, queryset):
-        updated = queryset.update(status='completed', processed_at=timezone.now())
-        self.message_user(request, f'{updated} payment(s) were marked as completed.')
+        with transaction.atomic():
+            payments = list(queryset.exclude(status='completed').select_for_update())
+            Payment.objects.filter(pk__in=[payment.pk for payment in payments]).update(
+                status='completed', processed_at=timezone.now()
+            )
+            # The update bypasses Payment.save, so post the captures here (idempotent per payment)
+            for payment in payments:
+                post_capture(payment)
+            sync_payment_state(Order.objects.filter(pk__in={payment.order_id for payment in payments}))
+        self.message_user(request, f'{len(payments)} payment(s) were marked as completed.')
     mark_as_completed.short_description = "Mark selected payments as completed"
 
     def mark_as_failed(self, request, queryset):
         updated = queryset.update(status='failed')
+        sync_payment_state(Order.objects.filter(pk__in=queryset.values('order')))
         self.message_user(request, f'{updated} payment(s) were marked as failed.')
     mark_as_failed.short_description = "Mark selected payments as failed"
 
@@ -336,6 +352,51 @@ class TransactionAdmin(admin.ModelAdmin):
     transaction_details.short_description = 'Transaction Details'
 
 
+# --- Ledger Admin (read-only: entries are append-only) ---
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'posting', 'kind', 'account', 'amount', 'currency', 'order', 'created_at')
+    list_filter = ('kind', 'account', 'currency', 'created_at')
+    search_fields = ('reference', 'posting', 'payment__id', 'order__order_number')
+    list_select_related = ('order',)
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(OrderBalance)
+class OrderBalanceAdmin(admin.ModelAdmin):
+    list_display = ('order', 'captured', 'refunded', 'fees', 'net', 'updated_at')
+    search_fields = ('order__order_number',)
+    list_select_related = ('order',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(PaymentBalance)
+class PaymentBalanceAdmin(admin.ModelAdmin):
+    list_display = ('payment', 'order', 'captured', 'refunded', 'fees', 'net', 'updated_at')
+    search_fields = ('payment__id', 'order__order_number')
+    list_select_related = ('payment', 'order')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 # --- MpesaTransaction Admin ---
 @admin.register(MpesaTransaction)
 class MpesaTransactionAdmin(admin.ModelAdmin):
@@ -0,0 +1,164 @@
+"""
+Bulk refunds for the operations team.
+
+``process_bulk_refunds`` validates every target payment with one locked query
+(plus one for the refunds already claimed against them), creates the Refund
+rows in bulk, calls the gateway concurrently from a bounded worker pool
+(outside any DB transaction, so slow provider calls never hold locks) and then
+applies the outcomes set-wise: bulk refund/transaction writes, one ledger
+batch, one UPDATE per resulting payment status and a bulk order payment-state
+resync.
+"""
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from orders.models import Order
+from orders.payment_state import sync_payment_state
+from .ledger import post_refunds
+from .models import Payment, Refund, Transaction
+from .services import payment_gateway
+
+logger = logging.getLogger(__name__)
+
+REFUNDABLE_PAYMENT_STATUSES = ('completed', 'partially_refunded')
+# Refunds that already claim part of a payment's amount
+OPEN_REFUND_STATUSES = ('pending', 'processing', 'completed')
+
+
+def _validate(items):
+    """Lock the target payments and split items into accepted refunds and rejected results"""
+    payment_ids = {item['payment'] for item in items}
+    payments = {payment.pk: payment for payment in Payment.objects.select_for_update().filter(pk__in=payment_ids)}
+    already_refunded = defaultdict(Decimal, Refund.objects.filter(
+        payment_id__in=payments, status__in=OPEN_REFUND_STATUSES
+    ).values_list('payment_id').annotate(total=Sum('amount')))
+
+    accepted = []
+    results = [None] * len(items)
+    for index, item in enumerate(items):
+        payment = payments.get(item['payment'])
+        if payment is None:
+            results[index] = {'payment': item['payment'], 'status': 'rejected', 'error': 'Payment not found'}
+            continue
+        if payment.status not in REFUNDABLE_PAYMENT_STATUSES:
+            results[index] = {
+                'payment': payment.pk,
+                'status': 'rejected',
+                'error': f'Payment is {payment.status}; only completed payments can be refunded',
+            }
+            continue
+
+        refundable = payment.amount - already_refunded[payment.pk]
+        amount = item.get('amount')
+        if amount is None:
+            amount = refundable
+        if amount <= 0 or amount > refundable:
+            results[index] = {
+                'payment': payment.pk,
+                'status': 'rejected',
+                'error': f'Invalid refund amount; {refundable} is refundable',
+            }
+            continue
+
+        # Later items for the same payment see this refund
+        already_refunded[payment.pk] += amount
+        refund = Refund(payment=payment, amount=amount, reason=item.get('reason', ''), status='processing')
+        accepted.append((index, refund))
+    return accepted, results
+
+
+def _call_gateway(refund):
+    try:
+        return payment_gateway.create_refund(refund), None
+    except Exception as e:
+        logger.error(f"Bulk refund {refund.pk} failed at gateway: {str(e)}")
+        return None, str(e)
+
+
+def process_bulk_refunds(items, max_workers=None):
+    """
+    Refund many payments. ``items`` are dicts with ``payment`` (id), optional
+    ``amount`` (defaults to the remaining refundable amount) and ``reason``.
+    Returns one result dict per item, in input order.
+    """
+    with transaction.atomic():
+        accepted, results = _validate(items)
+        Refund.objects.bulk_create([refund for _, refund in accepted])
+
+    if not accepted:
+        return results
+
+    max_workers = max_workers or getattr(settings, 'BULK_REFUND_MAX_WORKERS', 8)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(accepted))) as executor:
+        outcomes = list(executor.map(_call_gateway, [refund for _, refund in accepted]))
+
+    now = timezone.now()
+    completed = []
+    provider_logs = []
+    for (index, refund), (response, error) in zip(accepted, outcomes):
+        payment = refund.payment
+        if response is None:
+            refund.status = 'failed'
+        else:
+            refund.provider_refund_id = response['id']
+            if response['status'] == 'succeeded':
+                refund.status = 'completed'
+                completed.append(refund)
+            elif response['status'] in ('failed', 'canceled'):
+                refund.status = 'failed'
+                error = f"Provider returned {response['status']}"
+        refund.updated_at = now
+
+        provider_logs.append(Transaction(
+            payment=payment,
+            type='refund',
+            amount=refund.amount,
+            currency=payment.currency,
+            provider_transaction_id=refund.provider_refund_id,
+            provider_data={'status': response['status']} if response else {},
+            success=refund.status == 'completed',
+            error_message=error or '',
+        ))
+        results[index] = {
+            'payment': payment.pk,
+            'refund': refund.pk,
+            'amount': str(refund.amount),
+            'status': refund.status,
+            'provider_refund_id': refund.provider_refund_id,
+            'error': error,
+        }
+
+    # Settled totals per payment decide refunded vs partially_refunded
+    refunded_totals = defaultdict(Decimal)
+    for refund in completed:
+        refunded_totals[refund.payment_id] += refund.amount
+    payments = {refund.payment_id: refund.payment for refund in completed}
+    if payments:
+        for payment_id, total in Refund.objects.filter(
+            payment_id__in=payments, status='completed'
+        ).values_list('payment_id').annotate(total=Sum('amount')):
+            refunded_totals[payment_id] += total
+
+    by_status = defaultdict(list)
+    for payment_id, payment in payments.items():
+        by_status['refunded' if refunded_totals[payment_id] >= payment.amount else 'partially_refunded'].append(payment_id)
+
+    with transaction.atomic():
+        Refund.objects.bulk_update(
+            [refund for _, refund in accepted], ['status', 'provider_refund_id', 'updated_at']
+        )
+        Transaction.objects.bulk_create(provider_logs)
+        post_refunds(completed)
+        for payment_status, payment_ids in by_status.items():
+            Payment.objects.filter(pk__in=payment_ids).update(status=payment_status, updated_at=now)
+        if payments:
+            sync_payment_state(Order.objects.filter(payments__in=list(payments)).distinct())
+
+    return results
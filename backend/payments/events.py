@@ -0,0 +1,150 @@
+"""
+Lightweight pub-sub for M-Pesa transaction status.
+
+The callback view (or anything else that moves a transaction to a new status)
+calls ``publish_transaction_status``. That writes the status snapshot to the
+cache, so waiters in other workers see it on their next cache check, and wakes
+any waiters in this process immediately.
+
+Waiters are plain asyncio events held by ``payment_status_broker``, so a
+waiting client costs one coroutine and an occasional cache read rather than a
+DB query per poll. With the default per-process cache, cross-worker delivery
+needs a shared cache backend (Redis/Memcached) configured in CACHES.
+
+A transaction's status only moves forward (requested, pending, then a final
+status), so a publish never replaces a later status with an earlier one, and
+a subscriber seeding the cache from the DB only writes if nothing has been
+published yet.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+from core.utils import CacheKeys
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('successful', 'failed', 'cancelled')
+STATUS_RANK = {'requested': 0, 'pending': 1, **{status: 2 for status in TERMINAL_STATUSES}}
+STATUS_TOKEN_SALT = 'payments.mpesa-status'
+
+
+def make_status_token(mpesa_transaction):
+    """Signed token that lets the client subscribe without sending its JWT (EventSource can't)"""
+    return signing.dumps({'transaction': mpesa_transaction.id}, salt=STATUS_TOKEN_SALT, compress=True)
+
+
+def read_status_token(token, transaction_id):
+    """Return True if ``token`` was issued for ``transaction_id`` and has not expired"""
+    try:
+        data = signing.loads(
+            token,
+            salt=STATUS_TOKEN_SALT,
+            max_age=getattr(settings, 'PAYMENT_STATUS_TOKEN_MAX_AGE', 3600),
+        )
+    except signing.BadSignature:
+        return False
+    return data.get('transaction') == transaction_id
+
+
+def status_snapshot(mpesa_transaction):
+    return {
+        'transaction_id': mpesa_transaction.id,
+        'status': mpesa_transaction.status,
+        'result_code': mpesa_transaction.result_code,
+        'result_description': mpesa_transaction.result_description,
+        'mpesa_receipt': mpesa_transaction.transaction_id,
+    }
+
+
+class PaymentStatusBroker:
+    """In-process waiter registry backed by the cache for cross-worker delivery"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = {}  # transaction id -> set of (loop, asyncio.Event)
+
+    def cache_key(self, transaction_id):
+        return CacheKeys.MPESA_TRANSACTION_STATUS.format(transaction_id)
+
+    def cache_timeout(self):
+        return getattr(settings, 'PAYMENT_STATUS_CACHE_TIMEOUT', 3600)
+
+    def publish(self, snapshot):
+        transaction_id = snapshot['transaction_id']
+        key = self.cache_key(transaction_id)
+        if not cache.add(key, snapshot, self.cache_timeout()):
+            current = cache.get(key)
+            if current is not None and STATUS_RANK[current['status']] > STATUS_RANK[snapshot['status']]:
+                # A later status is already out; never move subscribers back
+                return
+            cache.set(key, snapshot, self.cache_timeout())
+        with self._lock:
+            waiters = list(self._waiters.get(transaction_id, ()))
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    async def get(self, transaction_id):
+        return await cache.aget(self.cache_key(transaction_id))
+
+    async def seed(self, snapshot):
+        """
+        Cache a snapshot read from the DB unless one has been published
+        meanwhile; returns whichever snapshot the cache now holds.
+        """
+        key = self.cache_key(snapshot['transaction_id'])
+        if await cache.aadd(key, snapshot, self.cache_timeout()):
+            return snapshot
+        return await cache.aget(key) or snapshot
+
+    async def wait(self, transaction_id, since=None, timeout=25):
+        """
+        Wait until the cached status differs from ``since`` or ``timeout`` seconds pass.
+        Returns the latest snapshot (possibly unchanged, possibly None).
+        """
+        poll_interval = getattr(settings, 'PAYMENT_STATUS_POLL_INTERVAL', 1.0)
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._lock:
+            self._waiters.setdefault(transaction_id, set()).add(waiter)
+
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                event.clear()
+                snapshot = await self.get(transaction_id)
+                if snapshot is not None and snapshot.get('status') != since:
+                    return snapshot
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return snapshot
+                try:
+                    # Woken instantly by a local publish; the poll interval only
+                    # bounds latency for publishes from other workers.
+                    await asyncio.wait_for(event.wait(), min(poll_interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(transaction_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[transaction_id]
+
+
+payment_status_broker = PaymentStatusBroker()
+
+
+def publish_transaction_status(mpesa_transaction):
+    """Push the transaction's current status to everyone waiting on it"""
+    try:
+        payment_status_broker.publish(status_snapshot(mpesa_transaction))
+    except Exception as e:
+        # Waiters fall back to their timeout; never fail the caller over a notification
+        logger.error(f"Failed to publish M-Pesa status for {mpesa_transaction.id}: {str(e)}")
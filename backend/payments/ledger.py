@@ -0,0 +1,207 @@
+"""
+Double-entry payment ledger.
+
+Money movements are posted as balanced pairs of LedgerEntry rows and the
+per-payment and per-order running balances are bumped with F() updates in
+the same transaction, so "how much has this order captured/refunded" is a
+single-row read. Postings are idempotent on their reference, so retried
+callbacks and webhooks never double count. ``recompute_balances`` rebuilds
+the balances from the ledger for verification and repair.
+"""
+import logging
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import LedgerEntry, OrderBalance, Payment, PaymentBalance, Refund
+
+logger = logging.getLogger(__name__)
+
+# kind -> (debit account, credit account, balance field)
+POSTING_RULES = {
+    'capture': ('provider', 'customer', 'captured'),
+    'refund': ('customer', 'provider', 'refunded'),
+    'fee': ('fees', 'provider', 'fees'),
+}
+
+BALANCE_FIELDS = ('captured', 'refunded', 'fees')
+
+
+def _post(kind, payment, amount, reference, refund=None):
+    """Write one balanced posting and bump the balances; returns False if it was already posted"""
+    amount = Decimal(amount)
+    if amount <= 0:
+        return False
+
+    debit_account, credit_account, balance_field = POSTING_RULES[kind]
+    posting = uuid.uuid4()
+    common = {
+        'posting': posting,
+        'reference': reference,
+        'kind': kind,
+        'currency': payment.currency,
+        'payment': payment,
+        'order_id': payment.order_id,
+        'refund': refund,
+    }
+
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                LedgerEntry.objects.bulk_create([
+                    LedgerEntry(account=debit_account, amount=amount, **common),
+                    LedgerEntry(account=credit_account, amount=-amount, **common),
+                ])
+        except IntegrityError:
+            logger.info(f"Ledger posting {reference} already recorded")
+            return False
+
+        PaymentBalance.objects.get_or_create(payment_id=payment.pk, defaults={'order_id': payment.order_id})
+        PaymentBalance.objects.filter(payment_id=payment.pk).update(**{balance_field: F(balance_field) + amount})
+        OrderBalance.objects.get_or_create(order_id=payment.order_id)
+        OrderBalance.objects.filter(order_id=payment.order_id).update(**{balance_field: F(balance_field) + amount})
+
+    return True
+
+
+def post_capture(payment):
+    """Record the funds captured for a completed payment"""
+    return _post('capture', payment, payment.amount, f"capture:{payment.pk}")
+
+
+def post_refund(refund):
+    """Record a completed refund against its payment"""
+    return _post('refund', refund.payment, refund.amount, f"refund:{refund.pk}", refund=refund)
+
+
+def post_refunds(refunds):
+    """
+    Record many completed refunds at once: one bulk insert for the entries and
+    one balance update per affected payment and order. Refunds must have
+    ``payment`` loaded and must not have been posted before.
+    """
+    entries = []
+    by_payment = defaultdict(Decimal)
+    by_order = defaultdict(Decimal)
+    for refund in refunds:
+        payment = refund.payment
+        common = {
+            'posting': uuid.uuid4(),
+            'reference': f"refund:{refund.pk}",
+            'kind': 'refund',
+            'currency': payment.currency,
+            'payment_id': payment.pk,
+            'order_id': payment.order_id,
+            'refund_id': refund.pk,
+        }
+        entries.append(LedgerEntry(account='customer', amount=refund.amount, **common))
+        entries.append(LedgerEntry(account='provider', amount=-refund.amount, **common))
+        by_payment[(payment.pk, payment.order_id)] += refund.amount
+        by_order[payment.order_id] += refund.amount
+    if not entries:
+        return 0
+
+    with transaction.atomic():
+        LedgerEntry.objects.bulk_create(entries)
+        PaymentBalance.objects.bulk_create(
+            [PaymentBalance(payment_id=payment_id, order_id=order_id) for payment_id, order_id in by_payment],
+            ignore_conflicts=True,
+        )
+        OrderBalance.objects.bulk_create([OrderBalance(order_id=order_id) for order_id in by_order], ignore_conflicts=True)
+        for (payment_id, _), amount in by_payment.items():
+            PaymentBalance.objects.filter(payment_id=payment_id).update(refunded=F('refunded') + amount)
+        for order_id, amount in by_order.items():
+            OrderBalance.objects.filter(order_id=order_id).update(refunded=F('refunded') + amount)
+    return len(entries) // 2
+
+
+def post_fee(payment, amount, reference):
+    """Record a provider fee charged on a payment (``reference`` should be the provider's fee id)"""
+    return _post('fee', payment, amount, f"fee:{reference}")
+
+
+def ledger_totals(group_by):
+    """Per-``group_by`` captured/refunded/fees totals recomputed from the ledger (debit side only)"""
+    money = DecimalField(max_digits=12, decimal_places=2)
+
+    def total(kind):
+        return Coalesce(
+            Sum(Case(When(kind=kind, then=F('amount')), default=Value(Decimal('0')), output_field=money)),
+            Value(Decimal('0')),
+            output_field=money,
+        )
+
+    return LedgerEntry.objects.filter(amount__gt=0).values(group_by).annotate(
+        captured=total('capture'),
+        refunded=total('refund'),
+        fees=total('fee'),
+    ).order_by(group_by)
+
+
+def unbalanced_postings():
+    """Postings whose lines do not sum to zero"""
+    return LedgerEntry.objects.values('posting').annotate(total=Sum('amount')).exclude(total=0)
+
+
+def recompute_balances(model, group_by, repair=False, batch_size=500):
+    """
+    Compare stored balances of ``model`` (PaymentBalance or OrderBalance) with
+    ledger totals. Returns a list of ``(key, stored, expected)`` drift tuples;
+    with ``repair`` the stored rows are corrected in bulk.
+    """
+    key_field = model._meta.pk.attname
+    stored = {
+        row[key_field]: row
+        for row in model.objects.values(key_field, *BALANCE_FIELDS).iterator()
+    }
+
+    drift = []
+    to_update = []
+    to_create = []
+    for totals in ledger_totals(group_by).iterator():
+        key = totals[group_by]
+        expected = {field: totals[field] for field in BALANCE_FIELDS}
+        current = stored.pop(key, None)
+        if current is None:
+            drift.append((key, None, expected))
+            to_create.append(model(**{key_field: key}, **expected))
+        elif any(current[field] != expected[field] for field in BALANCE_FIELDS):
+            drift.append((key, {field: current[field] for field in BALANCE_FIELDS}, expected))
+            to_update.append(model(**{key_field: key}, **expected))
+
+    # Balances with no ledger entries behind them at all
+    zero = {field: Decimal('0.00') for field in BALANCE_FIELDS}
+    for key, current in stored.items():
+        if any(current[field] != 0 for field in BALANCE_FIELDS):
+            drift.append((key, {field: current[field] for field in BALANCE_FIELDS}, zero))
+            to_update.append(model(**{key_field: key}, **zero))
+
+    if repair and drift:
+        with transaction.atomic():
+            if model is PaymentBalance:
+                # PaymentBalance also carries the order id
+                orders = dict(
+                    Payment.objects.filter(
+                        pk__in=[balance.pk for balance in to_create]
+                    ).values_list('pk', 'order_id')
+                )
+                for balance in to_create:
+                    balance.order_id = orders[balance.pk]
+            model.objects.bulk_create(to_create, batch_size=batch_size)
+            model.objects.bulk_update(to_update, BALANCE_FIELDS, batch_size=batch_size)
+    return drift
+
+
+def backfill_queryset():
+    """Completed payments and refunds that have no ledger postings yet"""
+    payments = Payment.objects.filter(
+        status__in=('completed', 'refunded', 'partially_refunded')
+    ).exclude(ledger_entries__kind='capture')
+    refunds = Refund.objects.filter(status='completed').exclude(
+        ledger_entries__kind='refund'
+    ).select_related('payment')
+    return payments, refunds
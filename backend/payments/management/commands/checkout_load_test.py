@@ -0,0 +1,209 @@
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import requests
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from orders.models import Order
+from payments.simulator import make_server
+from users.models import User
+from .run_payment_simulator import add_simulator_arguments, build_simulator
+
+TERMINAL_MPESA_STATUSES = ('successful', 'failed', 'cancelled')
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Scripted checkout load test. Creates orders for a load-test customer and runs '
+        'concurrent M-Pesa and card checkouts against a running API whose gateways point '
+        'at the payment simulator (start the API with PAYMENT_SIMULATOR_URL set to the '
+        'simulator and MPESA_CALLBACK_URL pointing back at the API).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Root URL of the running API')
+        parser.add_argument('--checkouts', type=int, default=100, help='Number of checkouts to run')
+        parser.add_argument('--concurrency', type=int, default=10, help='Concurrent customers')
+        parser.add_argument(
+            '--method',
+            choices=['mpesa', 'card', 'mixed'],
+            default='mixed',
+            help='Payment path to exercise'
+        )
+        parser.add_argument(
+            '--completion-timeout',
+            type=float,
+            default=60,
+            help='Seconds to wait for an M-Pesa checkout to reach a final status'
+        )
+        parser.add_argument('--poll-interval', type=float, default=0.5, help='Status poll interval in seconds')
+        parser.add_argument('--simulator-host', default='127.0.0.1', help='Interface for the embedded simulator')
+        parser.add_argument('--simulator-port', type=int, default=8099, help='Port for the embedded simulator')
+        parser.add_argument(
+            '--no-simulator',
+            action='store_true',
+            help='Do not start an embedded simulator (one is already running)'
+        )
+        add_simulator_arguments(parser)
+
+    def handle(self, *args, **options):
+        self.base_url = options['base_url'].rstrip('/')
+        self.options = options
+        self.local = threading.local()
+
+        server = None
+        if not options['no_simulator']:
+            options['webhook_url'] = options['webhook_url'] or f"{self.base_url}/api/payments/webhook/"
+            server = make_server(build_simulator(options), options['simulator_host'], options['simulator_port'])
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.stdout.write(
+                f"Embedded payment simulator on http://{options['simulator_host']}:{options['simulator_port']}"
+            )
+
+        try:
+            user, orders = self.prepare_orders(options['checkouts'])
+            self.auth = {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+
+            methods = {'mpesa': ['mpesa'], 'card': ['card'], 'mixed': ['mpesa', 'card']}[options['method']]
+            jobs = [(order_id, methods[i % len(methods)]) for i, order_id in enumerate(orders)]
+
+            self.stdout.write(
+                f"Running {len(jobs)} checkouts with concurrency {options['concurrency']} "
+                f"against {self.base_url}..."
+            )
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                results = list(executor.map(lambda job: self.checkout(*job), jobs))
+            elapsed = time.monotonic() - started
+
+            self.report(results, elapsed)
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+
+    def prepare_orders(self, count):
+        user, _ = User.objects.get_or_create(
+            email='loadtest@example.com',
+            defaults={'username': 'loadtest', 'first_name': 'Load', 'last_name': 'Test'}
+        )
+        orders = Order.objects.bulk_create([
+            Order(
+                user=user,
+                order_number=Order().generate_order_number(),
+                shipping_first_name='Load',
+                shipping_last_name='Test',
+                shipping_address='1 Simulator Way',
+                shipping_city='Nairobi',
+                shipping_state='Nairobi',
+                shipping_zip_code='00100',
+                shipping_country='Kenya',
+                shipping_phone='0712345678',
+                payment_method='mpesa',
+                subtotal=Decimal('1000.00'),
+                shipping_cost=Decimal('0.00'),
+                tax_amount=Decimal('0.00'),
+                total=Decimal('1000.00'),
+            )
+            for _ in range(count)
+        ])
+        return user, [order.id for order in orders]
+
+    @property
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+            self.local.session.headers.update(self.auth)
+        return self.local.session
+
+    def checkout(self, order_id, method):
+        result = {'method': method, 'initiate': None, 'completion': None, 'outcome': None}
+        started = time.monotonic()
+        try:
+            if method == 'mpesa':
+                self.mpesa_checkout(order_id, started, result)
+            else:
+                self.card_checkout(order_id, started, result)
+        except requests.exceptions.RequestException as e:
+            result['outcome'] = f'error: {e.__class__.__name__}'
+        return result
+
+    def mpesa_checkout(self, order_id, started, result):
+        api = f"{self.base_url}/api/payments"
+        response = self.session.post(f"{api}/mpesa/initiate/", json={
+            'order': order_id,
+            'phone_number': '0712345678',
+        }, timeout=120)
+        result['initiate'] = time.monotonic() - started
+        if response.status_code != 200:
+            result['outcome'] = f'rejected ({response.status_code})'
+            return
+
+        transaction_id = response.json()['transaction_id']
+        deadline = started + self.options['completion_timeout']
+        while time.monotonic() < deadline:
+            time.sleep(self.options['poll_interval'])
+            status_response = self.session.get(f"{api}/mpesa/transactions/{transaction_id}/status/", timeout=30)
+            result['polls'] = result.get('polls', 0) + 1
+            transaction_status = status_response.json().get('status')
+            if transaction_status in TERMINAL_MPESA_STATUSES:
+                result['completion'] = time.monotonic() - started
+                result['outcome'] = transaction_status
+                return
+        result['outcome'] = 'timeout'
+
+    def card_checkout(self, order_id, started, result):
+        api = f"{self.base_url}/api/payments"
+        response = self.session.post(f"{api}/payments/", json={'order': order_id}, timeout=120)
+        result['initiate'] = time.monotonic() - started
+        if response.status_code != 201:
+            result['outcome'] = f'rejected ({response.status_code})'
+            return
+
+        payment_id = response.json()['id']
+        response = self.session.post(f"{api}/payments/{payment_id}/confirm/", timeout=120)
+        result['completion'] = time.monotonic() - started
+        result['outcome'] = 'successful' if response.status_code == 200 else 'failed'
+
+    def report(self, results, elapsed):
+        self.stdout.write(self.style.SUCCESS(
+            f"Completed {len(results)} checkouts in {elapsed:.2f}s "
+            f"({len(results) / elapsed if elapsed else 0:.1f} checkouts/s)"
+        ))
+
+        by_method = defaultdict(list)
+        for result in results:
+            by_method[result['method']].append(result)
+
+        for method, method_results in sorted(by_method.items()):
+            initiate = [r['initiate'] for r in method_results if r['initiate'] is not None]
+            completion = [r['completion'] for r in method_results if r['completion'] is not None]
+            outcomes = Counter(r['outcome'] for r in method_results)
+            polls = sum(r.get('polls', 0) for r in method_results)
+
+            self.stdout.write(f"  {method}: {len(method_results)} checkouts")
+            self.stdout.write(
+                f"    initiate   p50 {percentile(initiate, 50) * 1000:.0f}ms  "
+                f"p95 {percentile(initiate, 95) * 1000:.0f}ms  p99 {percentile(initiate, 99) * 1000:.0f}ms"
+            )
+            self.stdout.write(
+                f"    completion p50 {percentile(completion, 50) * 1000:.0f}ms  "
+                f"p95 {percentile(completion, 95) * 1000:.0f}ms  p99 {percentile(completion, 99) * 1000:.0f}ms"
+            )
+            if polls:
+                self.stdout.write(f"    status polls: {polls}")
+            self.stdout.write(
+                '    outcomes: ' + ', '.join(f"{outcome}={count}" for outcome, count in outcomes.most_common())
+            )
@@ -0,0 +1,83 @@
+import csv
+import sys
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from payments.reconciliation import StatementReconciler, MISSING, AMOUNT_DRIFT, STATUS_DRIFT, INVALID
+
+REPORT_FIELDS = [
+    'line', 'kind', 'reference', 'statement_amount', 'record_amount',
+    'statement_status', 'record_status', 'record',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconcile a provider settlement statement (CSV of receipts and amounts) against '
+        'payments, M-Pesa transactions, provider transactions and refunds. The statement '
+        'is streamed in chunks, so memory use does not grow with its size. Only statement rows '
+        'are checked: settled records missing from the statement are not reported.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement', help='Path to the statement CSV, or - for stdin')
+        parser.add_argument('--output', help='Write the mismatch report CSV here (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Statement rows matched per query batch')
+        parser.add_argument('--tolerance', default='0.01', help='Allowed absolute amount difference')
+        parser.add_argument(
+            '--minor-units',
+            action='store_true',
+            help='Statement amounts are in cents (as in Stripe exports)'
+        )
+        parser.add_argument('--delimiter', default=',', help='CSV delimiter')
+        parser.add_argument('--reference-column', default='reference', help='Column holding the receipt/provider id')
+        parser.add_argument('--amount-column', default='amount', help='Column holding the settled amount')
+        parser.add_argument('--status-column', default='status', help='Column holding the provider status')
+        parser.add_argument(
+            '--type-column',
+            default='type',
+            help='Column holding the row type (payment or refund); negative amounts are treated as refunds'
+        )
+
+    def handle(self, *args, **options):
+        reconciler = StatementReconciler(
+            chunk_size=options['chunk_size'],
+            tolerance=Decimal(options['tolerance']),
+            minor_units=options['minor_units'],
+            reference_column=options['reference_column'],
+            amount_column=options['amount_column'],
+            status_column=options['status_column'],
+            type_column=options['type_column'],
+        )
+
+        try:
+            statement = sys.stdin if options['statement'] == '-' else open(options['statement'], newline='')
+        except OSError as e:
+            raise CommandError(f"Cannot open statement: {e}")
+        report = open(options['output'], 'w', newline='') if options['output'] else self.stdout
+
+        try:
+            reader = csv.DictReader(statement, delimiter=options['delimiter'])
+            missing_columns = {options['reference_column'], options['amount_column']} - set(reader.fieldnames or [])
+            if missing_columns:
+                raise CommandError(f"Statement is missing column(s): {', '.join(sorted(missing_columns))}")
+
+            writer = csv.DictWriter(report, fieldnames=REPORT_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            for mismatch in reconciler.reconcile(reader):
+                writer.writerow(mismatch)
+        finally:
+            if statement is not sys.stdin:
+                statement.close()
+            if options['output']:
+                report.close()
+
+        stats = reconciler.stats
+        self.stderr.write(self.style.SUCCESS(
+            f"Reconciled {stats['lines']} statement lines:\n"
+            f"  - {stats['matched']} matched\n"
+            f"  - {stats[MISSING]} missing from our records\n"
+            f"  - {stats[AMOUNT_DRIFT]} amount drift\n"
+            f"  - {stats[STATUS_DRIFT]} status drift\n"
+            f"  - {stats[INVALID]} unparseable rows"
+        ))
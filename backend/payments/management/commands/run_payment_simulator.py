@@ -0,0 +1,88 @@
+from django.core.management.base import BaseCommand
+from payments.simulator import PaymentProviderSimulator, SimulatorConfig, make_server
+
+
+def add_simulator_arguments(parser):
+    """Simulator knobs shared by run_payment_simulator and checkout_load_test"""
+    parser.add_argument(
+        '--latency',
+        default='lognormal:0.3,0.5',
+        help='API latency in seconds, e.g. 0.2, uniform:0.1,0.8, normal:0.3,0.05, '
+             'lognormal:<median>,<sigma> or exponential:<mean>'
+    )
+    parser.add_argument(
+        '--callback-delay',
+        default='uniform:2,8',
+        help='Delay before the STK callback / Stripe webhook is sent (same format as --latency)'
+    )
+    parser.add_argument(
+        '--failure-rate',
+        type=float,
+        default=0.0,
+        help='Fraction of API calls answered with a 503'
+    )
+    parser.add_argument(
+        '--decline-rate',
+        type=float,
+        default=0.05,
+        help='Fraction of payments declined or cancelled by the customer'
+    )
+    parser.add_argument(
+        '--callback-failure-rate',
+        type=float,
+        default=0.0,
+        help='Fraction of callbacks/webhooks that are never delivered'
+    )
+    parser.add_argument(
+        '--webhook-url',
+        default='',
+        help='Where to deliver Stripe webhooks, e.g. http://127.0.0.1:8000/api/payments/webhook/'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help='Random seed for reproducible runs'
+    )
+
+
+def build_simulator(options):
+    return PaymentProviderSimulator(SimulatorConfig(
+        latency=options['latency'],
+        callback_delay=options['callback_delay'],
+        failure_rate=options['failure_rate'],
+        decline_rate=options['decline_rate'],
+        callback_failure_rate=options['callback_failure_rate'],
+        webhook_url=options['webhook_url'],
+        seed=options['seed'],
+    ))
+
+
+class Command(BaseCommand):
+    help = 'Run the local M-Pesa (Daraja) and Stripe simulator as an HTTP server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Interface to bind')
+        parser.add_argument('--port', type=int, default=8099, help='Port to bind')
+        add_simulator_arguments(parser)
+
+    def handle(self, *args, **options):
+        simulator = build_simulator(options)
+        server = make_server(simulator, options['host'], options['port'])
+        config = simulator.config
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Payment simulator listening on http://{options['host']}:{options['port']}\n"
+            f"  - latency: {config.latency}\n"
+            f"  - callback delay: {config.callback_delay}\n"
+            f"  - failure rate: {config.failure_rate:.2%}, decline rate: {config.decline_rate:.2%}, "
+            f"dropped callbacks: {config.callback_failure_rate:.2%}\n"
+            f"Point the API at it with PAYMENT_SIMULATOR_URL=http://{options['host']}:{options['port']}"
+        ))
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write('Shutting down payment simulator...')
+        finally:
+            server.server_close()
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+
+from payments.ledger import backfill_queryset, post_capture, post_refund, recompute_balances, unbalanced_postings
+from payments.models import OrderBalance, PaymentBalance
+
+
+class Command(BaseCommand):
+    help = (
+        'Verify the payment ledger: every posting balances to zero and the materialized '
+        'payment/order balances match the ledger. Optionally backfill postings for payments '
+        'and refunds completed before the ledger existed, and repair drifted balances.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backfill',
+            action='store_true',
+            help='Post captures/refunds for completed payments and refunds missing from the ledger'
+        )
+        parser.add_argument('--repair', action='store_true', help='Rewrite drifted balances from the ledger')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows written per bulk update')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            payments, refunds = backfill_queryset()
+            captures = sum(post_capture(payment) for payment in payments.iterator())
+            refunded = sum(post_refund(refund) for refund in refunds.iterator())
+            self.stdout.write(f"Backfilled {captures} capture(s) and {refunded} refund(s)")
+
+        problems = 0
+
+        unbalanced = list(unbalanced_postings()[:20])
+        if unbalanced:
+            problems += len(unbalanced)
+            self.stdout.write(self.style.ERROR(f"{len(unbalanced)} unbalanced posting(s):"))
+            for row in unbalanced:
+                self.stdout.write(f"  - posting {row['posting']} sums to {row['total']}")
+
+        for model, group_by in ((PaymentBalance, 'payment'), (OrderBalance, 'order')):
+            drift = recompute_balances(
+                model, group_by, repair=options['repair'], batch_size=options['batch_size']
+            )
+            problems += len(drift)
+            if not drift:
+                self.stdout.write(f"{model._meta.verbose_name_plural.capitalize()}: consistent")
+                continue
+
+            self.stdout.write(self.style.WARNING(
+                f"{model._meta.verbose_name_plural.capitalize()}: {len(drift)} drifted"
+                f"{' (repaired)' if options['repair'] else ''}"
+            ))
+            for key, stored, expected in drift[:20]:
+                self.stdout.write(f"  - {group_by} {key}: stored {stored}, ledger {expected}")
+
+        if problems:
+            self.stdout.write(self.style.WARNING(f"Ledger verification found {problems} problem(s)"))
+        else:
+            self.stdout.write(self.style.SUCCESS('Ledger verified'))
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mpesatransaction',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, db_index=True, max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='mpesatransaction',
+            name='transaction_id',
+            field=models.CharField(blank=True, db_index=True, max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='provider_payment_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='refund',
+            name='provider_refund_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='provider_transaction_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_payment_state'),
+        ('payments', '0003_provider_reference_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderBalance',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='orders.order')),
+                ('captured', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('refunded', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('fees', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PaymentBalance',
+            fields=[
+                ('payment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='payments.payment')),
+                ('captured', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('refunded', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('fees', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_balances', to='orders.order')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posting', models.UUIDField(db_index=True)),
+                ('reference', models.CharField(max_length=150)),
+                ('kind', models.CharField(choices=[('capture', 'Capture'), ('refund', 'Refund'), ('fee', 'Fee')], max_length=20)),
+                ('account', models.CharField(choices=[('customer', 'Customer'), ('provider', 'Provider Clearing'), ('fees', 'Provider Fees')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('currency', models.CharField(default='USD', max_length=3)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='orders.order')),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='payments.payment')),
+                ('refund', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='payments.refund')),
+            ],
+            options={
+                'verbose_name_plural': 'Ledger entries',
+                'ordering': ['id'],
+                'constraints': [models.UniqueConstraint(fields=('reference', 'account'), name='unique_ledger_reference_account')],
+            },
+        ),
+    ]
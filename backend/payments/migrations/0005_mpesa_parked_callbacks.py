@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-19 12:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_payment_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mpesacallback',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, db_index=True, max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='mpesacallback',
+            name='transaction',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='callbacks', to='payments.mpesatransaction'),
+        ),
+    ]
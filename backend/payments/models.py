@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MinValueValidator
 from orders.models import Order
 from users.models import User
@@ -57,7 +57,7 @@ class Payment(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     
     # Provider data
-    provider_payment_id = models.CharField(max_length=100, blank=True)
+    provider_payment_id = models.CharField(max_length=100, blank=True, db_index=True)
     provider_client_secret = models.CharField(max_length=100, blank=True)
     
     # Error handling
@@ -75,6 +75,24 @@ class Payment(models.Model):
     def __str__(self):
         return f"Payment {self.id} - {self.amount} {self.currency}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._order_state = (instance.__dict__.get('status'), instance.__dict__.get('amount'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Save and keep the order's denormalized payment state in step"""
+        sync_order = self._state.adding or (self.status, self.amount) != getattr(self, '_order_state', None)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if sync_order:
+                if self.status in ('completed', 'refunded', 'partially_refunded'):
+                    from .ledger import post_capture
+                    post_capture(self)
+                self.order.update_payment_status()
+        self._order_state = (self.status, self.amount)
+
 class Refund(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -91,7 +109,7 @@ class Refund(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     
     # Provider data
-    provider_refund_id = models.CharField(max_length=100, blank=True)
+    provider_refund_id = models.CharField(max_length=100, blank=True, db_index=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -102,6 +120,27 @@ class Refund(models.Model):
     def __str__(self):
         return f"Refund {self.id} - {self.amount}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._order_state = (instance.__dict__.get('status'), instance.__dict__.get('amount'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Save and keep the order's amount_paid in step once the refund completes"""
+        previous_status = getattr(self, '_order_state', (None, None))[0]
+        sync_order = 'completed' in (self.status, previous_status) and (
+            (self.status, self.amount) != getattr(self, '_order_state', None)
+        )
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if sync_order:
+                if self.status == 'completed':
+                    from .ledger import post_refund
+                    post_refund(self)
+                self.payment.order.update_payment_status()
+        self._order_state = (self.status, self.amount)
+
 class Transaction(models.Model):
     TYPE_CHOICES = [
         ('payment', 'Payment'),
@@ -117,7 +156,7 @@ class Transaction(models.Model):
     currency = models.CharField(max_length=3, default='USD')
     
     # Provider data
-    provider_transaction_id = models.CharField(max_length=100, blank=True)
+    provider_transaction_id = models.CharField(max_length=100, blank=True, db_index=True)
     provider_data = models.JSONField(default=dict, blank=True)  # Store raw provider response
     
     success = models.BooleanField(default=False)
@@ -144,9 +183,9 @@ class MpesaTransaction(models.Model):
     payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name='mpesa_transaction')
     phone_number = models.CharField(max_length=15)  # Format: 254712345678
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    transaction_id = models.CharField(max_length=50, blank=True)  # M-Pesa transaction ID
+    transaction_id = models.CharField(max_length=50, blank=True, db_index=True)  # M-Pesa receipt number
     merchant_request_id = models.CharField(max_length=50, blank=True)
-    checkout_request_id = models.CharField(max_length=50, blank=True)
+    checkout_request_id = models.CharField(max_length=50, blank=True, db_index=True)
     result_code = models.IntegerField(null=True, blank=True)
     result_description = models.TextField(blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='requested')
@@ -163,8 +202,16 @@ class MpesaTransaction(models.Model):
         return f"M-Pesa {self.phone_number} - {self.amount}"
 
 class MpesaCallback(models.Model):
-    """Store raw callback data from M-Pesa for debugging and audit"""
-    transaction = models.ForeignKey(MpesaTransaction, on_delete=models.CASCADE, related_name='callbacks')
+    """
+    Store raw callback data from M-Pesa for debugging and audit.
+
+    A callback that arrives before its transaction has a checkout_request_id
+    is parked with no transaction and settled once the STK push is recorded.
+    """
+    transaction = models.ForeignKey(
+        MpesaTransaction, on_delete=models.CASCADE, related_name='callbacks', null=True, blank=True
+    )
+    checkout_request_id = models.CharField(max_length=50, blank=True, db_index=True)
     callback_data = models.JSONField()
     received_at = models.DateTimeField(auto_now_add=True)
     
@@ -172,4 +219,86 @@ class MpesaCallback(models.Model):
         ordering = ['-received_at']
     
     def __str__(self):
-        return f"Callback for {self.transaction}"
\ No newline at end of file
+        return f"Callback for {self.transaction}"
+
+class LedgerEntry(models.Model):
+    """
+    Append-only double-entry ledger line. Every posting writes one debit
+    (positive amount) and one credit (negative amount) sharing a posting id,
+    so each posting sums to zero. Write through payments.ledger only.
+    """
+    KIND_CHOICES = [
+        ('capture', 'Capture'),
+        ('refund', 'Refund'),
+        ('fee', 'Fee'),
+    ]
+
+    ACCOUNT_CHOICES = [
+        ('customer', 'Customer'),  # what the customer has paid us, net of refunds
+        ('provider', 'Provider Clearing'),  # funds held at the payment provider
+        ('fees', 'Provider Fees'),
+    ]
+
+    posting = models.UUIDField(db_index=True)
+    reference = models.CharField(max_length=150)  # idempotency key, e.g. capture:<payment id>
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    account = models.CharField(max_length=20, choices=ACCOUNT_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)  # debit > 0, credit < 0
+    currency = models.CharField(max_length=3, default='USD')
+
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='ledger_entries')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='ledger_entries')
+    refund = models.ForeignKey(Refund, on_delete=models.CASCADE, null=True, blank=True, related_name='ledger_entries')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name_plural = 'Ledger entries'
+        constraints = [
+            models.UniqueConstraint(fields=['reference', 'account'], name='unique_ledger_reference_account'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.account} {self.amount} {self.currency}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Ledger entries are append-only; post a correcting entry instead")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Ledger entries are append-only; post a correcting entry instead")
+
+
+class PaymentBalance(models.Model):
+    """Running totals of a payment's ledger postings, maintained incrementally"""
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, primary_key=True, related_name='balance')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payment_balances')
+    captured = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    refunded = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    fees = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Balance for payment {self.payment_id}"
+
+    @property
+    def net(self):
+        return self.captured - self.refunded - self.fees
+
+
+class OrderBalance(models.Model):
+    """Running totals of an order's ledger postings across all its payments"""
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True, related_name='balance')
+    captured = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    refunded = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    fees = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Balance for order {self.order_id}"
+
+    @property
+    def net(self):
+        return self.captured - self.refunded - self.fees
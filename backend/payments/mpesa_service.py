@@ -6,11 +6,12 @@ import logging
 from django.conf import settings
 from django.utils import timezone
 from .models import MpesaTransaction
+from .resilience import GatewayUnavailable, GuardedHttp, get_guard
 
 logger = logging.getLogger(__name__)
 
 class MpesaGateway:
-    def __init__(self):
+    def __init__(self, base_url=None, http=None):
         self.consumer_key = getattr(settings, 'MPESA_CONSUMER_KEY', '')
         self.consumer_secret = getattr(settings, 'MPESA_CONSUMER_SECRET', '')
         self.business_shortcode = getattr(settings, 'MPESA_BUSINESS_SHORTCODE', '')
@@ -18,7 +19,13 @@ class MpesaGateway:
         self.callback_url = getattr(settings, 'MPESA_CALLBACK_URL', '')
         self.environment = getattr(settings, 'MPESA_ENVIRONMENT', 'sandbox')  # sandbox or production
         
-        if self.environment == 'sandbox':
+        self.timeout = getattr(settings, 'MPESA_TIMEOUT', 30)
+        # anything with requests' get/post interface, behind the M-Pesa circuit breaker/bulkhead
+        self.http = GuardedHttp(http or requests, get_guard('mpesa'))
+        
+        if base_url:
+            self.base_url = base_url.rstrip('/')
+        elif self.environment == 'sandbox':
             self.base_url = 'https://sandbox.safaricom.co.ke'
         else:
             self.base_url = 'https://api.safaricom.co.ke'
@@ -34,7 +41,7 @@ class MpesaGateway:
                 'Authorization': f'Basic {encoded_auth}'
             }
             
-            response = requests.get(url, headers=headers, timeout=30)
+            response = self.http.get(url, headers=headers, timeout=self.timeout)
             response.raise_for_status()
             
             data = response.json()
@@ -78,7 +85,7 @@ class MpesaGateway:
                 'Content-Type': 'application/json'
             }
             
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            response = self.http.post(url, json=payload, headers=headers, timeout=self.timeout)
             response.raise_for_status()
             
             data = response.json()
@@ -98,6 +105,8 @@ class MpesaGateway:
                     'error_message': data.get('ResponseDescription')
                 }
                 
+        except GatewayUnavailable:
+            raise
         except requests.exceptions.RequestException as e:
             logger.error(f"M-Pesa STK push error: {str(e)}")
             return {
@@ -132,12 +141,14 @@ class MpesaGateway:
                 'Content-Type': 'application/json'
             }
             
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            response = self.http.post(url, json=payload, headers=headers, timeout=self.timeout)
             response.raise_for_status()
             
             data = response.json()
             return data
             
+        except GatewayUnavailable:
+            raise
         except Exception as e:
             logger.error(f"M-Pesa query error: {str(e)}")
             return None
@@ -170,4 +181,7 @@ class MockMpesaGateway(MpesaGateway):
             }
 
 # Initialize M-Pesa gateway
-mpesa_gateway = MockMpesaGateway()  # Switch to MpesaGateway() for production
\ No newline at end of file
+if getattr(settings, 'PAYMENT_SIMULATOR_URL', ''):
+    mpesa_gateway = MpesaGateway(base_url=settings.PAYMENT_SIMULATOR_URL)
+else:
+    mpesa_gateway = MockMpesaGateway()  # Switch to MpesaGateway() for production
\ No newline at end of file
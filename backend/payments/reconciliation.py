@@ -0,0 +1,180 @@
+"""
+Streaming reconciliation of provider settlement statements against our
+Payment, Transaction, MpesaTransaction and Refund records.
+
+Statement rows are consumed from any iterator (typically csv.DictReader over
+an open file) in fixed-size chunks; each chunk is matched with a handful of
+indexed ``__in`` lookups, so memory stays constant however long the
+statement is.
+
+Reconciliation runs one way, from the statement to our records: a settled
+record that never appears on the statement is not reported, since finding it
+would mean holding every statement reference in memory.
+"""
+import logging
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from .models import MpesaTransaction, Payment, Refund, Transaction
+
+logger = logging.getLogger(__name__)
+
+# Statement status wording varies by provider; collapse it to settled/failed
+SETTLED_STATUSES = {'completed', 'complete', 'success', 'successful', 'succeeded', 'paid', 'settled', 'refunded'}
+FAILED_STATUSES = {'failed', 'failure', 'declined', 'cancelled', 'canceled', 'reversed', 'voided'}
+
+# Our statuses that mean money actually moved
+SETTLED_RECORD_STATUSES = {
+    'mpesa': {'successful'},
+    'payment': {'completed', 'refunded', 'partially_refunded'},
+    'transaction': {True},
+    'refund': {'completed'},
+}
+
+MISSING = 'missing'
+AMOUNT_DRIFT = 'amount_drift'
+STATUS_DRIFT = 'status_drift'
+INVALID = 'invalid_row'
+
+
+class StatementReconciler:
+    """Matches statement rows against our records chunk by chunk"""
+
+    def __init__(self, chunk_size=1000, tolerance=Decimal('0.01'), minor_units=False,
+                 reference_column='reference', amount_column='amount',
+                 status_column='status', type_column='type'):
+        self.chunk_size = chunk_size
+        self.tolerance = Decimal(tolerance)
+        self.minor_units = minor_units
+        self.reference_column = reference_column
+        self.amount_column = amount_column
+        self.status_column = status_column
+        self.type_column = type_column
+        self.stats = Counter()
+
+    def reconcile(self, rows):
+        """Yield one mismatch dict per problem found in ``rows``"""
+        chunk = []
+        for line_number, row in enumerate(rows, start=2):  # line 1 is the CSV header
+            chunk.append((line_number, row))
+            if len(chunk) >= self.chunk_size:
+                yield from self._reconcile_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from self._reconcile_chunk(chunk)
+
+    def _reconcile_chunk(self, chunk):
+        parsed = []
+        for line_number, row in chunk:
+            self.stats['lines'] += 1
+            entry = self._parse_row(line_number, row)
+            if entry.get('kind') == INVALID:
+                self.stats[INVALID] += 1
+                yield entry
+                continue
+            parsed.append(entry)
+
+        refund_refs = {e['reference'] for e in parsed if e['type'] == 'refund'}
+        payment_refs = {e['reference'] for e in parsed if e['type'] != 'refund'}
+        records = self._lookup_payments(payment_refs)
+        records.update(self._lookup_refunds(refund_refs))
+
+        for entry in parsed:
+            record = records.get((entry['type'] == 'refund', entry['reference']))
+            mismatch = self._compare(entry, record)
+            if mismatch:
+                self.stats[mismatch['kind']] += 1
+                yield mismatch
+            else:
+                self.stats['matched'] += 1
+
+    def _parse_row(self, line_number, row):
+        reference = (row.get(self.reference_column) or '').strip()
+        raw_amount = (row.get(self.amount_column) or '').replace(',', '').strip()
+        try:
+            amount = Decimal(raw_amount)
+        except InvalidOperation:
+            amount = None
+        if amount is not None and not amount.is_finite():
+            # NaN and Infinity parse, but are not amounts
+            amount = None
+        if not reference or amount is None:
+            return {
+                'line': line_number, 'kind': INVALID, 'reference': reference,
+                'statement_amount': raw_amount, 'statement_status': row.get(self.status_column, ''),
+                'record': '', 'record_amount': '', 'record_status': '',
+            }
+        if self.minor_units:
+            amount = amount / 100
+
+        row_type = (row.get(self.type_column) or 'payment').strip().lower()
+        return {
+            'line': line_number,
+            'reference': reference,
+            'amount': abs(amount),
+            'status': (row.get(self.status_column) or '').strip().lower(),
+            'type': 'refund' if row_type == 'refund' or amount < 0 else 'payment',
+        }
+
+    def _lookup_payments(self, references):
+        """Resolve payment references: M-Pesa receipts, payment intents, then provider transactions"""
+        records = {}
+        if not references:
+            return records
+
+        for receipt, pk, amount, status in MpesaTransaction.objects.filter(
+            transaction_id__in=references
+        ).values_list('transaction_id', 'id', 'amount', 'status').iterator():
+            records[(False, receipt)] = ('mpesa', pk, amount, status)
+
+        remaining = references - {ref for _, ref in records}
+        if remaining:
+            for ref, pk, amount, status in Payment.objects.filter(
+                provider_payment_id__in=remaining
+            ).values_list('provider_payment_id', 'id', 'amount', 'status').iterator():
+                records[(False, ref)] = ('payment', pk, amount, status)
+
+        remaining = references - {ref for _, ref in records}
+        if remaining:
+            for ref, pk, amount, success in Transaction.objects.filter(
+                provider_transaction_id__in=remaining
+            ).exclude(type='refund').values_list(
+                'provider_transaction_id', 'id', 'amount', 'success'
+            ).iterator():
+                records[(False, ref)] = ('transaction', pk, amount, success)
+        return records
+
+    def _lookup_refunds(self, references):
+        if not references:
+            return {}
+        return {
+            (True, ref): ('refund', pk, amount, status)
+            for ref, pk, amount, status in Refund.objects.filter(
+                provider_refund_id__in=references
+            ).values_list('provider_refund_id', 'id', 'amount', 'status').iterator()
+        }
+
+    def _compare(self, entry, record):
+        mismatch = {
+            'line': entry['line'],
+            'reference': entry['reference'],
+            'statement_amount': entry['amount'],
+            'statement_status': entry['status'],
+            'record': '',
+            'record_amount': '',
+            'record_status': '',
+        }
+        if record is None:
+            return {**mismatch, 'kind': MISSING}
+
+        model, pk, amount, status = record
+        mismatch.update(record=f"{model}:{pk}", record_amount=amount, record_status=status)
+        if abs(amount - entry['amount']) > self.tolerance:
+            return {**mismatch, 'kind': AMOUNT_DRIFT}
+
+        record_settled = status in SETTLED_RECORD_STATUSES[model]
+        if entry['status'] in SETTLED_STATUSES and not record_settled:
+            return {**mismatch, 'kind': STATUS_DRIFT}
+        if entry['status'] in FAILED_STATUSES and record_settled:
+            return {**mismatch, 'kind': STATUS_DRIFT}
+        return None
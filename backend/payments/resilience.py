@@ -0,0 +1,146 @@
+"""
+Circuit breaker and bulkhead for payment provider calls.
+
+Each provider gets a ``ProviderGuard``:
+
+* a circuit breaker whose state lives in the cache, so every worker sharing
+  the cache trips and recovers together. After ``failure_threshold`` failures
+  (timeouts, connection errors, 5xx) within ``failure_window`` seconds the
+  circuit opens and calls fail fast for ``reset_timeout`` seconds; then a
+  single probe call is let through to decide whether to close it again.
+* a bulkhead: a per-process semaphore capping concurrent calls to the
+  provider, so a slow provider can only tie up that many workers while the
+  rest keep serving catalog traffic.
+
+Both raise ``GatewayUnavailable``, which views turn into a 503 with
+Retry-After instead of waiting on the provider.
+"""
+import logging
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from core.utils import CacheKeys
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayUnavailable(Exception):
+    """Raised instead of calling a provider whose circuit is open or whose bulkhead is full"""
+
+    def __init__(self, provider, reason, retry_after):
+        self.provider = provider
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"{provider} is unavailable ({reason}); retry in {retry_after}s")
+
+
+class ProviderGuard:
+    def __init__(self, provider, failure_threshold=5, failure_window=60, reset_timeout=30,
+                 max_concurrent=10, acquire_timeout=0.5):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.reset_timeout = reset_timeout
+        self.acquire_timeout = acquire_timeout
+        self.semaphore = threading.BoundedSemaphore(max_concurrent)
+
+    def _key(self, part):
+        return CacheKeys.PAYMENT_CIRCUIT.format(self.provider, part)
+
+    @property
+    def state(self):
+        open_until = cache.get(self._key('open_until'))
+        if open_until is None:
+            return 'closed'
+        return 'open' if time.time() < open_until else 'half_open'
+
+    def _before_call(self):
+        open_until = cache.get(self._key('open_until'))
+        if open_until is None:
+            return
+        remaining = open_until - time.time()
+        if remaining > 0:
+            raise GatewayUnavailable(self.provider, 'circuit open', int(remaining) + 1)
+        # Half-open: exactly one caller gets to probe the provider
+        if not cache.add(self._key('probe'), 1, self.acquire_timeout + self.reset_timeout):
+            raise GatewayUnavailable(self.provider, 'circuit half-open', self.reset_timeout)
+
+    def record_success(self):
+        keys = [self._key('open_until'), self._key('probe'), self._key('failures')]
+        current = cache.get_many(keys)
+        if not current:
+            return
+        if keys[0] in current:
+            logger.info(f"Circuit for {self.provider} closed")
+        cache.delete_many(keys)
+
+    def record_failure(self):
+        failures_key = self._key('failures')
+        cache.add(failures_key, 0, self.failure_window)
+        try:
+            failures = cache.incr(failures_key)
+        except ValueError:  # expired between add and incr
+            cache.set(failures_key, 1, self.failure_window)
+            failures = 1
+
+        half_open = cache.get(self._key('open_until')) is not None
+        if half_open or failures >= self.failure_threshold:
+            logger.warning(f"Circuit for {self.provider} opened after {failures} failure(s)")
+            cache.set(self._key('open_until'), time.time() + self.reset_timeout, self.reset_timeout * 10)
+            cache.delete(self._key('probe'))
+
+    def call(self, func, *args, **kwargs):
+        """Run ``func`` under the breaker and bulkhead; HTTP 5xx responses count as failures"""
+        self._before_call()
+        if not self.semaphore.acquire(timeout=self.acquire_timeout):
+            raise GatewayUnavailable(self.provider, 'too many concurrent requests', 1)
+        try:
+            result = func(*args, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.record_failure()
+            raise
+        finally:
+            self.semaphore.release()
+
+        if getattr(result, 'status_code', 200) >= 500:
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+
+class GuardedHttp:
+    """requests-like client that routes every call through a ProviderGuard"""
+
+    def __init__(self, http, guard):
+        self.http = http
+        self.guard = guard
+
+    def get(self, *args, **kwargs):
+        return self.guard.call(self.http.get, *args, **kwargs)
+
+    def post(self, *args, **kwargs):
+        return self.guard.call(self.http.post, *args, **kwargs)
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def get_guard(provider):
+    """Process-wide guard for ``provider``, configured from PAYMENT_CIRCUIT_* settings"""
+    with _guards_lock:
+        if provider not in _guards:
+            _guards[provider] = ProviderGuard(
+                provider,
+                failure_threshold=getattr(settings, 'PAYMENT_CIRCUIT_FAILURE_THRESHOLD', 5),
+                failure_window=getattr(settings, 'PAYMENT_CIRCUIT_FAILURE_WINDOW', 60),
+                reset_timeout=getattr(settings, 'PAYMENT_CIRCUIT_RESET_TIMEOUT', 30),
+                max_concurrent=getattr(settings, 'PAYMENT_GATEWAY_MAX_CONCURRENT', 10),
+                acquire_timeout=getattr(settings, 'PAYMENT_GATEWAY_ACQUIRE_TIMEOUT', 0.5),
+            )
+        return _guards[provider]
@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from .models import PaymentMethod, Payment, Refund, Transaction, MpesaTransaction
 from orders.serializers import OrderSerializer
@@ -71,6 +73,20 @@ class RefundSerializer(serializers.ModelSerializer):
                  'provider_refund_id', 'created_at', 'updated_at')
         read_only_fields = ('id', 'created_at', 'updated_at')
 
+class BulkRefundItemSerializer(serializers.Serializer):
+    payment = serializers.UUIDField()
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, min_value=Decimal('0.01'))
+    reason = serializers.CharField(required=False, allow_blank=True)
+
+class BulkRefundSerializer(serializers.Serializer):
+    refunds = BulkRefundItemSerializer(many=True, allow_empty=False)
+    reason = serializers.CharField(required=False, allow_blank=True, default='')
+    
+    def validate_refunds(self, value):
+        if len(value) > 500:
+            raise serializers.ValidationError("At most 500 refunds can be processed per request")
+        return value
+
 class TransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
@@ -91,7 +107,7 @@ class MpesaTransactionSerializer(serializers.ModelSerializer):
 
 class CreateMpesaPaymentSerializer(serializers.Serializer):
     phone_number = serializers.CharField(max_length=15)
-    order = serializers.UUIDField()
+    order = serializers.IntegerField()
     
     def validate_phone_number(self, value):
         """Validate and format phone number"""
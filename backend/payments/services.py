@@ -1,6 +1,10 @@
+import json
 import logging
+import requests
 from django.conf import settings
+from django.utils import timezone
 from .models import Payment, Transaction
+from .resilience import GuardedHttp, get_guard
 
 logger = logging.getLogger(__name__)
 
@@ -73,6 +77,8 @@ class PaymentGateway:
         try:
             # Mock webhook handling
             # In real implementation, verify signature and parse event
+            if isinstance(payload, (bytes, str)):
+                payload = json.loads(payload)
             event_type = payload.get('type')
             event_data = payload.get('data', {}).get('object', {})
             
@@ -84,11 +90,10 @@ class PaymentGateway:
                 payment.processed_at = timezone.now()
                 payment.save()
                 
-                # Update order status
+                # Payment status is synced onto the order by Payment.save
                 order = payment.order
-                order.payment_status = 'paid'
                 order.status = 'confirmed'
-                order.save()
+                order.save(update_fields=['status', 'updated_at'])
             
             return True
             
@@ -121,5 +126,58 @@ class MockPaymentGateway(PaymentGateway):
             'status': 'succeeded',
         }
 
+class SimulatedPaymentGateway(PaymentGateway):
+    """Card gateway that talks Stripe's REST API to the local provider simulator"""
+    
+    def __init__(self, base_url, http=None):
+        super().__init__()
+        self.base_url = base_url.rstrip('/')
+        # anything with requests' get/post interface, behind the card circuit breaker/bulkhead
+        self.http = GuardedHttp(http or requests, get_guard('stripe'))
+        self.timeout = getattr(settings, 'PAYMENT_GATEWAY_TIMEOUT', 30)
+    
+    def _post(self, path, data):
+        response = self.http.post(
+            f"{self.base_url}{path}",
+            data=data,
+            headers={'Authorization': f'Bearer {self.api_key}'},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+    
+    def create_payment_intent(self, payment):
+        intent = self._post('/v1/payment_intents', {
+            'amount': int(payment.amount * 100),  # Convert to cents
+            'currency': payment.currency.lower(),
+            'metadata[payment_id]': str(payment.id),
+        })
+        return {
+            'id': intent['id'],
+            'client_secret': intent['client_secret'],
+            'status': intent['status'],
+        }
+    
+    def confirm_payment(self, payment, payment_method_id=None):
+        data = {'payment_method': payment_method_id} if payment_method_id else {}
+        intent = self._post(f'/v1/payment_intents/{payment.provider_payment_id}/confirm', data)
+        return {
+            'id': intent['id'],
+            'status': intent['status'],
+        }
+    
+    def create_refund(self, refund):
+        result = self._post('/v1/refunds', {
+            'payment_intent': refund.payment.provider_payment_id,
+            'amount': int(refund.amount * 100),
+        })
+        return {
+            'id': result['id'],
+            'status': result['status'],
+        }
+
 # Initialize payment gateway
-payment_gateway = MockPaymentGateway()
\ No newline at end of file
+if getattr(settings, 'PAYMENT_SIMULATOR_URL', ''):
+    payment_gateway = SimulatedPaymentGateway(settings.PAYMENT_SIMULATOR_URL)
+else:
+    payment_gateway = MockPaymentGateway()
\ No newline at end of file
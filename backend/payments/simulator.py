@@ -0,0 +1,533 @@
+"""
+Local payment provider simulator.
+
+Implements the parts of the Safaricom Daraja API (OAuth, STK push, STK push
+query and the result callback) and the Stripe API (payment intents, refunds
+and webhooks) that our gateways use, with configurable latency, failure rates
+and callback delays. It can run in-process (see SimulatorTransport) or as a
+small HTTP server (see the run_payment_simulator management command).
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyProfile:
+    """Samples simulated latencies (in seconds) from a distribution"""
+
+    DISTRIBUTIONS = ('fixed', 'uniform', 'normal', 'lognormal', 'exponential')
+
+    def __init__(self, distribution='fixed', mean=0.0, spread=0.0, rng=None):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.distribution = distribution
+        self.mean = float(mean)
+        self.spread = float(spread)
+        self.rng = rng or random.Random()
+
+    @classmethod
+    def parse(cls, spec, rng=None):
+        """
+        Build a profile from a compact spec such as ``0.2``, ``fixed:0.2``,
+        ``uniform:0.1,0.8``, ``normal:0.3,0.05``, ``lognormal:0.3,0.5`` or
+        ``exponential:0.3``.
+        """
+        if isinstance(spec, cls):
+            return spec
+        spec = str(spec or '0').strip()
+        if ':' not in spec:
+            return cls('fixed', float(spec), rng=rng)
+        distribution, params = spec.split(':', 1)
+        values = [float(v) for v in params.split(',') if v.strip()]
+        if distribution == 'uniform':
+            low, high = (values + [values[0]])[:2]
+            return cls('uniform', (low + high) / 2, (high - low) / 2, rng=rng)
+        mean = values[0] if values else 0.0
+        spread = values[1] if len(values) > 1 else 0.0
+        return cls(distribution, mean, spread, rng=rng)
+
+    def sample(self):
+        if self.distribution == 'fixed':
+            value = self.mean
+        elif self.distribution == 'uniform':
+            value = self.rng.uniform(self.mean - self.spread, self.mean + self.spread)
+        elif self.distribution == 'normal':
+            value = self.rng.gauss(self.mean, self.spread)
+        elif self.distribution == 'lognormal':
+            # mean is the median latency, spread the sigma of the underlying normal
+            value = self.mean * self.rng.lognormvariate(0, self.spread)
+        else:
+            value = self.rng.expovariate(1 / self.mean) if self.mean > 0 else 0.0
+        return max(value, 0.0)
+
+    def __str__(self):
+        return f"{self.distribution}(mean={self.mean}, spread={self.spread})"
+
+
+class SimulatorConfig:
+    """Behaviour knobs shared by the simulated providers"""
+
+    def __init__(self, latency='0', callback_delay='1', failure_rate=0.0,
+                 decline_rate=0.0, callback_failure_rate=0.0, seed=None,
+                 webhook_url='', webhook_secret='whsec_mock_secret'):
+        self.rng = random.Random(seed)
+        self.latency = LatencyProfile.parse(latency, rng=self.rng)
+        self.callback_delay = LatencyProfile.parse(callback_delay, rng=self.rng)
+        self.failure_rate = float(failure_rate)  # API call returns a 5xx
+        self.decline_rate = float(decline_rate)  # payment is declined by the customer/bank
+        self.callback_failure_rate = float(callback_failure_rate)  # callback/webhook is never sent
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+
+    def chance(self, rate):
+        return rate > 0 and self.rng.random() < rate
+
+
+class SimulatorError(Exception):
+    def __init__(self, status_code, payload):
+        super().__init__(payload)
+        self.status_code = status_code
+        self.payload = payload
+
+
+def post_json(url, payload, headers=None):
+    """Default callback sender: deliver a callback/webhook over HTTP"""
+    try:
+        requests.post(url, data=json.dumps(payload), timeout=30, headers={
+            'Content-Type': 'application/json', **(headers or {})
+        })
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Simulator callback to {url} failed: {str(e)}")
+
+
+class DarajaSimulator:
+    """Simulates the Daraja OAuth, STK push, STK query and callback flow"""
+
+    TOKEN_TTL = 3599
+
+    def __init__(self, config, callback_sender=post_json):
+        self.config = config
+        self.callback_sender = callback_sender
+        self.tokens = {}
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def oauth(self, headers, query):
+        if query.get('grant_type') != 'client_credentials':
+            raise SimulatorError(400, {'errorCode': '400.008.01', 'errorMessage': 'Invalid grant type passed'})
+        auth = headers.get('authorization', '')
+        if not auth.startswith('Basic ') or ':' not in self._decode_basic(auth[6:]):
+            raise SimulatorError(400, {'errorCode': '400.008.02', 'errorMessage': 'Invalid Authentication passed'})
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = time.time() + self.TOKEN_TTL
+        return {'access_token': token, 'expires_in': str(self.TOKEN_TTL)}
+
+    def stk_push(self, headers, payload):
+        self._authorize(headers)
+        missing = [k for k in ('BusinessShortCode', 'Password', 'Timestamp', 'Amount',
+                               'PhoneNumber', 'CallBackURL') if not payload.get(k)]
+        if missing:
+            raise SimulatorError(400, {
+                'requestId': uuid.uuid4().hex,
+                'errorCode': '400.002.02',
+                'errorMessage': f"Bad Request - Invalid {missing[0]}",
+            })
+
+        merchant_request_id = f"{self.config.rng.randint(10000, 99999)}-{self.config.rng.randint(1000000, 9999999)}-1"
+        checkout_request_id = f"ws_CO_{datetime.now().strftime('%d%m%Y%H%M%S')}{uuid.uuid4().hex[:12]}"
+        result_code, result_desc = self._decide_outcome(str(payload['PhoneNumber']))
+        with self.lock:
+            self.requests[checkout_request_id] = {
+                'merchant_request_id': merchant_request_id,
+                'amount': payload['Amount'],
+                'phone_number': payload['PhoneNumber'],
+                'callback_url': payload['CallBackURL'],
+                'result_code': result_code,
+                'result_desc': result_desc,
+                'completed': False,
+            }
+
+        self._schedule(self._complete, checkout_request_id)
+        return {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing',
+        }
+
+    def stk_query(self, headers, payload):
+        self._authorize(headers)
+        state = self.requests.get(payload.get('CheckoutRequestID'))
+        if state is None:
+            raise SimulatorError(400, {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid CheckoutRequestID'})
+        if not state['completed']:
+            raise SimulatorError(500, {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'})
+        return {
+            'ResponseCode': '0',
+            'ResponseDescription': 'The service request has been accepted successsfully',
+            'MerchantRequestID': state['merchant_request_id'],
+            'CheckoutRequestID': payload['CheckoutRequestID'],
+            'ResultCode': str(state['result_code']),
+            'ResultDesc': state['result_desc'],
+        }
+
+    def _decide_outcome(self, phone_number):
+        # Same magic numbers as MockMpesaGateway, plus a random decline rate
+        if phone_number.endswith('1111'):
+            return 1, 'The balance is insufficient for the transaction.'
+        if phone_number.endswith('2222') or self.config.chance(self.config.decline_rate):
+            return 1032, 'Request cancelled by user'
+        return 0, 'The service request is processed successfully.'
+
+    def _complete(self, checkout_request_id):
+        with self.lock:
+            state = self.requests[checkout_request_id]
+            state['completed'] = True
+        callback = {
+            'MerchantRequestID': state['merchant_request_id'],
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': state['result_code'],
+            'ResultDesc': state['result_desc'],
+        }
+        if state['result_code'] == 0:
+            callback['CallbackMetadata'] = {'Item': [
+                {'Name': 'Amount', 'Value': state['amount']},
+                {'Name': 'MpesaReceiptNumber', 'Value': f"SIM{uuid.uuid4().hex[:7].upper()}"},
+                {'Name': 'TransactionDate', 'Value': int(datetime.now().strftime('%Y%m%d%H%M%S'))},
+                {'Name': 'PhoneNumber', 'Value': int(state['phone_number'])},
+            ]}
+        if self.config.chance(self.config.callback_failure_rate):
+            logger.info(f"Simulator dropping M-Pesa callback for {checkout_request_id}")
+            return
+        self.callback_sender(state['callback_url'], {'Body': {'stkCallback': callback}})
+
+    def _schedule(self, func, *args):
+        timer = threading.Timer(self.config.callback_delay.sample(), func, args=args)
+        timer.daemon = True
+        timer.start()
+
+    def _authorize(self, headers):
+        auth = headers.get('authorization', '')
+        expires = self.tokens.get(auth[7:]) if auth.startswith('Bearer ') else None
+        if not expires or expires < time.time():
+            raise SimulatorError(401, {'errorCode': '404.001.03', 'errorMessage': 'Invalid Access Token'})
+
+    @staticmethod
+    def _decode_basic(value):
+        try:
+            return base64.b64decode(value).decode()
+        except (ValueError, UnicodeDecodeError):
+            return ''
+
+
+class StripeSimulator:
+    """Simulates Stripe payment intents, refunds and their webhooks"""
+
+    def __init__(self, config, callback_sender=post_json):
+        self.config = config
+        self.callback_sender = callback_sender
+        self.intents = {}
+        self.refunds = {}
+        self.lock = threading.Lock()
+
+    def create_intent(self, headers, payload):
+        self._authorize(headers)
+        try:
+            amount = int(payload.get('amount', 0))
+        except (TypeError, ValueError):
+            amount = 0
+        if amount <= 0:
+            raise SimulatorError(400, self._error('invalid_request_error', 'Invalid positive integer', 'amount'))
+
+        intent_id = f"pi_sim_{uuid.uuid4().hex[:24]}"
+        intent = {
+            'id': intent_id,
+            'object': 'payment_intent',
+            'amount': amount,
+            'amount_received': 0,
+            'currency': payload.get('currency', 'usd').lower(),
+            'client_secret': f"{intent_id}_secret_{uuid.uuid4().hex[:16]}",
+            'payment_method': payload.get('payment_method'),
+            'status': 'requires_confirmation' if payload.get('payment_method') else 'requires_payment_method',
+            'last_payment_error': None,
+            'metadata': payload.get('metadata', {}),
+            'created': int(time.time()),
+        }
+        with self.lock:
+            self.intents[intent_id] = intent
+        if str(payload.get('confirm', '')).lower() == 'true':
+            return self.confirm_intent(headers, intent_id, {})
+        return dict(intent)
+
+    def retrieve_intent(self, headers, intent_id):
+        self._authorize(headers)
+        return dict(self._get_intent(intent_id))
+
+    def confirm_intent(self, headers, intent_id, payload):
+        self._authorize(headers)
+        intent = self._get_intent(intent_id)
+        if intent['status'] == 'succeeded':
+            raise SimulatorError(400, self._error(
+                'invalid_request_error', 'This PaymentIntent has already succeeded.', code='payment_intent_unexpected_state'
+            ))
+        if self.config.chance(self.config.decline_rate):
+            intent['status'] = 'requires_payment_method'
+            intent['last_payment_error'] = {'code': 'card_declined', 'message': 'Your card was declined.'}
+            event_type = 'payment_intent.payment_failed'
+        else:
+            intent['status'] = 'succeeded'
+            intent['amount_received'] = intent['amount']
+            intent['last_payment_error'] = None
+            event_type = 'payment_intent.succeeded'
+        self._schedule_webhook(event_type, dict(intent))
+        return dict(intent)
+
+    def create_refund(self, headers, payload):
+        self._authorize(headers)
+        intent = self._get_intent(payload.get('payment_intent'))
+        if intent['status'] != 'succeeded':
+            raise SimulatorError(400, self._error('invalid_request_error', 'This PaymentIntent has not succeeded.'))
+        refundable = intent['amount_received'] - intent.get('amount_refunded', 0)
+        amount = int(payload.get('amount') or refundable)
+        if amount <= 0 or amount > refundable:
+            raise SimulatorError(400, self._error(
+                'invalid_request_error', 'Refund amount is greater than unrefunded amount on charge', 'amount'
+            ))
+
+        intent['amount_refunded'] = intent.get('amount_refunded', 0) + amount
+        refund = {
+            'id': f"re_sim_{uuid.uuid4().hex[:24]}",
+            'object': 'refund',
+            'amount': amount,
+            'currency': intent['currency'],
+            'payment_intent': intent['id'],
+            'status': 'succeeded',
+            'created': int(time.time()),
+        }
+        with self.lock:
+            self.refunds[refund['id']] = refund
+        self._schedule_webhook('charge.refunded', {
+            'id': f"ch_sim_{intent['id'][7:]}",
+            'object': 'charge',
+            'payment_intent': intent['id'],
+            'amount': intent['amount'],
+            'amount_refunded': intent['amount_refunded'],
+        })
+        return dict(refund)
+
+    def signature_header(self, payload, timestamp=None):
+        """Build a Stripe-Signature header the way Stripe signs webhooks"""
+        timestamp = int(timestamp or time.time())
+        signed = f"{timestamp}.{payload}".encode()
+        digest = hmac.new(self.config.webhook_secret.encode(), signed, hashlib.sha256).hexdigest()
+        return f"t={timestamp},v1={digest}"
+
+    def _schedule_webhook(self, event_type, obj):
+        if not self.config.webhook_url or self.config.chance(self.config.callback_failure_rate):
+            return
+        event = {
+            'id': f"evt_sim_{uuid.uuid4().hex[:24]}",
+            'object': 'event',
+            'type': event_type,
+            'created': int(time.time()),
+            'data': {'object': obj},
+        }
+
+        def deliver():
+            payload = json.dumps(event)
+            self.callback_sender(self.config.webhook_url, event, {
+                'Stripe-Signature': self.signature_header(payload)
+            })
+
+        timer = threading.Timer(self.config.callback_delay.sample(), deliver)
+        timer.daemon = True
+        timer.start()
+
+    def _get_intent(self, intent_id):
+        intent = self.intents.get(intent_id)
+        if intent is None:
+            raise SimulatorError(404, self._error(
+                'invalid_request_error', f"No such payment_intent: '{intent_id}'", code='resource_missing'
+            ))
+        return intent
+
+    def _authorize(self, headers):
+        if not headers.get('authorization', '').startswith('Bearer sk_'):
+            raise SimulatorError(401, self._error('invalid_request_error', 'Invalid API Key provided'))
+
+    @staticmethod
+    def _error(error_type, message, param=None, code=None):
+        error = {'type': error_type, 'message': message}
+        if param:
+            error['param'] = param
+        if code:
+            error['code'] = code
+        return {'error': error}
+
+
+class PaymentProviderSimulator:
+    """Routes Daraja and Stripe style requests to the simulated providers"""
+
+    def __init__(self, config=None, callback_sender=post_json):
+        self.config = config or SimulatorConfig()
+        self.daraja = DarajaSimulator(self.config, callback_sender)
+        self.stripe = StripeSimulator(self.config, callback_sender)
+
+    def handle(self, method, path, headers=None, body=b''):
+        """Handle one request; returns ``(status_code, payload)``"""
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        parts = urlsplit(path)
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        route = parts.path.rstrip('/')
+
+        time.sleep(self.config.latency.sample())
+        if self.config.chance(self.config.failure_rate):
+            return 503, {'errorCode': '503.001.01', 'errorMessage': 'Service is currently unavailable'}
+
+        try:
+            return 200, self._dispatch(method.upper(), route, headers, query, body)
+        except SimulatorError as e:
+            return e.status_code, e.payload
+
+    def _dispatch(self, method, route, headers, query, body):
+        if method == 'GET' and route == '/oauth/v1/generate':
+            return self.daraja.oauth(headers, query)
+        if method == 'POST' and route == '/mpesa/stkpush/v1/processrequest':
+            return self.daraja.stk_push(headers, self._json(body))
+        if method == 'POST' and route == '/mpesa/stkpushquery/v1/query':
+            return self.daraja.stk_query(headers, self._json(body))
+
+        segments = route.strip('/').split('/')
+        if segments[:2] == ['v1', 'payment_intents']:
+            if method == 'POST' and len(segments) == 2:
+                return self.stripe.create_intent(headers, self._form(body, headers))
+            if method == 'GET' and len(segments) == 3:
+                return self.stripe.retrieve_intent(headers, segments[2])
+            if method == 'POST' and len(segments) == 4 and segments[3] == 'confirm':
+                return self.stripe.confirm_intent(headers, segments[2], self._form(body, headers))
+        if method == 'POST' and segments == ['v1', 'refunds']:
+            return self.stripe.create_refund(headers, self._form(body, headers))
+
+        raise SimulatorError(404, {'errorCode': '404.001.01', 'errorMessage': f"Unknown route {method} {route}"})
+
+    @staticmethod
+    def _json(body):
+        try:
+            return json.loads(body or b'{}')
+        except ValueError:
+            raise SimulatorError(400, {'errorCode': '400.002.01', 'errorMessage': 'Invalid JSON body'})
+
+    @classmethod
+    def _form(cls, body, headers):
+        if 'application/json' in headers.get('content-type', ''):
+            return cls._json(body)
+        if isinstance(body, bytes):
+            body = body.decode()
+        return {k: v[-1] for k, v in parse_qs(body or '').items()}
+
+
+class SimulatedResponse:
+    """Minimal stand-in for ``requests.Response``"""
+
+    def __init__(self, status_code, payload, url):
+        self.status_code = status_code
+        self.url = url
+        self._payload = payload
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class SimulatorTransport:
+    """
+    Drop-in replacement for the ``requests`` module that routes calls into an
+    in-process simulator. Calls slower than ``timeout`` raise ``Timeout`` just
+    like a real socket would.
+    """
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+
+    def get(self, url, headers=None, timeout=None, **kwargs):
+        return self.request('GET', url, headers=headers, timeout=timeout, **kwargs)
+
+    def post(self, url, json=None, data=None, headers=None, timeout=None, **kwargs):
+        return self.request('POST', url, json=json, data=data, headers=headers, timeout=timeout, **kwargs)
+
+    def request(self, method, url, json=None, data=None, headers=None, timeout=None, **kwargs):
+        headers = dict(headers or {})
+        if json is not None:
+            body = _json_dumps(json).encode()
+            headers.setdefault('Content-Type', 'application/json')
+        elif isinstance(data, dict):
+            body = urlencode(data).encode()
+        else:
+            body = data or b''
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else '')
+
+        started = time.monotonic()
+        status_code, payload = self.simulator.handle(method, path, headers, body)
+        if timeout and time.monotonic() - started > _read_timeout(timeout):
+            raise requests.exceptions.ReadTimeout(f"Read timed out. (read timeout={timeout})")
+        return SimulatedResponse(status_code, payload, url)
+
+
+class SimulatorRequestHandler(BaseHTTPRequestHandler):
+    simulator = None
+
+    def do_GET(self):
+        self._respond('GET')
+
+    def do_POST(self):
+        self._respond('POST')
+
+    def _respond(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status_code, payload = self.simulator.handle(method, self.path, dict(self.headers), body)
+        data = _json_dumps(payload).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Simulator {self.address_string()} {format % args}")
+
+
+def make_server(simulator, host='127.0.0.1', port=8099):
+    """Create a threaded HTTP server exposing ``simulator``"""
+    handler = type('BoundSimulatorRequestHandler', (SimulatorRequestHandler,), {'simulator': simulator})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def _json_dumps(payload):
+    return json.dumps(payload, default=str)
+
+
+def _read_timeout(timeout):
+    return timeout[-1] if isinstance(timeout, (tuple, list)) else timeout
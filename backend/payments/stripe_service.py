@@ -158,11 +158,10 @@ class StripeService:
             payment.processed_at = timezone.now()
             payment.save()
             
-            # Update order status
+            # Payment status is synced onto the order by Payment.save
             order = payment.order
-            order.payment_status = 'paid'
             order.status = 'confirmed'
-            order.save()
+            order.save(update_fields=['status', 'updated_at'])
             
             logger.info(f"Payment completed: {payment_intent['id']}")
             return True
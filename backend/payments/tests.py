@@ -1,3 +1,655 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import threading
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.admin.sites import site
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from orders.models import Order
+from users.models import User
+from .admin import PaymentAdmin
+from .bulk_refunds import process_bulk_refunds
+from .events import make_status_token, payment_status_broker, publish_transaction_status, status_snapshot
+from .ledger import post_capture, post_fee, post_refund, recompute_balances, unbalanced_postings
+from .models import (
+    LedgerEntry, MpesaCallback, MpesaTransaction, OrderBalance, Payment, PaymentBalance, Refund, Transaction
+)
+from .mpesa_service import MpesaGateway
+from .reconciliation import AMOUNT_DRIFT, INVALID, MISSING, STATUS_DRIFT, StatementReconciler
+from .resilience import GatewayUnavailable, ProviderGuard
+from .services import SimulatedPaymentGateway, payment_gateway
+from .simulator import LatencyProfile, PaymentProviderSimulator, SimulatorConfig, SimulatorTransport
+
+
+def create_order(user, total=Decimal('100.00')):
+    return Order.objects.create(
+        user=user, shipping_first_name='A', shipping_last_name='B', shipping_address='1 Main St',
+        shipping_city='Nairobi', shipping_state='NRB', shipping_zip_code='00100', payment_method='card',
+        subtotal=total, shipping_cost=0, tax_amount=0, total=total,
+    )
+
+
+class PaymentTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='shopper@example.com', username='shopper', password='x')
+
+    def setUp(self):
+        self.order = create_order(self.user)
+
+    def create_payment(self, amount='100.00', status='completed', **fields):
+        return Payment.objects.create(
+            order=self.order, user=self.user, amount=Decimal(amount), status=status,
+            processed_at=timezone.now() if status == 'completed' else None, **fields
+        )
+
+
+class LedgerTests(PaymentTestCase):
+    """Every posting balances and the materialized balances match the ledger"""
+
+    def assertBalances(self, payment, captured, refunded='0', fees='0', order_captured=None):
+        expected = (Decimal(captured), Decimal(refunded), Decimal(fees))
+        balance = PaymentBalance.objects.get(payment=payment)
+        self.assertEqual((balance.captured, balance.refunded, balance.fees), expected)
+        balance = OrderBalance.objects.get(order=payment.order)
+        self.assertEqual(
+            (balance.captured, balance.refunded, balance.fees),
+            (Decimal(order_captured or captured),) + expected[1:],
+        )
+        self.assertFalse(unbalanced_postings().exists())
+        self.assertEqual(recompute_balances(PaymentBalance, 'payment'), [])
+        self.assertEqual(recompute_balances(OrderBalance, 'order'), [])
+
+    def test_capture_refund_and_fee_post_balanced_pairs(self):
+        payment = self.create_payment()
+        Refund.objects.create(payment=payment, amount=Decimal('30.00'), status='completed')
+        post_fee(payment, Decimal('2.50'), 'fee_1')
+
+        self.assertEqual(LedgerEntry.objects.count(), 6)
+        self.assertEqual(LedgerEntry.objects.aggregate(total=Sum('amount'))['total'], 0)
+        self.assertBalances(payment, '100.00', '30.00', '2.50')
+
+    def test_postings_are_idempotent(self):
+        payment = self.create_payment()
+        refund = Refund.objects.create(payment=payment, amount=Decimal('10.00'), status='completed')
+
+        self.assertFalse(post_capture(payment))
+        self.assertFalse(post_refund(refund))
+        self.assertEqual(LedgerEntry.objects.count(), 4)
+        self.assertBalances(payment, '100.00', '10.00')
+
+    def test_pending_payment_posts_nothing_until_completed(self):
+        payment = self.create_payment(status='pending')
+        self.assertFalse(LedgerEntry.objects.exists())
+
+        payment.status = 'completed'
+        payment.save()
+        self.assertBalances(payment, '100.00')
+
+    def test_recompute_repairs_drifted_balances(self):
+        payment = self.create_payment()
+        PaymentBalance.objects.filter(payment=payment).update(captured=Decimal('1.00'))
+
+        drift = recompute_balances(PaymentBalance, 'payment', repair=True)
+        self.assertEqual([key for key, _, _ in drift], [payment.pk])
+        self.assertBalances(payment, '100.00')
+
+    def test_admin_mark_as_completed_posts_captures(self):
+        pending = self.create_payment(status='pending')
+        completed = self.create_payment(amount='20.00')
+
+        with mock.patch.object(PaymentAdmin, 'message_user') as message_user:
+            PaymentAdmin(Payment, site).mark_as_completed(None, Payment.objects.filter(pk__in=[pending.pk, completed.pk]))
+
+        message_user.assert_called_once_with(None, '1 payment(s) were marked as completed.')
+        self.assertEqual(LedgerEntry.objects.filter(kind='capture', account='provider').count(), 2)
+        self.assertBalances(pending, '100.00', order_captured='120.00')
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.payment_status, self.order.amount_paid), ('paid', Decimal('120.00')))
+
+
+class ProviderGuardTests(SimpleTestCase):
+    """The breaker trips on repeated failures, fails fast, and lets one probe through"""
+
+    def setUp(self):
+        cache.clear()
+        self.enterContext(mock.patch('payments.resilience.logger'))
+        self.guard = ProviderGuard('test', failure_threshold=2, reset_timeout=30, max_concurrent=1, acquire_timeout=0)
+
+    def fail(self):
+        raise requests.exceptions.ConnectionError('down')
+
+    def trip(self):
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                self.guard.call(self.fail)
+
+    def test_opens_after_threshold_and_fails_fast(self):
+        self.trip()
+        self.assertEqual(self.guard.state, 'open')
+
+        called = mock.Mock()
+        with self.assertRaises(GatewayUnavailable) as raised:
+            self.guard.call(called)
+        called.assert_not_called()
+        self.assertGreater(raised.exception.retry_after, 0)
+
+    def test_server_errors_count_as_failures(self):
+        for _ in range(2):
+            self.guard.call(lambda: mock.Mock(status_code=502))
+        self.assertEqual(self.guard.state, 'open')
+
+    def test_half_open_lets_a_single_probe_through_and_closes_on_success(self):
+        self.trip()
+        with mock.patch('payments.resilience.time.time', return_value=timezone.now().timestamp() + 31):
+            self.assertEqual(self.guard.state, 'half_open')
+            self.assertEqual(self.guard.call(lambda: 'ok'), 'ok')
+        self.assertEqual(self.guard.state, 'closed')
+
+    def test_failed_probe_reopens_the_circuit(self):
+        self.trip()
+        with mock.patch('payments.resilience.time.time', return_value=timezone.now().timestamp() + 31):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                self.guard.call(self.fail)
+            self.assertEqual(self.guard.state, 'open')
+
+    def test_bulkhead_rejects_calls_beyond_the_concurrency_limit(self):
+        def nested():
+            return self.guard.call(lambda: 'inner')
+
+        with self.assertRaises(GatewayUnavailable) as raised:
+            self.guard.call(nested)
+        self.assertEqual(raised.exception.reason, 'too many concurrent requests')
+
+
+class MpesaCallbackTests(PaymentTestCase):
+    """Callbacks settle the transaction however they race the STK push bookkeeping"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def callback(self, checkout_request_id, result_code=0):
+        stk_callback = {
+            'MerchantRequestID': 'm-1',
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': result_code,
+            'ResultDesc': 'Processed' if result_code == 0 else 'Request cancelled by user',
+        }
+        if result_code == 0:
+            stk_callback['CallbackMetadata'] = {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'SIM1234'}]}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('mpesa-callback'), {'Body': {'stkCallback': stk_callback}}, format='json'
+            )
+        self.assertEqual(response.json()['ResultCode'], 0)
+
+    def initiate(self, stk_push):
+        with mock.patch('payments.views.mpesa_gateway.stk_push', side_effect=stk_push), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('mpesa-initiate'), {'order': self.order.id, 'phone_number': '0712345678'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        return MpesaTransaction.objects.select_related('payment__order').get(id=response.data['transaction_id'])
+
+    def accepted(self, checkout_request_id):
+        return {
+            'success': True,
+            'merchant_request_id': 'm-1',
+            'checkout_request_id': checkout_request_id,
+            'customer_message': 'Success. Request accepted for processing',
+        }
+
+    def test_callback_after_push_settles_the_payment(self):
+        mpesa_transaction = self.initiate(lambda **kwargs: self.accepted('ws_CO_1'))
+        self.assertEqual(
+            cache.get(payment_status_broker.cache_key(mpesa_transaction.id))['status'], 'pending'
+        )
+        self.callback('ws_CO_1')
+
+        mpesa_transaction.refresh_from_db()
+        self.assertEqual(mpesa_transaction.status, 'successful')
+        self.assertEqual(mpesa_transaction.transaction_id, 'SIM1234')
+        self.assertEqual(mpesa_transaction.payment.status, 'completed')
+        self.assertEqual(mpesa_transaction.callbacks.count(), 1)
+        self.assertEqual(
+            cache.get(payment_status_broker.cache_key(mpesa_transaction.id))['status'], 'successful'
+        )
+
+    def test_callback_that_beats_the_push_bookkeeping_is_parked_then_settled(self):
+        def stk_push(**kwargs):
+            # Daraja answers before MpesaPaymentView has saved the checkout_request_id
+            with self.assertLogs('payments.views', 'WARNING'):
+                self.callback('ws_CO_2')
+            self.assertTrue(MpesaCallback.objects.filter(transaction=None, checkout_request_id='ws_CO_2').exists())
+            return self.accepted('ws_CO_2')
+
+        mpesa_transaction = self.initiate(stk_push)
+
+        self.assertEqual(mpesa_transaction.status, 'successful')
+        self.assertEqual(mpesa_transaction.payment.status, 'completed')
+        self.assertEqual(mpesa_transaction.payment.order.status, 'confirmed')
+        self.assertFalse(MpesaCallback.objects.filter(transaction=None).exists())
+        self.assertEqual(mpesa_transaction.callbacks.count(), 1)
+        self.assertEqual(
+            cache.get(payment_status_broker.cache_key(mpesa_transaction.id))['status'], 'successful'
+        )
+
+    def test_repeated_callback_does_not_change_a_settled_transaction(self):
+        mpesa_transaction = self.initiate(lambda **kwargs: self.accepted('ws_CO_3'))
+        self.callback('ws_CO_3')
+        self.callback('ws_CO_3', result_code=1032)
+
+        mpesa_transaction.refresh_from_db()
+        self.assertEqual(mpesa_transaction.status, 'successful')
+        self.assertEqual(mpesa_transaction.payment.status, 'completed')
+        self.assertEqual(mpesa_transaction.callbacks.count(), 2)
+
+
+class TransactionEventsTests(PaymentTestCase):
+    """Long-poll and SSE subscribers see every status change and never an older one"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        payment = self.create_payment(status='pending')
+        self.mpesa_transaction = MpesaTransaction.objects.create(
+            payment=payment, phone_number='254712345678', amount=payment.amount,
+            checkout_request_id='ws_CO_9', status='pending'
+        )
+        self.url = reverse('mpesa-events', args=[self.mpesa_transaction.id])
+        self.token = make_status_token(self.mpesa_transaction)
+
+    def snapshot(self, status):
+        self.mpesa_transaction.status = status
+        return status_snapshot(self.mpesa_transaction)
+
+    async def test_rejects_an_invalid_token(self):
+        response = await self.async_client.get(self.url, {'token': 'forged'})
+        self.assertEqual(response.status_code, 403)
+
+    async def test_long_poll_seeds_the_cache_from_the_db(self):
+        response = await self.async_client.get(self.url, {'token': self.token})
+
+        self.assertEqual(response.json()['status'], 'pending')
+        self.assertEqual((await payment_status_broker.get(self.mpesa_transaction.id))['status'], 'pending')
+
+    async def test_long_poll_wakes_on_publish(self):
+        request = asyncio.ensure_future(
+            self.async_client.get(self.url, {'token': self.token, 'since': 'pending', 'wait': 5})
+        )
+        await asyncio.sleep(0.1)
+        self.assertFalse(request.done())
+
+        payment_status_broker.publish(self.snapshot('successful'))
+        response = await asyncio.wait_for(request, 2)
+        self.assertEqual(response.json()['status'], 'successful')
+
+    async def test_event_stream_closes_on_a_final_status(self):
+        payment_status_broker.publish(self.snapshot('failed'))
+
+        response = await self.async_client.get(
+            self.url, {'token': self.token}, headers={'Accept': 'text/event-stream'}
+        )
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = [line[len('data: '):] for line in body.splitlines() if line.startswith('data: ')]
+        self.assertEqual([json.loads(event)['status'] for event in events], ['failed'])
+
+    async def test_seed_never_replaces_a_published_status(self):
+        payment_status_broker.publish(self.snapshot('successful'))
+
+        # A subscriber that read 'pending' from the DB before the callback committed
+        seeded = await payment_status_broker.seed(self.snapshot('pending'))
+
+        self.assertEqual(seeded['status'], 'successful')
+        self.assertEqual((await payment_status_broker.get(self.mpesa_transaction.id))['status'], 'successful')
+
+    def test_publish_never_moves_a_status_back(self):
+        publish_transaction_status(self.mpesa_transaction)
+        payment_status_broker.publish(self.snapshot('successful'))
+        payment_status_broker.publish(self.snapshot('pending'))
+
+        self.assertEqual(
+            cache.get(payment_status_broker.cache_key(self.mpesa_transaction.id))['status'], 'successful'
+        )
+
+
+class RefundViewTests(PaymentTestCase):
+    """Refunds commit before the gateway call and record its outcome afterwards"""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.payment = self.create_payment()
+
+    def request_refund(self, amount, **gateway):
+        with mock.patch.object(payment_gateway, 'create_refund', **gateway) as create_refund:
+            response = self.client.post(
+                reverse('refund-list'), {'payment': str(self.payment.pk), 'amount': amount}, format='json'
+            )
+        return response, create_refund
+
+    def test_successful_refund_updates_the_payment(self):
+        def create_refund(refund):
+            # The refund is already saved as processing when the gateway is called
+            self.assertEqual(Refund.objects.get(pk=refund.pk).status, 'processing')
+            return {'id': 're_1', 'status': 'succeeded'}
+
+        response, _ = self.request_refund('100.00', side_effect=create_refund)
+
+        self.assertEqual(response.status_code, 201)
+        refund = Refund.objects.get()
+        self.assertEqual((refund.status, refund.provider_refund_id), ('completed', 're_1'))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'refunded')
+        self.assertTrue(self.payment.transactions.filter(type='refund', success=True).exists())
+
+    def test_gateway_error_marks_the_refund_failed(self):
+        response, _ = self.request_refund('40.00', side_effect=Exception('card expired'))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Refund.objects.get().status, 'failed')
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+
+    def test_open_circuit_returns_503(self):
+        response, _ = self.request_refund(
+            '40.00', side_effect=GatewayUnavailable('stripe', 'circuit open', 12)
+        )
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '12')
+        self.assertEqual(Refund.objects.get().status, 'failed')
+
+    def test_refunds_in_flight_count_against_the_refundable_amount(self):
+        Refund.objects.create(payment=self.payment, amount=Decimal('80.00'), status='processing')
+
+        response, create_refund = self.request_refund('30.00')
+
+        self.assertEqual(response.status_code, 400)
+        create_refund.assert_not_called()
+
+
+@override_settings(MPESA_BUSINESS_SHORTCODE='174379', MPESA_PASSKEY='passkey', MPESA_CALLBACK_URL='https://shop.test/cb/')
+class SimulatorTests(SimpleTestCase):
+    """The gateways run end to end against the in-process provider simulator"""
+
+    def setUp(self):
+        cache.clear()
+        self.callbacks = []
+        self.delivered = threading.Event()
+
+    def simulator(self, **config):
+        def record(url, payload, headers=None):
+            self.callbacks.append((url, payload))
+            self.delivered.set()
+
+        config.setdefault('callback_delay', '0')
+        return PaymentProviderSimulator(SimulatorConfig(seed=7, **config), callback_sender=record)
+
+    def test_latency_specs(self):
+        self.assertEqual(LatencyProfile.parse('0.2').sample(), 0.2)
+        uniform = LatencyProfile.parse('uniform:0.1,0.5')
+        self.assertEqual((uniform.mean, uniform.spread), (0.3, 0.2))
+        self.assertTrue(all(0.1 <= uniform.sample() <= 0.5 for _ in range(50)))
+        self.assertGreaterEqual(LatencyProfile.parse('normal:0,1').sample(), 0)
+        with self.assertRaises(ValueError):
+            LatencyProfile.parse('pareto:1')
+
+    def test_stk_push_and_callback(self):
+        gateway = MpesaGateway(base_url='http://sim', http=SimulatorTransport(self.simulator()))
+
+        result = gateway.stk_push('254712345678', 100, 'ORDER1', 'Payment for order 1')
+
+        self.assertTrue(result['success'])
+        self.assertTrue(self.delivered.wait(2))
+        url, payload = self.callbacks[0]
+        self.assertEqual(url, 'https://shop.test/cb/')
+        callback = payload['Body']['stkCallback']
+        self.assertEqual(callback['CheckoutRequestID'], result['checkout_request_id'])
+        self.assertEqual(callback['ResultCode'], 0)
+        items = {item['Name']: item['Value'] for item in callback['CallbackMetadata']['Item']}
+        self.assertEqual(items['Amount'], 100)
+
+    def test_magic_number_declines(self):
+        gateway = MpesaGateway(base_url='http://sim', http=SimulatorTransport(self.simulator()))
+
+        gateway.stk_push('254700001111', 100, 'ORDER1', 'Payment for order 1')
+
+        self.assertTrue(self.delivered.wait(2))
+        callback = self.callbacks[0][1]['Body']['stkCallback']
+        self.assertEqual(callback['ResultCode'], 1)
+        self.assertNotIn('CallbackMetadata', callback)
+
+    def test_dropped_callbacks_are_never_sent(self):
+        gateway = MpesaGateway(base_url='http://sim', http=SimulatorTransport(self.simulator(callback_failure_rate=1)))
+
+        with self.assertLogs('payments.simulator', 'INFO'):
+            self.assertTrue(gateway.stk_push('254712345678', 100, 'ORDER1', 'Payment')['success'])
+            self.assertFalse(self.delivered.wait(0.2))
+
+    def test_provider_errors_reach_the_gateway(self):
+        gateway = MpesaGateway(base_url='http://sim', http=SimulatorTransport(self.simulator(failure_rate=1)))
+
+        with self.assertLogs('payments.mpesa_service', 'ERROR'):
+            result = gateway.stk_push('254712345678', 100, 'ORDER1', 'Payment')
+
+        self.assertFalse(result['success'])
+
+    def test_slow_calls_time_out(self):
+        transport = SimulatorTransport(self.simulator(latency='0.05'))
+
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            transport.get('http://sim/oauth/v1/generate?grant_type=client_credentials', timeout=0.01)
+
+    def test_card_intent_confirm_and_refund(self):
+        gateway = SimulatedPaymentGateway('http://sim', http=SimulatorTransport(self.simulator()))
+        payment = mock.Mock(id='p1', amount=Decimal('25.00'), currency='USD')
+
+        intent = gateway.create_payment_intent(payment)
+        payment.provider_payment_id = intent['id']
+        self.assertEqual(gateway.confirm_payment(payment, 'pm_card')['status'], 'succeeded')
+
+        refund = gateway.create_refund(mock.Mock(payment=payment, amount=Decimal('10.00')))
+        self.assertEqual(refund['status'], 'succeeded')
+        with self.assertRaises(requests.exceptions.HTTPError):
+            gateway.create_refund(mock.Mock(payment=payment, amount=Decimal('20.00')))
+
+
+class ReconciliationTests(PaymentTestCase):
+    """Statement rows are matched in chunks and every kind of drift is reported"""
+
+    def setUp(self):
+        super().setUp()
+        mpesa_payment = self.create_payment('100.00')
+        MpesaTransaction.objects.create(
+            payment=mpesa_payment, phone_number='254712345678', amount=Decimal('100.00'),
+            transaction_id='SIM0001', status='successful'
+        )
+        card = self.create_payment('50.00', provider_payment_id='pi_1')
+        Refund.objects.create(payment=card, amount=Decimal('20.00'), status='completed', provider_refund_id='re_1')
+        Transaction.objects.create(
+            payment=card, type='capture', amount=Decimal('50.00'), provider_transaction_id='ch_1', success=False
+        )
+
+    def reconcile(self, rows, **options):
+        reconciler = StatementReconciler(**options)
+        return reconciler, {mismatch['reference']: mismatch['kind'] for mismatch in reconciler.reconcile(rows)}
+
+    def test_reports_each_kind_of_mismatch(self):
+        reconciler, mismatches = self.reconcile([
+            {'reference': 'SIM0001', 'amount': '100.00', 'status': 'Completed'},
+            {'reference': 'pi_1', 'amount': '55.00', 'status': 'succeeded'},
+            {'reference': 're_1', 'amount': '-20.00', 'status': 'succeeded'},
+            {'reference': 'ch_1', 'amount': '50.00', 'status': 'paid'},
+            {'reference': 'SIM9999', 'amount': '10.00', 'status': 'Completed'},
+            {'reference': 'SIM0002', 'amount': 'n/a', 'status': 'Completed'},
+        ], chunk_size=4)
+
+        self.assertEqual(mismatches, {
+            'pi_1': AMOUNT_DRIFT, 'ch_1': STATUS_DRIFT, 'SIM9999': MISSING, 'SIM0002': INVALID,
+        })
+        self.assertEqual(reconciler.stats['matched'], 2)
+        self.assertEqual(reconciler.stats['lines'], 6)
+
+    def test_non_finite_amounts_are_invalid_rows(self):
+        reconciler, mismatches = self.reconcile([
+            {'reference': 'SIM0001', 'amount': 'NaN', 'status': 'Completed'},
+            {'reference': 'pi_1', 'amount': 'Infinity', 'status': 'succeeded'},
+            {'reference': 're_1', 'amount': '-inf', 'status': 'succeeded'},
+            {'reference': 'ch_1', 'amount': '50.00', 'status': 'failed'},
+        ])
+
+        self.assertEqual(mismatches, {'SIM0001': INVALID, 'pi_1': INVALID, 're_1': INVALID})
+        self.assertEqual(reconciler.stats['matched'], 1)
+
+    def test_failed_statement_row_against_a_settled_record_is_drift(self):
+        _, mismatches = self.reconcile([{'reference': 'SIM0001', 'amount': '100', 'status': 'reversed'}])
+        self.assertEqual(mismatches, {'SIM0001': STATUS_DRIFT})
+
+    def test_minor_units_and_tolerance(self):
+        _, mismatches = self.reconcile([
+            {'reference': 'pi_1', 'amount': '5000', 'status': 'succeeded'},
+            {'reference': 'SIM0001', 'amount': '10001', 'status': 'Completed'},
+        ], minor_units=True)
+        self.assertEqual(mismatches, {})
+
+    def test_query_count_is_per_chunk_not_per_row(self):
+        rows = [{'reference': f'SIM{n:04}', 'amount': '1', 'status': 'Completed'} for n in range(10)]
+        # Receipt, payment intent and provider transaction lookups for each of two chunks
+        with self.assertNumQueries(6):
+            _, mismatches = self.reconcile(rows, chunk_size=5)
+        self.assertEqual(len(mismatches), 10)
+
+    def test_command_writes_a_mismatch_report(self):
+        statement = io.StringIO('reference,amount,status\r\nSIM0001,100.00,Completed\r\nSIM9999,5,Completed\r\n')
+        report, summary = io.StringIO(), io.StringIO()
+
+        with mock.patch('sys.stdin', statement):
+            call_command('reconcile_payments', '-', stdout=report, stderr=summary)
+
+        rows = list(csv.DictReader(io.StringIO(report.getvalue())))
+        self.assertEqual([(row['reference'], row['kind']) for row in rows], [('SIM9999', MISSING)])
+        self.assertIn('1 matched', summary.getvalue())
+
+
+class BulkRefundTests(PaymentTestCase):
+    """Bulk refunds validate set-wise, call the gateway outside the transaction and settle in bulk"""
+
+    def gateway_refund(self, refund):
+        if refund.amount == Decimal('13.00'):
+            raise Exception('card expired')
+        return {'id': f're_{refund.pk.hex[:8]}', 'status': 'succeeded'}
+
+    def test_results_follow_input_order(self):
+        full = self.create_payment('100.00')
+        partial = self.create_payment('50.00')
+        pending = self.create_payment('20.00', status='pending')
+        failing = self.create_payment('13.00')
+
+        with mock.patch.object(payment_gateway, 'create_refund', side_effect=self.gateway_refund), \
+                self.assertLogs('payments.bulk_refunds', 'ERROR'):
+            results = process_bulk_refunds([
+                {'payment': full.pk},
+                {'payment': partial.pk, 'amount': Decimal('20.00')},
+                {'payment': partial.pk, 'amount': Decimal('40.00')},
+                {'payment': pending.pk},
+                {'payment': failing.pk},
+                {'payment': Payment._meta.pk.default()},
+            ], max_workers=2)
+
+        self.assertEqual([result['status'] for result in results], [
+            'completed', 'completed', 'rejected', 'rejected', 'failed', 'rejected',
+        ])
+        self.assertEqual(results[2]['error'], 'Invalid refund amount; 30.00 is refundable')
+        self.assertEqual(results[4]['error'], 'card expired')
+
+        statuses = dict(Payment.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[p.pk] for p in (full, partial, pending, failing)],
+            ['refunded', 'partially_refunded', 'pending', 'completed'],
+        )
+        self.assertEqual(Refund.objects.get(payment=failing).status, 'failed')
+        self.assertEqual(Transaction.objects.filter(type='refund').count(), 3)
+
+        # Order state and ledger are settled in the same pass
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.amount_paid, Decimal('43.00'))
+        self.assertFalse(unbalanced_postings().exists())
+        self.assertEqual(PaymentBalance.objects.get(payment=partial).refunded, Decimal('20.00'))
+
+    def test_open_refunds_count_against_the_refundable_amount(self):
+        payment = self.create_payment('100.00')
+        Refund.objects.create(payment=payment, amount=Decimal('90.00'), status='processing')
+
+        with mock.patch.object(payment_gateway, 'create_refund') as create_refund:
+            results = process_bulk_refunds([{'payment': payment.pk, 'amount': Decimal('20.00')}])
+
+        self.assertEqual(results[0]['status'], 'rejected')
+        create_refund.assert_not_called()
+
+    def test_zero_amount_is_rejected_not_a_full_refund(self):
+        payment = self.create_payment('100.00')
+
+        with mock.patch.object(payment_gateway, 'create_refund', side_effect=self.gateway_refund) as create_refund:
+            results = process_bulk_refunds([{'payment': payment.pk, 'amount': Decimal('0')}])
+        self.assertEqual(results[0]['status'], 'rejected')
+        create_refund.assert_not_called()
+
+        with mock.patch.object(payment_gateway, 'create_refund', side_effect=self.gateway_refund):
+            results = process_bulk_refunds([{'payment': payment.pk, 'amount': Decimal('30.00')}])
+        self.assertEqual((results[0]['status'], results[0]['amount']), ('completed', '30.00'))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'partially_refunded')
+
+    def test_endpoint_rejects_a_zero_amount(self):
+        payment = self.create_payment('100.00')
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(
+            email='ops@example.com', username='ops', password='x', is_staff=True
+        ))
+
+        with mock.patch.object(payment_gateway, 'create_refund') as create_refund:
+            response = client.post(
+                reverse('refund-bulk'), {'refunds': [{'payment': str(payment.pk), 'amount': '0'}]}, format='json'
+            )
+
+        self.assertEqual(response.status_code, 400)
+        create_refund.assert_not_called()
+        self.assertFalse(Refund.objects.exists())
+
+    def test_endpoint_is_staff_only_and_summarises(self):
+        payment = self.create_payment('100.00')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse('refund-bulk')
+        data = {'refunds': [{'payment': str(payment.pk)}], 'reason': 'recall'}
+
+        self.assertEqual(client.post(url, data, format='json').status_code, 403)
+
+        client.force_authenticate(User.objects.create_user(
+            email='ops@example.com', username='ops', password='x', is_staff=True
+        ))
+        with mock.patch.object(payment_gateway, 'create_refund', side_effect=self.gateway_refund):
+            response = client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['summary'], {'completed': 1})
+        self.assertEqual(Refund.objects.get().reason, 'recall')
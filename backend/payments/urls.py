@@ -13,6 +13,7 @@ urlpatterns = [
     # M-Pesa endpoints
     path('mpesa/initiate/', views.MpesaPaymentView.as_view(), name='mpesa-initiate'),
     path('mpesa/callback/', views.MpesaCallbackView.as_view(), name='mpesa-callback'),
-    path('mpesa/transactions/<uuid:transaction_id>/status/', views.MpesaTransactionStatusView.as_view(), name='mpesa-status'),
+    path('mpesa/transactions/<int:transaction_id>/status/', views.MpesaTransactionStatusView.as_view(), name='mpesa-status'),
+    path('mpesa/transactions/<int:transaction_id>/events/', views.MpesaTransactionEventsView.as_view(), name='mpesa-events'),
     path('mpesa/payment-methods/', views.MpesaPaymentMethodsView.as_view(), name='mpesa-payment-methods'),
 ]
\ No newline at end of file
@@ -1,17 +1,46 @@
+import json
+import logging
+import time
+from collections import Counter
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.conf import settings
 from django.db import transaction
-from .models import PaymentMethod, Payment, Refund, MpesaTransaction, MpesaCallback
+from django.db.models import Sum
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views import View
+from .models import PaymentMethod, Payment, Refund, Transaction, MpesaTransaction, MpesaCallback
 from .serializers import (
     PaymentMethodSerializer, CreatePaymentMethodSerializer,
     PaymentSerializer, CreatePaymentSerializer, RefundSerializer, 
     MpesaTransactionSerializer, CreateMpesaPaymentSerializer, 
-    MpesaCallbackSerializer
+    MpesaCallbackSerializer, BulkRefundSerializer
 )
+from .bulk_refunds import OPEN_REFUND_STATUSES, process_bulk_refunds
 from .services import payment_gateway
 from .mpesa_service import mpesa_gateway
+from .resilience import GatewayUnavailable
+from .events import (
+    TERMINAL_STATUSES, make_status_token, read_status_token,
+    payment_status_broker, publish_transaction_status, status_snapshot
+)
+
+logger = logging.getLogger(__name__)
+
+def gateway_unavailable_response(error):
+    """Fail-fast 503 for calls refused by the circuit breaker or bulkhead"""
+    response = Response(
+        {
+            'error': 'Payment provider is temporarily unavailable. Please try again shortly.',
+            'retry_after': error.retry_after
+        },
+        status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    response['Retry-After'] = str(error.retry_after)
+    return response
 
 class PaymentMethodViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
@@ -62,51 +91,67 @@ class PaymentViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         
         try:
-            with transaction.atomic():
-                order = serializer.validated_data['order']
-                payment_method = serializer.validated_data.get('payment_method')
-                save_payment_method = serializer.validated_data.get('save_payment_method', False)
-                
-                # Create payment
-                payment = Payment.objects.create(
-                    order=order,
-                    user=request.user,
-                    payment_method=payment_method,
-                    amount=order.total,
-                    currency='USD',
-                    status='pending'
-                )
-                
-                # Create payment intent with payment gateway
-                payment_intent = payment_gateway.create_payment_intent(payment)
-                
-                # Update payment with provider data
-                payment.provider_payment_id = payment_intent['id']
-                payment.provider_client_secret = payment_intent.get('client_secret', '')
-                payment.save()
-                
-                # Create transaction record
-                from .models import Transaction
-                Transaction.objects.create(
-                    payment=payment,
-                    type='payment',
-                    amount=payment.amount,
-                    success=True
-                )
-                
-                # If user wants to save payment method and it's a card
-                if save_payment_method and payment_method and payment_method.type == 'card':
-                    payment_method.is_default = True
-                    payment_method.save()
-                
-                response_serializer = PaymentSerializer(payment)
-                return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-                
+            order = serializer.validated_data['order']
+            payment_method = serializer.validated_data.get('payment_method')
+            save_payment_method = serializer.validated_data.get('save_payment_method', False)
+            
+            # Phase 1: record the pending payment and commit before talking to the provider
+            payment = Payment.objects.create(
+                order=order,
+                user=request.user,
+                payment_method=payment_method,
+                amount=order.total,
+                currency='USD',
+                status='pending'
+            )
         except Exception as e:
             return Response(
                 {'error': f'Payment creation failed: {str(e)}'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        
+        # Phase 2: provider call, outside any DB transaction
+        try:
+            payment_intent = payment_gateway.create_payment_intent(payment)
+        except GatewayUnavailable as e:
+            payment.status = 'cancelled'
+            payment.error_code = 'provider_unavailable'
+            payment.error_message = str(e)
+            payment.save(update_fields=['status', 'error_code', 'error_message', 'updated_at'])
+            return gateway_unavailable_response(e)
+        except Exception as e:
+            payment.status = 'failed'
+            payment.error_message = str(e)
+            payment.save(update_fields=['status', 'error_message', 'updated_at'])
+            return Response(
+                {'error': f'Payment creation failed: {str(e)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Phase 3: mark the payment as submitted to the provider
+        with transaction.atomic():
+            payment.provider_payment_id = payment_intent['id']
+            payment.provider_client_secret = payment_intent.get('client_secret', '')
+            payment.save(update_fields=['provider_payment_id', 'provider_client_secret', 'updated_at'])
+            
+            # Log the provider call; money is only recorded in the ledger once captured
+            Transaction.objects.create(
+                payment=payment,
+                type='authorization',
+                amount=payment.amount,
+                currency=payment.currency,
+                provider_transaction_id=payment_intent['id'],
+                provider_data={'status': payment_intent['status']},
+                success=True
+            )
+            
+            # If user wants to save payment method and it's a card
+            if save_payment_method and payment_method and payment_method.type == 'card':
+                payment_method.is_default = True
+                payment_method.save()
+        
+        response_serializer = PaymentSerializer(payment)
+        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
     
     @action(detail=True, methods=['post'])
     def confirm(self, request, pk=None):
@@ -128,11 +173,10 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 payment.processed_at = timezone.now()
                 payment.save()
                 
-                # Update order status
+                # Payment status is synced onto the order by Payment.save
                 order = payment.order
-                order.payment_status = 'paid'
                 order.status = 'confirmed'
-                order.save()
+                order.save(update_fields=['status', 'updated_at'])
                 
                 return Response({'status': 'Payment completed successfully'})
             else:
@@ -145,6 +189,9 @@ class PaymentViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
                 
+        except GatewayUnavailable as e:
+            # Never reached the provider; the payment stays pending so it can be retried
+            return gateway_unavailable_response(e)
         except Exception as e:
             payment.status = 'failed'
             payment.error_message = str(e)
@@ -184,67 +231,106 @@ class RefundViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        try:
-            with transaction.atomic():
-                payment = serializer.validated_data['payment']
-                amount = serializer.validated_data['amount']
-                reason = serializer.validated_data.get('reason', '')
-                
-                # Verify payment belongs to user
-                if payment.user != request.user:
-                    return Response(
-                        {'error': 'Payment does not belong to user'},
-                        status=status.HTTP_403_FORBIDDEN
-                    )
-                
-                # Verify payment is completed
-                if payment.status != 'completed':
-                    return Response(
-                        {'error': 'Refund can only be created for completed payments'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Verify refund amount is valid
-                if amount <= 0 or amount > payment.amount:
-                    return Response(
-                        {'error': 'Invalid refund amount'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Create refund
-                refund = Refund.objects.create(
-                    payment=payment,
-                    amount=amount,
-                    reason=reason,
-                    status='pending'
+        amount = serializer.validated_data['amount']
+        reason = serializer.validated_data.get('reason', '')
+        
+        # Phase 1: validate against the locked payment and commit the refund as processing
+        with transaction.atomic():
+            payment = Payment.objects.select_for_update().get(pk=serializer.validated_data['payment'].pk)
+            
+            # Verify payment belongs to user
+            if payment.user != request.user:
+                return Response(
+                    {'error': 'Payment does not belong to user'},
+                    status=status.HTTP_403_FORBIDDEN
                 )
-                
-                # Process refund with payment gateway
-                refund_intent = payment_gateway.create_refund(refund)
-                
-                # Update refund with provider data
-                refund.provider_refund_id = refund_intent['id']
-                
-                if refund_intent['status'] == 'succeeded':
-                    refund.status = 'completed'
-                    
-                    # Update payment status
-                    if amount == payment.amount:
-                        payment.status = 'refunded'
-                    else:
-                        payment.status = 'partially_refunded'
-                    payment.save()
-                
-                refund.save()
-                
-                response_serializer = RefundSerializer(refund)
-                return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-                
+            
+            # Verify payment is completed
+            if payment.status != 'completed':
+                return Response(
+                    {'error': 'Refund can only be created for completed payments'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            # Verify refund amount is valid; refunds still at the gateway already claim their share
+            claimed = payment.refunds.filter(status__in=OPEN_REFUND_STATUSES).aggregate(
+                total=Sum('amount')
+            )['total'] or 0
+            if amount <= 0 or amount > payment.amount - claimed:
+                return Response(
+                    {'error': 'Invalid refund amount'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            refund = Refund.objects.create(
+                payment=payment,
+                amount=amount,
+                reason=reason,
+                status='processing'
+            )
+        
+        # Phase 2: process refund with payment gateway, outside any DB transaction
+        try:
+            refund_intent = payment_gateway.create_refund(refund)
         except Exception as e:
+            refund.status = 'failed'
+            refund.save(update_fields=['status', 'updated_at'])
+            if isinstance(e, GatewayUnavailable):
+                return gateway_unavailable_response(e)
             return Response(
                 {'error': f'Refund creation failed: {str(e)}'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        
+        # Phase 3: record the provider outcome
+        with transaction.atomic():
+            payment = Payment.objects.select_for_update().get(pk=payment.pk)
+            
+            # Update refund with provider data
+            refund.payment = payment
+            refund.provider_refund_id = refund_intent['id']
+            Transaction.objects.create(
+                payment=payment,
+                type='refund',
+                amount=amount,
+                currency=payment.currency,
+                provider_transaction_id=refund_intent['id'],
+                provider_data={'status': refund_intent['status']},
+                success=refund_intent['status'] == 'succeeded'
+            )
+            
+            if refund_intent['status'] == 'succeeded':
+                refund.status = 'completed'
+                
+                # Update payment status
+                if amount == payment.amount:
+                    payment.status = 'refunded'
+                else:
+                    payment.status = 'partially_refunded'
+                payment.save()
+            elif refund_intent['status'] in ('failed', 'canceled'):
+                refund.status = 'failed'
+            
+            refund.save()
+        
+        response_serializer = RefundSerializer(refund)
+        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def bulk(self, request):
+        """Refund many payments in one request (staff only)"""
+        serializer = BulkRefundSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        default_reason = serializer.validated_data['reason']
+        items = [
+            {**item, 'reason': item.get('reason') or default_reason}
+            for item in serializer.validated_data['refunds']
+        ]
+        results = process_bulk_refunds(items)
+        
+        summary = Counter(result['status'] for result in results)
+        return Response({'summary': summary, 'results': results}, status=status.HTTP_200_OK)
 
 class WebhookView(APIView):
     """Handle webhooks from payment provider"""
@@ -279,12 +365,12 @@ class MpesaPaymentView(APIView):
         serializer = CreateMpesaPaymentSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         
+        order = serializer.validated_data['order']
+        phone_number = serializer.validated_data['phone_number']
+        
         try:
+            # Phase 1: record the payment as requested and commit before calling Daraja
             with transaction.atomic():
-                order = serializer.validated_data['order']
-                phone_number = serializer.validated_data['phone_number']
-                
-                # Create payment record
                 payment = Payment.objects.create(
                     order=order,
                     user=request.user,
@@ -292,56 +378,70 @@ class MpesaPaymentView(APIView):
                     currency='KES',  # M-Pesa uses Kenyan Shillings
                     status='pending'
                 )
-                
-                # Create M-Pesa transaction
                 mpesa_transaction = MpesaTransaction.objects.create(
                     payment=payment,
                     phone_number=phone_number,
                     amount=order.total,
                     status='requested'
                 )
-                
-                # Initiate STK push
+            publish_transaction_status(mpesa_transaction)
+            
+            # Phase 2: STK push, outside any DB transaction
+            try:
                 result = mpesa_gateway.stk_push(
                     phone_number=phone_number,
                     amount=order.total,
                     account_reference=f"ORDER{order.order_number}",
                     transaction_desc=f"Payment for order {order.order_number}"
                 )
+            except GatewayUnavailable as e:
+                with transaction.atomic():
+                    mpesa_transaction.status = 'cancelled'
+                    mpesa_transaction.result_description = str(e)
+                    mpesa_transaction.save(update_fields=['status', 'result_description', 'updated_at'])
+                    payment.status = 'cancelled'
+                    payment.error_code = 'provider_unavailable'
+                    payment.error_message = str(e)
+                    payment.save(update_fields=['status', 'error_code', 'error_message', 'updated_at'])
+                publish_transaction_status(mpesa_transaction)
+                return gateway_unavailable_response(e)
+            
+            # Phase 3: mark the transaction as submitted (pending) or failed
+            if result['success']:
+                mpesa_transaction.merchant_request_id = result['merchant_request_id']
+                mpesa_transaction.checkout_request_id = result['checkout_request_id']
+                mpesa_transaction.status = 'pending'
+                mpesa_transaction.save(update_fields=[
+                    'merchant_request_id', 'checkout_request_id', 'status', 'updated_at'
+                ])
+                publish_transaction_status(mpesa_transaction)
+                # A callback that beat this save was parked; settle it now
+                settle_parked_callbacks(mpesa_transaction)
+                
+                response_data = {
+                    'success': True,
+                    'message': result['customer_message'],
+                    'transaction_id': mpesa_transaction.id,
+                    'checkout_request_id': result['checkout_request_id'],
+                    'status_token': make_status_token(mpesa_transaction)
+                }
+                
+                return Response(response_data, status=status.HTTP_200_OK)
+            
+            with transaction.atomic():
+                mpesa_transaction.status = 'failed'
+                mpesa_transaction.result_description = result.get('error_message', 'STK push failed')
+                mpesa_transaction.save(update_fields=['status', 'result_description', 'updated_at'])
                 
-                if result['success']:
-                    # Update transaction with M-Pesa details
-                    mpesa_transaction.merchant_request_id = result['merchant_request_id']
-                    mpesa_transaction.checkout_request_id = result['checkout_request_id']
-                    mpesa_transaction.status = 'pending'
-                    mpesa_transaction.save()
-                    
-                    # Start background task to check payment status (in real implementation)
-                    # self.check_payment_status.delay(mpesa_transaction.id)
-                    
-                    response_data = {
-                        'success': True,
-                        'message': result['customer_message'],
-                        'transaction_id': mpesa_transaction.id,
-                        'checkout_request_id': result['checkout_request_id']
-                    }
-                    
-                    return Response(response_data, status=status.HTTP_200_OK)
-                else:
-                    # Update transaction with error
-                    mpesa_transaction.status = 'failed'
-                    mpesa_transaction.result_description = result.get('error_message', 'STK push failed')
-                    mpesa_transaction.save()
-                    
-                    # Update payment status
-                    payment.status = 'failed'
-                    payment.error_message = result.get('error_message', 'STK push failed')
-                    payment.save()
-                    
-                    return Response(
-                        {'error': result.get('error_message', 'STK push failed')},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+                payment.status = 'failed'
+                payment.error_message = result.get('error_message', 'STK push failed')
+                payment.save(update_fields=['status', 'error_message', 'updated_at'])
+            publish_transaction_status(mpesa_transaction)
+            
+            return Response(
+                {'error': result.get('error_message', 'STK push failed')},
+                status=status.HTTP_400_BAD_REQUEST
+            )
                     
         except Exception as e:
             logger.error(f"M-Pesa payment initiation failed: {str(e)}")
@@ -350,6 +450,90 @@ class MpesaPaymentView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+def apply_stk_callback(mpesa_transaction, callback_data):
+    """Settle the transaction and its payment from a (recorded) STK callback"""
+    stk_callback = callback_data.get('Body', {}).get('stkCallback', {})
+    callback_metadata = stk_callback.get('CallbackMetadata', {})
+    result_code = stk_callback.get('ResultCode')
+    result_desc = stk_callback.get('ResultDesc')
+    
+    with transaction.atomic():
+        # Locked so a retried or parked callback is never applied twice
+        mpesa_transaction = MpesaTransaction.objects.select_for_update().select_related(
+            'payment__order'
+        ).get(pk=mpesa_transaction.pk)
+        if mpesa_transaction.status in TERMINAL_STATUSES:
+            logger.info(f"M-Pesa callback for settled transaction ignored: {mpesa_transaction.checkout_request_id}")
+            return mpesa_transaction
+        
+        # Update transaction with callback data
+        mpesa_transaction.result_code = result_code
+        mpesa_transaction.result_description = result_desc
+        
+        if result_code == 0:
+            # Payment successful
+            mpesa_transaction.status = 'successful'
+            mpesa_transaction.completed_at = timezone.now()
+            
+            # Extract transaction details from metadata
+            if callback_metadata and isinstance(callback_metadata, dict):
+                items = callback_metadata.get('Item', [])
+                for item in items:
+                    if item.get('Name') == 'MpesaReceiptNumber':
+                        mpesa_transaction.transaction_id = item.get('Value', '')
+                    elif item.get('Name') == 'Amount':
+                        mpesa_transaction.amount = item.get('Value', mpesa_transaction.amount)
+                    elif item.get('Name') == 'PhoneNumber':
+                        mpesa_transaction.phone_number = item.get('Value', mpesa_transaction.phone_number)
+            
+            # Update payment status
+            payment = mpesa_transaction.payment
+            payment.status = 'completed'
+            payment.processed_at = timezone.now()
+            payment.save()
+            
+            # Payment status is synced onto the order by Payment.save
+            order = payment.order
+            order.status = 'confirmed'
+            order.save(update_fields=['status', 'updated_at'])
+            
+            logger.info(f"M-Pesa payment successful: {mpesa_transaction.transaction_id}")
+            
+        else:
+            # Payment failed
+            mpesa_transaction.status = 'failed'
+            
+            # Update payment status
+            payment = mpesa_transaction.payment
+            payment.status = 'failed'
+            payment.error_message = result_desc
+            payment.save()
+            
+            logger.warning(f"M-Pesa payment failed: {result_desc}")
+        
+        mpesa_transaction.save()
+        transaction.on_commit(lambda: publish_transaction_status(mpesa_transaction))
+    return mpesa_transaction
+
+def settle_parked_callbacks(mpesa_transaction):
+    """
+    Apply callbacks that arrived before the transaction had its checkout_request_id.
+    Returns the settled transaction, or None if nothing was parked.
+    """
+    with transaction.atomic():
+        # Claiming under a row lock lets the callback view and MpesaPaymentView
+        # race to settle the same parked callback without applying it twice
+        parked = list(MpesaCallback.objects.select_for_update().filter(
+            transaction__isnull=True,
+            checkout_request_id=mpesa_transaction.checkout_request_id
+        ).order_by('received_at', 'id'))
+        if not parked:
+            return None
+        MpesaCallback.objects.filter(id__in=[callback.id for callback in parked]).update(
+            transaction=mpesa_transaction
+        )
+        return apply_stk_callback(mpesa_transaction, parked[-1].callback_data)
+
 class MpesaCallbackView(APIView):
     """Handle M-Pesa STK push callback"""
     permission_classes = []
@@ -360,77 +544,37 @@ class MpesaCallbackView(APIView):
             # Log the callback for debugging
             logger.info(f"M-Pesa callback received: {json.dumps(request.data)}")
             
-            # Save callback data
             callback_data = request.data
-            MpesaCallback.objects.create(callback_data=callback_data)
-            
-            # Parse callback data
-            body = callback_data.get('Body', {})
-            stk_callback = body.get('stkCallback', {})
-            callback_metadata = stk_callback.get('CallbackMetadata', {})
+            stk_callback = callback_data.get('Body', {}).get('stkCallback', {})
             checkout_request_id = stk_callback.get('CheckoutRequestID')
-            result_code = stk_callback.get('ResultCode')
-            result_desc = stk_callback.get('ResultDesc')
             
             if not checkout_request_id:
                 return Response({'ResultCode': 1, 'ResultDesc': 'Invalid callback'})
             
             # Find the transaction
-            try:
-                mpesa_transaction = MpesaTransaction.objects.get(
-                    checkout_request_id=checkout_request_id
+            mpesa_transaction = MpesaTransaction.objects.filter(
+                checkout_request_id=checkout_request_id
+            ).first()
+            if mpesa_transaction is not None:
+                MpesaCallback.objects.create(
+                    transaction=mpesa_transaction,
+                    checkout_request_id=checkout_request_id,
+                    callback_data=callback_data
                 )
-            except MpesaTransaction.DoesNotExist:
-                logger.error(f"M-Pesa transaction not found: {checkout_request_id}")
-                return Response({'ResultCode': 1, 'ResultDesc': 'Transaction not found'})
-            
-            # Update transaction with callback data
-            mpesa_transaction.result_code = result_code
-            mpesa_transaction.result_description = result_desc
-            
-            if result_code == 0:
-                # Payment successful
-                mpesa_transaction.status = 'successful'
-                mpesa_transaction.completed_at = timezone.now()
-                
-                # Extract transaction details from metadata
-                if callback_metadata and isinstance(callback_metadata, dict):
-                    items = callback_metadata.get('Item', [])
-                    for item in items:
-                        if item.get('Name') == 'MpesaReceiptNumber':
-                            mpesa_transaction.transaction_id = item.get('Value', '')
-                        elif item.get('Name') == 'Amount':
-                            mpesa_transaction.amount = item.get('Value', mpesa_transaction.amount)
-                        elif item.get('Name') == 'PhoneNumber':
-                            mpesa_transaction.phone_number = item.get('Value', mpesa_transaction.phone_number)
-                
-                # Update payment status
-                payment = mpesa_transaction.payment
-                payment.status = 'completed'
-                payment.processed_at = timezone.now()
-                payment.save()
-                
-                # Update order status
-                order = payment.order
-                order.payment_status = 'paid'
-                order.status = 'confirmed'
-                order.save()
-                
-                logger.info(f"M-Pesa payment successful: {mpesa_transaction.transaction_id}")
-                
-            else:
-                # Payment failed
-                mpesa_transaction.status = 'failed'
-                
-                # Update payment status
-                payment = mpesa_transaction.payment
-                payment.status = 'failed'
-                payment.error_message = result_desc
-                payment.save()
-                
-                logger.warning(f"M-Pesa payment failed: {result_desc}")
+                apply_stk_callback(mpesa_transaction, callback_data)
+                return Response({'ResultCode': 0, 'ResultDesc': 'Success'})
+            
+            # Daraja can call back before MpesaPaymentView has saved the
+            # checkout_request_id: park the callback for the view to settle
+            MpesaCallback.objects.create(checkout_request_id=checkout_request_id, callback_data=callback_data)
+            logger.warning(f"M-Pesa callback parked for unknown transaction: {checkout_request_id}")
             
-            mpesa_transaction.save()
+            # The view may have saved the id between the lookup and the park
+            mpesa_transaction = MpesaTransaction.objects.filter(
+                checkout_request_id=checkout_request_id
+            ).first()
+            if mpesa_transaction is not None:
+                settle_parked_callbacks(mpesa_transaction)
             
             return Response({'ResultCode': 0, 'ResultDesc': 'Success'})
             
@@ -454,6 +598,9 @@ class MpesaTransactionStatusView(APIView):
                 # In production, you might want to query M-Pesa API for current status
                 # status_data = mpesa_gateway.query_transaction_status(mpesa_transaction.checkout_request_id)
                 pass
+            elif mpesa_transaction.status in TERMINAL_STATUSES:
+                # Keeps the push channel's cached snapshot warm for late subscribers
+                publish_transaction_status(mpesa_transaction)
             
             serializer = MpesaTransactionSerializer(mpesa_transaction)
             return Response(serializer.data)
@@ -464,6 +611,68 @@ class MpesaTransactionStatusView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
+class MpesaTransactionEventsView(View):
+    """
+    Push channel for M-Pesa transaction status, authorised by the signed
+    status_token returned from MpesaPaymentView (EventSource can't send the JWT).
+
+    With ``Accept: text/event-stream`` this is a Server-Sent Events stream that
+    emits a ``status`` event on every change and closes on a final status.
+    Otherwise it is a long-poll that answers as soon as the status differs from
+    ``?since=`` or after ``?wait=`` seconds. Waiting is async, so serve the
+    project through ASGI (backend.asgi) to hold many clients cheaply.
+    """
+
+    async def get(self, request, transaction_id):
+        if not read_status_token(request.GET.get('token', ''), transaction_id):
+            return JsonResponse({'error': 'Invalid or expired status token'}, status=403)
+
+        snapshot = await self.current_snapshot(transaction_id)
+        if snapshot is None:
+            return JsonResponse({'error': 'Transaction not found'}, status=404)
+
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            response = StreamingHttpResponse(
+                self.event_stream(transaction_id, snapshot),
+                content_type='text/event-stream'
+            )
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        try:
+            wait = min(float(request.GET.get('wait', 25)), 30)
+        except ValueError:
+            return JsonResponse({'error': 'wait must be a number of seconds'}, status=400)
+
+        since = request.GET.get('since')
+        if since and snapshot['status'] == since and since not in TERMINAL_STATUSES:
+            snapshot = await payment_status_broker.wait(transaction_id, since=since, timeout=wait) or snapshot
+        return JsonResponse(snapshot)
+
+    async def current_snapshot(self, transaction_id):
+        snapshot = await payment_status_broker.get(transaction_id)
+        if snapshot is None:
+            # First subscriber after a cache miss: read once from the DB and seed the
+            # cache, unless a status was published while the query ran
+            mpesa_transaction = await MpesaTransaction.objects.filter(id=transaction_id).afirst()
+            if mpesa_transaction is None:
+                return None
+            snapshot = await payment_status_broker.seed(status_snapshot(mpesa_transaction))
+        return snapshot
+
+    async def event_stream(self, transaction_id, snapshot):
+        yield "retry: 3000\n\n"
+        yield f"event: status\ndata: {json.dumps(snapshot)}\n\n"
+        deadline = time.monotonic() + getattr(settings, 'PAYMENT_STATUS_STREAM_TIMEOUT', 300)
+        while snapshot['status'] not in TERMINAL_STATUSES and time.monotonic() < deadline:
+            latest = await payment_status_broker.wait(transaction_id, since=snapshot['status'], timeout=15)
+            if latest is None or latest['status'] == snapshot['status']:
+                yield ": keep-alive\n\n"
+                continue
+            snapshot = latest
+            yield f"event: status\ndata: {json.dumps(snapshot)}\n\n"
+
 class MpesaPaymentMethodsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
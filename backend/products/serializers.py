@@ -23,8 +23,16 @@ class ProductSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     average_rating = serializers.DecimalField(max_digits=3, decimal_places=2, read_only=True)
     review_count = serializers.IntegerField(read_only=True)
+    rating_histogram = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
         fields = '__all__'
+    
+    def get_rating_histogram(self, obj):
+        # From the ProductRating row joined by reviews.ratings.with_ratings
+        summary = getattr(obj, 'rating_summary', None)
+        if summary is None:
+            return {str(stars): 0 for stars in range(1, 6)}
+        return summary.histogram
 
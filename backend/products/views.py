@@ -9,6 +9,8 @@ from .serializers import (
     ProductImageSerializer, ProductVariantSerializer
 )
 from .filters import ProductFilter
+from analytics.trending import SIGNALS, trending
+from reviews.ratings import with_ratings
 
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.filter(is_active=True)
@@ -17,18 +19,19 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     lookup_field = 'slug'
 
 class ProductViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Product.objects.filter(is_active=True).prefetch_related('images', 'variants')
+    queryset = Product.objects.filter(is_active=True).select_related('category').prefetch_related('images', 'variants')
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_class = ProductFilter
     search_fields = ['name', 'description', 'brand', 'category__name']
-    ordering_fields = ['price', 'created_at', 'name', 'rating']
+    ordering_fields = ['price', 'created_at', 'name', 'average_rating', 'review_count']
     ordering = ['-created_at']
     lookup_field = 'slug'
     
     def get_queryset(self):
-        queryset = super().get_queryset()
+        # average_rating and review_count come from the ProductRating aggregates
+        queryset = with_ratings(super().get_queryset())
         
         # Handle category filtering
         category_slug = self.request.query_params.get('category')
@@ -48,10 +51,10 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=True, methods=['get'])
     def similar(self, request, slug=None):
         product = self.get_object()
-        similar_products = Product.objects.filter(
+        similar_products = with_ratings(Product.objects.filter(
             category=product.category,
             is_active=True
-        ).exclude(id=product.id)[:4]
+        ).select_related('category').prefetch_related('images', 'variants')).exclude(id=product.id)[:4]
         serializer = self.get_serializer(similar_products, many=True)
         return Response(serializer.data)
     
@@ -63,6 +66,35 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = self.get_serializer(featured_products, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        # Ranked from the in-memory trending sketches; see analytics/trending.py
+        signal = request.query_params.get('signal', 'score')
+        if signal not in SIGNALS:
+            return Response(
+                {'error': f"signal must be one of {', '.join(SIGNALS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        except ValueError:
+            limit = 10
+        
+        # Over-fetch so inactive products can be skipped without a second round
+        ranked = trending.top(signal, k=limit * 2)
+        products = self.get_queryset().in_bulk([product_id for product_id, _ in ranked])
+        results = []
+        for product_id, score in ranked:
+            product = products.get(product_id)
+            if product is None:
+                continue
+            data = self.get_serializer(product).data
+            data['trending_score'] = round(score, 2)
+            results.append(data)
+            if len(results) == limit:
+                break
+        return Response(results)
+    
     @action(detail=False, methods=['get'])
     def search_suggestions(self, request):
         query = request.query_params.get('q', '')
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Review
+from .ratings import delete_reviews, set_review_approval
 
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
@@ -30,6 +31,7 @@ class ReviewAdmin(admin.ModelAdmin):
     
     readonly_fields = (
         'created_at',
+        'moderated_at',
         'user_email_display',
         'product_name_display'
     )
@@ -53,6 +55,7 @@ class ReviewAdmin(admin.ModelAdmin):
         ('Status & Metadata', {
             'fields': (
                 'is_approved',
+                'moderated_at',
                 'created_at'
             )
         }),
@@ -79,7 +82,7 @@ class ReviewAdmin(admin.ModelAdmin):
     
     def approve_reviews(self, request, queryset):
         """Admin action to approve selected reviews"""
-        updated = queryset.update(is_approved=True)
+        updated = set_review_approval(queryset, True)
         self.message_user(
             request, 
             f'{updated} review(s) were successfully approved.'
@@ -88,13 +91,17 @@ class ReviewAdmin(admin.ModelAdmin):
     
     def reject_reviews(self, request, queryset):
         """Admin action to reject selected reviews"""
-        updated = queryset.update(is_approved=False)
+        updated = set_review_approval(queryset, False)
         self.message_user(
             request, 
             f'{updated} review(s) were successfully rejected.'
         )
     reject_reviews.short_description = "Reject selected reviews"
     
+    def delete_queryset(self, request, queryset):
+        """Bulk delete that keeps the product rating aggregates in step"""
+        delete_reviews(queryset)
+    
     def get_queryset(self, request):
         """Optimize database queries by selecting related objects"""
         return super().get_queryset(request).select_related('user', 'product')
@@ -0,0 +1,73 @@
+"""
+Product review feed.
+
+``GET /api/reviews/feed/?product=<id>`` lists a product's approved reviews
+newest first, paginated by cursor on ``(created_at, id)``. Each page is one
+range scan of the (product, is_approved, created_at, id) index starting
+where the previous page ended, so page 50 costs the same as page 1; page
+numbers would count every approved review and skip OFFSET rows on each
+request. Reviews are read with their user and product in the same query,
+loading only the columns the serializer uses.
+
+The first page of each product -- what every product page asks for -- is
+cached for REVIEW_FEED_CACHE_TTL seconds as the serialized rows plus the
+next cursor. A review approved, rejected, edited or deleted drops its
+product's entry once the transaction commits (``invalidate_review_feed``).
+"""
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.utils.urls import replace_query_param
+
+from core.pagination import NewestFirstCursorPagination
+from core.utils import CacheKeys
+from .models import Review
+
+FEED_FIELDS = (
+    'id', 'product', 'user', 'rating', 'title', 'comment', 'is_approved', 'created_at',
+    'product__name', 'user__first_name', 'user__last_name', 'user__email',
+)
+
+
+def feed_queryset(product_id):
+    return Review.objects.filter(product_id=product_id, is_approved=True).select_related(
+        'user', 'product'
+    ).only(*FEED_FIELDS)
+
+
+def _cursor(link):
+    if not link:
+        return None
+    return parse_qs(urlparse(link).query)[NewestFirstCursorPagination.cursor_query_param][0]
+
+
+def review_feed(view, request, product_id):
+    """Paginated response data for one page of ``product_id``'s feed"""
+    paginator = NewestFirstCursorPagination()
+    first_page = not {paginator.cursor_query_param, paginator.page_size_query_param} & set(request.query_params)
+    key = CacheKeys.REVIEW_FEED.format(product_id)
+
+    if first_page:
+        cached = cache.get(key)
+        if cached is not None:
+            results, cursor = cached
+            next_link = None
+            if cursor:
+                next_link = replace_query_param(request.build_absolute_uri(), paginator.cursor_query_param, cursor)
+            return {'next': next_link, 'previous': None, 'results': results}
+
+    page = paginator.paginate_queryset(feed_queryset(product_id), request, view=view)
+    results = view.get_serializer(page, many=True).data
+    next_link = paginator.get_next_link()
+    if first_page:
+        cache.set(key, (results, _cursor(next_link)), getattr(settings, 'REVIEW_FEED_CACHE_TTL', 3600))
+    return {'next': next_link, 'previous': paginator.get_previous_link(), 'results': results}
+
+
+def invalidate_review_feed(product_ids):
+    """Drop the cached first pages of ``product_ids`` when the current transaction commits"""
+    keys = [CacheKeys.REVIEW_FEED.format(product_id) for product_id in set(product_ids) if product_id]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_delete_review'),
+        ('reviews', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRating',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='products.product')),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('rating_total', models.PositiveIntegerField(default=0)),
+                ('one_star', models.PositiveIntegerField(default=0)),
+                ('two_star', models.PositiveIntegerField(default=0)),
+                ('three_star', models.PositiveIntegerField(default=0)),
+                ('four_star', models.PositiveIntegerField(default=0)),
+                ('five_star', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
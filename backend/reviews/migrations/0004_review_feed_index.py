@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_delete_review'),
+        ('reviews', '0003_product_rating'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'is_approved', 'created_at', 'id'], name='reviews_rev_product_222951_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-19 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0004_review_feed_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='moderated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['is_approved', 'moderated_at', 'created_at', 'id'], name='reviews_rev_is_appr_1ca1ba_idx'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator 
 from products.models import Product  
 from django.conf import settings
@@ -12,10 +12,68 @@ class Review(models.Model):
     title = models.CharField(max_length=200)
     comment = models.TextField()
     is_approved = models.BooleanField(default=False)
+    moderated_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ['product', 'user']
+        indexes = [
+            models.Index(fields=['product', 'is_approved', 'created_at', 'id']),
+            models.Index(fields=['is_approved', 'moderated_at', 'created_at', 'id']),
+        ]
 
     def __str__(self):
         return f"Review for {self.product.name} by {self.user.email}"
+
+    def save(self, *args, **kwargs):
+        # Keeps ProductRating in step with approved reviews; see reviews/ratings.py
+        from .feed import invalidate_review_feed
+        from .ratings import rating_changes, apply_rating_changes
+        with transaction.atomic():
+            previous = None
+            if self.pk and not self._state.adding:
+                previous = Review.objects.select_for_update().filter(pk=self.pk).values(
+                    'product_id', 'rating', 'is_approved', 'created_at'
+                ).first()
+            super().save(*args, **kwargs)
+            apply_rating_changes(rating_changes(previous, self))
+            if (previous and previous['is_approved']) or self.is_approved:
+                invalidate_review_feed([previous and previous['product_id'], self.product_id])
+
+    def delete(self, *args, **kwargs):
+        from .feed import invalidate_review_feed
+        from .ratings import rating_changes, apply_rating_changes
+        with transaction.atomic():
+            previous = Review.objects.select_for_update().filter(pk=self.pk).values(
+                'product_id', 'rating', 'is_approved', 'created_at'
+            ).first()
+            result = super().delete(*args, **kwargs)
+            apply_rating_changes(rating_changes(previous, None))
+            if previous and previous['is_approved']:
+                invalidate_review_feed([previous['product_id']])
+        return result
+
+class ProductRating(models.Model):
+    """Rating aggregate over a product's approved reviews"""
+    product = models.OneToOneField(Product, primary_key=True, related_name='rating_summary', on_delete=models.CASCADE)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_total = models.PositiveIntegerField(default=0)
+    one_star = models.PositiveIntegerField(default=0)
+    two_star = models.PositiveIntegerField(default=0)
+    three_star = models.PositiveIntegerField(default=0)
+    four_star = models.PositiveIntegerField(default=0)
+    five_star = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    STAR_FIELDS = ['one_star', 'two_star', 'three_star', 'four_star', 'five_star']
+
+    @property
+    def average_rating(self):
+        return round(self.rating_total / self.review_count, 2) if self.review_count else None
+
+    @property
+    def histogram(self):
+        return {str(stars): getattr(self, field) for stars, field in enumerate(self.STAR_FIELDS, start=1)}
+
+    def __str__(self):
+        return f"Rating for product {self.product_id}"
@@ -0,0 +1,75 @@
+"""
+Review moderation queue.
+
+``GET /api/reviews/moderation/?limit=N`` returns the N oldest reviews no
+moderator has decided on yet (``is_approved=False``, ``moderated_at`` unset),
+read as one range scan of the (is_approved, moderated_at, created_at, id)
+index. ``POST /api/reviews/moderation/`` takes a batch of approve/reject
+decisions and ``moderate_reviews`` applies them set-wise: one locked read of
+the targets, one chunked UPDATE per outcome, one ``apply_rating_changes``
+call (which already groups deltas per product) and one feed invalidation
+for every affected product, however many of its reviews were in the batch.
+
+Rejected reviews keep ``is_approved=False`` but get ``moderated_at``, which
+takes them out of the queue.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .feed import invalidate_review_feed
+from .models import Review
+from .ratings import ID_CHUNK, apply_rating_changes
+
+DEFAULT_QUEUE_SIZE = 50
+MAX_BATCH_SIZE = 500
+
+QUEUE_FIELDS = (
+    'id', 'product', 'user', 'rating', 'title', 'comment', 'is_approved', 'created_at',
+    'product__name', 'user__first_name', 'user__last_name', 'user__email',
+)
+
+
+def moderation_queue(limit=DEFAULT_QUEUE_SIZE):
+    """The ``limit`` oldest undecided reviews"""
+    return Review.objects.filter(is_approved=False, moderated_at__isnull=True).select_related(
+        'user', 'product'
+    ).only(*QUEUE_FIELDS).order_by('created_at', 'id')[:limit]
+
+
+def moderate_reviews(decisions):
+    """
+    Apply ``{review_id: approved}`` decisions; returns one result per review id.
+
+    Each result is ``{'review': id, 'status': 'approved' | 'rejected' | 'not_found'}``.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        rows = {
+            review_id: (product_id, rating, was_approved, created_at)
+            for review_id, product_id, rating, was_approved, created_at in Review.objects.select_for_update().filter(
+                id__in=list(decisions)
+            ).values_list('id', 'product_id', 'rating', 'is_approved', 'created_at')
+        }
+
+        for approved in (True, False):
+            ids = [review_id for review_id in rows if decisions[review_id] is approved]
+            for start in range(0, len(ids), ID_CHUNK):
+                Review.objects.filter(id__in=ids[start:start + ID_CHUNK]).update(
+                    is_approved=approved, moderated_at=now
+                )
+
+        changed = [
+            (product_id, rating, 1 if decisions[review_id] else -1, created_at)
+            for review_id, (product_id, rating, was_approved, created_at) in rows.items()
+            if decisions[review_id] != was_approved
+        ]
+        apply_rating_changes(changed)
+        invalidate_review_feed(product_id for product_id, _, _, _ in changed)
+
+    return [
+        {
+            'review': review_id,
+            'status': 'not_found' if review_id not in rows else ('approved' if approved else 'rejected'),
+        }
+        for review_id, approved in decisions.items()
+    ]
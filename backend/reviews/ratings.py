@@ -0,0 +1,155 @@
+"""
+Per-product rating aggregates over approved reviews.
+
+``ProductRating`` holds, for every product with a review that was ever
+approved, the number of approved reviews, the sum of their ratings and a
+one-to-five star histogram. The average is ``rating_total / review_count``.
+
+Every path that changes which reviews count goes through here, inside the
+same transaction as the change itself: ``Review.save`` and ``Review.delete``
+(API create/update/approve/reject, admin edits) compare against the locked
+stored row, the admin bulk actions use ``set_review_approval`` and
+``delete_reviews``, and moderation batches use ``moderate_reviews``
+(reviews/moderation.py). Each turns the change into ``(product, rating, +-1)``
+deltas applied as ``F()`` increments, so concurrent approvals for the same
+product add up instead of overwriting each other. The same deltas, keyed on
+the review's creation day, keep the review columns of the per-product daily
+metrics current (analytics/product_metrics.py). Reviews removed by a
+cascade (a deleted user) bypass these paths; ``recompute_product_ratings``
+rebuilds every row from the reviews table in one grouped aggregate.
+
+``with_ratings`` annotates a product queryset with ``average_rating`` and
+``review_count`` from the aggregate table (one join, no per-product query).
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Greatest, NullIf
+from django.utils import timezone
+
+from .feed import invalidate_review_feed
+from .models import ProductRating, Review
+
+ID_CHUNK = 500
+
+
+def rating_changes(previous, review):
+    """``[(product_id, rating, delta, created_at)]`` from a stored row (dict) to a review instance
+
+    Either may be None.
+    """
+    changes = []
+    if previous and previous['is_approved']:
+        changes.append((previous['product_id'], previous['rating'], -1, previous['created_at']))
+    if review is not None and review.is_approved:
+        changes.append((review.product_id, review.rating, 1, review.created_at))
+    if len(changes) == 2 and changes[0][:2] == changes[1][:2]:
+        return []
+    return changes
+
+
+def apply_rating_changes(changes):
+    """Apply ``(product_id, rating, delta, created_at)`` changes to ProductRating and the daily metrics
+
+    Call inside the review's transaction.
+    """
+    from analytics.product_metrics import apply_review_changes
+    changes = list(changes)
+    apply_review_changes(changes)
+    deltas = defaultdict(lambda: defaultdict(int))
+    for product_id, rating, delta, _ in changes:
+        product = deltas[product_id]
+        product['review_count'] += delta
+        product['rating_total'] += rating * delta
+        product[ProductRating.STAR_FIELDS[rating - 1]] += delta
+    if not deltas:
+        return
+
+    ProductRating.objects.bulk_create(
+        [ProductRating(product_id=product_id) for product_id in deltas], ignore_conflicts=True
+    )
+    now = timezone.now()
+    for product_id, fields in deltas.items():
+        updates = {}
+        for field, delta in fields.items():
+            if delta > 0:
+                updates[field] = F(field) + delta
+            elif delta < 0:
+                # A row that drifted low (cascaded deletes) stops at zero until the next recompute
+                updates[field] = Greatest(F(field) + delta, Value(0))
+        if updates:
+            ProductRating.objects.filter(pk=product_id).update(updated_at=now, **updates)
+
+
+def _chunks(items):
+    for start in range(0, len(items), ID_CHUNK):
+        yield items[start:start + ID_CHUNK]
+
+
+def set_review_approval(queryset, approved):
+    """Approve or reject the reviews in ``queryset`` and mark them moderated; returns how many changed state"""
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(queryset.select_for_update().values_list(
+            'id', 'product_id', 'rating', 'is_approved', 'created_at'
+        ))
+        for ids in _chunks([row[0] for row in rows]):
+            Review.objects.filter(id__in=ids).update(is_approved=approved, moderated_at=now)
+        delta = 1 if approved else -1
+        changed = [
+            (product_id, rating, delta, created_at)
+            for _, product_id, rating, was_approved, created_at in rows if was_approved != approved
+        ]
+        apply_rating_changes(changed)
+        invalidate_review_feed(product_id for product_id, _, _, _ in changed)
+    return len(changed)
+
+
+def delete_reviews(queryset):
+    """Delete the reviews in ``queryset`` and take the approved ones out of the aggregates"""
+    with transaction.atomic():
+        rows = list(queryset.select_for_update().values_list(
+            'id', 'product_id', 'rating', 'is_approved', 'created_at'
+        ))
+        for ids in _chunks([row[0] for row in rows]):
+            Review.objects.filter(id__in=ids).delete()
+        apply_rating_changes(
+            (product_id, rating, -1, created_at) for _, product_id, rating, approved, created_at in rows if approved
+        )
+        invalidate_review_feed(product_id for _, product_id, _, approved, _ in rows if approved)
+    return len(rows)
+
+
+def recompute_product_ratings(batch_size=1000):
+    """Rebuild every ProductRating row from the approved reviews; returns the number of products"""
+    stars = {
+        field: Count('id', filter=Q(rating=stars))
+        for stars, field in enumerate(ProductRating.STAR_FIELDS, start=1)
+    }
+    totals = Review.objects.filter(is_approved=True).values('product').annotate(
+        approved=Count('id'), total=Sum('rating'), **stars
+    ).order_by()
+    now = timezone.now()
+    rows = [
+        ProductRating(
+            product_id=row['product'],
+            review_count=row['approved'],
+            rating_total=row['total'],
+            updated_at=now,
+            **{field: row[field] for field in ProductRating.STAR_FIELDS},
+        )
+        for row in totals
+    ]
+    with transaction.atomic():
+        ProductRating.objects.all().delete()
+        ProductRating.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def with_ratings(queryset):
+    """Annotate products with ``average_rating`` (None when unrated) and ``review_count``"""
+    return queryset.select_related('rating_summary').annotate(
+        average_rating=Cast('rating_summary__rating_total', FloatField()) / NullIf('rating_summary__review_count', 0),
+        review_count=Coalesce('rating_summary__review_count', 0),
+    )
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Review
+from .moderation import MAX_BATCH_SIZE
 
 class ReviewSerializer(serializers.ModelSerializer):
     user_name = serializers.CharField(source='user.get_full_name', read_only=True)
@@ -26,4 +27,16 @@ class ReviewSerializer(serializers.ModelSerializer):
         if Review.objects.filter(user=user, product=product).exists():
             raise serializers.ValidationError("You have already reviewed this product")
         
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+class ModerationDecisionSerializer(serializers.Serializer):
+    review = serializers.IntegerField()
+    action = serializers.ChoiceField(choices=['approve', 'reject'])
+
+class ModerationBatchSerializer(serializers.Serializer):
+    decisions = ModerationDecisionSerializer(many=True, allow_empty=False)
+    
+    def validate_decisions(self, value):
+        if len(value) > MAX_BATCH_SIZE:
+            raise serializers.ValidationError(f"At most {MAX_BATCH_SIZE} decisions can be submitted per request")
+        return value
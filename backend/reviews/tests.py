@@ -1,3 +1,226 @@
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from products.models import Category, Product
+from users.models import User
+from .models import ProductRating, Review
+from .moderation import moderate_reviews, moderation_queue
+from .ratings import delete_reviews, recompute_product_ratings, set_review_approval, with_ratings
+
+
+class ReviewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.products = [
+            Product.objects.create(
+                name=f'Shirt {i}', slug=f'shirt-{i}', description='', price=10, category=category, brand='Nexus'
+            )
+            for i in range(2)
+        ]
+        cls.users = [
+            User.objects.create_user(email=f'reviewer{i}@example.com', username=f'reviewer{i}', password='x')
+            for i in range(6)
+        ]
+
+    def review(self, user, rating, product=None, approved=True):
+        return Review.objects.create(
+            product=product or self.products[0], user=self.users[user], rating=rating,
+            title='Review', comment='Fits well', is_approved=approved,
+        )
+
+    def stored(self):
+        return {
+            row.pop('product_id'): row
+            for row in ProductRating.objects.filter(review_count__gt=0).values(
+                'product_id', 'review_count', 'rating_total', *ProductRating.STAR_FIELDS
+            )
+        }
+
+    def assertMatchesRecompute(self):
+        incremental = self.stored()
+        recompute_product_ratings()
+        self.assertEqual(incremental, self.stored())
+        return incremental
+
+
+class RatingAggregateTests(ReviewTestCase):
+    """ProductRating always equals a full recompute from the approved reviews"""
+
+    def test_save_counts_approved_reviews_only(self):
+        self.review(0, 5)
+        self.review(1, 3)
+        self.review(2, 1, approved=False)
+
+        stored = self.assertMatchesRecompute()
+        self.assertEqual(stored[self.products[0].pk]['review_count'], 2)
+        self.assertEqual(stored[self.products[0].pk]['rating_total'], 8)
+
+    def test_edits_move_the_rating_between_stars_and_products(self):
+        review = self.review(0, 5)
+        review.rating = 2
+        review.save()
+        review.product = self.products[1]
+        review.save()
+        self.review(1, 4, approved=False).delete()
+
+        stored = self.assertMatchesRecompute()
+        self.assertEqual(list(stored), [self.products[1].pk])
+        self.assertEqual(stored[self.products[1].pk]['two_star'], 1)
+
+    def test_unapprove_and_delete(self):
+        first = self.review(0, 5)
+        second = self.review(1, 4)
+        first.is_approved = False
+        first.save()
+        second.delete()
+
+        self.assertEqual(self.assertMatchesRecompute(), {})
+
+    def test_bulk_approval_and_delete(self):
+        for user in range(4):
+            self.review(user, user + 1, approved=False)
+        self.review(4, 5, product=self.products[1])
+
+        self.assertEqual(set_review_approval(Review.objects.filter(product=self.products[0]), True), 4)
+        # Already approved reviews are not counted twice
+        self.assertEqual(set_review_approval(Review.objects.all(), True), 0)
+        self.assertMatchesRecompute()
+
+        self.assertEqual(set_review_approval(Review.objects.filter(rating__lte=2), False), 2)
+        self.assertMatchesRecompute()
+
+        self.assertEqual(delete_reviews(Review.objects.filter(rating__gte=3)), 3)
+        self.assertEqual(self.assertMatchesRecompute(), {})
+        self.assertFalse(Review.objects.filter(moderated_at__isnull=True, rating__lte=2).exists())
+
+    def test_with_ratings_reads_the_aggregate(self):
+        self.review(0, 5)
+        self.review(1, 2)
+
+        with self.assertNumQueries(1):
+            rated, unrated = with_ratings(Product.objects.order_by('pk'))
+        self.assertEqual((rated.average_rating, rated.review_count), (3.5, 2))
+        self.assertEqual((unrated.average_rating, unrated.review_count), (None, 0))
+
+
+class ReviewFeedTests(ReviewTestCase):
+    """The feed pages by cursor and its cached first page follows committed changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.reviews = [self.review(user, user % 5 + 1) for user in range(5)]
+        self.review(5, 1, approved=False)
+
+    def feed(self, **params):
+        response = self.client.get('/api/reviews/feed/', {'product': self.products[0].pk, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_cursor_pages_cover_every_approved_review_newest_first(self):
+        page = self.feed(page_size=2)
+        seen = [review['id'] for review in page['results']]
+        while page['next']:
+            response = self.client.get(page['next'])
+            page = response.data
+            seen.extend(review['id'] for review in page['results'])
+
+        self.assertEqual(seen, [review.pk for review in reversed(self.reviews)])
+
+    def test_first_page_is_served_from_cache(self):
+        first = self.feed()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.feed(), first)
+
+    def test_cache_is_dropped_when_a_change_commits(self):
+        self.feed()
+        pending = Review.objects.get(is_approved=False)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            pending.is_approved = True
+            pending.save()
+        # Until the transaction commits readers keep the old page
+        self.assertNotIn(pending.pk, [review['id'] for review in self.feed()['results']])
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.feed()['results'][0]['id'], pending.pk)
+
+    def test_bulk_paths_drop_the_cache(self):
+        self.feed()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_reviews(Review.objects.filter(pk=self.reviews[-1].pk))
+        self.assertEqual(len(self.feed()['results']), 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            set_review_approval(Review.objects.all(), False)
+        self.assertEqual(self.feed()['results'], [])
+
+    def test_requires_a_product_id(self):
+        response = self.client.get('/api/reviews/feed/', {'product': 'shirts'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ModerationTests(ReviewTestCase):
+    """Moderation batches report every decision and keep the aggregates exact"""
+
+    def setUp(self):
+        cache.clear()
+        self.pending = [self.review(user, user + 1, approved=False) for user in range(4)]
+        self.approved = self.review(4, 5)
+
+    def queue(self, limit=50):
+        return [review.pk for review in moderation_queue(limit)]
+
+    def test_queue_lists_undecided_reviews_oldest_first(self):
+        self.assertEqual(self.queue(), [review.pk for review in self.pending])
+        self.assertEqual(self.queue(limit=2), [review.pk for review in self.pending[:2]])
+
+    def test_results_include_missing_reviews(self):
+        results = moderate_reviews({
+            self.pending[0].pk: True, self.pending[1].pk: False, self.approved.pk: False, 999999: True,
+        })
+
+        self.assertEqual(results, [
+            {'review': self.pending[0].pk, 'status': 'approved'},
+            {'review': self.pending[1].pk, 'status': 'rejected'},
+            {'review': self.approved.pk, 'status': 'rejected'},
+            {'review': 999999, 'status': 'not_found'},
+        ])
+        # Rejected reviews are decided too, so they leave the queue
+        self.assertEqual(self.queue(), [review.pk for review in self.pending[2:]])
+        stored = self.assertMatchesRecompute()
+        self.assertEqual(stored[self.products[0].pk]['review_count'], 1)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        # Savepoint, locked read, UPDATE, then an upsert of the product's rating and of its daily metrics
+        with self.assertNumQueries(8):
+            moderate_reviews({self.pending[0].pk: True})
+        with self.assertNumQueries(8):
+            moderate_reviews({review.pk: True for review in self.pending[1:]})
+        self.assertMatchesRecompute()
+
+    def test_endpoint_is_staff_only_and_summarises(self):
+        client = APIClient()
+        data = {'decisions': [
+            {'review': self.pending[0].pk, 'action': 'approve'},
+            {'review': self.pending[1].pk, 'action': 'reject'},
+            {'review': 999999, 'action': 'approve'},
+        ]}
+        client.force_authenticate(self.users[0])
+        self.assertEqual(client.post('/api/reviews/moderation/', data, format='json').status_code, 403)
+
+        client.force_authenticate(User.objects.create_user(
+            email='moderator@example.com', username='moderator', password='x', is_staff=True
+        ))
+        self.assertEqual(len(client.get('/api/reviews/moderation/', {'limit': 3}).data), 3)
+        self.assertEqual(client.get('/api/reviews/moderation/', {'limit': 'all'}).status_code, 400)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/reviews/moderation/', data, format='json')
+        self.assertEqual(response.data['summary'], {'approved': 1, 'rejected': 1, 'not_found': 1})
+        feed = client.get('/api/reviews/feed/', {'product': self.products[0].pk}).data
+        self.assertEqual({review['id'] for review in feed['results']}, {self.pending[0].pk, self.approved.pk})
@@ -1,9 +1,14 @@
+from collections import Counter
+
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
+from .feed import review_feed
 from .models import Review
-from .serializers import ReviewSerializer
+from .moderation import DEFAULT_QUEUE_SIZE, MAX_BATCH_SIZE, moderate_reviews, moderation_queue
+from .serializers import ModerationBatchSerializer, ReviewSerializer
 
 class ReviewViewSet(viewsets.ModelViewSet):
     serializer_class = ReviewSerializer
@@ -12,17 +17,58 @@ class ReviewViewSet(viewsets.ModelViewSet):
     filterset_fields = ['product', 'user', 'rating', 'is_approved']
     
     def get_queryset(self):
+        queryset = Review.objects.select_related('user', 'product')
         if self.request.user.is_staff:
-            return Review.objects.all()
-        return Review.objects.filter(is_approved=True)
+            return queryset
+        return queryset.filter(is_approved=True)
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
     
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
+    def feed(self, request):
+        # Approved reviews of one product, newest first, by cursor; see reviews/feed.py
+        try:
+            product_id = int(request.query_params['product'])
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'product must be a product id'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(review_feed(self, request, product_id))
+    
+    @action(detail=False, methods=['get', 'post'], permission_classes=[permissions.IsAdminUser])
+    def moderation(self, request):
+        """Next pending reviews (GET) or a batch of approve/reject decisions (POST); see reviews/moderation.py"""
+        if request.method == 'GET':
+            try:
+                limit = min(int(request.query_params.get('limit', DEFAULT_QUEUE_SIZE)), MAX_BATCH_SIZE)
+            except ValueError:
+                return Response(
+                    {'error': 'limit must be a number'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            serializer = self.get_serializer(moderation_queue(max(limit, 1)), many=True)
+            return Response(serializer.data)
+        
+        serializer = ModerationBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        # A review listed twice takes its last decision
+        decisions = {
+            item['review']: item['action'] == 'approve'
+            for item in serializer.validated_data['decisions']
+        }
+        results = moderate_reviews(decisions)
+        
+        summary = Counter(result['status'] for result in results)
+        return Response({'summary': summary, 'results': results}, status=status.HTTP_200_OK)
+    
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAdminUser])
     def approve(self, request, pk=None):
         review = self.get_object()
         review.is_approved = True
+        review.moderated_at = timezone.now()
         review.save()
         return Response({'status': 'Review approved'})
     
@@ -30,5 +76,6 @@ class ReviewViewSet(viewsets.ModelViewSet):
     def reject(self, request, pk=None):
         review = self.get_object()
         review.is_approved = False
+        review.moderated_at = timezone.now()
         review.save()
         return Response({'status': 'Review rejected'})
\ No newline at end of file
@@ -5,6 +5,7 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.tokens import default_token_generator
 from django.core.mail import send_mail
 from django.conf import settings
+from analytics.attribution import capture_signup
 from .models import User
 from .serializers import (
     UserSerializer, UserProfileSerializer, 
@@ -49,6 +50,7 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
+        capture_signup(request, user)
         
         # Generate tokens for immediate login after registration
         refresh = RefreshToken.for_user(user)
@@ -158,6 +160,7 @@ class AuthViewSet(viewsets.ViewSet):
         serializer = UserRegistrationSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
+        capture_signup(request, user)
         
         # Generate tokens
         refresh = RefreshToken.for_user(user)
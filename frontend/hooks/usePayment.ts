@@ -1,6 +1,6 @@
 'use client';
 
-import { useState } from 'react';
+import { useCallback, useEffect, useRef, useState } from 'react';
 import { apiClient } from '@/lib/api';
 
 interface UsePaymentProps {
@@ -26,6 +26,16 @@ interface MpesaPaymentData {
   order?: string;
 }
 
+export interface MpesaStatus {
+  transaction_id: number;
+  status: 'requested' | 'pending' | 'successful' | 'failed' | 'cancelled';
+  result_code: number | null;
+  result_description: string;
+  mpesa_receipt: string;
+}
+
+const TERMINAL_MPESA_STATUSES = ['successful', 'failed', 'cancelled'];
+
 interface CardPaymentData {
   order: string;
   payment_method?: string;
@@ -35,6 +45,10 @@ interface CardPaymentData {
 export function usePayment({ onSuccess, onError }: UsePaymentProps = {}) {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
+  const [mpesaStatus, setMpesaStatus] = useState<MpesaStatus | null>(null);
+  const stopWaitingRef = useRef<(() => void) | null>(null);
+
+  useEffect(() => () => stopWaitingRef.current?.(), []);
 
   // Create a payment for an order
   const createPayment = async (paymentData: CardPaymentData) => {
@@ -75,6 +89,69 @@ export function usePayment({ onSuccess, onError }: UsePaymentProps = {}) {
     }
   };
 
+  // Wait for an M-Pesa payment to finish: Server-Sent Events, falling back to long-polling
+  const waitForMpesaPayment = useCallback((transactionId: number, statusToken: string) => {
+    stopWaitingRef.current?.();
+
+    return new Promise<MpesaStatus>((resolve, reject) => {
+      let stopped = false;
+      let source: EventSource | null = null;
+
+      const stop = () => {
+        stopped = true;
+        source?.close();
+      };
+      stopWaitingRef.current = stop;
+
+      const handleStatus = (status: MpesaStatus) => {
+        setMpesaStatus(status);
+        if (TERMINAL_MPESA_STATUSES.includes(status.status)) {
+          stop();
+          resolve(status);
+          return true;
+        }
+        return false;
+      };
+
+      const longPoll = async (since?: string) => {
+        try {
+          while (!stopped) {
+            const status: MpesaStatus = await apiClient.waitForMpesaStatus(transactionId, statusToken, since);
+            if (handleStatus(status)) {
+              return;
+            }
+            since = status.status;
+          }
+        } catch (err) {
+          const errorMessage = err instanceof Error ? err.message : 'Failed to fetch M-Pesa payment status';
+          setError(errorMessage);
+          onError?.(errorMessage);
+          reject(err);
+        }
+      };
+
+      if (typeof EventSource === 'undefined') {
+        longPoll();
+        return;
+      }
+
+      source = new EventSource(apiClient.getMpesaStatusEventsUrl(transactionId, statusToken));
+      let lastStatus: string | undefined;
+      source.addEventListener('status', (event) => {
+        const status: MpesaStatus = JSON.parse((event as MessageEvent).data);
+        lastStatus = status.status;
+        handleStatus(status);
+      });
+      source.onerror = () => {
+        // Stream dropped or blocked by a proxy: continue with long-polling
+        source?.close();
+        if (!stopped) {
+          longPoll(lastStatus);
+        }
+      };
+    });
+  }, [onError]);
+
   // Confirm payment (for 3D Secure or other verification)
   const confirmPayment = async (paymentId: string, paymentIntent?: string) => {
     setLoading(true);
@@ -211,6 +288,7 @@ export function usePayment({ onSuccess, onError }: UsePaymentProps = {}) {
     // Payment methods
     createPayment,
     initiateMpesaPayment,
+    waitForMpesaPayment,
     confirmPayment,
     getPaymentStatus,
     
@@ -226,6 +304,7 @@ export function usePayment({ onSuccess, onError }: UsePaymentProps = {}) {
     // State
     loading,
     error,
+    mpesaStatus,
     clearError: () => setError(null),
   };
 }
\ No newline at end of file
@@ -1,19 +1,63 @@
+const SESSION_STORAGE_KEY = 'analytics_session';
+// A visit ends after this long without an event, like a GA session
+const SESSION_IDLE_MS = 30 * 60 * 1000;
+
+function newSessionId(): string {
+  if (typeof crypto !== 'undefined' && crypto.randomUUID) {
+    return crypto.randomUUID();
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+}
+
+// The backend keys funnels, abandoned carts and acquisition touches to this
+// id; the SPA never holds Django's session cookie.
+export function getAnalyticsSessionId(): string {
+  const now = Date.now();
+  let id = '';
+  try {
+    const stored = JSON.parse(localStorage.getItem(SESSION_STORAGE_KEY) || 'null');
+    if (stored && typeof stored.id === 'string' && now - stored.seen < SESSION_IDLE_MS) {
+      id = stored.id;
+    }
+  } catch {
+    // Unreadable entry; start a new session
+  }
+  id = id || newSessionId();
+  try {
+    localStorage.setItem(SESSION_STORAGE_KEY, JSON.stringify({ id, seen: now }));
+  } catch {
+    // Storage disabled; the id still holds for this page
+  }
+  return id;
+}
+
 class AnalyticsService {
+  // The external referrer is only meaningful for the landing page view;
+  // document.referrer does not change on client-side navigation.
+  private landingReported = false;
+
   private async trackEvent(event: string, data: any) {
     if (typeof window !== 'undefined' && (window as any).gtag) {
       (window as any).gtag('event', event, data);
     }
 
-    // Send to backend
+    // Send to backend, signed in when we have a token so events carry the user
+    const headers: Record<string, string> = {
+      'Content-Type': 'application/json',
+    };
+    const token = localStorage.getItem('access_token');
+    if (token) {
+      headers['Authorization'] = `Bearer ${token}`;
+    }
+
     try {
       await fetch('/api/analytics/track', {
         method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
+        headers,
         body: JSON.stringify({
           event,
           data,
+          session_id: getAnalyticsSessionId(),
           timestamp: new Date().toISOString(),
           url: window.location.href,
         }),
@@ -28,7 +72,9 @@ class AnalyticsService {
       product_id: productId,
       category_id: categoryId,
       page_location: window.location.href,
+      page_referrer: this.landingReported ? undefined : document.referrer,
     });
+    this.landingReported = true;
   }
 
   trackProductView(productId: string) {
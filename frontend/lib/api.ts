@@ -1,3 +1,5 @@
+import { getAnalyticsSessionId } from './analytics';
+
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000/api';
 
 interface ApiError {
@@ -85,7 +87,8 @@ class ApiClient {
   }) {
     return this.request('/auth/register/', {
       method: 'POST',
-      body: JSON.stringify(userData),
+      // Lets the backend credit the signup to the visit's acquisition channel
+      body: JSON.stringify({ ...userData, session_id: getAnalyticsSessionId() }),
     });
   }
 
@@ -231,6 +234,20 @@ class ApiClient {
     });
   }
 
+  // Push channel for M-Pesa status; authorised by the status_token from initiateMpesaPayment
+  getMpesaStatusEventsUrl(transactionId: number | string, statusToken: string) {
+    return `${API_BASE_URL}/payments/mpesa/transactions/${transactionId}/events/?token=${encodeURIComponent(statusToken)}`;
+  }
+
+  // Long-poll fallback: resolves when the status differs from `since` or after `wait` seconds
+  async waitForMpesaStatus(transactionId: number | string, statusToken: string, since?: string, wait = 25) {
+    const params = new URLSearchParams({ token: statusToken, wait: wait.toString() });
+    if (since) {
+      params.append('since', since);
+    }
+    return this.request(`/payments/mpesa/transactions/${transactionId}/events/?${params}`);
+  }
+
   async confirmMpesaPayment(transactionId: string) {
     return this.authenticatedRequest(`/payments/mpesa/${transactionId}/confirm/`, {
       method: 'POST',